@@ -0,0 +1,701 @@
+"""
+ASGI service for the chat engine (run with `poe worker` or `python api.py`).
+
+One process loads the classifier and builds the agents once, in the lifespan
+hook, and every request shares them. Handlers are async; the engine itself
+(agents, classifier, memory) is synchronous, so each blocking call is handed
+to a bounded thread pool and the event loop never waits on a model. The user
+id comes from the request (X-User-Id header or the body) and is passed to the
+agents as their runtime Context.
+
+Chat turns can also be streamed, as server-sent events (POST /chat/stream) or
+over a WebSocket (/chat/ws, one JSON message per turn). Either way the events
+are: the classifier result ("sentiment"), tool-call progress ("status"), reply
+tokens ("token"), the turn result ("done") and finally a "memory" event with
+what the turn stored. A client that goes away cancels its turn, including the
+model call in flight.
+
+Chat turns go through admission control (chatapp/admission.py) first. A
+turn that cannot run yet waits in a bounded queue: /chat holds the request,
+the streaming endpoints send "queued" events with the queue position. When
+the queue is full the request is rejected at once with 429 and Retry-After;
+a turn that waited too long gets 503 (or an "error" event once streaming).
+
+POST /sentiment/batch scores many texts with the classifier alone: a JSON body
+{"texts": [...]} or an NDJSON body (one string or {"id", "text"} object per
+line). Results stream back as NDJSON, in input order, as they are scored.
+A line longer than BULK_MAX_LINE_BYTES or a body larger than
+BULK_MAX_BODY_BYTES gets 413, or an "error" line once results have started.
+
+    uvicorn api:app --workers 4
+    python api.py            # host, port and workers from settings
+"""
+import asyncio
+import functools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import copy_context
+from typing import AsyncIterator, List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from chatapp.admission import AdmissionRejected, admission
+from chatapp.metrics import metrics, start_exporters
+from settings import config
+
+_engine_pool = ThreadPoolExecutor(max_workers=config.API_ENGINE_THREADS, thread_name_prefix="api-engine")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Helper function to run a blocking engine call on the shared pool, keeping the caller's context."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_engine_pool, functools.partial(copy_context().run, fn, *args, **kwargs))
+
+
+async def run_admitted(ticket, fn, *args, **kwargs):
+    """
+    Helper function to run a blocking engine call that holds an admission slot
+    until the call returns, even if the client has gone by then.
+    """
+    release = ticket.hold()
+    future = _engine_pool.submit(copy_context().run, fn, *args, **kwargs)
+    future.add_done_callback(lambda _: release())
+    return await asyncio.wrap_future(future)
+
+
+def _load_engine():
+    # Importing the agents builds them; the classifier is loaded once and cached.
+    from chatapp import agents
+    from chatapp.tools.sentimentanalysis import get_classifier
+
+    get_classifier()
+    return agents
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.agents = await run_blocking(_load_engine)
+    start_exporters()
+    yield
+    _engine_pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="Sentiment Chatbot API", lifespan=lifespan)
+
+
+class ChatRequest(BaseModel):
+    message: str
+    user_id: Optional[str] = None
+
+
+class ChatResponse(BaseModel):
+    response: str
+    sentiment_type: str
+    sentiment_score: float
+    stage_seconds: dict
+    errors: dict
+    total_seconds: float
+
+
+class SentimentRequest(BaseModel):
+    text: str
+
+
+class SentimentResponse(BaseModel):
+    label: str
+    score: float
+
+
+class BulkSentimentRequest(BaseModel):
+    texts: List[str]
+
+
+class SessionEndRequest(BaseModel):
+    user_id: Optional[str] = None
+
+
+def resolve_request_user(body_user_id: Optional[str], header_user_id: Optional[str]) -> str:
+    """Helper function to pick the request's user id (body first, then the X-User-Id header)."""
+    return body_user_id or header_user_id or "default_user"
+
+
+def rejection_error(error: AdmissionRejected) -> HTTPException:
+    """Helper function to turn an admission rejection into 429 (no room) or 503 (waited too long)."""
+    status = 503 if error.reason == "timeout" else 429
+    return HTTPException(status_code=status, detail=str(error),
+                         headers={"Retry-After": str(max(1, round(error.retry_after)))})
+
+
+def request_admission(user_id: str):
+    """Helper function to get an admission ticket (queued or running) or fail fast with 429."""
+    try:
+        return admission.request(user_id)
+    except AdmissionRejected as e:
+        raise rejection_error(e)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "stub_mode": config.STUB_MODE}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return metrics.render_prometheus()
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, x_user_id: Optional[str] = Header(default=None)):
+    from chatapp.pipeline import run_turn
+
+    agents = app.state.agents
+    user_id = resolve_request_user(request.user_id, x_user_id)
+    ticket = request_admission(user_id)
+    with ticket:
+        try:
+            async for _ in ticket.queued():
+                pass
+        except AdmissionRejected as e:
+            raise rejection_error(e)
+        result = await run_admitted(
+            ticket, run_turn, request.message, user_id,
+            sentiment_agent=agents.sentiment_agent, replier_agent=agents.replier_agent,
+        )
+    return ChatResponse(
+        response=result.response_text,
+        sentiment_type=result.sentiment_type,
+        sentiment_score=result.sentiment_score,
+        stage_seconds=result.stage_seconds,
+        errors=result.errors,
+        total_seconds=result.total_seconds,
+    )
+
+
+@app.post("/sentiment", response_model=SentimentResponse)
+async def sentiment(request: SentimentRequest):
+    from chatapp.tools.sentimentanalysis import classify_text, sentiment_result
+
+    result = await run_blocking(classify_text, request.text)
+    return SentimentResponse(**sentiment_result(result["label"], result["score"]))
+
+
+_bulk_stats = {"requests": 0, "texts": 0, "rejected": 0, "cancelled": 0, "busy_seconds": 0.0}
+
+
+def get_bulk_stats() -> dict:
+    """Helper function to get bulk sentiment counters and throughput (texts per busy second)."""
+    stats = dict(_bulk_stats)
+    stats["texts_per_second"] = stats["texts"] / stats["busy_seconds"] if stats["busy_seconds"] else 0.0
+    return stats
+
+
+metrics.register_collector("bulk_sentiment", get_bulk_stats)
+
+
+def _bulk_item(index: int, value) -> tuple:
+    """Helper function to turn one input into (index, id, text, error)."""
+    item_id, text = None, value
+    if isinstance(value, dict):
+        item_id, text = value.get("id"), value.get("text")
+    if not isinstance(text, str):
+        return index, item_id, None, "expected a string or an object with a text field"
+    if len(text) > config.BULK_MAX_TEXT_CHARS:
+        return index, item_id, None, f"text longer than {config.BULK_MAX_TEXT_CHARS} characters"
+    return index, item_id, text, None
+
+
+def _line_too_long() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"NDJSON line longer than {config.BULK_MAX_LINE_BYTES} bytes")
+
+
+def _ndjson_value(line: bytes):
+    """Helper function to decode one NDJSON line, rejecting it if it is longer than BULK_MAX_LINE_BYTES."""
+    if len(line) > config.BULK_MAX_LINE_BYTES:
+        raise _line_too_long()
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+async def _ndjson_items(request: Request) -> AsyncIterator[tuple]:
+    # Only the unfinished last line is kept between chunks, and each chunk is split once.
+    buffer, index, received = bytearray(), 0, 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > config.BULK_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=f"Request body larger than {config.BULK_MAX_BODY_BYTES} bytes")
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            lines[0] = bytes(buffer) + lines[0]
+            buffer.clear()
+        buffer += rest
+        if len(buffer) > config.BULK_MAX_LINE_BYTES:
+            raise _line_too_long()
+        for line in lines:
+            if not line.strip():
+                continue
+            yield _bulk_item(index, _ndjson_value(line))
+            index += 1
+    if buffer.strip():
+        yield _bulk_item(index, _ndjson_value(bytes(buffer)))
+
+
+async def _list_items(texts: list) -> AsyncIterator[tuple]:
+    for index, text in enumerate(texts):
+        yield _bulk_item(index, text)
+
+
+async def score_bulk(items: AsyncIterator[tuple]) -> AsyncIterator[bytes]:
+    """
+    Score (index, id, text, error) items through the shared classifier batcher.
+    Yields one NDJSON line per item, in input order. At most BULK_MAX_IN_FLIGHT
+    texts are queued at a time, so a large upload is read as fast as it is
+    scored rather than buffered whole.
+    """
+    from chatapp.tools.sentimentanalysis import batcher, sentiment_result
+
+    def line(item, future) -> bytes:
+        index, item_id, _, error = item
+        row = {"index": index}
+        if item_id is not None:
+            row["id"] = item_id
+        if error is None:
+            try:
+                row.update(sentiment_result(*future.result()))
+            except Exception as e:
+                error = str(e)
+        if error is not None:
+            row["error"] = error
+        return (json.dumps(row) + "\n").encode()
+
+    start = time.perf_counter()
+    pending, scored, emitted, rejected = deque(), 0, 0, None
+    try:
+        try:
+            async for item in items:
+                if item[0] >= config.BULK_MAX_TEXTS:
+                    _bulk_stats["rejected"] += 1
+                    rejected = {"index": item[0], "error": f"more than {config.BULK_MAX_TEXTS} texts"}
+                    break
+                future = asyncio.wrap_future(batcher.submit(item[2])) if item[3] is None else None
+                pending.append((item, future))
+                while pending and (len(pending) >= config.BULK_MAX_IN_FLIGHT or pending[0][1] is None
+                                   or pending[0][1].done()):
+                    # The head stays in pending until it is done, so a disconnect while waiting cancels it too.
+                    head, head_future = pending[0]
+                    if head_future is not None:
+                        await asyncio.wait([head_future])
+                        scored += 1
+                    pending.popleft()
+                    emitted += 1
+                    yield line(head, head_future)
+        except HTTPException as e:
+            _bulk_stats["rejected"] += 1
+            if not emitted:
+                # Nothing sent yet: DuplexStreamingResponse turns this into the status code.
+                raise
+            rejected = {"index": emitted + len(pending), "error": e.detail}
+        while pending:
+            head, head_future = pending[0]
+            if head_future is not None:
+                await asyncio.wait([head_future])
+                scored += 1
+            pending.popleft()
+            emitted += 1
+            yield line(head, head_future)
+        if rejected is not None:
+            # After the results before it, so the output stays in input order.
+            yield (json.dumps(rejected) + "\n").encode()
+    finally:
+        # Left over only when the client went away (or the stream failed): stop the batcher from scoring them.
+        cancelled = sum(1 for _, future in pending if future is not None and future.cancel())
+        _bulk_stats["cancelled"] += cancelled
+        if cancelled:
+            metrics.inc("bulk_sentiment_cancelled_total", cancelled)
+        elapsed = time.perf_counter() - start
+        _bulk_stats["requests"] += 1
+        _bulk_stats["texts"] += scored
+        _bulk_stats["busy_seconds"] += elapsed
+        metrics.inc("bulk_sentiment_texts_total", scored)
+        metrics.observe("bulk_sentiment_request_seconds", elapsed)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for bodies that are still reading the request. The stock
+    one listens for a disconnect by consuming receive(), which would swallow
+    the rest of the upload; here a disconnect surfaces from request.stream().
+    The status line waits for the first chunk, so an HTTPException raised
+    before then (e.g. an oversized upload) is sent as that status instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        body = self.body_iterator
+        try:
+            first = await anext(body)
+        except StopAsyncIteration:
+            first = None
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+
+        async def chained():
+            if first is not None:
+                yield first
+            async for chunk in body:
+                yield chunk
+
+        self.body_iterator = chained()
+        await self.stream_response(send)
+
+
+@app.post("/sentiment/batch")
+async def sentiment_batch(request: Request):
+    if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/jsonl")):
+        return DuplexStreamingResponse(score_bulk(_ndjson_items(request)), media_type="application/x-ndjson")
+    try:
+        body = BulkSentimentRequest.model_validate(await request.json())
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if len(body.texts) > config.BULK_MAX_TEXTS:
+        _bulk_stats["rejected"] += 1
+        raise HTTPException(status_code=413, detail=f"At most {config.BULK_MAX_TEXTS} texts per request")
+    return StreamingResponse(score_bulk(_list_items(body.texts)), media_type="application/x-ndjson")
+
+
+_open_streams = {"sse": 0, "websocket": 0}
+_stream_stats = {"peak_open": 0, "slow_consumers": 0}
+
+
+@contextmanager
+def _track_connection(transport: str):
+    _open_streams[transport] += 1
+    _stream_stats["peak_open"] = max(_stream_stats["peak_open"], sum(_open_streams.values()))
+    metrics.inc("api_stream_connections_total", transport=transport)
+    try:
+        yield
+    finally:
+        _open_streams[transport] -= 1
+
+
+def get_stream_connection_stats() -> dict:
+    """Helper function to get the number of open streaming connections per transport."""
+    stats = {f"open_{transport}": count for transport, count in _open_streams.items()}
+    stats.update(_stream_stats)
+    return stats
+
+
+metrics.register_collector("api_streams", get_stream_connection_stats)
+
+
+def _event_data(event) -> dict:
+    if event.kind == "token":
+        return {"text": event.data}
+    if event.kind == "status":
+        return {"message": event.data}
+    if event.kind == "done":
+        result = event.data
+        return {
+            "response": result.response_text,
+            "sentiment_type": result.sentiment_type,
+            "sentiment_score": result.sentiment_score,
+            "stage_seconds": result.stage_seconds,
+            "errors": result.errors,
+            "total_seconds": result.total_seconds,
+            "ttft_seconds": result.ttft_seconds,
+            "cancelled": result.cancelled,
+        }
+    return event.data
+
+
+def _memory_status(result, user_id: str, summary_version: int) -> dict:
+    from chatapp.memory.sessiondigest import get_digest_version
+    from chatapp.memory.shorttermmemory import get_chats_from_memory, get_memory_tokens
+    from chatapp.memory.summarymemory import get_summary_version
+
+    return {
+        "extracted_memory": result.extracted_memory or {},
+        "short_term_chats": len(get_chats_from_memory(user_id)),
+        "short_term_tokens": get_memory_tokens(user_id),
+        "summarized": get_summary_version(user_id) != summary_version,
+        "digest_version": get_digest_version(user_id),
+    }
+
+
+class TurnStream:
+    """
+    One streamed chat turn, bridged from an engine thread to the event loop.
+
+    The engine never waits on the socket: its events are queued on the loop
+    as they happen, and the reader drains everything queued at once, merging
+    consecutive tokens, so a slow client gets fewer and larger frames. A
+    client that falls more than STREAM_MAX_PENDING_EVENTS behind is not
+    reading at all and its turn is cancelled; the engine thread checks this
+    as it queues, so a reader that never resumes is still caught.
+
+    The turn starts once its admission ticket is admitted; until then the
+    stream sends "queued" events. From then on the engine thread owns the
+    ticket and releases it when the turn has stopped, or straight away if the
+    turn never got to start.
+    """
+
+    def __init__(self, message: str, user_id: str, agents, transport: str, ticket):
+        self.message = message
+        self.user_id = user_id
+        self.agents = agents
+        self.transport = transport
+        self.ticket = ticket
+        self.cancel = threading.Event()
+        self.finished = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._handed_over = False
+
+    def _put(self, event):
+        # Called by the engine: events queued but not yet read by the consumer.
+        with self._pending_lock:
+            self._pending += 1
+            slow = self._pending > config.STREAM_MAX_PENDING_EVENTS and not self.cancel.is_set()
+            if slow:
+                _stream_stats["slow_consumers"] += 1
+                self.cancel.set()
+        if slow:
+            metrics.inc("api_stream_slow_consumers_total", transport=self.transport)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def _produce(self):
+        # Called by the engine; self._release is the held ticket's release.
+        from chatapp.pipeline import TurnEvent, stream_turn
+
+        try:
+            turn = stream_turn(
+                self.message, self.user_id,
+                sentiment_agent=self.agents.sentiment_agent, replier_agent=self.agents.replier_agent,
+                cancel=self.cancel, on_exit=self._release,
+            )
+            # stream_turn calls on_exit from here on, even if it fails to start.
+            self._handed_over = True
+            for event in turn:
+                self._put(event)
+        except Exception as e:
+            self._put(TurnEvent("error", {"stage": "turn", "error": str(e)}))
+        finally:
+            if not self._handed_over:
+                self._release()
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    def _produced(self, task: asyncio.Future):
+        # run_blocking failed before _produce ran (e.g. the engine pool is shut down).
+        if task.cancelled() or task.exception() is not None:
+            if not self._handed_over:
+                self._release()
+            self._queue.put_nowait(None)
+
+    def _drain(self, first) -> list:
+        batch = [first]
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        with self._pending_lock:
+            self._pending -= sum(event is not None for event in batch)
+        merged = []
+        for event in batch:
+            if event is not None and event.kind == "token" and merged and merged[-1] is not None \
+                    and merged[-1].kind == "token":
+                merged[-1] = type(event)("token", merged[-1].data + event.data)
+            else:
+                merged.append(event)
+        return merged
+
+    async def events(self) -> AsyncIterator[tuple]:
+        """Yield (event name, data) pairs for the turn, ending with the memory status."""
+        from chatapp.memory.summarymemory import get_summary_version
+
+        try:
+            async for position in self.ticket.queued():
+                yield "queued", {"position": position}
+        except AdmissionRejected as e:
+            self.finished = True
+            metrics.inc("api_stream_rejected_total", transport=self.transport)
+            yield "error", {"stage": "admission", "error": str(e), "retry_after": e.retry_after}
+            return
+        finally:
+            if not self.ticket.admitted:
+                # Disconnected while queued.
+                self.ticket.release()
+
+        summary_version = await run_blocking(get_summary_version, self.user_id)
+        # Runs until stream_turn ends; after a cancel that is within a poll interval.
+        self._release = self.ticket.hold()
+        asyncio.ensure_future(run_blocking(self._produce)).add_done_callback(self._produced)
+        result = None
+        try:
+            while True:
+                for event in self._drain(await self._queue.get()):
+                    if event is None:
+                        self.finished = True
+                        if result is not None:
+                            yield "memory", await run_blocking(_memory_status, result, self.user_id, summary_version)
+                        return
+                    if event.kind == "done":
+                        result = event.data
+                    yield event.kind, _event_data(event)
+        finally:
+            if not self.finished:
+                # The client went away mid-turn.
+                self.cancel.set()
+                metrics.inc("api_stream_disconnects_total", transport=self.transport)
+
+
+def format_sse(event: str, data, event_id: int) -> str:
+    """Helper function to encode one server-sent event."""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """A streaming response that gives its admission ticket back if the body never got to start the turn."""
+
+    def __init__(self, content, ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        with self.ticket:
+            await super().__call__(scope, receive, send)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, x_user_id: Optional[str] = Header(default=None)):
+    user_id = resolve_request_user(request.user_id, x_user_id)
+    ticket = request_admission(user_id)
+    stream = TurnStream(request.message, user_id, app.state.agents, "sse", ticket)
+
+    async def body():
+        with _track_connection("sse"):
+            event_id = 0
+            async for event, data in stream.events():
+                event_id += 1
+                yield format_sse(event, data, event_id)
+
+    return AdmittedStreamingResponse(body(), ticket, media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/chat/ws")
+async def chat_ws(websocket: WebSocket):
+    """
+    Send {"message": ..., "user_id": ...} to start a turn and {"type": "cancel"}
+    to abort the current one; each event arrives as {"event": ..., "data": ...}.
+    """
+    await websocket.accept()
+    header_user_id = websocket.headers.get("x-user-id")
+    incoming: asyncio.Queue = asyncio.Queue()
+    current = {}
+
+    async def receive():
+        try:
+            while True:
+                text = await websocket.receive_text()
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    message = {"message": None}
+                if isinstance(message, dict) and message.get("type") == "cancel":
+                    if "stream" in current:
+                        current["stream"].cancel.set()
+                    continue
+                await incoming.put(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if "stream" in current:
+                current["stream"].cancel.set()
+            incoming.put_nowait(None)
+
+    with _track_connection("websocket"):
+        receiver = asyncio.create_task(receive())
+        try:
+            while (message := await incoming.get()) is not None:
+                try:
+                    request = ChatRequest.model_validate(message)
+                except ValidationError as e:
+                    await websocket.send_json({"event": "error", "data": {"stage": "request", "error": str(e)}})
+                    continue
+                user_id = resolve_request_user(request.user_id, header_user_id)
+                try:
+                    ticket = admission.request(user_id)
+                except AdmissionRejected as e:
+                    await websocket.send_json({"event": "error", "data": {
+                        "stage": "admission", "error": str(e), "retry_after": e.retry_after}})
+                    continue
+                stream = TurnStream(request.message, user_id, app.state.agents, "websocket", ticket)
+                current["stream"] = stream
+                try:
+                    with ticket:
+                        async for event, data in stream.events():
+                            await websocket.send_json({"event": event, "data": data})
+                finally:
+                    current.pop("stream", None)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            receiver.cancel()
+
+
+def _memory_snapshot(user_id: str) -> dict:
+    from chatapp.memory.longtermmemory import store
+    from chatapp.memory.sessiondigest import get_digest_tail
+    from chatapp.memory.shorttermmemory import get_chats_from_memory, get_mood_shifts
+    from chatapp.memory.summarymemory import get_summaries
+
+    profile = store.get(("users",), user_id)
+    digest, tail = get_digest_tail(user_id)
+    return {
+        "user_id": user_id,
+        "short_term": [chat.model_dump() for chat in get_chats_from_memory(user_id)],
+        "summaries": [entry.model_dump() for entry in get_summaries(user_id)],
+        "session_digest": digest.model_dump(),
+        "unfolded_summaries": len(tail),
+        "long_term": profile.value if profile else {},
+        "mood_shifts": len(get_mood_shifts(user_id)),
+    }
+
+
+@app.get("/memory")
+async def memory(user_id: Optional[str] = None, x_user_id: Optional[str] = Header(default=None)):
+    return await run_blocking(_memory_snapshot, resolve_request_user(user_id, x_user_id))
+
+
+def _end_session(global_analyzer_agent, user_id: str) -> str:
+    from chatapp.memory.sessiondigest import prepare_session_digest
+    from chatapp.models import Context
+    from chatapp.pipeline import extract_text
+
+    prepare_session_digest(user_id)
+    result = global_analyzer_agent.invoke(
+        {"messages": [{"role": "user", "content": "Provide a comprehensive summary of this conversation session."}]},
+        context=Context(user_id=user_id),
+    )
+    return extract_text(result, default="Unable to generate analysis.")
+
+
+@app.post("/session/end")
+async def end_session(request: SessionEndRequest, x_user_id: Optional[str] = Header(default=None)):
+    user_id = resolve_request_user(request.user_id, x_user_id)
+    summary = await run_blocking(_end_session, app.state.agents.global_analyzer_agent, user_id)
+    return {"user_id": user_id, "summary": summary}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api:app", host=config.API_HOST, port=config.API_PORT, workers=config.API_WORKERS)
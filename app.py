@@ -1,9 +1,13 @@
 import streamlit as st
-from page_modules.chat import show_chat_page
+from page_modules.chat import session_user_id, show_chat_page
 from page_modules.sentiments import show_sentiments_page
+from page_modules.diagnostics import show_diagnostics_page
 from page_modules.streamlit_router import show_home_page, show_memory_page
 from chatapp.memory.shorttermmemory import clear_memory
 from chatapp.memory.summarymemory import clear_summaries
+from chatapp.metrics import start_exporters
+
+start_exporters()
 
 st.set_page_config(
     page_title="LangChain Sentiment Chatbot",
@@ -17,7 +21,7 @@ st.sidebar.markdown("---")
 
 page = st.sidebar.radio(
     "Navigation",
-    ["🏠 Home", "💬 Chat", "📊 Mood Tracking", "🧠 Memory Viewer"],
+    ["🏠 Home", "💬 Chat", "📊 Mood Tracking", "🧠 Memory Viewer", "🩺 Diagnostics"],
     label_visibility="collapsed"
 )
 
@@ -28,8 +32,8 @@ st.sidebar.info("💾 Memory available")
 
 st.sidebar.markdown("---")
 if st.sidebar.button("🗑️ Clear All Data", type="secondary", use_container_width=True):
-    clear_memory()
-    clear_summaries()
+    clear_memory(session_user_id())
+    clear_summaries(session_user_id())
     if 'chat_history' in st.session_state:
         st.session_state.chat_history = []
     st.sidebar.success("All data cleared!")
@@ -43,3 +47,5 @@ elif page == "📊 Mood Tracking":
     show_sentiments_page()
 elif page == "🧠 Memory Viewer":
     show_memory_page()
+elif page == "🩺 Diagnostics":
+    show_diagnostics_page()
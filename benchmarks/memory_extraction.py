@@ -0,0 +1,123 @@
+"""
+Precision and recall of the local memory extractor (chatapp/memory/extraction.py)
+against LLM extraction, plus how often the gate lets a message through to Gemini.
+
+By default the reference is the hand-labelled expected extraction for the
+sample messages below. With --live the reference is recomputed by calling
+Gemini's extraction on every sample (needs GEMINI_API_KEY).
+
+    python -m benchmarks.memory_extraction
+    STUB_MODE=0 python -m benchmarks.memory_extraction --live --json extraction.json
+"""
+import argparse
+import json
+import os
+
+os.environ.setdefault("STUB_MODE", "1")
+
+from chatapp.memory.extraction import FIELDS, LLM_FIELDS, extract_candidates, extract_with_llm  # noqa: E402
+
+# (message, fields LLM extraction is expected to return)
+SAMPLES = [
+    ("Hi, my name is Priya and I live in Toronto.", {"name": "Priya", "location": "Toronto"}),
+    ("I'm 29 years old and feeling pretty stressed about work.", {"age": "29", "current_mood": "stressed"}),
+    ("What is the weather in Paris today?", {}),
+    ("Call me Sam. I'm from New York.", {"name": "Sam", "location": "New York"}),
+    ("I had a great day at work, the project finally shipped!", {"current_mood": "happy"}),
+    ("Can you recommend a good book for the weekend?", {}),
+    ("I just turned 40 and I feel a bit lonely lately.", {"age": "40", "current_mood": "lonely"}),
+    ("My hometown is Lisbon but I moved to Berlin last year.", {"location": "Berlin"}),
+    ("Who won the football match last night?", {}),
+    ("I am so tired today.", {"current_mood": "tired"}),
+    ("I'm Alex, nice to meet you!", {"name": "Alex"}),
+    ("The meeting is at 5 pm, I'm 10 minutes late already.", {}),
+    ("I hate when my train is late, it ruins the whole morning.", {"current_mood": "frustrated"}),
+    ("I'm based in Bangalore and work as a designer.", {"location": "Bangalore"}),
+    ("Tell me something interesting about octopuses.", {}),
+    ("I'm feeling anxious about my exam tomorrow.", {"current_mood": "anxious"}),
+    ("My friend Maria lives in Madrid.", {}),
+    ("I'm 35, married, and live in Austin.", {"age": "35", "location": "Austin"}),
+    ("Thanks, that was really helpful, I'm glad I asked.", {"current_mood": "grateful"}),
+    ("This is Jordan again, I'm excited about the trip!", {"name": "Jordan", "current_mood": "excited"}),
+    ("What's 25 plus 17?", {}),
+    ("I'm not sure what to cook tonight.", {}),
+    ("I am 62 years old and recently retired.", {"age": "62"}),
+    ("People call me Kenji, I'm from Osaka.", {"name": "Kenji", "location": "Osaka"}),
+    ("I've been feeling overwhelmed with everything going on.", {"current_mood": "overwhelmed"}),
+    ("Where can I watch the game tonight?", {}),
+    ("Honestly I'm just bored.", {"current_mood": "bored"}),
+    ("My name is Fatima, I'm 24 and I live in Dubai.", {"name": "Fatima", "age": "24", "location": "Dubai"}),
+    ("Do you know any good restaurants in Rome?", {}),
+    ("I'm worried my cat is sick.", {"current_mood": "worried"}),
+    ("I'm a 30-year-old teacher from Chicago.", {"age": "30", "location": "Chicago"}),
+    ("Sarah here, just checking in.", {"name": "Sarah"}),
+    ("This is Rome at its best, what a view!", {}),
+    ("Ugh, I'm Monday-ing hard today.", {"current_mood": "tired"}),
+]
+
+
+def _same(a: str, b: str) -> bool:
+    return a.strip().lower() == b.strip().lower()
+
+
+def score(samples, predictions) -> dict:
+    """Per-field precision/recall of predictions against the reference fields."""
+    report = {}
+    for field in FIELDS:
+        tp = fp = fn = 0
+        for (_, reference), predicted in zip(samples, predictions):
+            if field in predicted and field in reference and _same(predicted[field], reference[field]):
+                tp += 1
+                continue
+            if field in predicted:
+                fp += 1
+            if field in reference:
+                fn += 1
+        report[field] = {
+            "precision": tp / (tp + fp) if tp + fp else 1.0,
+            "recall": tp / (tp + fn) if tp + fn else 1.0,
+            "support": tp + fn,
+        }
+    return report
+
+
+def gate_stats(samples, predictions) -> dict:
+    """How often the gate sends a message to Gemini, and whether it misses messages with profile fields."""
+    triggered = [any(field in predicted for field in LLM_FIELDS) for predicted in predictions]
+    needed = [any(field in reference for field in LLM_FIELDS) for _, reference in samples]
+    caught = sum(1 for t, n in zip(triggered, needed) if t and n)
+    return {
+        "llm_call_rate": sum(triggered) / len(samples),
+        "gate_recall": caught / sum(needed) if any(needed) else 1.0,
+        "gate_precision": caught / sum(triggered) if any(triggered) else 1.0,
+        "model_calls_saved": len(samples) - sum(triggered),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="Recompute the reference with Gemini")
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    samples = SAMPLES
+    if args.live:
+        samples = [(text, extract_with_llm(text)) for text, _ in SAMPLES]
+    predictions = [extract_candidates(text) for text, _ in samples]
+    report = {"samples": len(samples), "reference": "live" if args.live else "labelled",
+              "fields": score(samples, predictions), "gate": gate_stats(samples, predictions)}
+
+    print(f"{len(samples)} samples, reference={report['reference']}")
+    print(f"{'field':14s} {'precision':>9s} {'recall':>7s} {'support':>8s}")
+    for field, row in report["fields"].items():
+        print(f"{field:14s} {row['precision']:9.2f} {row['recall']:7.2f} {row['support']:8d}")
+    gate = report["gate"]
+    print(f"gate: {gate['llm_call_rate']:.0%} of messages call Gemini, recall {gate['gate_recall']:.2f}, "
+          f"precision {gate['gate_precision']:.2f}, {gate['model_calls_saved']} of {len(samples)} calls saved")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
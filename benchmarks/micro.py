@@ -0,0 +1,397 @@
+"""
+Microbenchmarks for the hot paths under a chat turn and the analytics page:
+short-term memory writes and mood-shift detection, save_mood_shifts, the
+memory prompt renderers, summary formatting and parsing, the sentiments-page
+aggregations and analyze_sentiment at several batch sizes. Runs offline
+against the stand-ins in chatapp/stubs.py (STUB_MODE=0 scores with the real
+classifier).
+
+Each case is timed pytest-benchmark style: a warmup call, then rounds of
+enough calls to last at least --min-round-time, repeated for --max-time
+seconds (at least --min-rounds rounds, except cases slower than --max-time per
+call, which run once). Sizes are the number of stored chats.
+
+    python -m benchmarks.micro run --json baseline.json
+    python -m benchmarks.micro run --sizes 100,10000,1000000 --only memory,prompt
+    # ... change the code ...
+    python -m benchmarks.micro run --json current.json --compare baseline.json
+    python -m benchmarks.micro compare baseline.json current.json --threshold 0.1
+
+compare flags a case as a regression when its --stat time (min by default)
+grew by more than --threshold and exits with status 1 if any did.
+
+The same cases run under pytest-benchmark from benchmarks/test_micro.py;
+this script needs nothing beyond the app's own dependencies and its JSON
+baselines sit next to the other benchmarks' reports.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Callable, Optional
+
+os.environ.setdefault("STUB_MODE", "1")
+os.environ.setdefault("LLM_CACHE_BACKEND", "off")
+os.environ.setdefault("TRACE_RECORD_DIR", "")
+# Time the batching around the classifier, not the stand-in's simulated model latency.
+os.environ.setdefault("STUB_CLASSIFIER_LATENCY", "none")
+
+from chatapp import state  # noqa: E402
+from chatapp.analytics import all_chats, mood_overview, sentiment_overview  # noqa: E402
+from chatapp.memory import shorttermmemory  # noqa: E402
+from chatapp.memory.shorttermmemory import MOOD_SHIFTS, SHORT_TERM, add_chat_to_memory, save_mood_shifts  # noqa: E402
+from chatapp.memory.summarymemory import SUMMARIES, format_chats, parse_summary_response  # noqa: E402
+from chatapp.models import ChatMemory, SummaryEntry  # noqa: E402
+from chatapp.promptmiddleware import REPLIER_INSTRUCTIONS, build_prompt, _RENDERERS  # noqa: E402
+from chatapp.records import ChatRecord, ChatWindow, MoodShiftRecord, SummaryLog, SummaryRecord  # noqa: E402
+from chatapp.replay import code_version  # noqa: E402
+from chatapp.tools.sentimentanalysis import analyze_sentiment  # noqa: E402
+
+USER = "bench_user"
+DEFAULT_SIZES = "100,10000,1000000"
+DEFAULT_BATCHES = "1,8,32"
+STATS = ("min", "median", "mean")
+SENTIMENTS = ("POS", "NEG", "NEU")
+WORDS = ("weather", "movie", "project", "deadline", "happy", "tired", "coffee",
+         "family", "weekend", "python", "travel", "music", "stress", "great")
+
+
+@dataclass
+class Case:
+    """One benchmark case: setup() builds the data (not timed), run(data) is timed."""
+    group: str
+    name: str
+    params: dict
+    setup: Callable
+    run: Callable
+    teardown: Optional[Callable] = None
+
+    @property
+    def id(self) -> str:
+        params = ",".join(f"{key}={value}" for key, value in self.params.items())
+        return f"{self.group}.{self.name}[{params}]" if params else f"{self.group}.{self.name}"
+
+
+@dataclass
+class Timing:
+    rounds: int
+    iterations: int
+    samples: list = field(repr=False)
+
+    def stats(self) -> dict:
+        return {
+            "min": min(self.samples),
+            "max": max(self.samples),
+            "mean": statistics.fmean(self.samples),
+            "median": statistics.median(self.samples),
+            "stddev": statistics.stdev(self.samples) if len(self.samples) > 1 else 0.0,
+            "rounds": self.rounds,
+            "iterations": self.iterations,
+        }
+
+
+def measure(fn: Callable, min_rounds: int = 5, max_time: float = 1.0, min_round_time: float = 0.001,
+            max_rounds: int = 10000) -> Timing:
+    """
+    Helper function to time fn() pytest-benchmark style.
+    Args:
+        fn: The call to time (no arguments).
+        min_rounds: Rounds to run at least, unless one call takes longer than max_time.
+        max_time: Seconds to keep adding rounds for.
+        min_round_time: Calls per round are raised until a round lasts this long, so fast calls are not all timer noise.
+        max_rounds: Stop after this many rounds.
+    Returns:
+        Seconds per call of every round.
+    """
+    start = time.perf_counter()
+    fn()  # warmup
+    first = time.perf_counter() - start
+    if first > max_time:
+        return Timing(1, 1, [first])
+    iterations = max(1, math.ceil(min_round_time / first)) if first > 0 else 1000
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_rounds and (len(samples) < min_rounds or time.perf_counter() - started < max_time):
+        round_start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        samples.append((time.perf_counter() - round_start) / iterations)
+    return Timing(len(samples), iterations, samples)
+
+
+def _text(i: int, words: int = 12) -> str:
+    return " ".join(WORDS[(i + j * 7) % len(WORDS)] for j in range(words))
+
+
+def make_chats(n: int, alternate: bool = False) -> list:
+    """Helper function to build n chats; alternate=True flips POS/NEG on every chat (a mood shift each time)."""
+    return [
+        ChatMemory(
+            user=_text(i), assistant=_text(i + 3),
+            sentiment_score=0.5 + (i % 50) / 100,
+            sentiment_type=("POS", "NEG")[i % 2] if alternate else SENTIMENTS[(i * 7) % 3],
+        )
+        for i in range(n)
+    ]
+
+
+def make_records(n: int, alternate: bool = False) -> list:
+    """Helper function to build the chats of make_chats as the ChatRecords memory stores."""
+    return [ChatRecord.from_model(chat) for chat in make_chats(n, alternate)]
+
+
+def make_summaries(n: int) -> list:
+    return [SummaryRecord(_text(i, 40), SENTIMENTS[i % 3], datetime.datetime(2026, 1, 1).isoformat()) for i in range(n)]
+
+
+def _fresh_state():
+    state.backend = state.InProcessBackend()
+
+
+def _store_window(chats: list):
+    window = ChatWindow(chats, max_chats=max(len(chats), 1))
+    state.backend.store(USER, SHORT_TERM, window.to_document(), state.backend.version(USER, SHORT_TERM))
+
+
+def _store_summaries(n: int):
+    memory = SummaryLog(make_summaries(n), max_summaries=max(n, 10))
+    state.backend.store(USER, SUMMARIES, memory.to_document(), state.backend.version(USER, SUMMARIES))
+
+
+def memory_cases(sizes: list) -> list:
+    cases = []
+    for n in sizes:
+        def window_setup(n=n):
+            return ChatWindow(make_records(n, alternate=True), max_chats=n)
+
+        def detect(window, chats=make_records(2, alternate=True), counter=count()):
+            # Appends POS, NEG, POS, ... so every call completes a mood shift and drops the oldest chat.
+            shorttermmemory._append_chat(window, chats[next(counter) % 2])
+
+        cases.append(Case("memory", "mood_shift_detection", {"chats": n}, window_setup, detect))
+
+        for shift in (False, True):
+            def add_setup(n=n):
+                _fresh_state()
+                _store_window(make_records(n))
+                return count()
+
+            def add(counter, shift=shift):
+                i = next(counter)
+                sentiment = ("POS", "NEG")[i % 2] if shift else "NEU"
+                add_chat_to_memory(_text(i), 0.9, sentiment, USER)
+
+            cases.append(Case("memory", "add_chat_to_memory", {"chats": n, "shift": shift}, add_setup, add))
+
+        def shifts_setup(n=n):
+            _fresh_state()
+            chats = make_records(n, alternate=True)
+            shifts = [MoodShiftRecord(chats[i], chats[i + 1]).to_row() for i in range(0, n - 1, 2)]
+            state.backend.store(USER, MOOD_SHIFTS, {"shifts": shifts}, 0)
+
+        cases.append(Case("memory", "save_mood_shifts", {"chats": n}, shifts_setup, lambda _: save_mood_shifts()))
+    return cases
+
+
+def prompt_cases(sizes: list) -> list:
+    cases = []
+    for n in sizes:
+        def setup(n=n):
+            _fresh_state()
+            _store_window(make_records(n))
+            _store_summaries(10)
+
+        for variant, render in _RENDERERS.items():
+            cases.append(Case("prompt", f"render_{variant}", {"chats": n}, setup,
+                              lambda _, render=render: render(USER)))
+        # Unchanged memory: served from the render cache after the first call.
+        cases.append(Case("prompt", "build_prompt_cached", {"chats": n}, setup,
+                          lambda _: build_prompt("replier", REPLIER_INSTRUCTIONS, "agent", USER)))
+    return cases
+
+
+def summary_cases(sizes: list) -> list:
+    cases = []
+    for n in sizes:
+        cases.append(Case("summary", "format_chats", {"chats": n}, lambda n=n: make_chats(n), format_chats))
+    response = json.dumps({"summary": _text(1, 80), "general_mood": "mostly positive, a dip around the deadline"})
+    for fenced in (False, True):
+        text = f"```json\n{response}\n```" if fenced else response
+        cases.append(Case("summary", "parse_summary_response", {"fenced": fenced}, lambda text=text: text,
+                          parse_summary_response))
+    return cases
+
+
+def analytics_cases(sizes: list) -> list:
+    cases = []
+    for n in sizes:
+        def history_setup(n=n, window=12):
+            chats = make_chats(n)
+            return [chats[i:i + window] for i in range(0, n, window)]
+
+        cases.append(Case("analytics", "sentiment_overview", {"chats": n}, history_setup,
+                          lambda history: sentiment_overview(all_chats(history, []))))
+        summaries = max(1, n // 12)
+        cases.append(Case("analytics", "mood_overview", {"summaries": summaries},
+                          lambda summaries=summaries: [SummaryEntry(summary="", general_mood=SENTIMENTS[i % 3],
+                                                                    timestamp="") for i in range(summaries)],
+                          mood_overview))
+    return cases
+
+
+def classifier_cases(batches: list) -> list:
+    cases = []
+    texts = count()
+    for batch in batches:
+        def setup(batch=batch):
+            return ThreadPoolExecutor(max_workers=batch)
+
+        def score(pool, batch=batch):
+            # Fresh texts every call: repeated texts would be answered by the classify cache.
+            inputs = [f"{_text(i)} #{next(texts)}" for i in range(batch)]
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                list(pool.map(lambda text: analyze_sentiment.invoke({"text": text}), inputs))
+
+        cases.append(Case("classifier", "analyze_sentiment", {"batch": batch}, setup, score,
+                          teardown=lambda pool: pool.shutdown()))
+    return cases
+
+
+def all_cases(sizes: list, batches: list) -> list:
+    return (memory_cases(sizes) + prompt_cases(sizes) + summary_cases(sizes) + analytics_cases(sizes)
+            + classifier_cases(batches))
+
+
+def run_cases(cases: list, min_rounds: int, max_time: float, min_round_time: float) -> list:
+    results = []
+    for case in cases:
+        data = case.setup()
+        try:
+            timing = measure(lambda: case.run(data), min_rounds, max_time, min_round_time)
+        finally:
+            if case.teardown:
+                case.teardown(data)
+        stats = timing.stats()
+        results.append({"id": case.id, "group": case.group, "name": case.name, "params": case.params,
+                        "stats": stats})
+        print(f"{case.id:58s} {format_seconds(stats['median']):>10s} median  "
+              f"{format_seconds(stats['min']):>10s} min  ±{format_seconds(stats['stddev']):>9s}  "
+              f"({stats['rounds']}x{stats['iterations']})", flush=True)
+    _fresh_state()
+    return results
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f}{unit}"
+    return f"{seconds / 1e-9:.1f}ns"
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1, stat: str = "min") -> list:
+    """
+    Helper function to compare two benchmark reports case by case.
+    Args:
+        baseline: The earlier report (a --json file).
+        current: The new report.
+        threshold: Relative slowdown above which a case counts as a regression (0.1 = 10% slower).
+        stat: Which timing to compare ("min", "median" or "mean").
+    Returns:
+        One row per case found in both reports: id, before, after, change and status
+        ("regression", "improved" or "same").
+    """
+    before = {result["id"]: result for result in baseline["benchmarks"]}
+    rows = []
+    for result in current["benchmarks"]:
+        old = before.get(result["id"])
+        if old is None:
+            continue
+        a, b = old["stats"][stat], result["stats"][stat]
+        change = (b - a) / a if a else 0.0
+        status = "regression" if change > threshold else "improved" if change < -threshold else "same"
+        rows.append({"id": result["id"], "before": a, "after": b, "change": change, "status": status})
+    return rows
+
+
+def print_comparison(rows: list, baseline: dict, current: dict, stat: str) -> int:
+    print(f"\n{stat} per call: {baseline['code_version']} -> {current['code_version']}")
+    for row in rows:
+        flag = {"regression": "REGRESSION", "improved": "faster", "same": ""}[row["status"]]
+        print(f"{row['id']:58s} {format_seconds(row['before']):>10s} {format_seconds(row['after']):>10s} "
+              f"{row['change']:+8.1%}  {flag}")
+    regressions = [row for row in rows if row["status"] == "regression"]
+    print(f"{len(regressions)} regressions, {sum(row['status'] == 'improved' for row in rows)} faster, "
+          f"{len(rows)} compared")
+    return 1 if regressions else 0
+
+
+def _ints(value: str) -> list:
+    return [int(float(item)) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run the benchmarks")
+    run.add_argument("--sizes", default=DEFAULT_SIZES, help="Stored chats per case, comma separated")
+    run.add_argument("--batches", default=DEFAULT_BATCHES, help="analyze_sentiment batch sizes, comma separated")
+    run.add_argument("--only", help="Comma separated prefixes of case ids to run (e.g. memory,prompt.render)")
+    run.add_argument("--min-rounds", type=int, default=5)
+    run.add_argument("--max-time", type=float, default=1.0, help="Seconds to time each case for")
+    run.add_argument("--min-round-time", type=float, default=0.001)
+    run.add_argument("--json", help="Write the results to this file (a baseline for compare)")
+    run.add_argument("--compare", help="A baseline to compare the results against")
+    for command in (run, commands.add_parser("compare", help="Compare two saved results")):
+        command.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown flagged as a regression")
+        command.add_argument("--stat", choices=STATS, default="min",
+                             help="Timing to compare (min is the least disturbed by a busy machine)")
+    commands.choices["compare"].add_argument("baseline")
+    commands.choices["compare"].add_argument("current")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(print_comparison(compare(baseline, current, args.threshold, args.stat), baseline, current, args.stat))
+
+    output = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    # save_mood_shifts writes mood_shifts.json relative to the working directory.
+    os.chdir(tempfile.mkdtemp(prefix="micro_"))
+
+    cases = all_cases(_ints(args.sizes), _ints(args.batches))
+    if args.only:
+        prefixes = [prefix.strip() for prefix in args.only.split(",")]
+        cases = [case for case in cases if any(case.id.startswith(prefix) for prefix in prefixes)]
+    report = {
+        "code_version": code_version(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "stub_mode": os.environ["STUB_MODE"],
+        "options": {"min_rounds": args.min_rounds, "max_time": args.max_time, "min_round_time": args.min_round_time},
+        "benchmarks": run_cases(cases, args.min_rounds, args.max_time, args.min_round_time),
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        sys.exit(print_comparison(compare(baseline, report, args.threshold, args.stat), baseline, report, args.stat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare system-prompt input tokens between the legacy inline rendering and the
+budgeted PromptBuilder, using the local tokenizer in chatapp.tokens.
+
+    python -m benchmarks.prompt_tokens --chats 5 --summaries 10 --message-words 400
+"""
+import argparse
+import json
+from datetime import datetime
+
+from chatapp import state
+from chatapp.models import ChatMemory, ShortTermMemory, SummaryEntry, SummaryMemory
+from chatapp.memory.shorttermmemory import SHORT_TERM
+from chatapp.memory.summarymemory import SUMMARIES
+from chatapp.promptmiddleware import (
+    GLOBAL_INSTRUCTIONS,
+    REPLIER_INSTRUCTIONS,
+    _memory_block,
+    build_prompt,
+)
+from chatapp.promptbuilder import get_prompt_reports
+from chatapp.tokens import count_tokens, tokenizer_name
+
+
+def _words(n: int, seed: int) -> str:
+    vocab = ["weather", "movie", "project", "deadline", "happy", "tired", "coffee",
+             "family", "weekend", "python", "travel", "music", "stress", "great"]
+    return " ".join(vocab[(seed + i * 7) % len(vocab)] for i in range(n))
+
+
+USER = "bench_user"
+short_term_memory = ShortTermMemory(chats=[])
+summary_memory = SummaryMemory(summaries=[])
+
+
+def populate(chats: int, summaries: int, message_words: int):
+    short_term_memory.chats = [
+        ChatMemory(
+            user=_words(message_words, i), assistant=_words(message_words, i + 3),
+            sentiment_score=0.9, sentiment_type="POS" if i % 2 else "NEG",
+        )
+        for i in range(chats)
+    ]
+    short_term_memory.max_chats = max(chats, short_term_memory.max_chats)
+    summary_memory.summaries = [
+        SummaryEntry(summary=_words(message_words // 2, i), general_mood="POS", timestamp=datetime.now().isoformat())
+        for i in range(summaries)
+    ]
+    summary_memory.max_summaries = max(summaries, summary_memory.max_summaries)
+    state.update(USER, SHORT_TERM, lambda _: (short_term_memory.model_dump(), None))
+    state.update(USER, SUMMARIES, lambda _: (summary_memory.model_dump(), None))
+
+
+def legacy_tokens(instructions: str, variant: str) -> int:
+    chats = json.dumps([c.model_dump() for c in short_term_memory.chats])
+    if variant == "global":
+        summaries = json.dumps([s.model_dump() for s in summary_memory.summaries])
+    else:
+        summaries = json.dumps([s.model_dump() for s in summary_memory.summaries[:5]])
+    return count_tokens(f"{instructions}\n{chats}\n{summaries}\nNo long-term memory")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--summaries", type=int, default=10)
+    parser.add_argument("--message-words", type=int, default=400)
+    args = parser.parse_args()
+
+    populate(args.chats, args.summaries, args.message_words)
+    print(f"tokenizer: {tokenizer_name()}")
+    for name, instructions, variant in [
+        ("replier", REPLIER_INSTRUCTIONS, "agent"),
+        ("global", GLOBAL_INSTRUCTIONS, "global"),
+    ]:
+        _memory_block(variant, USER)
+        build_prompt(name, instructions, variant, USER)
+        report = get_prompt_reports(limit=1)[0]
+        before = legacy_tokens(instructions, variant)
+        after = report["total_tokens"]
+        print(f"{name:8s} legacy={before:6d} budgeted={after:6d} "
+              f"saved={1 - after / before:6.1%} sections={report['section_tokens']} "
+              f"dropped={report['dropped_items']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Compare how memory is stored now (slotted records in chatapp/records.py,
+written as arrays with orjson) with how it was stored before (pydantic models
+from chatapp/models.py, written with model_dump() and json): document size,
+encode and decode time, and the memory held by the decoded objects.
+
+Each size is the number of chats in a short-term window, history or mood-shift
+document (n // 2 shifts) and of summaries in a summaries document. Formats:
+
+- pydantic: Container.model_validate(json.loads(...)) / json.dumps(model_dump()),
+  what chatapp/memory did before records;
+- records+json: records, encoded with the json module (the fallback when
+  orjson is not installed);
+- records: records with the default codec.
+
+    python -m benchmarks.records
+    python -m benchmarks.records --sizes 1000,1000000 --json records.json
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.micro import format_seconds, make_chats, make_summaries, measure
+from chatapp import records
+from chatapp.models import ShortTermMemory, SummaryEntry, SummaryMemory, local, moodshift
+from chatapp.records import ChatRecord, ChatWindow, MoodShiftRecord, SummaryLog
+
+DEFAULT_SIZES = "1000,100000,1000000"
+FORMATS = ("pydantic", "records+json", "records")
+
+
+def _json_dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def _codecs(fmt: str) -> tuple:
+    return (records.dumps, records.loads) if fmt == "records" else (_json_dumps, json.loads)
+
+
+def chat_formats(n: int) -> dict:
+    """Helper function to build the encode/decode pair of every format for a window of n chats."""
+    chats = make_chats(n, alternate=True)
+    window = ShortTermMemory(chats=chats, max_chats=n)
+    formats = {"pydantic": (window, lambda model: json.dumps(model.model_dump()),
+                            lambda data: ShortTermMemory.model_validate(json.loads(data)))}
+    record = ChatWindow([ChatRecord.from_model(chat) for chat in chats], max_chats=n)
+    for fmt in FORMATS[1:]:
+        dumps, loads = _codecs(fmt)
+        formats[fmt] = (record, lambda value, dumps=dumps: dumps(value.to_document()),
+                        lambda data, loads=loads: ChatWindow.from_document(loads(data)))
+    return formats
+
+
+def summary_formats(n: int) -> dict:
+    """Helper function to build the encode/decode pair of every format for n summaries."""
+    entries = make_summaries(n)
+    memory = SummaryMemory(summaries=[SummaryEntry(**entry.as_dict()) for entry in entries], max_summaries=n)
+    formats = {"pydantic": (memory, lambda model: json.dumps(model.model_dump()),
+                            lambda data: SummaryMemory.model_validate(json.loads(data)))}
+    log = SummaryLog(entries, max_summaries=n)
+    for fmt in FORMATS[1:]:
+        dumps, loads = _codecs(fmt)
+        formats[fmt] = (log, lambda value, dumps=dumps: dumps(value.to_document()),
+                        lambda data, loads=loads: SummaryLog.from_document(loads(data)))
+    return formats
+
+
+def shift_formats(n: int) -> dict:
+    """Helper function to build the encode/decode pair of every format for the n // 2 shifts in n chats."""
+    chats = make_chats(n, alternate=True)
+    shifts = [moodshift(moodshift=local(chat=chats[i:i + 2])) for i in range(0, n - 1, 2)]
+    formats = {"pydantic": (shifts, lambda models: json.dumps({"shifts": [shift.model_dump() for shift in models]}),
+                            lambda data: [moodshift.model_validate(item) for item in json.loads(data)["shifts"]])}
+    rows = [MoodShiftRecord(ChatRecord.from_model(shift.moodshift.chat[0]), ChatRecord.from_model(shift.moodshift.chat[1]))
+            for shift in shifts]
+    for fmt in FORMATS[1:]:
+        dumps, loads = _codecs(fmt)
+        formats[fmt] = (rows, lambda value, dumps=dumps: dumps({"shifts": [shift.to_row() for shift in value]}),
+                        lambda data, loads=loads: MoodShiftRecord.from_rows(loads(data)["shifts"]))
+    return formats
+
+
+KINDS = {"chats": chat_formats, "summaries": summary_formats, "mood_shifts": shift_formats}
+
+
+def retained_bytes(decode, data) -> int:
+    """Helper function to measure the memory held by decode(data)'s result once its intermediates are freed."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        value = decode(data)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del value
+    return size
+
+
+def run(kinds: list, sizes: list, min_rounds: int, max_time: float) -> list:
+    results = []
+    print(f"{'case':26s} {'format':13s} {'bytes':>12s} {'encode':>10s} {'decode':>10s} {'held MB':>9s}  vs pydantic")
+    for kind in kinds:
+        for n in sizes:
+            baseline = None
+            for fmt, (value, encode, decode) in KINDS[kind](n).items():
+                data = encode(value)
+                result = {
+                    "kind": kind, "size": n, "format": fmt, "bytes": len(data),
+                    "encode": min(measure(lambda: encode(value), min_rounds, max_time).samples),
+                    "decode": min(measure(lambda: decode(data), min_rounds, max_time).samples),
+                    "held": retained_bytes(decode, data),
+                }
+                results.append(result)
+                baseline = baseline or result
+                speedup = (f"encode {baseline['encode'] / result['encode']:.1f}x, "
+                           f"decode {baseline['decode'] / result['decode']:.1f}x, "
+                           f"held {result['held'] / baseline['held']:.0%}") if result is not baseline else ""
+                print(f"{kind + '[' + str(n) + ']':26s} {fmt:13s} {len(data):12d} {format_seconds(result['encode']):>10s} "
+                      f"{format_seconds(result['decode']):>10s} {result['held'] / 2 ** 20:9.1f}  {speedup}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Chats (or summaries) per document, comma separated")
+    parser.add_argument("--only", help="Comma separated kinds to run: " + ",".join(KINDS))
+    parser.add_argument("--min-rounds", type=int, default=3)
+    parser.add_argument("--max-time", type=float, default=1.0, help="Seconds to time each encode/decode for")
+    parser.add_argument("--json", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.only.split(",")] if args.only else list(KINDS)
+    sizes = [int(float(size)) for size in args.sizes.split(",") if size.strip()]
+    print(f"codec: {'orjson' if records.orjson is not None else 'json'}")
+    results = run(kinds, sizes, args.min_rounds, args.max_time)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Replay recorded sessions (see chatapp/replay.py) through the sentiment and
+replier agents, with every model, search and classifier call answered from the
+trace, and report how the replay differs from the recording: time per stage,
+state growth per turn, and whether replies and sentiment came out the same.
+
+Record traces by running the app (or the API) with TRACE_RECORD_DIR set, then:
+
+    python -m benchmarks.replay traces/1234.jsonl.gz
+    python -m benchmarks.replay traces/*.jsonl.gz --json before.json
+    # ... change the code ...
+    python -m benchmarks.replay traces/*.jsonl.gz --compare before.json
+
+With --timing none (the default) calls are answered at once, so stage times
+are the app's own overhead; --timing recorded makes each call take as long as
+it did when it was recorded. A turn's stages run one after another so replays
+are deterministic; --concurrent runs them side by side as the app does. Calls
+are matched by request first; "by stage" matches mean the prompts changed
+since the recording and "missing" calls went to the offline stand-ins instead.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+os.environ.setdefault("STUB_MODE", "1")
+os.environ.setdefault("LLM_CACHE_BACKEND", "off")
+os.environ.setdefault("TRACE_RECORD_DIR", "")
+
+from chatapp.replay import TIMINGS, code_version, replay_session  # noqa: E402
+
+
+def stage_totals(sessions: list, side: str) -> dict:
+    """Helper function to add up the seconds per stage over every replayed turn (side: "recorded" or "replayed")."""
+    totals = {}
+    for session in sessions:
+        for turn in session["turns"]:
+            for stage, times in list(turn["stages"].items()) + [("turn_total", turn["total"])]:
+                if times[side] is not None:
+                    totals[stage] = totals.get(stage, 0.0) + times[side]
+    return totals
+
+
+def summarize(sessions: list) -> dict:
+    """Helper function to total a replay: stage times on both sides, call matches, changed turns, state growth."""
+    turns = [turn for session in sessions for turn in session["turns"]]
+    calls = {}
+    state = {"recorded": 0, "replayed": 0}
+    for turn in turns:
+        for match, count in turn["calls"].items():
+            calls[match] = calls.get(match, 0) + count
+        for delta in turn["state_delta"].values():
+            state["recorded"] += delta["recorded"]
+            state["replayed"] += delta["replayed"]
+    return {
+        "turns": len(turns),
+        "recorded_seconds": stage_totals(sessions, "recorded"),
+        "replayed_seconds": stage_totals(sessions, "replayed"),
+        "calls": calls,
+        "changed_responses": sum(not turn["same_response"] for turn in turns),
+        "changed_sentiment": sum(not turn["same_sentiment"] for turn in turns),
+        "turns_with_errors": sum(bool(turn["errors"]) for turn in turns),
+        "state_bytes_added": state,
+        "allocated_bytes": sum(turn["allocated_bytes"] or 0 for turn in turns),
+    }
+
+
+def print_session(session: dict):
+    print(f"\n{session['trace']} (user {session['user_id']}, recorded at {session['recorded_code_version']})")
+    print(f"{'turn':>4s} {'rec ms':>9s} {'replay ms':>9s} {'diff ms':>9s} {'calls e/s/m/u':>14s} "
+          f"{'state +B rec':>12s} {'state +B replay':>15s}  same")
+    for turn in session["turns"]:
+        calls = turn["calls"]
+        recorded_state = sum(delta["recorded"] for delta in turn["state_delta"].values())
+        replayed_state = sum(delta["replayed"] for delta in turn["state_delta"].values())
+        same = ("reply" if turn["same_response"] else "REPLY CHANGED") + \
+               ("" if turn["same_sentiment"] else ", SENTIMENT CHANGED")
+        total = turn["total"]
+        print(f"{turn['index']:4d} {total['recorded'] * 1000:9.1f} {total['replayed'] * 1000:9.1f} "
+              f"{total['diff'] * 1000:9.1f} {calls['exact']:4d}/{calls['by_stage']}/{calls['missing']}/{calls['unused']:<5d}"
+              f"{recorded_state:12d} {replayed_state:15d}  {same}")
+
+
+def print_stage_table(title: str, left_name: str, left: dict, right_name: str, right: dict):
+    print(f"\n{title}")
+    print(f"{'stage':18s} {left_name:>12s} {right_name:>12s} {'diff ms':>10s}")
+    for stage in sorted(set(left) | set(right)):
+        a, b = left.get(stage, 0.0), right.get(stage, 0.0)
+        print(f"{stage:18s} {a * 1000:12.1f} {b * 1000:12.1f} {(b - a) * 1000:10.1f}")
+
+
+def compare(report: dict, baseline: dict):
+    """Print how this replay differs from an earlier one of the same traces (e.g. another commit)."""
+    print_stage_table(
+        f"vs baseline {baseline['code_version']} ({baseline['summary']['turns']} turns)",
+        "baseline ms", baseline["summary"]["replayed_seconds"], "current ms", report["summary"]["replayed_seconds"],
+    )
+    before = {(s["trace"], t["index"]): t for s in baseline["sessions"] for t in s["turns"]}
+    for session in report["sessions"]:
+        for turn in session["turns"]:
+            old = before.get((session["trace"], turn["index"]))
+            if old is None:
+                continue
+            state_now = sum(delta["replayed"] for delta in turn["state_delta"].values())
+            state_then = sum(delta["replayed"] for delta in old["state_delta"].values())
+            notes = []
+            if state_now != state_then:
+                notes.append(f"state +{state_now}B (was +{state_then}B)")
+            if turn["calls"] != old["calls"]:
+                notes.append(f"calls {turn['calls']} (was {old['calls']})")
+            if notes:
+                print(f"  {os.path.basename(session['trace'])} turn {turn['index']}: {'; '.join(notes)}")
+    added = report["summary"]["state_bytes_added"]["replayed"]
+    added_before = baseline["summary"]["state_bytes_added"]["replayed"]
+    print(f"state bytes added: {added} (baseline {added_before}, {added - added_before:+d})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="+", help="Trace files (<user_id>.jsonl.gz)")
+    parser.add_argument("--timing", choices=TIMINGS, default="none")
+    parser.add_argument("--allocations", action="store_true", help="Measure Python memory allocated per turn")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="Run each turn's stages concurrently, as the app does (replays are then not deterministic)")
+    parser.add_argument("--compare", help="An earlier --json report of the same traces to compare against")
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    traces = [os.path.abspath(path) for path in args.traces]
+    output = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    # Memory tools write mood_shifts.json relative to the working directory.
+    os.chdir(tempfile.mkdtemp(prefix="replay_"))
+
+    sessions = [replay_session(path, timing=args.timing, track_allocations=args.allocations, serial=not args.concurrent)
+                for path in traces]
+    report = {"code_version": code_version(), "timing": args.timing, "sessions": sessions,
+              "summary": summarize(sessions)}
+    for session in sessions:
+        print_session(session)
+    summary = report["summary"]
+    print_stage_table(f"{summary['turns']} turns, replayed at {report['code_version']} (timing {args.timing})",
+                      "recorded ms", summary["recorded_seconds"], "replayed ms", summary["replayed_seconds"])
+    print(f"calls: {summary['calls']}, changed replies: {summary['changed_responses']}, "
+          f"changed sentiment: {summary['changed_sentiment']}, turns with errors: {summary['turns_with_errors']}")
+    print(f"state bytes added: recorded {summary['state_bytes_added']['recorded']}, "
+          f"replayed {summary['state_bytes_added']['replayed']}")
+    if args.allocations:
+        print(f"allocated by turns: {summary['allocated_bytes'] / 1024:.1f} KB")
+    if baseline_path:
+        with open(baseline_path) as f:
+            compare(report, json.load(f))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Exercise chatapp.resilience against a local fake search service with injected
+latency and errors, and compare tail latency and failure rate per strategy:
+
+    plain    single attempt, no deadline
+    retry    jittered retries within the deadline
+    hedge    retries plus a hedged duplicate after the recent p95
+
+    python -m benchmarks.resilience --calls 300 --latency lognormal:0.05,0.8 --error-rate 0.05 --deadline 1.0
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("STUB_MODE", "1")
+
+from benchmarks.turn_latency import percentile  # noqa: E402
+from chatapp.resilience import (  # noqa: E402
+    ResiliencePolicy,
+    call_with_resilience,
+    deadline_scope,
+    register_dependency,
+)
+from chatapp.stubs import FakeTavilyClient, LatencyDistribution  # noqa: E402
+
+STRATEGIES = {
+    "plain": ResiliencePolicy(max_attempts=1, hedge=False),
+    "retry": ResiliencePolicy(max_attempts=3, base_delay=0.05, hedge=False),
+    "hedge": ResiliencePolicy(max_attempts=3, base_delay=0.05, hedge=True),
+}
+
+
+def run_strategy(name: str, policy: ResiliencePolicy, args) -> dict:
+    client = FakeTavilyClient(latency=LatencyDistribution.parse(args.latency, seed=args.seed),
+                              error_rate=args.error_rate)
+    dependency_name = f"bench_{name}"
+    # A high threshold keeps the breaker out of the comparison.
+    register_dependency(dependency_name, policy, failure_threshold=10_000)
+    deadline = None if name == "plain" else args.deadline
+
+    def one(i: int):
+        start = time.monotonic()
+        try:
+            with deadline_scope(deadline):
+                call_with_resilience(dependency_name, client.search, f"query {i}")
+            ok = True
+        except Exception:
+            ok = False
+        return time.monotonic() - start, ok
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.calls)))
+    latencies = [seconds for seconds, _ in results]
+    failures = sum(1 for _, ok in results if not ok)
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "failure_rate": failures / len(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", default="lognormal:0.05,0.8")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--deadline", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"latency={args.latency} error_rate={args.error_rate} deadline={args.deadline}s calls={args.calls}")
+    print(f"{'strategy':8s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} {'failed':>7s}")
+    for name, policy in STRATEGIES.items():
+        row = run_strategy(name, policy, args)
+        print(f"{name:8s} {row['p50_ms']:8.1f} {row['p95_ms']:8.1f} {row['p99_ms']:8.1f} "
+              f"{row['max_ms']:8.1f} {row['failure_rate']:7.1%}")
+
+
+if __name__ == "__main__":
+    main()
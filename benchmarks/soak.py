@@ -0,0 +1,379 @@
+"""
+Conversation load generator and soak test, run against the offline stand-ins
+in chatapp/stubs.py (no Gemini, Tavily or model download needed).
+
+Simulates --users virtual users for --duration seconds. Each user comes back
+for session after session; a session is a random number of turns
+(--session-turns) with think time between messages (--think) and a longer
+break between sessions (--session-gap). Messages have a random length in words
+(--message-words) and a sentiment drawn from --sentiment-mix, worded so the
+stand-in classifier labels them accordingly. Distributions use the latency
+spec syntax from chatapp/stubs.py: "fixed:S", "uniform:LO,HI",
+"lognormal:MEDIAN,SIGMA".
+
+Turns run in-process (admission control, then chatapp.pipeline.run_turn, as
+the API does) or over HTTP against a running `api:app` with --url (start it
+with STUB_MODE=1). Every --sample-interval seconds the run records throughput,
+latency percentiles, errors, process RSS (in-process) and the bytes held per
+kind of state document (from the "state" collector, or /metrics over HTTP).
+A document kind whose size keeps growing with the number of turns after the
+warm-up is flagged: per-user state should level off, not grow per turn.
+
+    python -m benchmarks.soak --users 1000 --duration 120
+    python -m benchmarks.soak --users 200 --duration 600 --think lognormal:20,0.8 --json soak.json
+    python -m benchmarks.soak --url http://127.0.0.1:8000 --users 500 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("STUB_MODE", "1")
+os.environ.setdefault("LLM_CACHE_BACKEND", "off")
+
+from benchmarks.turn_latency import percentile  # noqa: E402
+from chatapp.stubs import LatencyDistribution  # noqa: E402
+
+TOPIC_WORDS = ["work", "weekend", "movie", "coffee", "deadline", "family", "trip", "python", "music", "weather",
+               "project", "dinner", "friend", "book", "game", "idea", "plan", "today", "morning", "team"]
+# Words the stand-in classifier scores (see FakeClassifier in chatapp/stubs.py).
+SENTIMENT_WORDS = {
+    "positive": ["good", "great", "happy", "love", "awesome", "glad", "amazing"],
+    "negative": ["bad", "sad", "hate", "angry", "terrible", "upset", "worried"],
+    "neutral": [],
+}
+OUTCOMES = ("ok", "stage_error", "rejected", "failed")
+STATE_LINE = re.compile(r"^chatapp_state_(bytes|documents)_(\w+) ([0-9.e+-]+)$")
+
+
+def parse_mix(spec: str) -> dict:
+    """Helper function to parse a sentiment mix like "positive=0.4,negative=0.3,neutral=0.3" into weights."""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SENTIMENT_WORDS:
+            raise ValueError(f"Unknown sentiment in mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class TrafficProfile:
+    """The shape of the simulated traffic: message lengths, sentiment mix, think times and session lengths."""
+
+    def __init__(self, args: argparse.Namespace, seed: int):
+        self.rng = random.Random(seed)
+        self.message_words = LatencyDistribution.parse(args.message_words, seed=self.rng.random())
+        self.think = LatencyDistribution.parse(args.think, seed=self.rng.random())
+        self.session_gap = LatencyDistribution.parse(args.session_gap, seed=self.rng.random())
+        self.session_turns = LatencyDistribution.parse(args.session_turns, seed=self.rng.random())
+        self.time_scale = args.time_scale
+        self.mix = parse_mix(args.sentiment_mix)
+
+    def message(self) -> str:
+        sentiment = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        words = [self.rng.choice(TOPIC_WORDS) for _ in range(max(1, round(self.message_words.sample())))]
+        for _ in range(1 + len(words) // 20 if SENTIMENT_WORDS[sentiment] else 0):
+            words.insert(self.rng.randrange(len(words) + 1), self.rng.choice(SENTIMENT_WORDS[sentiment]))
+        return " ".join(words)
+
+    def turns(self) -> int:
+        return max(1, round(self.session_turns.sample()))
+
+    def think_seconds(self) -> float:
+        return self.think.sample() * self.time_scale
+
+    def gap_seconds(self) -> float:
+        return self.session_gap.sample() * self.time_scale
+
+
+def rss_bytes() -> int:
+    """Helper function to get this process's resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class InProcessDriver:
+    """Runs turns in this process on a bounded thread pool, through admission control like the API."""
+
+    def __init__(self, concurrency: int):
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="soak")
+
+    def _turn(self, user_id: str, message: str) -> str:
+        from chatapp.admission import AdmissionRejected, admission
+        from chatapp.pipeline import run_turn
+
+        try:
+            ticket = admission.admit(user_id)
+        except AdmissionRejected:
+            return "rejected"
+        with ticket:
+            result = run_turn(message, user_id=user_id)
+        return "stage_error" if result.errors else "ok"
+
+    async def turn(self, user_id: str, message: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self._turn, user_id, message)
+
+    async def state_sizes(self) -> dict:
+        from chatapp.state import backend
+
+        return backend.sizes()
+
+    def rss(self):
+        return rss_bytes()
+
+    async def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class HttpDriver:
+    """Sends turns to a running API (POST /chat) and reads state sizes from its /metrics."""
+
+    def __init__(self, url: str, concurrency: int):
+        import httpx
+
+        self.url = url.rstrip("/")
+        self.client = httpx.AsyncClient(
+            timeout=120, limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def turn(self, user_id: str, message: str) -> str:
+        response = await self.client.post(f"{self.url}/chat", json={"message": message, "user_id": user_id})
+        if response.status_code in (429, 503):
+            return "rejected"
+        if response.status_code != 200:
+            return "failed"
+        return "stage_error" if response.json().get("errors") else "ok"
+
+    async def state_sizes(self) -> dict:
+        sizes = {}
+        try:
+            response = await self.client.get(f"{self.url}/metrics")
+        except Exception:
+            return sizes
+        for line in response.text.splitlines():
+            match = STATE_LINE.match(line)
+            if match:
+                sizes.setdefault(match.group(2), {})[match.group(1)] = int(float(match.group(3)))
+        return sizes
+
+    def rss(self):
+        return None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class LoadRun:
+    """Shared counters of one run; the sampler reads and resets the per-interval part."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.outcomes = {outcome: 0 for outcome in OUTCOMES}
+        self.latencies = []
+        self.interval_latencies = []
+        self.interval_turns = 0
+        self.interval_completed = 0
+        self.active_sessions = 0
+        self.samples = []
+
+    def record(self, outcome: str, seconds: float):
+        self.outcomes[outcome] += 1
+        if outcome in ("ok", "stage_error"):
+            self.latencies.append(seconds)
+            self.interval_latencies.append(seconds)
+            self.interval_completed += 1
+        self.interval_turns += 1
+
+    @property
+    def turns(self) -> int:
+        return sum(self.outcomes.values())
+
+
+async def virtual_user(index: int, profile: TrafficProfile, driver, run: LoadRun, stop_at: float, ramp_up: float):
+    user_id = f"soak_user_{index}"
+    await asyncio.sleep(profile.rng.uniform(0, ramp_up))
+    while time.monotonic() < stop_at:
+        run.active_sessions += 1
+        try:
+            for turn in range(profile.turns()):
+                if turn:
+                    await asyncio.sleep(min(profile.think_seconds(), max(0.0, stop_at - time.monotonic())))
+                if time.monotonic() >= stop_at:
+                    return
+                start = time.perf_counter()
+                try:
+                    outcome = await driver.turn(user_id, profile.message())
+                except Exception:
+                    outcome = "failed"
+                run.record(outcome, time.perf_counter() - start)
+        finally:
+            run.active_sessions -= 1
+        await asyncio.sleep(min(profile.gap_seconds(), max(0.0, stop_at - time.monotonic())))
+
+
+async def sampler(driver, run: LoadRun, interval: float, stop_at: float):
+    last = time.monotonic()
+    while True:
+        await asyncio.sleep(max(0.0, min(interval, stop_at - time.monotonic())))
+        now = time.monotonic()
+        latencies, run.interval_latencies = run.interval_latencies, []
+        turns, run.interval_turns = run.interval_turns, 0
+        completed, run.interval_completed = run.interval_completed, 0
+        sample = {
+            "elapsed_seconds": now - run.started,
+            "turns": run.turns,
+            "turns_per_second": turns / (now - last) if now > last else 0.0,
+            "completed_per_second": completed / (now - last) if now > last else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "errors": run.outcomes["stage_error"] + run.outcomes["failed"],
+            "rejected": run.outcomes["rejected"],
+            "active_sessions": run.active_sessions,
+            "rss_bytes": driver.rss(),
+            "state": await driver.state_sizes(),
+        }
+        run.samples.append(sample)
+        last = now
+        rss = f"{sample['rss_bytes'] / 2 ** 20:7.1f}" if sample["rss_bytes"] is not None else "    n/a"
+        state_bytes = sum(size.get("bytes", 0) for size in sample["state"].values())
+        print(f"{sample['elapsed_seconds']:7.1f}s {sample['turns']:8d} {sample['completed_per_second']:8.1f} "
+              f"{sample['p50_ms']:9.1f} {sample['p95_ms']:9.1f} {sample['errors']:7d} {sample['rejected']:8d} "
+              f"{sample['active_sessions']:7d} {rss} {state_bytes / 1024:10.1f}", flush=True)
+        if now >= stop_at:
+            return
+
+
+def slope(points: list) -> float:
+    """Helper function to get the least-squares slope of (x, y) points (0 for fewer than two distinct x)."""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+
+def growth_report(samples: list, warmup: float, threshold: float) -> dict:
+    """
+    Helper function to find state that grows with traffic.
+    Args:
+        samples: The periodic samples of the run.
+        warmup: Fraction of the samples to skip before fitting (state fills up at first).
+        threshold: Bytes per turn above which a document kind counts as growing.
+    Returns:
+        Per document kind: final documents and bytes, bytes per turn after warm-up, and whether it grows.
+    """
+    steady = samples[int(len(samples) * warmup):]
+    names = sorted({name for sample in samples for name in sample["state"]})
+    report = {}
+    for name in names:
+        points = [(s["turns"], s["state"].get(name, {}).get("bytes", 0)) for s in steady]
+        final = samples[-1]["state"].get(name, {})
+        per_turn = slope(points)
+        report[name] = {
+            "documents": final.get("documents", 0),
+            "bytes": final.get("bytes", 0),
+            "bytes_per_turn": per_turn,
+            "growing": per_turn > threshold,
+        }
+    rss_points = [(s["turns"], s["rss_bytes"]) for s in steady if s["rss_bytes"] is not None]
+    if rss_points:
+        report["process_rss"] = {"bytes": rss_points[-1][1], "bytes_per_turn": slope(rss_points)}
+    return report
+
+
+async def run_load(args: argparse.Namespace) -> dict:
+    driver = HttpDriver(args.url, args.concurrency) if args.url else InProcessDriver(args.concurrency)
+    if not args.url:
+        # Load the classifier and build the agents before the clock starts.
+        await asyncio.get_running_loop().run_in_executor(None, __import__, "chatapp.agents")
+    run = LoadRun()
+    stop_at = run.started + args.duration
+    profile = TrafficProfile(args, args.seed)
+    print(f"{'elapsed':>8s} {'turns':>8s} {'done/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'errors':>7s} "
+          f"{'rejected':>8s} {'active':>7s} {'RSS MB':>7s} {'state KB':>10s}")
+    try:
+        users = [virtual_user(i, profile, driver, run, stop_at, args.ramp_up) for i in range(args.users)]
+        await asyncio.gather(sampler(driver, run, args.sample_interval, stop_at), *users)
+    finally:
+        await driver.close()
+    elapsed = time.monotonic() - run.started
+    return {
+        "mode": "http" if args.url else "in_process",
+        "users": args.users,
+        "duration_seconds": elapsed,
+        "turns": run.turns,
+        "turns_per_second": run.turns / elapsed if elapsed else 0.0,
+        "completed_per_second": len(run.latencies) / elapsed if elapsed else 0.0,
+        "outcomes": run.outcomes,
+        "error_rate": (run.outcomes["stage_error"] + run.outcomes["failed"]) / run.turns if run.turns else 0.0,
+        "rejection_rate": run.outcomes["rejected"] / run.turns if run.turns else 0.0,
+        "latency_ms": {f"p{pct}": percentile(run.latencies, pct) * 1000 for pct in (50, 90, 95, 99)},
+        "growth": growth_report(run.samples, args.warmup, args.growth_threshold),
+        "samples": run.samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="Virtual users")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="Seconds over which users start")
+    parser.add_argument("--concurrency", type=int, default=64, help="Turns (in-process) or connections (HTTP) at once")
+    parser.add_argument("--message-words", default="lognormal:12,0.8", help="Words per message")
+    parser.add_argument("--sentiment-mix", default="positive=0.4,negative=0.3,neutral=0.3")
+    parser.add_argument("--think", default="lognormal:3,0.6", help="Seconds between a reply and the next message")
+    parser.add_argument("--session-turns", default="uniform:3,15", help="Turns per session")
+    parser.add_argument("--session-gap", default="uniform:5,30", help="Seconds between a user's sessions")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiplier for think times and session gaps")
+    parser.add_argument("--url", help="Drive a running API at this base URL instead of the engine in-process")
+    parser.add_argument("--sample-interval", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=0.3, help="Fraction of samples ignored by the growth check")
+    parser.add_argument("--growth-threshold", type=float, default=1.0,
+                        help="Bytes per turn above which a kind of state counts as growing")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write the report (including every sample) to this file as JSON")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.json) if args.json else None
+    if not args.url:
+        # Memory tools write mood_shifts.json relative to the working directory.
+        os.chdir(tempfile.mkdtemp(prefix="soak_"))
+
+    report = asyncio.run(run_load(args))
+
+    outcomes = report["outcomes"]
+    latency = report["latency_ms"]
+    print(f"\n{report['turns']} turns from {report['users']} users in {report['duration_seconds']:.1f}s "
+          f"({report['turns_per_second']:.2f} turns/sec, {report['completed_per_second']:.2f} completed/sec, "
+          f"{report['mode']})")
+    print(f"outcomes: {outcomes}, error rate {report['error_rate']:.2%}, rejected {report['rejection_rate']:.2%}")
+    print(f"latency ms: p50 {latency['p50']:.1f}  p90 {latency['p90']:.1f}  p95 {latency['p95']:.1f}  "
+          f"p99 {latency['p99']:.1f}")
+    print(f"{'state':16s} {'documents':>9s} {'KB':>10s} {'bytes/turn':>11s}")
+    for name, row in report["growth"].items():
+        if name == "process_rss":
+            continue
+        flag = "  GROWING" if row["growing"] else ""
+        print(f"{name:16s} {row['documents']:9d} {row['bytes'] / 1024:10.1f} {row['bytes_per_turn']:11.1f}{flag}")
+    if "process_rss" in report["growth"]:
+        rss = report["growth"]["process_rss"]
+        print(f"process RSS {rss['bytes'] / 2 ** 20:.1f} MB, {rss['bytes_per_turn']:.0f} bytes/turn after warm-up")
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Replay synthetic chat traces through the short-term summarization trigger and
+compare it with the old fixed rule (summarize after every 5 chats): how many
+Gemini summarization calls each makes, how many tokens each call carries, and
+how often the window overflowed the short-term prompt budget first.
+
+Traces mimic three kinds of session: quick chit-chat, a mixed session, and
+long-form venting/explaining. Message lengths and gaps between messages are
+drawn from fixed-seed distributions; no model is called.
+
+    python -m benchmarks.summarization_trigger --sessions 50 --messages 40
+"""
+import argparse
+import json
+import os
+import random
+
+os.environ.setdefault("STUB_MODE", "1")
+
+from chatapp.memory.shorttermmemory import LEGACY_SUMMARY_EVERY, chat_tokens, summarization_policy  # noqa: E402
+from chatapp.records import ChatRecord  # noqa: E402
+
+VOCAB = ["work", "weekend", "movie", "coffee", "deadline", "family", "trip", "python", "music", "tired",
+         "happy", "project", "weather", "dinner", "friend", "book", "game", "stress", "idea", "plan"]
+
+# name -> (user words range, reply words range, seconds between messages range, chance of a long break)
+TRACES = {
+    "chit_chat": ((2, 12), (8, 30), (5, 40), 0.02),
+    "mixed": ((5, 60), (20, 90), (10, 120), 0.05),
+    "long_form": ((80, 300), (60, 200), (60, 300), 0.05),
+}
+LONG_BREAK = 3600.0
+
+
+def _text(rng: random.Random, words: tuple) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(rng.randint(*words)))
+
+
+def replay(trace: str, messages: int, rng: random.Random) -> dict:
+    user_words, reply_words, gap, break_chance = TRACES[trace]
+    window, window_started, now = [], None, 0.0
+    legacy_window = []
+    result = {"summaries": 0, "legacy_summaries": 0, "summary_tokens": 0, "legacy_summary_tokens": 0,
+              "legacy_overflows": 0, "reasons": {}}
+    for _ in range(messages):
+        now += LONG_BREAK if rng.random() < break_chance else rng.uniform(*gap)
+        chat = ChatRecord(_text(rng, user_words), _text(rng, reply_words), 0.8, "NEU")
+        tokens = chat_tokens(chat)
+
+        legacy_window.append(tokens)
+        if sum(legacy_window) > summarization_policy.max_tokens:
+            result["legacy_overflows"] += 1
+        if len(legacy_window) >= LEGACY_SUMMARY_EVERY:
+            result["legacy_summaries"] += 1
+            result["legacy_summary_tokens"] += sum(legacy_window)
+            legacy_window = []
+
+        if not window:
+            window_started = now
+        window.append(tokens)
+        reason = summarization_policy.reason(sum(window), len(window), now - window_started)
+        if reason is not None:
+            result["summaries"] += 1
+            result["summary_tokens"] += sum(window)
+            result["reasons"][reason] = result["reasons"].get(reason, 0) + 1
+            window = []
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50, help="Sessions per trace kind")
+    parser.add_argument("--messages", type=int, default=40, help="Messages per session")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    print(f"policy: {summarization_policy.max_tokens} tokens / {summarization_policy.max_chats} chats / "
+          f"{summarization_policy.max_age:.0f}s, legacy: every {LEGACY_SUMMARY_EVERY} chats")
+    print(f"{'trace':10s} {'legacy':>7s} {'adaptive':>8s} {'avoided':>8s} {'tok/call':>9s} "
+          f"{'legacy tok/call':>15s} {'legacy overflows':>16s}  reasons")
+    report = {}
+    for trace in TRACES:
+        rng = random.Random(args.seed)
+        totals = {"summaries": 0, "legacy_summaries": 0, "summary_tokens": 0, "legacy_summary_tokens": 0,
+                  "legacy_overflows": 0, "reasons": {}}
+        for _ in range(args.sessions):
+            result = replay(trace, args.messages, rng)
+            for key, value in result.items():
+                if key == "reasons":
+                    for reason, count in value.items():
+                        totals["reasons"][reason] = totals["reasons"].get(reason, 0) + count
+                else:
+                    totals[key] += value
+        totals["avoided"] = totals["legacy_summaries"] - totals["summaries"]
+        report[trace] = totals
+        per_call = totals["summary_tokens"] / totals["summaries"] if totals["summaries"] else 0
+        legacy_per_call = totals["legacy_summary_tokens"] / totals["legacy_summaries"] if totals["legacy_summaries"] else 0
+        print(f"{trace:10s} {totals['legacy_summaries']:7d} {totals['summaries']:8d} {totals['avoided']:8d} "
+              f"{per_call:9.0f} {legacy_per_call:15.0f} {totals['legacy_overflows']:16d}  {totals['reasons']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
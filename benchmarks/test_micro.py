@@ -0,0 +1,41 @@
+"""
+The cases of benchmarks/micro.py as pytest-benchmark tests, for keeping
+baselines and comparing runs with pytest-benchmark's own storage:
+
+    pip install -e .[bench]
+    pytest benchmarks/test_micro.py --benchmark-autosave
+    # ... change the code ...
+    pytest benchmarks/test_micro.py --benchmark-compare --benchmark-compare-fail=min:10%
+
+Sizes default to 100 and 10000 chats so a run stays short; set MICRO_SIZES
+(and MICRO_BATCHES for analyze_sentiment) to the comma separated lists
+micro.py takes, e.g. MICRO_SIZES=100,10000,1000000.
+"""
+import os
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmarks.micro import _fresh_state, _ints, all_cases  # noqa: E402
+
+CASES = all_cases(_ints(os.getenv("MICRO_SIZES", "100,10000")), _ints(os.getenv("MICRO_BATCHES", "1,8,32")))
+
+
+@pytest.fixture(autouse=True)
+def _isolated(tmp_path, monkeypatch):
+    # save_mood_shifts writes mood_shifts.json relative to the working directory.
+    monkeypatch.chdir(tmp_path)
+    yield
+    _fresh_state()
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case.id for case in CASES])
+def test_micro(benchmark, case):
+    benchmark.group = f"{case.group}.{case.name}"
+    data = case.setup()
+    try:
+        benchmark(case.run, data)
+    finally:
+        if case.teardown:
+            case.teardown(data)
@@ -0,0 +1,140 @@
+"""
+End-to-end latency benchmark for chat turns, run fully offline against the
+stand-ins in chatapp/stubs.py (no Gemini, Tavily or model download needed).
+
+Each conversation runs --turns chat turns through chatapp.pipeline.run_turn and
+then the end-of-session global analysis. Reports p50/p95/p99 per stage and
+overall turns/sec, plus how much running each step's tool calls side by side
+saved against their sequential baseline.
+
+    python -m benchmarks.turn_latency --conversations 20 --turns 5 --concurrency 4
+    STUB_GEMINI_LATENCY=fixed:0.2 python -m benchmarks.turn_latency --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("STUB_MODE", "1")
+os.environ.setdefault("LLM_CACHE_BACKEND", "off")
+
+MESSAGES = [
+    "I had a great day at work, the project finally shipped!",
+    "What is the latest news about the weather in Paris today?",
+    "I'm so tired and stressed about the deadline tomorrow.",
+    "Can you recommend a good book for the weekend?",
+    "I hate when my train is late, it ruins the whole morning.",
+    "Who won the football match last night?",
+    "Thanks, that was really helpful, I'm glad I asked.",
+    "Tell me something interesting about octopuses.",
+    "Who is playing tonight? What is the weather today? Where can I watch it?",
+]
+
+
+def percentile(samples, pct: float) -> float:
+    """Helper function to get the nearest-rank percentile of a list of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_conversation(conversation_id: int, turns: int, seed: int) -> dict:
+    from chatapp.agents import global_analyzer_agent
+    from chatapp.memory.sessiondigest import prepare_session_digest
+    from chatapp.models import Context
+    from chatapp.pipeline import run_turn
+
+    rng = random.Random(seed + conversation_id)
+    user_id = f"bench_user_{conversation_id}"
+    stages, errors = {}, 0
+    for _ in range(turns):
+        result = run_turn(rng.choice(MESSAGES), user_id=user_id)
+        for name, seconds in result.stage_seconds.items():
+            stages.setdefault(name, []).append(seconds)
+        stages.setdefault("turn_total", []).append(result.total_seconds)
+        errors += len(result.errors)
+
+    start = time.perf_counter()
+    prepare_session_digest(user_id)
+    global_analyzer_agent.invoke(
+        {"messages": [{"role": "user", "content": "Provide a comprehensive summary of this conversation session."}]},
+        context=Context(user_id=user_id),
+    )
+    stages.setdefault("session_summary", []).append(time.perf_counter() - start)
+    return {"stages": stages, "errors": errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write the report to this file as JSON")
+    args = parser.parse_args()
+
+    # Memory tools write mood_shifts.json relative to the working directory.
+    workdir = tempfile.mkdtemp(prefix="turn_latency_")
+    output = os.path.abspath(args.json) if args.json else None
+    os.chdir(workdir)
+
+    from chatapp.toolexec import get_tool_step_stats
+    from settings import config
+
+    stages, errors = {}, 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_conversation, i, args.turns, args.seed) for i in range(args.conversations)]
+        for future in futures:
+            result = future.result()
+            errors += result["errors"]
+            for name, samples in result["stages"].items():
+                stages.setdefault(name, []).extend(samples)
+    elapsed = time.perf_counter() - start
+
+    total_turns = args.conversations * args.turns
+    report = {
+        "conversations": args.conversations,
+        "turns": total_turns,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "turns_per_second": total_turns / elapsed if elapsed else 0.0,
+        "stage_errors": errors,
+        "latency": {
+            "gemini": config.STUB_GEMINI_LATENCY,
+            "tavily": config.STUB_TAVILY_LATENCY,
+            "classifier": config.STUB_CLASSIFIER_LATENCY,
+        },
+        "stages": {
+            name: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+            for name, samples in sorted(stages.items())
+        },
+        "tool_steps": get_tool_step_stats(),
+    }
+
+    print(f"{total_turns} turns in {elapsed:.2f}s ({report['turns_per_second']:.2f} turns/sec), "
+          f"concurrency={args.concurrency}, stage errors={errors}")
+    print(f"{'stage':18s} {'count':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, row in report["stages"].items():
+        print(f"{name:18s} {row['count']:6d} {row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f}")
+    tool_steps = report["tool_steps"]
+    if tool_steps["multi_call_steps"]:
+        print(f"multi-call tool steps: {tool_steps['multi_call_steps']}, wall {tool_steps['wall_seconds']:.2f}s "
+              f"vs sequential {tool_steps['sequential_seconds']:.2f}s ({tool_steps['speedup']:.2f}x)")
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Admission control for chat turns.
+
+Every turn fans out to the classifier, Gemini and Tavily at once, so letting
+every request in during a burst makes all of them slow. Turns are admitted
+here first:
+
+- at most ADMISSION_MAX_CONCURRENT turns run at once, and at most
+  ADMISSION_PER_USER of them for the same user;
+- the rest wait in a FIFO queue of ADMISSION_MAX_QUEUED tickets (at most
+  ADMISSION_USER_QUEUED per user) for up to ADMISSION_QUEUE_TIMEOUT seconds;
+- anything beyond that is rejected straight away with AdmissionRejected.
+
+A ticket can carry a key (e.g. the user and the message); a second request
+with the key of a turn that is still queued or running is rejected as a
+duplicate instead of starting the same turn twice.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Callable
+
+from chatapp.metrics import metrics
+from settings import config
+
+
+class AdmissionRejected(Exception):
+    """Raised when a turn is not admitted: the queue is full, it timed out waiting, or it is a duplicate."""
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(f"Turn not admitted: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    A turn's place in the admission queue, and its running slot once admitted.
+
+    Use it as a context manager to release the slot on exit, or call hold() to
+    hand the release over to whoever outlives the block (e.g. the worker thread
+    that keeps running after a streamed turn's consumer went away).
+    """
+
+    def __init__(self, controller: "AdmissionController", user_id: str, key=None):
+        self.controller = controller
+        self.user_id = user_id
+        self.key = key
+        self.requested_at = time.monotonic()
+        self.future = Future()
+        self._held = False
+        self._released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.future.done()
+
+    def position(self) -> int:
+        """Place in the queue (1 is next); 0 once admitted or withdrawn."""
+        return self.controller.position(self)
+
+    def wait(self, timeout: float = None) -> "AdmissionTicket":
+        """Block until admitted; raises AdmissionRejected("timeout") after timeout seconds."""
+        timeout = self.controller.queue_timeout if timeout is None else timeout
+        try:
+            self.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._expire()
+        return self
+
+    async def queued(self, timeout: float = None, poll: float = 1.0) -> AsyncIterator[int]:
+        """
+        Wait for admission on the event loop (no thread is held while queued).
+        Args:
+            timeout: Seconds to wait (defaults to ADMISSION_QUEUE_TIMEOUT).
+            poll: How often the queue position is checked.
+        Yields:
+            The queue position whenever it changes; the loop ends once the ticket is admitted.
+        Raises:
+            AdmissionRejected: If the ticket was still queued after timeout seconds.
+        """
+        timeout = self.controller.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waiter = asyncio.wrap_future(self.future)
+        last_position = None
+        while not self.future.done():
+            position = self.position()
+            if position and position != last_position:
+                last_position = position
+                yield position
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._expire()
+                return
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), min(poll, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    def _expire(self):
+        if self.controller._withdraw(self, "timeout"):
+            raise AdmissionRejected("timeout", self.controller.retry_after)
+        # Admitted just as the wait ran out.
+
+    def hold(self) -> Callable[[], None]:
+        """Keep the slot past the `with` block; the returned callable releases it."""
+        self._held = True
+        return self.release
+
+    def release(self):
+        """Give back the running slot (or leave the queue). Safe to call more than once."""
+        self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self._held:
+            self.release()
+        return False
+
+
+class AdmissionController:
+    """Global and per-user concurrency limits in front of the turn pipeline, with a bounded FIFO wait queue."""
+
+    def __init__(self, max_concurrent: int = 8, per_user: int = 1, max_queued: int = 32, user_queued: int = 1,
+                 queue_timeout: float = 10.0, retry_after: float = 2.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_user = max(1, per_user)
+        self.max_queued = max(0, max_queued)
+        self.user_queued = max(0, user_queued)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._waiting = deque()
+        self._running = 0
+        self._user_running = {}
+        self._user_waiting = {}
+        self._keys = set()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0, "duplicates": 0, "peak_queued": 0}
+
+    def _can_run(self, user_id: str) -> bool:
+        return self._running < self.max_concurrent and self._user_running.get(user_id, 0) < self.per_user
+
+    def _reject(self, reason: str):
+        self._stats["duplicates" if reason == "duplicate" else "rejected"] += 1
+        metrics.inc("admission_rejected_total", reason=reason)
+        raise AdmissionRejected(reason, self.retry_after)
+
+    def _start(self, ticket: AdmissionTicket):
+        # Caller holds the lock.
+        self._running += 1
+        self._user_running[ticket.user_id] = self._user_running.get(ticket.user_id, 0) + 1
+        self._stats["admitted"] += 1
+        try:
+            ticket.future.set_result(True)
+        except InvalidStateError:
+            pass
+
+    def request(self, user_id, key=None) -> AdmissionTicket:
+        """
+        Ask for a running slot without waiting.
+        Args:
+            user_id: The user the turn belongs to.
+            key: Optional identity of the turn; a request whose key is already queued or running is a duplicate.
+        Returns:
+            A ticket, already admitted if a slot was free, otherwise queued (see AdmissionTicket.wait).
+        Raises:
+            AdmissionRejected: If the turn is a duplicate or the queue has no room for it.
+        """
+        ticket = AdmissionTicket(self, str(user_id), key)
+        with self._lock:
+            if key is not None and key in self._keys:
+                self._reject("duplicate")
+            if self._can_run(ticket.user_id):
+                self._start(ticket)
+            else:
+                if len(self._waiting) >= self.max_queued:
+                    self._reject("queue_full")
+                if self._user_waiting.get(ticket.user_id, 0) >= self.user_queued:
+                    self._reject("user_queue_full")
+                self._waiting.append(ticket)
+                self._user_waiting[ticket.user_id] = self._user_waiting.get(ticket.user_id, 0) + 1
+                self._stats["queued"] += 1
+                self._stats["peak_queued"] = max(self._stats["peak_queued"], len(self._waiting))
+            if key is not None:
+                self._keys.add(key)
+        if ticket.admitted:
+            metrics.inc("admission_admitted_total", queued="false")
+        else:
+            metrics.inc("admission_queued_total")
+        return ticket
+
+    def admit(self, user_id, key=None, timeout: float = None) -> AdmissionTicket:
+        """Helper function to request a slot and block until it is granted (see request and AdmissionTicket.wait)."""
+        return self.request(user_id, key).wait(timeout)
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        with self._lock:
+            for index, waiting in enumerate(self._waiting):
+                if waiting is ticket:
+                    return index + 1
+        return 0
+
+    def _dequeue(self, ticket: AdmissionTicket):
+        # Caller holds the lock.
+        self._waiting.remove(ticket)
+        self._user_waiting[ticket.user_id] -= 1
+        if not self._user_waiting[ticket.user_id]:
+            del self._user_waiting[ticket.user_id]
+
+    def _grant_waiting(self) -> list:
+        # Caller holds the lock. Waiters blocked only by their own per-user limit are skipped, not waited behind.
+        granted = []
+        for ticket in list(self._waiting):
+            if self._running >= self.max_concurrent:
+                break
+            if self._can_run(ticket.user_id):
+                self._dequeue(ticket)
+                self._start(ticket)
+                granted.append(ticket)
+        return granted
+
+    def _record_granted(self, granted: list):
+        now = time.monotonic()
+        for ticket in granted:
+            metrics.inc("admission_admitted_total", queued="true")
+            metrics.observe("admission_queue_seconds", now - ticket.requested_at)
+
+    def _withdraw(self, ticket: AdmissionTicket, reason: str) -> bool:
+        """Take a queued ticket out of the queue; False if it was admitted already."""
+        with self._lock:
+            if ticket.future.done() or ticket._released:
+                return False
+            self._dequeue(ticket)
+            ticket._released = True
+            self._keys.discard(ticket.key)
+            if reason == "timeout":
+                self._stats["timeouts"] += 1
+        metrics.inc("admission_rejected_total", reason=reason)
+        metrics.observe("admission_queue_seconds", time.monotonic() - ticket.requested_at)
+        return True
+
+    def _release(self, ticket: AdmissionTicket):
+        with self._lock:
+            if ticket._released:
+                return
+            if not ticket.future.done():
+                granted = None
+            else:
+                ticket._released = True
+                self._running -= 1
+                self._user_running[ticket.user_id] -= 1
+                if not self._user_running[ticket.user_id]:
+                    del self._user_running[ticket.user_id]
+                self._keys.discard(ticket.key)
+                granted = self._grant_waiting()
+        if granted is None:
+            # Still queued: the caller gave up before it was admitted (or it was admitted just now).
+            if not self._withdraw(ticket, "abandoned"):
+                self._release(ticket)
+            return
+        self._record_granted(granted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["running"] = self._running
+            stats["queue_depth"] = len(self._waiting)
+            stats["active_users"] = len(self._user_running)
+            oldest = self._waiting[0].requested_at if self._waiting else None
+        stats["oldest_wait_seconds"] = time.monotonic() - oldest if oldest is not None else 0.0
+        return stats
+
+
+admission = AdmissionController(
+    max_concurrent=config.ADMISSION_MAX_CONCURRENT,
+    per_user=config.ADMISSION_PER_USER,
+    max_queued=config.ADMISSION_MAX_QUEUED,
+    user_queued=config.ADMISSION_USER_QUEUED,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT,
+    retry_after=config.ADMISSION_RETRY_AFTER,
+)
+metrics.describe("admission_queue_seconds", "Time chat turns waited in the admission queue")
+metrics.register_collector("admission", admission.stats)
+
+
+def turn_key(user_id, message: str) -> tuple:
+    """Helper function to build the duplicate-detection key of a turn (same user, same message)."""
+    return (str(user_id), message.strip())
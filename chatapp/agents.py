@@ -1,28 +1,36 @@
 from langchain.agents import create_agent
 from chatapp.promptmiddleware import inject_global_prompt,inject_memory_replier,inject_memory_sentiment
-from langchain.agents.middleware import ModelCallLimitMiddleware,ToolCallLimitMiddleware
 from chatapp.tools.index import sentiment_tools,replier_tools
 from chatapp.memory.longtermmemory import store
 from chatapp.gemini import llm
+from chatapp.cache import ResponseCacheMiddleware, response_cache
+from chatapp.metrics import MetricsMiddleware
+from chatapp.budget import budget_for
+from chatapp.toolexec import tool_execution_for
 
-llm_sentiment = llm.bind_tools(sentiment_tools)
+llm_sentiment = llm.with_priority("sentiment").bind_tools(sentiment_tools)
 
 sentiment_agent = create_agent(
         model=llm_sentiment,
         tools=sentiment_tools,
-        middleware=[inject_memory_sentiment,ModelCallLimitMiddleware(thread_limit=5),ToolCallLimitMiddleware(thread_limit=5)],
+        middleware=[budget_for("sentiment"),inject_memory_sentiment,tool_execution_for("sentiment"),MetricsMiddleware("sentiment")],
         store =store
     )
 
-llm_replier = llm.bind_tools(replier_tools)
+llm_replier = llm.with_priority("interactive").bind_tools(replier_tools)
+
+# The budget middleware is outermost so a forced final call (no tools) is what the cache sees;
+# the response cache then wraps prompt rendering so a hit also skips it.
+replier_cache = [ResponseCacheMiddleware(response_cache, namespace="replier")] if response_cache else []
+global_cache = [ResponseCacheMiddleware(response_cache, namespace="global_analyzer", memory_variant="global")] if response_cache else []
 
 replier_agent = create_agent(
         model=llm_replier,
         tools=replier_tools,
-        middleware=[inject_memory_replier,ModelCallLimitMiddleware(thread_limit=5),ToolCallLimitMiddleware(thread_limit=5)],
+        middleware=[budget_for("replier"),*replier_cache,inject_memory_replier,tool_execution_for("replier"),MetricsMiddleware("replier")],
     )
 
 global_analyzer_agent = create_agent(
-        model=llm,
-        middleware=[inject_global_prompt]
+        model=llm.with_priority("analytics"),
+        middleware=[budget_for("global_analyzer", has_tools=False),*global_cache,inject_global_prompt,MetricsMiddleware("global_analyzer")]
     )
\ No newline at end of file
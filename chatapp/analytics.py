@@ -0,0 +1,60 @@
+"""
+Aggregations behind the sentiments page (page_modules/sentiments.py), kept
+free of Streamlit so they can be reused and benchmarked on their own.
+"""
+from collections import Counter
+from typing import List
+
+POSITIVE_TYPES = ("POSITIVE", "POS")
+NEGATIVE_TYPES = ("NEGATIVE", "NEG")
+
+
+def all_chats(history, current) -> list:
+    """Helper function to put every summarized window and the current window in one list, oldest first."""
+    chats = []
+    for window in history:
+        chats.extend(window)
+    chats.extend(current)
+    return chats
+
+
+def sentiment_value(sentiment_type: str) -> int:
+    """Helper function to map a sentiment type to the trend line: 1 positive, -1 negative, 0 otherwise."""
+    if sentiment_type in POSITIVE_TYPES:
+        return 1
+    if sentiment_type in NEGATIVE_TYPES:
+        return -1
+    return 0
+
+
+def sentiment_overview(chats) -> dict:
+    """
+    Helper function to aggregate chats for the current-session tab.
+    Args:
+        chats: ChatMemory objects, oldest first.
+    Returns:
+        total, average_score, dominant sentiment type, trend (one sentiment
+        value per chat) and counts per sentiment type, most common first.
+    """
+    if not chats:
+        return {"total": 0, "average_score": 0.0, "dominant": None, "trend": [], "counts": {}}
+    sentiment_types = [chat.sentiment_type for chat in chats]
+    return {
+        "total": len(chats),
+        "average_score": sum(chat.sentiment_score for chat in chats) / len(chats),
+        "dominant": max(set(sentiment_types), key=sentiment_types.count),
+        "trend": [sentiment_value(sentiment_type) for sentiment_type in sentiment_types],
+        "counts": dict(Counter(sentiment_types).most_common()),
+    }
+
+
+def mood_overview(summaries: List) -> dict:
+    """Helper function to aggregate summaries for the historical tab: sessions, dominant mood and counts per mood."""
+    if not summaries:
+        return {"sessions": 0, "dominant": None, "counts": {}}
+    moods = [summary.general_mood for summary in summaries]
+    return {
+        "sessions": len(summaries),
+        "dominant": max(set(moods), key=moods.count),
+        "counts": dict(Counter(moods).most_common()),
+    }
@@ -0,0 +1,222 @@
+"""
+Per-run time/token budgets for the agents (replaces ModelCallLimitMiddleware
+and ToolCallLimitMiddleware).
+
+RunBudgetMiddleware tracks wall time, tokens and model calls for each agent
+run. The time budget is the tighter of the agent's own limit and the turn
+deadline from chatapp.resilience. When a budget is nearly spent, the next model
+call is made without tools and with a note asking for the final answer now.
+When it is fully spent, the run ends with a short fallback message. Each
+run's end reason is counted in metrics and kept in a small report log.
+"""
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Annotated, Any, Optional
+
+from langchain.agents.middleware import AgentMiddleware, AgentState, ModelRequest, ModelResponse
+from langchain.agents.middleware.types import PrivateStateAttr, hook_config
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableBinding
+from langgraph.channels.untracked_value import UntrackedValue
+from typing_extensions import NotRequired
+
+from chatapp.metrics import metrics
+from chatapp.resilience import get_dependency, remaining_time
+from settings import config
+
+FINAL_ANSWER_NOTE = (
+    "(System note: the time/token budget for this reply is almost used up. "
+    "Do not call any more tools; reply now with your best final answer.)"
+)
+BUDGET_EXHAUSTED_REPLY = "I'm sorry, I ran out of time before I could finish that. Could you try again?"
+# Fraction of each budget kept back for the forced final answer.
+RESERVE_FRACTION = 0.25
+
+_run_reports = deque(maxlen=200)
+
+
+class RunBudgetState(AgentState):
+    budget_started_at: NotRequired[Annotated[float, UntrackedValue, PrivateStateAttr]]
+    budget_tokens: NotRequired[Annotated[int, UntrackedValue, PrivateStateAttr]]
+    budget_model_calls: NotRequired[Annotated[int, UntrackedValue, PrivateStateAttr]]
+    budget_forced: NotRequired[Annotated[str, UntrackedValue, PrivateStateAttr]]
+    budget_stopped: NotRequired[Annotated[str, UntrackedValue, PrivateStateAttr]]
+
+
+@dataclass
+class RunReport:
+    """How one agent run used its budget and why it ended."""
+    agent: str
+    end_reason: str
+    seconds: float
+    tokens: int
+    model_calls: int
+    max_seconds: float
+    max_tokens: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _base_model(model):
+    # The agents pass models with tools pre-bound; drop the bindings so a forced
+    # final call really has no tools available.
+    while isinstance(model, RunnableBinding):
+        model = model.bound
+    return model
+
+
+class RunBudgetMiddleware(AgentMiddleware[RunBudgetState, Any]):
+    """
+    Enforce a wall-time, token and model-call budget on each agent run.
+    Args:
+        agent_name: Label used in metrics and reports.
+        max_seconds: Wall-time budget per run (further capped by the turn deadline).
+        max_tokens: Total (input + output) tokens per run.
+        max_model_calls: Model calls per run.
+        has_tools: Whether the agent can loop on tools; if not, a nearly spent
+            budget is only recorded, since there is nothing to cut short.
+    """
+
+    state_schema = RunBudgetState
+
+    def __init__(self, agent_name: str, max_seconds: float, max_tokens: int, max_model_calls: int = 5,
+                 has_tools: bool = True):
+        super().__init__()
+        self.agent_name = agent_name
+        self.has_tools = has_tools
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_model_calls = max_model_calls
+
+    @property
+    def name(self) -> str:
+        return f"RunBudgetMiddleware[{self.agent_name}]"
+
+    def _remaining_seconds(self, state) -> float:
+        elapsed = time.monotonic() - state.get("budget_started_at", time.monotonic())
+        remaining = self.max_seconds - elapsed
+        deadline = remaining_time()
+        return remaining if deadline is None else min(remaining, deadline)
+
+    def _check(self, state) -> tuple:
+        """Returns (stop_reason, force_reason); at most one is set."""
+        remaining = self._remaining_seconds(state)
+        tokens = state.get("budget_tokens", 0)
+        calls = state.get("budget_model_calls", 0)
+        if remaining <= 0:
+            return "time_budget", None
+        if tokens >= self.max_tokens:
+            return "token_budget", None
+        if calls >= self.max_model_calls:
+            return "call_budget", None
+        # Enough time for the final call means a typical model call, twice for safety.
+        typical_call = get_dependency("gemini").latency.percentile(50) or 0.0
+        if remaining < max(RESERVE_FRACTION * self.max_seconds, 2 * typical_call):
+            return None, "time_budget"
+        if tokens >= (1 - RESERVE_FRACTION) * self.max_tokens:
+            return None, "token_budget"
+        if calls >= self.max_model_calls - 1:
+            return None, "call_budget"
+        return None, None
+
+    def before_agent(self, state: RunBudgetState, runtime) -> dict:
+        return {"budget_started_at": time.monotonic(), "budget_tokens": 0, "budget_model_calls": 0,
+                "budget_forced": "", "budget_stopped": ""}
+
+    async def abefore_agent(self, state: RunBudgetState, runtime) -> dict:
+        return self.before_agent(state, runtime)
+
+    @hook_config(can_jump_to=["end"])
+    def before_model(self, state: RunBudgetState, runtime) -> Optional[dict]:
+        stop_reason, force_reason = self._check(state)
+        if stop_reason is not None:
+            return {"jump_to": "end", "budget_stopped": stop_reason,
+                    "messages": [AIMessage(content=BUDGET_EXHAUSTED_REPLY)]}
+        if force_reason is not None and self.has_tools and not state.get("budget_forced"):
+            return {"budget_forced": force_reason}
+        return None
+
+    @hook_config(can_jump_to=["end"])
+    async def abefore_model(self, state: RunBudgetState, runtime) -> Optional[dict]:
+        return self.before_model(state, runtime)
+
+    def _prepare(self, request: ModelRequest) -> ModelRequest:
+        if not request.state.get("budget_forced") or not request.tools:
+            return request
+        return request.override(
+            model=_base_model(request.model),
+            tools=[],
+            tool_choice=None,
+            messages=[*request.messages, HumanMessage(content=FINAL_ANSWER_NOTE)],
+        )
+
+    def wrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        return handler(self._prepare(request))
+
+    async def awrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        return await handler(self._prepare(request))
+
+    def after_model(self, state: RunBudgetState, runtime) -> dict:
+        tokens = 0
+        messages = state.get("messages", [])
+        if messages and isinstance(messages[-1], AIMessage):
+            usage = messages[-1].usage_metadata or {}
+            tokens = usage.get("total_tokens", 0)
+        return {
+            "budget_tokens": state.get("budget_tokens", 0) + tokens,
+            "budget_model_calls": state.get("budget_model_calls", 0) + 1,
+        }
+
+    async def aafter_model(self, state: RunBudgetState, runtime) -> dict:
+        return self.after_model(state, runtime)
+
+    def after_agent(self, state: RunBudgetState, runtime) -> None:
+        if state.get("budget_stopped"):
+            reason = f"stopped_{state['budget_stopped']}"
+        elif state.get("budget_forced"):
+            reason = f"forced_{state['budget_forced']}"
+        else:
+            reason = "completed"
+        report = RunReport(
+            agent=self.agent_name,
+            end_reason=reason,
+            seconds=time.monotonic() - state.get("budget_started_at", time.monotonic()),
+            tokens=state.get("budget_tokens", 0),
+            model_calls=state.get("budget_model_calls", 0),
+            max_seconds=self.max_seconds,
+            max_tokens=self.max_tokens,
+        )
+        _run_reports.append(report)
+        metrics.inc("agent_run_end_total", agent=self.agent_name, reason=reason)
+        metrics.observe("agent_run_seconds", report.seconds, agent=self.agent_name)
+        return None
+
+    async def aafter_agent(self, state: RunBudgetState, runtime) -> None:
+        return self.after_agent(state, runtime)
+
+
+def budget_for(agent_name: str, has_tools: bool = True) -> RunBudgetMiddleware:
+    """Helper function to build the budget middleware configured in settings for an agent."""
+    return RunBudgetMiddleware(
+        agent_name,
+        max_seconds=config.AGENT_TIME_BUDGETS.get(agent_name, 30.0),
+        max_tokens=int(config.AGENT_TOKEN_BUDGETS.get(agent_name, 16000)),
+        max_model_calls=int(config.AGENT_CALL_BUDGETS.get(agent_name, 5)),
+        has_tools=has_tools,
+    )
+
+
+def get_run_reports(limit: int = 20) -> list:
+    """Helper function to get the most recent agent run reports (newest first)."""
+    return [report.to_dict() for report in list(_run_reports)[-limit:][::-1]]
+
+
+def get_end_reason_counts() -> dict:
+    """Helper function to count recent runs by agent and end reason."""
+    counts = {}
+    for report in list(_run_reports):
+        key = f"{report.agent}:{report.end_reason}"
+        counts[key] = counts.get(key, 0) + 1
+    return counts
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain_core.messages import AIMessage, message_to_dict, messages_from_dict
+
+from chatapp.metrics import metrics
+from settings import config
+
+SEARCH_TOOLS = {"web_search"}
+# Maximum number of same-scope entries compared by the similarity tier.
+SIMILARITY_SCAN_LIMIT = 200
+
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Helper function to normalize a prompt for exact-match keys (case, whitespace, trailing punctuation)."""
+    return " ".join(text.lower().split()).strip(" ?!.")
+
+
+def _similarity_tokens(text: str) -> frozenset:
+    return frozenset(_WORD_PATTERN.findall(text.lower()))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MemoryCacheBackend:
+    """In-process LRU backend."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry["value"]
+
+    def set(self, key: str, value: str, expires_at: float, scope: str, text: Optional[str]):
+        with self._lock:
+            self._entries[key] = {"value": value, "expires_at": expires_at, "scope": scope, "text": text}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def candidates(self, scope: str, limit: int):
+        now = time.time()
+        with self._lock:
+            found = []
+            for key in reversed(self._entries):
+                entry = self._entries[key]
+                if entry["scope"] == scope and entry["text"] and entry["expires_at"] >= now:
+                    found.append((key, entry["text"]))
+                    if len(found) >= limit:
+                        break
+            return found
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """
+    Local on-disk backend (sqlite), shared by every process on the machine.
+    Writes only count rows; the table is pruned back to max_entries once it
+    has grown past max_entries plus prune_slack, not on every write.
+    """
+
+    def __init__(self, path: str, max_entries: int, prune_slack: Optional[int] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_slack = max(1, max_entries // 10) if prune_slack is None else prune_slack
+        self._lock = Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "last_access REAL NOT NULL, scope TEXT NOT NULL, text TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope, last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        # Rows written since the last prune, on top of the count then (other processes may write too).
+        self._rows = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, expires_at: float, scope: str, text: Optional[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_access, scope, text) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, expires_at, now, scope, text),
+            )
+            self._rows += 1
+            if self._rows > self.max_entries + self.prune_slack:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_access, rowid LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            count = self.max_entries
+        self._rows = count
+
+    def candidates(self, scope: str, limit: int):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, text FROM responses WHERE scope = ? AND text IS NOT NULL AND expires_at >= ? "
+                "ORDER BY last_access DESC LIMIT ?",
+                (scope, time.time(), limit),
+            ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._rows = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    Exact-match response cache with an optional similarity tier.
+
+    Keys combine a namespace (which agent), a fingerprint of the memory block
+    at its current version and the normalized conversation transcript, so an
+    entry is only reused while the memory the prompt was built from is unchanged.
+    """
+
+    def __init__(self, backend, ttl: float = 3600.0, search_ttl: float = 0.0,
+                 similarity_threshold: Optional[float] = None):
+        self.backend = backend
+        self.ttl = ttl
+        self.search_ttl = search_ttl
+        self.similarity_threshold = similarity_threshold
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "skipped_search": 0}
+        self._lock = Lock()
+
+    @staticmethod
+    def make_scope(namespace: str, memory_fingerprint: str) -> str:
+        return f"{namespace}:{memory_fingerprint}"
+
+    @staticmethod
+    def make_key(scope: str, transcript: str) -> str:
+        return hashlib.sha256(f"{scope}\n{transcript}".encode("utf-8")).hexdigest()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def lookup(self, scope: str, transcript: str, similarity_text: Optional[str] = None) -> Optional[str]:
+        value = self.backend.get(self.make_key(scope, transcript))
+        if value is not None:
+            self._count("hits")
+            return value
+        if self.similarity_threshold and similarity_text:
+            wanted = _similarity_tokens(similarity_text)
+            best_key, best_score = None, 0.0
+            for key, text in self.backend.candidates(scope, SIMILARITY_SCAN_LIMIT):
+                score = _jaccard(wanted, _similarity_tokens(text))
+                if score > best_score:
+                    best_key, best_score = key, score
+            if best_key is not None and best_score >= self.similarity_threshold:
+                value = self.backend.get(best_key)
+                if value is not None:
+                    self._count("similar_hits")
+                    return value
+        self._count("misses")
+        return None
+
+    def store(self, scope: str, transcript: str, value: str, used_search: bool = False,
+              similarity_text: Optional[str] = None):
+        ttl = self.search_ttl if used_search else self.ttl
+        if ttl <= 0:
+            self._count("skipped_search")
+            return
+        self.backend.set(self.make_key(scope, transcript), value, time.time() + ttl, scope, similarity_text)
+        self._count("stores")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        stats["entries"] = len(self.backend)
+        return stats
+
+
+def _transcript(messages) -> str:
+    parts = []
+    for msg in messages:
+        content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content, sort_keys=True)
+        if msg.type == "human":
+            content = normalize_prompt(content)
+        line = f"{msg.type}:{content}"
+        for call in getattr(msg, "tool_calls", None) or []:
+            line += f"|call:{call['name']}:{json.dumps(call['args'], sort_keys=True)}"
+        parts.append(line)
+    return "\n".join(parts)
+
+
+def _uses_search(messages, response: AIMessage) -> bool:
+    if any(getattr(m, "type", None) == "tool" and getattr(m, "name", None) in SEARCH_TOOLS for m in messages):
+        return True
+    return any(call["name"] in SEARCH_TOOLS for call in getattr(response, "tool_calls", None) or [])
+
+
+class ResponseCacheMiddleware(AgentMiddleware):
+    """
+    Serve model calls from a ResponseCache. Only the model call is cached; tool
+    calls in a cached response still execute normally.
+    """
+
+    def __init__(self, cache: ResponseCache, namespace: str, memory_variant: str = "agent"):
+        super().__init__()
+        self.cache = cache
+        self.namespace = namespace
+        self.memory_variant = memory_variant
+
+    @property
+    def name(self) -> str:
+        return f"ResponseCacheMiddleware[{self.namespace}]"
+
+    def _scope(self, request: ModelRequest) -> str:
+        from chatapp.promptmiddleware import memory_fingerprint, resolve_user_id
+
+        fingerprint = memory_fingerprint(self.memory_variant, resolve_user_id(request))
+        return ResponseCache.make_scope(self.namespace, fingerprint)
+
+    def _lookup(self, request: ModelRequest):
+        scope = self._scope(request)
+        transcript = _transcript(request.messages)
+        human_only = len(request.messages) == 1 and request.messages[0].type == "human"
+        similarity_text = transcript if human_only else None
+        cached = self.cache.lookup(scope, transcript, similarity_text)
+        if cached is not None:
+            message = messages_from_dict([json.loads(cached)])[0]
+            message.id = None
+            return ModelResponse(result=[message]), None
+        return None, (scope, transcript, similarity_text)
+
+    def _store(self, request: ModelRequest, response, key):
+        scope, transcript, similarity_text = key
+        messages = response.result if isinstance(response, ModelResponse) else [response]
+        if len(messages) == 1 and isinstance(messages[0], AIMessage):
+            self.cache.store(
+                scope, transcript, json.dumps(message_to_dict(messages[0])),
+                used_search=_uses_search(request.messages, messages[0]),
+                similarity_text=similarity_text,
+            )
+
+    def wrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        if request.response_format is not None:
+            return handler(request)
+        cached, key = self._lookup(request)
+        if cached is not None:
+            return cached
+        response = handler(request)
+        self._store(request, response, key)
+        return response
+
+    async def awrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        if request.response_format is not None:
+            return await handler(request)
+        cached, key = self._lookup(request)
+        if cached is not None:
+            return cached
+        response = await handler(request)
+        self._store(request, response, key)
+        return response
+
+
+def build_response_cache() -> Optional[ResponseCache]:
+    """Helper function to build the cache configured in settings (None when disabled)."""
+    backend_name = config.LLM_CACHE_BACKEND.lower()
+    if backend_name == "off":
+        return None
+    if backend_name == "memory":
+        backend = MemoryCacheBackend(config.LLM_CACHE_MAX_ENTRIES)
+    else:
+        backend = DiskCacheBackend(config.LLM_CACHE_PATH, config.LLM_CACHE_MAX_ENTRIES)
+    return ResponseCache(
+        backend,
+        ttl=config.LLM_CACHE_TTL,
+        search_ttl=config.LLM_CACHE_SEARCH_TTL,
+        similarity_threshold=config.LLM_CACHE_SIMILARITY,
+    )
+
+
+response_cache = build_response_cache()
+
+
+def get_cache_stats() -> dict:
+    """Helper function to get response-cache hit/miss counters."""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+
+metrics.register_collector("response_cache", get_cache_stats)
@@ -0,0 +1,363 @@
+"""
+Memory diagnostics: where a long-running process's memory goes.
+
+With DIAGNOSTICS_ENABLED, tracemalloc traces allocations (DIAGNOSTICS_FRAMES
+frames deep) and after every DIAGNOSTICS_EVERY-th chat turn a background
+thread takes a snapshot and records:
+
+- RSS and traced memory per turn, and how fast they grow;
+- memory per component: traced memory by the app module nearest to each
+  allocation ("code:chatapp.pipeline"), state documents by name
+  ("state:history", "state:mood_shifts") and sizes reported by the UI
+  ("session:streamlit", see track_size);
+- the allocation sites that grew the most since the previous snapshot;
+- live memory records (ChatRecord / SummaryRecord), the pydantic models they
+  are converted to at the API boundary (ChatMemory / SummaryEntry) and
+  compiled agent graphs (a count that keeps rising means pipelines are being
+  rebuilt).
+
+Components over their DIAGNOSTICS_BUDGETS (MB) log a warning once per
+crossing. get_memory_report() returns all of it for /stats in main.py and the
+Streamlit diagnostics page; without tracing, reports still cover RSS, state
+sizes and object counts.
+"""
+import gc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from chatapp import state
+from chatapp.metrics import metrics
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Object types counted in every snapshot (by class name).
+TRACKED_TYPES = ("ChatRecord", "SummaryRecord", "ChatMemory", "SummaryEntry", "SessionDigest", "CompiledStateGraph")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Allocations made directly in these files are left out (tracemalloc's own bookkeeping, imports).
+_IGNORED = {tracemalloc.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>"}
+# Snapshot bookkeeping (previous sites, samples) is left out too.
+_OWN = f"code:{__name__}"
+
+
+def rss_bytes() -> int:
+    """Helper function to read this process's resident set size (0 if the platform does not say)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return 0
+
+
+def json_size(value) -> int:
+    """Helper function to measure a value as the bytes of its JSON form (how state documents are sized too)."""
+    return len(json.dumps(value, default=str))
+
+
+@lru_cache(maxsize=4096)
+def _app_module(filename: str) -> Optional[str]:
+    path = os.path.abspath(filename)
+    if not path.startswith(_ROOT + os.sep) or "site-packages" in path or not path.endswith(".py"):
+        return None
+    return os.path.relpath(path, _ROOT)[:-3].replace(os.sep, ".")
+
+
+def _site(traceback) -> tuple:
+    """The (component, "file:line") an allocation is charged to: the newest app frame, else the allocating frame."""
+    for frame in reversed(traceback):
+        module = _app_module(frame.filename)
+        if module is not None:
+            return f"code:{module}", f"{module}:{frame.lineno}"
+    frame = traceback[-1]
+    return "code:other", f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+
+def _slope(points: list) -> float:
+    """Least-squares slope of (x, y) points; 0.0 with fewer than two distinct x."""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def count_objects(types=TRACKED_TYPES) -> dict:
+    """Helper function to count live objects of the tracked types (walks every gc-tracked object; not cheap)."""
+    counts = dict.fromkeys(types, 0)
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            counts[name] += 1
+    return counts
+
+
+class MemoryDiagnostics:
+    """Per-turn memory snapshots, per-component accounting and budget warnings (see the module docstring)."""
+
+    def __init__(self, enabled: bool = False, frames: int = 10, every: int = 1, top: int = 10,
+                 budgets: Optional[dict] = None, history: int = 200):
+        self.enabled = enabled
+        self.frames = max(1, frames)
+        self.every = max(1, every)
+        self.top = top
+        # component -> budget in bytes
+        self.budgets = {name: int(mb * MB) for name, mb in (budgets or {}).items()}
+        self._samples = deque(maxlen=history)
+        self._warnings = deque(maxlen=50)
+        self._over = set()
+        self._sizes = {}
+        self._previous_sites = {}
+        self._previous_components = {}
+        self._latest = None
+        self._turns = 0
+        self._pending = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-diagnostics")
+        self._started_rss = rss_bytes()
+        if enabled:
+            self.start()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        """Start tracing allocations (only allocations made from now on are traced) and per-turn snapshots."""
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        """Stop per-turn snapshots and tracing; the last report stays available."""
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        with self._lock:
+            self._previous_sites = {}
+
+    def track_size(self, component: str, key, size: int):
+        """
+        Report the current size of something the snapshots cannot see on their own.
+        Args:
+            component: Component name, e.g. "session:streamlit".
+            key: What within the component (e.g. the session's user id); the component's size is the sum over keys.
+            size: Current size in bytes (see json_size).
+        """
+        with self._lock:
+            sizes = self._sizes.setdefault(component, {})
+            sizes.pop(key, None)
+            sizes[key] = size
+            if len(sizes) > 10000:
+                sizes.pop(next(iter(sizes)))
+
+    def after_turn(self):
+        """Count a finished chat turn; every `every`-th one takes a snapshot in the background."""
+        with self._lock:
+            self._turns += 1
+            if not self.enabled or self._turns % self.every or self._pending:
+                return
+            self._pending = True
+        self._executor.submit(self._background_snapshot)
+
+    def _background_snapshot(self):
+        try:
+            self.snapshot()
+        except Exception as e:
+            logger.warning(f"Memory snapshot failed: {e}")
+        finally:
+            with self._lock:
+                self._pending = False
+
+    def _traced(self) -> tuple:
+        # Returns (traced bytes per component, allocation sites as {site: [bytes, blocks]}).
+        if not tracemalloc.is_tracing():
+            return {}, {}
+        # Skipping ignored files here is much cheaper than Snapshot.filter_traces, which matches every trace.
+        components, sites = {}, {}
+        for stat in tracemalloc.take_snapshot().statistics("traceback"):
+            if stat.traceback[-1].filename in _IGNORED:
+                continue
+            component, site = _site(stat.traceback)
+            if component == _OWN:
+                continue
+            components[component] = components.get(component, 0) + stat.size
+            totals = sites.setdefault(site, [0, 0])
+            totals[0] += stat.size
+            totals[1] += stat.count
+        return components, sites
+
+    def _check_budgets(self, components: dict, turn: int):
+        for name, budget in self.budgets.items():
+            size = components.get(name)
+            if size is None:
+                continue
+            if size > budget and name not in self._over:
+                self._over.add(name)
+                warning = {"component": name, "bytes": size, "budget": budget, "turn": turn, "at": time.time()}
+                self._warnings.append(warning)
+                metrics.inc("memory_budget_exceeded_total", component=name)
+                logger.warning(f"Memory budget exceeded: {name} uses {size / MB:.1f} MB (budget {budget / MB:.1f} MB)")
+            elif size <= budget:
+                self._over.discard(name)
+
+    def snapshot(self) -> dict:
+        """
+        Take a snapshot now (after_turn does this in the background).
+        Returns:
+            The new report (see report()).
+        """
+        started = time.perf_counter()
+        traced_components, sites = self._traced()
+        components = dict(traced_components)
+        for name, totals in state.backend.sizes().items():
+            components[f"state:{name}"] = totals["bytes"]
+        with self._lock:
+            for name, sizes in self._sizes.items():
+                components[name] = sum(sizes.values())
+        rss = rss_bytes()
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        components["rss"] = rss
+        objects = count_objects()
+
+        with self._lock:
+            turn = self._turns
+            previous_sites, self._previous_sites = self._previous_sites, sites
+            previous_components, self._previous_components = self._previous_components, components
+            growth = sorted(
+                ({"site": site, "bytes": size, "blocks": blocks,
+                  "bytes_diff": size - previous_sites.get(site, [0, 0])[0],
+                  "blocks_diff": blocks - previous_sites.get(site, [0, 0])[1]}
+                 for site, (size, blocks) in sites.items()),
+                key=lambda row: row["bytes_diff"], reverse=True,
+            )[:self.top] if previous_sites else []
+            largest = sorted(
+                ({"site": site, "bytes": size, "blocks": blocks} for site, (size, blocks) in sites.items()),
+                key=lambda row: row["bytes"], reverse=True,
+            )[:self.top]
+            sample = {
+                "turn": turn,
+                "at": time.time(),
+                "rss": rss,
+                "traced": traced,
+                "objects": objects,
+                "growth": {name: size - previous_components.get(name, 0) for name, size in components.items()
+                           if previous_components and size != previous_components.get(name, 0)},
+            }
+            self._samples.append(sample)
+            self._check_budgets(components, turn)
+            self._latest = {
+                "turn": turn,
+                "components": components,
+                "top_growth": growth,
+                "top_sites": largest,
+                "objects": objects,
+                "snapshot_seconds": time.perf_counter() - started,
+            }
+        metrics.observe("memory_snapshot_seconds", time.perf_counter() - started)
+        return self.report()
+
+    def report(self) -> dict:
+        """
+        The latest snapshot with its trends.
+        Returns:
+            enabled, tracing, turns; rss (current, at start, growth per turn
+            over the kept samples); traced memory and its growth per turn;
+            components ({name: {bytes, budget, over}}); top_growth and
+            top_sites (allocation sites); objects (live counts); samples
+            (per-snapshot history) and warnings (budget crossings).
+        """
+        with self._lock:
+            latest = dict(self._latest) if self._latest else None
+            samples = list(self._samples)
+            warnings = list(self._warnings)
+            turns = self._turns
+        if latest is None:
+            latest = {"turn": turns, "components": {}, "top_growth": [], "top_sites": [], "objects": {},
+                      "snapshot_seconds": 0.0}
+        components = {
+            name: {"bytes": size, "budget": self.budgets.get(name), "over": name in self._over}
+            for name, size in sorted(latest["components"].items(), key=lambda item: item[1], reverse=True)
+        }
+        return {
+            "enabled": self.enabled,
+            "tracing": self.tracing,
+            "turns": turns,
+            "snapshot_turn": latest["turn"],
+            "rss": {
+                "current": samples[-1]["rss"] if samples else rss_bytes(),
+                "start": self._started_rss,
+                "per_turn": _slope([(s["turn"], s["rss"]) for s in samples]),
+            },
+            "traced": {
+                "current": samples[-1]["traced"] if samples else 0,
+                "per_turn": _slope([(s["turn"], s["traced"]) for s in samples]),
+            },
+            "components": components,
+            "top_growth": latest["top_growth"],
+            "top_sites": latest["top_sites"],
+            "objects": latest["objects"],
+            "snapshot_seconds": latest["snapshot_seconds"],
+            "samples": samples,
+            "warnings": warnings,
+        }
+
+    def stats(self) -> dict:
+        """Numeric summary for the metrics exporter (reads the latest snapshot; never takes one)."""
+        with self._lock:
+            latest = self._latest
+            samples = list(self._samples)
+            stats = {"enabled": int(self.enabled), "turns": self._turns, "budget_warnings": len(self._warnings),
+                     "over_budget": len(self._over)}
+        if latest is not None:
+            stats["rss_bytes"] = latest["components"].get("rss", 0)
+            stats["traced_bytes"] = samples[-1]["traced"] if samples else 0
+            stats["rss_per_turn_bytes"] = _slope([(s["turn"], s["rss"]) for s in samples])
+            for name, count in latest["objects"].items():
+                stats[f"objects_{name}"] = count
+        return stats
+
+
+diagnostics = MemoryDiagnostics(
+    enabled=config.DIAGNOSTICS_ENABLED,
+    frames=config.DIAGNOSTICS_FRAMES,
+    every=config.DIAGNOSTICS_EVERY,
+    top=config.DIAGNOSTICS_TOP_SITES,
+    budgets=config.DIAGNOSTICS_BUDGETS,
+)
+metrics.describe("memory_snapshot_seconds", "Time taken by memory diagnostics snapshots")
+metrics.register_collector("memory_diagnostics", diagnostics.stats)
+
+
+def get_memory_report(refresh: bool = False) -> dict:
+    """
+    Helper function to get the memory diagnostics report.
+    Args:
+        refresh: Take a snapshot now instead of returning the one from the last turn.
+    Returns:
+        See MemoryDiagnostics.report.
+    """
+    return diagnostics.snapshot() if refresh else diagnostics.report()
@@ -1,12 +1,43 @@
-from google import genai
+import json
 from settings import config
-from langchain_google_genai import ChatGoogleGenerativeAI
+from chatapp.replay import TracedChatModel, TracedGenaiClient
+from chatapp.scheduler import ScheduledChatModel, ScheduledGenaiClient
 
 class GeminiClient:
-    def __init__(self, api_key: str):
-        self.client = genai.Client(api_key=api_key)
+    def __init__(self, api_key: str, client=None):
+        if client is None:
+            from google import genai
+            client = genai.Client(api_key=api_key)
+        # Raw calls (summarize_memory) go through the shared scheduler as background "summary" work
+        self.client = ScheduledGenaiClient(TracedGenaiClient(client), priority="summary")
         self.api_key = api_key
 
-client = GeminiClient(api_key=config.GEMINI_API_KEY)
+if config.STUB_MODE:
+    from chatapp.stubs import FakeChatModel, FakeGenaiClient, LatencyDistribution
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+    client = GeminiClient(api_key="stub", client=FakeGenaiClient(
+        LatencyDistribution.parse(config.STUB_GEMINI_LATENCY), error_rate=config.STUB_GEMINI_ERROR_RATE,
+    ))
+    base_llm = FakeChatModel(
+        latency=LatencyDistribution.parse(config.STUB_GEMINI_LATENCY), error_rate=config.STUB_GEMINI_ERROR_RATE,
+    )
+else:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    client = GeminiClient(api_key=config.GEMINI_API_KEY)
+    # Retries, deadlines and hedging are handled by chatapp/resilience.py, so the client makes a single attempt
+    base_llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", max_retries=1)
+
+# Every agent call goes through the scheduler; agents pick their class with llm.with_priority().
+# Below the scheduler, calls are recorded or replayed when the turn has a trace (chatapp/replay.py).
+llm = ScheduledChatModel(inner=TracedChatModel(inner=base_llm), priority="interactive")
+
+
+def parse_json_reply(text: str) -> dict:
+    """Helper function to parse a JSON object from a model reply that may be wrapped in a code fence."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return json.loads(text.strip())
@@ -0,0 +1,199 @@
+"""
+Gated long-term memory extraction.
+
+Instead of letting the sentiment agent decide on every turn whether to call
+save_memory, each user message goes through a local extractor first: regular
+expressions for the ExtractedMemory fields plus, when spaCy and its small
+English model are installed, named entities for names and places. Most
+messages carry no profile information and stop there, without a model call.
+When a name, age or location candidate is found, one Gemini extraction call
+confirms the fields. A mood on its own is taken from the local match. The
+result is merged into the long-term store directly.
+"""
+import logging
+import re
+from functools import lru_cache
+from typing import Optional
+
+from chatapp.memory.longtermmemory import merge_user_memory
+from chatapp.metrics import metrics, timed
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("name", "age", "location", "current_mood")
+# Fields worth a model call to confirm; a mood alone is stored from the local match.
+LLM_FIELDS = ("name", "age", "location")
+
+_NAME = r"([A-Z][a-z]+(?: [A-Z][a-z]+)?)"
+_PLACE = r"([A-Z][a-zA-Z]+(?:[ -][A-Z][a-zA-Z]+)*)"
+_NAME_PATTERNS = [
+    re.compile(r"\b[Mm]y name is " + _NAME),
+    re.compile(r"\b(?:[Cc]all me|[Pp]eople call me) " + _NAME),
+    re.compile(r"^(?:(?:Hi|Hey|Hello),? )?[Tt]his is " + _NAME + r"(?=[,.!]|\s+(?:again|here)\b)"),
+    re.compile(r"\b(?:I'm|I am) " + _NAME + r"(?=[,.!]|\s+(?:and|from|here)\b|$)"),
+]
+_AGE_PATTERNS = [
+    re.compile(r"\b(?:I'm|I am|I(?: just)? turned|turning)\s+(\d{1,3})(?:\s+years?\s+old|\s*yo)?\b(?!\s*(?:%|am|pm|minutes|hours|days))", re.I),
+    re.compile(r"\bmy age is\s+(\d{1,3})\b", re.I),
+    re.compile(r"\b(\d{1,3})\s+years?\s+old\b", re.I),
+]
+_LOCATION_PATTERNS = [
+    re.compile(r"\b(?:(?:I|and) live in|I'm from|I am from|I'm based in|I am based in|I moved to|I'm living in|I am living in) " + _PLACE),
+    re.compile(r"\b[Mm]y (?:home ?town|city) is " + _PLACE),
+]
+MOOD_WORDS = {
+    "happy", "sad", "angry", "anxious", "excited", "tired", "stressed", "lonely", "bored", "nervous",
+    "calm", "frustrated", "depressed", "hopeful", "overwhelmed", "grateful", "upset", "worried", "relaxed",
+}
+_MOOD_PATTERN = re.compile(
+    r"\b(?:I feel|I'm feeling|I am feeling|I've been feeling|feeling|I'm|I am)\s+"
+    r"(?:(?:so|really|very|quite|a bit|pretty|just|a little)\s+)?([a-z]+)\b",
+    re.I,
+)
+# Capitalized words that follow "I'm" without being names.
+_NOT_NAMES = {"Not", "So", "Just", "Really", "Very", "Sure", "Sorry", "Fine", "Good", "Here", "Back", "Done", "Also"}
+
+EXTRACTION_PROMPT = """
+Extract profile information the user states about themselves in this message:
+
+{text}
+
+Return ONLY a JSON object with these fields, using null for anything not stated:
+{{
+    "name": "the user's name",
+    "age": "the user's age",
+    "location": "where the user lives or is from",
+    "current_mood": "the user's current mood, one word"
+}}
+
+Return only valid JSON, no additional text.
+"""
+
+
+@lru_cache(maxsize=1)
+def get_ner():
+    """Helper function to load the optional spaCy pipeline once (None when spaCy or the model is missing)."""
+    if not config.MEMORY_NER_MODEL:
+        return None
+    try:
+        import spacy
+        return spacy.load(config.MEMORY_NER_MODEL, disable=["parser", "lemmatizer"])
+    except Exception as e:
+        logger.info(f"NER model unavailable ({e}); using patterns only")
+        return None
+
+
+def _first_match(patterns, text: str) -> Optional[str]:
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match.group(1).strip()
+    return None
+
+
+def _ner_candidates(text: str) -> dict:
+    nlp = get_ner()
+    if nlp is None:
+        return {}
+    found = {}
+    for ent in nlp(text).ents:
+        # Only entities in a first-person statement describe the user.
+        before = text[max(0, ent.start_char - 24):ent.start_char].lower()
+        if ent.label_ == "PERSON" and re.search(r"\b(name is|i'm|i am|call me)\s*$", before):
+            found.setdefault("name", ent.text)
+        elif ent.label_ in ("GPE", "LOC") and re.search(r"\b(live in|from|based in|moved to)\s*$", before):
+            found.setdefault("location", ent.text)
+    return found
+
+
+def extract_candidates(text: str) -> dict:
+    """
+    Find profile fields in a message without calling a model.
+    Args:
+        text: The user's message.
+    Returns:
+        The ExtractedMemory fields that were found (possibly empty).
+    """
+    found = {}
+    name = _first_match(_NAME_PATTERNS, text)
+    if name and name.split()[0] not in _NOT_NAMES and name.lower() not in MOOD_WORDS:
+        found["name"] = name
+    age = _first_match(_AGE_PATTERNS, text)
+    if age and 1 <= int(age) <= 120:
+        found["age"] = age
+    location = _first_match(_LOCATION_PATTERNS, text)
+    if location:
+        found["location"] = location
+    for match in _MOOD_PATTERN.finditer(text):
+        if match.group(1).lower() in MOOD_WORDS:
+            found["current_mood"] = match.group(1).lower()
+            break
+    for field, value in _ner_candidates(text).items():
+        found.setdefault(field, value)
+    return found
+
+
+def extract_with_llm(text: str) -> dict:
+    """
+    Extract profile fields with one Gemini call.
+    Args:
+        text: The user's message.
+    Returns:
+        The ExtractedMemory fields the model found (null fields dropped).
+    """
+    from chatapp.gemini import client, parse_json_reply
+
+    response = client.client.models.generate_content(
+        model="gemini-2.5-flash",
+        contents=EXTRACTION_PROMPT.format(text=text),
+    )
+    extracted = parse_json_reply(response.candidates[0].content.parts[0].text)
+    return {field: str(extracted[field]) for field in FIELDS if extracted.get(field) not in (None, "", "null")}
+
+
+@timed("memory_extraction_seconds")
+def extract_memory(text: str, use_llm: Optional[bool] = None) -> dict:
+    """
+    Gated extraction: local candidates first, one model call only when they
+    include a name, age or location.
+    Args:
+        text: The user's message.
+        use_llm: Confirm candidates with Gemini (defaults to MEMORY_EXTRACTION_LLM).
+    Returns:
+        The fields to store (empty when the message has no profile information).
+    """
+    use_llm = config.MEMORY_EXTRACTION_LLM if use_llm is None else use_llm
+    candidates = extract_candidates(text)
+    if not candidates:
+        metrics.inc("memory_extraction_total", path="skipped")
+        return {}
+    if not use_llm or not any(field in candidates for field in LLM_FIELDS):
+        metrics.inc("memory_extraction_total", path="local")
+        return candidates
+    try:
+        extracted = extract_with_llm(text)
+    except Exception as e:
+        logger.warning(f"LLM memory extraction failed, keeping local candidates: {e}")
+        metrics.inc("memory_extraction_total", path="local_fallback")
+        return candidates
+    metrics.inc("memory_extraction_total", path="llm")
+    # The mood is short-lived; keep the local one when the model did not report it.
+    if "current_mood" in candidates:
+        extracted.setdefault("current_mood", candidates["current_mood"])
+    return extracted
+
+
+def update_long_term_memory(text: str, user_id) -> dict:
+    """
+    Extract profile fields from a user message and merge them into the store.
+    Args:
+        text: The user's message.
+        user_id: The user whose profile is updated.
+    Returns:
+        The fields that were stored (empty when nothing was found).
+    """
+    memory = extract_memory(text)
+    if memory:
+        merge_user_memory(user_id, memory)
+    return memory
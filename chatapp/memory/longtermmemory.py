@@ -1,12 +1,127 @@
-from langgraph.store.memory import InMemoryStore
+import asyncio
+from datetime import datetime, timezone
+from langgraph.store.base import BaseStore, GetOp, Item, PutOp, SearchItem, SearchOp
+from chatapp import state
 from chatapp.models import ExtractedMemory
 from langchain.tools import ToolRuntime,tool
+from chatapp.metrics import timer
 from dataclasses import dataclass
 import logging
 
 logger = logging.getLogger(__name__)
 
-store = InMemoryStore()
+PROFILE_NAMESPACE = ("users",)
+
+
+class SharedStore(BaseStore):
+    """
+    LangGraph store kept in the shared state backend (chatapp/state.py), so
+    every worker sees the same profiles. Each item is one document sharded by
+    its key (the user id for profiles) and named after its namespace. Supports
+    get, put/delete and search within one namespace (filter, limit, offset; no
+    semantic query). Records the latency of every batch (get/put/search all go
+    through batch).
+    """
+
+    @staticmethod
+    def document_name(namespace) -> str:
+        return "store:" + "/".join(namespace)
+
+    @staticmethod
+    def _op_name(ops) -> str:
+        names = {type(op).__name__.removesuffix("Op").lower() for op in ops}
+        return names.pop() if len(names) == 1 else "mixed"
+
+    @staticmethod
+    def _item(namespace, key, document, cls=Item):
+        return cls(
+            namespace=tuple(namespace), key=key, value=document["value"],
+            created_at=datetime.fromisoformat(document["created_at"]),
+            updated_at=datetime.fromisoformat(document["updated_at"]),
+        )
+
+    def _get(self, op: GetOp):
+        document, _ = state.backend.load(op.key, self.document_name(op.namespace))
+        return self._item(op.namespace, op.key, document) if document else None
+
+    def _put(self, op: PutOp):
+        name = self.document_name(op.namespace)
+        if op.value is None:
+            state.backend.delete(op.key, name)
+            return None
+
+        def write(current):
+            now = datetime.now(timezone.utc).isoformat()
+            created_at = current["created_at"] if current else now
+            return {"value": op.value, "created_at": created_at, "updated_at": now}, None
+
+        return state.update(op.key, name, write)
+
+    def _search(self, op: SearchOp):
+        items = [self._item(op.namespace_prefix, key, document, SearchItem)
+                 for key, document in state.backend.scan(self.document_name(op.namespace_prefix))]
+        if op.filter:
+            items = [item for item in items if all(item.value.get(k) == v for k, v in op.filter.items())]
+        items.sort(key=lambda item: item.updated_at, reverse=True)
+        return items[op.offset:op.offset + op.limit]
+
+    def _run(self, op):
+        if isinstance(op, GetOp):
+            return self._get(op)
+        if isinstance(op, PutOp):
+            return self._put(op)
+        if isinstance(op, SearchOp):
+            return self._search(op)
+        raise NotImplementedError(f"{type(op).__name__} is not supported by SharedStore")
+
+    def batch(self, ops):
+        ops = list(ops)
+        with timer("store_op_seconds", op=self._op_name(ops)):
+            return [self._run(op) for op in ops]
+
+    async def abatch(self, ops):
+        return await asyncio.get_running_loop().run_in_executor(None, self.batch, list(ops))
+
+    def merge(self, namespace, key, fields: dict) -> bool:
+        """Merge fields into an item's value in one optimistic write; returns True if the item was created."""
+        def apply(current):
+            now = datetime.now(timezone.utc).isoformat()
+            if not current or not current.get("value"):
+                return {"value": dict(fields), "created_at": now, "updated_at": now}, True
+            return {"value": {**current["value"], **fields}, "created_at": current["created_at"],
+                    "updated_at": now}, False
+
+        return state.update(key, self.document_name(namespace), apply)
+
+
+store = SharedStore()
+
+def get_profile_version(user_id) -> int:
+    """Helper function to get the long-term profile version for a user (bumped on every write)."""
+    return state.backend.version(user_id, SharedStore.document_name(PROFILE_NAMESPACE))
+
+def merge_user_memory(user_id, memory: dict, store_instance=None) -> bool:
+    """
+    Merge extracted fields into a user's long-term profile.
+    Args:
+        user_id: The user whose profile is updated.
+        memory: The ExtractedMemory fields to store.
+        store_instance: Store to write to (defaults to the shared store).
+    Returns:
+        True if a new profile was created, False if an existing one was updated.
+    """
+    store_instance = store_instance or store
+    if isinstance(store_instance, SharedStore):
+        return store_instance.merge(PROFILE_NAMESPACE, str(user_id), memory)
+
+    from chatapp.toolexec import user_lock
+
+    with user_lock(user_id):
+        existing = store_instance.get(PROFILE_NAMESPACE, user_id)
+        created = not (existing and existing.value)
+        merged = dict(memory) if created else {**existing.value, **memory}
+        store_instance.put(PROFILE_NAMESPACE, user_id, merged)
+    return created
 
 @dataclass
 class Context:
@@ -37,24 +152,14 @@ def save_memory(memory: ExtractedMemory, runtime: ToolRuntime[Context]) -> str:
         if not user_id:
             raise ValueError("user_id cannot be empty")
 
-        store_instance = runtime.store
-
-        existing = store_instance.get(("users",), user_id)
-
         memory_dict = memory if isinstance(memory, dict) else memory.__dict__
-        
-        if existing and existing.value:
 
-            merged = {**existing.value, **memory_dict}
-            store_instance.put(("users",), user_id, merged)
-            logger.info(f"Updated memory for user {user_id}")
-            return f"Updated memory for user {user_id}: {list(memory_dict.keys())}"
-        else:
-
-            store_instance.put(("users",), user_id, memory_dict)
+        if merge_user_memory(user_id, memory_dict, runtime.store):
             logger.info(f"Created new memory for user {user_id}")
             return f"Stored new memory for user {user_id}: {list(memory_dict.keys())}"
-            
+        logger.info(f"Updated memory for user {user_id}")
+        return f"Updated memory for user {user_id}: {list(memory_dict.keys())}"
+
     except Exception as e:
         logger.error(f"Failed to save memory: {e}")
         raise
\ No newline at end of file
@@ -0,0 +1,255 @@
+"""
+Rolling session digest.
+
+Every time summarize_memory stores a window summary, the summary is queued on
+the user's digest document (chatapp/state.py) and folded into a single running
+digest of the session in the background. End-of-session analysis then reads the digest plus the few window
+summaries that have not been folded yet (the tail) instead of every summary,
+so its prompt stays the same size however long the session ran.
+
+Folds for different users run side by side on a shared pool. Each user has at
+most one fold queued or running; summaries that arrive meanwhile are picked up
+by a follow-up fold of the same user, so a user's windows reach the digest in
+order. At most SESSION_DIGEST_MAX_QUEUED users wait for a fold; past that, new
+summaries simply stay in the tail until the next fold.
+
+When the tail is long (for example after the background folds failed or fell
+behind) it is reduced map-reduce style: chunks of summaries are condensed in
+parallel, then the partial summaries are folded into the digest in one call.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextvars import copy_context
+from typing import List
+
+from chatapp import state
+from chatapp.metrics import metrics, timed
+from chatapp.models import SessionDigest, SummaryEntry
+from chatapp.turn import current_user_id
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+FOLD_PROMPT = """
+You maintain a running digest of one chat session.
+
+Current digest (empty at the start of the session):
+{digest}
+
+New conversation summaries, oldest first:
+{summaries}
+
+Rewrite the digest so it covers the current digest and the new summaries in at
+most {max_words} words: key topics, the user's emotional journey and any
+preferences or patterns. Return ONLY a JSON object with these fields:
+{{
+    "summary": "the updated digest",
+    "general_mood": "overall mood/sentiment pattern across the session"
+}}
+
+Return only valid JSON, no additional text.
+"""
+
+CHUNK_PROMPT = """
+Condense these consecutive conversation summaries, oldest first, into one
+summary of at most {max_words} words:
+
+{summaries}
+
+Return ONLY a JSON object with these fields:
+{{
+    "summary": "brief summary of the chat interactions and key topics",
+    "general_mood": "overall mood/sentiment pattern across conversations"
+}}
+
+Return only valid JSON, no additional text.
+"""
+
+# State document (chatapp/state.py) holding each user's digest and its unfolded tail.
+DIGEST = "digest"
+
+_lock = threading.Lock()
+_fold_executor = ThreadPoolExecutor(max_workers=config.SESSION_DIGEST_FOLD_WORKERS, thread_name_prefix="digest")
+_map_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="digest-map")
+# user_id -> Future of the user's queued or running folds; users whose summaries arrived while theirs ran.
+_folds = {}
+_refold = set()
+_stats = {"folds": 0, "fold_errors": 0, "fold_conflicts": 0, "folds_skipped": 0, "map_reduce_runs": 0,
+          "chunks_summarized": 0}
+
+
+def _generate(prompt: str) -> dict:
+    from chatapp.gemini import client, parse_json_reply
+
+    response = client.client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
+    return parse_json_reply(response.candidates[0].content.parts[0].text)
+
+
+def _format_summaries(entries) -> str:
+    return "\n".join(f"- ({entry.general_mood}) {entry.summary}" for entry in entries)
+
+
+def _summarize_chunk(entries: List[SummaryEntry]) -> SummaryEntry:
+    extracted = _generate(CHUNK_PROMPT.format(
+        summaries=_format_summaries(entries), max_words=config.SESSION_DIGEST_MAX_WORDS // 2,
+    ))
+    return SummaryEntry(
+        summary=extracted.get("summary", ""),
+        general_mood=extracted.get("general_mood", entries[-1].general_mood),
+        timestamp=entries[-1].timestamp,
+    )
+
+
+def map_reduce_summaries(entries: List[SummaryEntry], chunk_size: int = None) -> List[SummaryEntry]:
+    """
+    Condense a long list of summaries by summarizing chunks of it in parallel.
+    Args:
+        entries: Window summaries, oldest first.
+        chunk_size: Summaries per chunk (defaults to SESSION_DIGEST_CHUNK_SIZE).
+    Returns:
+        One summary per chunk, in order.
+    """
+    chunk_size = max(2, chunk_size or config.SESSION_DIGEST_CHUNK_SIZE)
+    chunks = [entries[i:i + chunk_size] for i in range(0, len(entries), chunk_size)]
+    # Each chunk call runs in a copy of the caller's context so it keeps the deadline.
+    futures = [_map_executor.submit(copy_context().run, _summarize_chunk, chunk) for chunk in chunks]
+    partials = [future.result() for future in futures]
+    with _lock:
+        _stats["map_reduce_runs"] += 1
+        _stats["chunks_summarized"] += len(chunks)
+    return partials
+
+
+@timed("digest_fold_seconds")
+def fold_pending(user_id=None) -> int:
+    """
+    Fold the queued window summaries into the user's session digest.
+    Args:
+        user_id: Whose digest (defaults to the current turn's user).
+    Returns:
+        The number of window summaries folded.
+    """
+    user_id = current_user_id(user_id)
+    digest = state.load_model(user_id, DIGEST, SessionDigest)
+    batch = list(digest.pending)
+    if not batch:
+        return 0
+    summaries = batch
+    if len(batch) >= config.SESSION_DIGEST_MAP_REDUCE_MIN:
+        summaries = map_reduce_summaries(batch)
+    try:
+        extracted = _generate(FOLD_PROMPT.format(
+            digest=digest.summary or "(empty)", summaries=_format_summaries(summaries),
+            max_words=config.SESSION_DIGEST_MAX_WORDS,
+        ))
+    except Exception as e:
+        logger.warning(f"Session digest fold failed, keeping {len(batch)} summaries in the tail: {e}")
+        with _lock:
+            _stats["fold_errors"] += 1
+        return 0
+
+    def apply(current: SessionDigest):
+        # Another fold got these summaries in first, or the session was cleared meanwhile.
+        if current.epoch != digest.epoch or current.pending[:len(batch)] != batch:
+            return 0
+        current.summary = extracted.get("summary", digest.summary)
+        current.general_mood = extracted.get("general_mood", batch[-1].general_mood)
+        current.windows += len(batch)
+        del current.pending[:len(batch)]
+        return len(batch)
+
+    folded = state.update_model(user_id, DIGEST, SessionDigest, apply)
+    with _lock:
+        _stats["folds" if folded else "fold_conflicts"] += 1
+    return folded
+
+
+def _run_folds(user_id):
+    while True:
+        try:
+            fold_pending(user_id)
+        except Exception as e:
+            logger.warning(f"Session digest fold for {user_id} failed: {e}")
+        with _lock:
+            if user_id not in _refold:
+                _folds.pop(user_id, None)
+                return
+            _refold.discard(user_id)
+
+
+def _schedule_fold(user_id):
+    with _lock:
+        if user_id in _folds:
+            # The running fold may have read the digest already; fold again once it is done.
+            _refold.add(user_id)
+            return
+        if len(_folds) >= config.SESSION_DIGEST_MAX_QUEUED:
+            _stats["folds_skipped"] += 1
+            return
+        _folds[user_id] = _fold_executor.submit(_run_folds, user_id)
+
+
+def add_window_summary(entry: SummaryEntry, user_id=None):
+    """Helper function to queue a new window summary and fold it into the digest in the background."""
+    if not config.SESSION_DIGEST_ENABLED:
+        return
+    user_id = current_user_id(user_id)
+    state.update_model(user_id, DIGEST, SessionDigest, lambda digest: digest.pending.append(entry))
+    _schedule_fold(user_id)
+
+
+def wait_for_folds(wait: float = 2.0, user_id=None):
+    """Helper function to wait up to `wait` seconds for the background folds of `user_id` (every user when None)."""
+    with _lock:
+        futures = list(_folds.values()) if user_id is None else [f for f in [_folds.get(user_id)] if f]
+    if futures:
+        wait_futures(futures, timeout=wait)
+
+
+def prepare_session_digest(user_id=None, wait: float = 2.0):
+    """
+    Helper function to call before end-of-session analysis. Waits up to `wait`
+    seconds for background folds, then map-reduces the tail if it is still long.
+    """
+    if not config.SESSION_DIGEST_ENABLED:
+        return
+    user_id = current_user_id(user_id)
+    wait_for_folds(wait, user_id)
+    if len(state.load_model(user_id, DIGEST, SessionDigest).pending) >= config.SESSION_DIGEST_MAP_REDUCE_MIN:
+        fold_pending(user_id)
+
+
+def get_digest_tail(user_id=None) -> tuple:
+    """Helper function to get (digest, window summaries not folded yet)."""
+    digest = state.load_model(current_user_id(user_id), DIGEST, SessionDigest)
+    tail = digest.pending
+    digest.pending = []
+    return digest, tail
+
+
+def get_digest_version(user_id=None) -> int:
+    """Helper function to get the session digest version (bumped on every write)."""
+    return state.backend.version(current_user_id(user_id), DIGEST)
+
+
+def _reset(digest: SessionDigest):
+    digest.summary = ""
+    digest.general_mood = "NEUTRAL"
+    digest.windows = 0
+    digest.pending = []
+    digest.epoch += 1
+
+
+def clear_session_digest(user_id=None):
+    """Helper function to reset the digest and drop queued summaries."""
+    state.update_model(current_user_id(user_id), DIGEST, SessionDigest, _reset)
+
+
+def get_digest_stats() -> dict:
+    """Helper function to get digest counters (folds, map-reduce runs, folds dropped as stale)."""
+    with _lock:
+        return dict(_stats)
+
+
+metrics.register_collector("session_digest", get_digest_stats)
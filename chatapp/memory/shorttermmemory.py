@@ -1,55 +1,248 @@
 from langchain.tools import tool
-from chatapp.models import ShortTermMemory, ChatMemory, moodshift, local
+from chatapp import state
+from chatapp.records import ChatRecord, ChatWindow, MoodShiftRecord, dumps, loads
+from chatapp.metrics import metrics
+from chatapp.tokens import count_tokens
+from chatapp.turn import DEFAULT_USER, current_user_id, get_current_turn
+from settings import config
+from dataclasses import dataclass
+from threading import Lock, Timer
+from typing import Optional
+import atexit
 import json
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
 
 MOOD_SHIFTS_FILE = "mood_shifts.json"
+# State documents (chatapp/state.py) this module keeps per user.
+SHORT_TERM = "short_term"
+MOOD_SHIFTS = "mood_shifts"
+# Inside a chat turn the sentiment agent and the replier run concurrently, so their memory tools do not write:
+# the pipeline adds the turn's chat once both are done (add_turn_to_memory), with the reply already in it.
+TURN_WRITE_NOTE = "Noted. This chat is added to memory once the turn finishes."
+# Mood shifts are recorded on the request path; their saves are coalesced into one background write this often.
+MOOD_SHIFTS_SAVE_DELAY = 1.0
+_save_lock = Lock()
+_save_timer = None
+_save_timer_lock = Lock()
+
+def _parse_shifts(items) -> list:
+    return MoodShiftRecord.from_rows(items)
 
-def load_mood_shifts():
+def load_mood_shifts() -> dict:
+    """Helper function to read persisted mood shifts as {user_id: [MoodShiftRecord]} (older files hold one list)."""
     if os.path.exists(MOOD_SHIFTS_FILE):
         try:
-            with open(MOOD_SHIFTS_FILE, 'r') as f:
-                data = json.load(f)
-                return [moodshift(moodshift=local(chat=[ChatMemory(**c) for c in item['moodshift']['chat']])) for item in data]
-        except Exception:
-            return []
-    return []
+            with open(MOOD_SHIFTS_FILE, 'rb') as f:
+                data = loads(f.read())
+                if isinstance(data, list):
+                    data = {DEFAULT_USER: data}
+                return {user_id: _parse_shifts(items) for user_id, items in data.items()}
+        except Exception as e:
+            logger.warning(f"Could not read {MOOD_SHIFTS_FILE}, starting without saved mood shifts: {e}")
+            return {}
+    return {}
 
 def save_mood_shifts():
-    data = [shift.model_dump() for shift in mood_shifts]
-    with open(MOOD_SHIFTS_FILE, 'w') as f:
-        json.dump(data, f)
+    """
+    Helper function to persist mood shifts; a shared backend already persists them, so only the in-process one writes the file.
+    Writes are serialized and atomic (temp file, then os.replace), so a reader never sees a torn file.
+    """
+    if state.backend.shared:
+        return
+    with _save_lock:
+        data = {user_id: document["shifts"] for user_id, document in state.backend.scan(MOOD_SHIFTS)}
+        temp_file = f"{MOOD_SHIFTS_FILE}.{os.getpid()}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(dumps(data))
+        os.replace(temp_file, MOOD_SHIFTS_FILE)
+
+def _flush_mood_shifts():
+    global _save_timer
+    with _save_timer_lock:
+        if _save_timer is None:
+            return
+        _save_timer.cancel()
+        _save_timer = None
+    try:
+        save_mood_shifts()
+    except Exception as e:
+        logger.warning(f"Could not save {MOOD_SHIFTS_FILE}: {e}")
+
+def _schedule_save():
+    # One pending background save covers every shift recorded until it runs.
+    global _save_timer
+    if state.backend.shared:
+        return
+    with _save_timer_lock:
+        if _save_timer is not None:
+            return
+        _save_timer = Timer(MOOD_SHIFTS_SAVE_DELAY, _flush_mood_shifts)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+atexit.register(_flush_mood_shifts)
+
+@dataclass
+class SummarizationPolicy:
+    """
+    When to summarize the short-term window: once its rendered chats reach
+    max_tokens (the same budget as the short-term prompt section), once it
+    holds max_chats chats, or once its oldest chat is max_age seconds old
+    (with at least min_chats_for_age chats, so one stale chat is left alone).
+    """
+    max_tokens: int
+    max_chats: int
+    max_age: float
+    min_chats_for_age: int = 2
+
+    def reason(self, tokens: int, count: int, age: Optional[float]) -> Optional[str]:
+        if count == 0:
+            return None
+        if tokens >= self.max_tokens:
+            return "tokens"
+        if count >= self.max_chats:
+            return "count"
+        if age is not None and age >= self.max_age and count >= self.min_chats_for_age:
+            return "age"
+        return None
 
-short_term_memory = ShortTermMemory(chats=[], max_chats=5)
-mood_shifts = load_mood_shifts()
 
-def add_chat_to_memory(user: str, sentiment_score: float, sentiment_type: str):
+# The fixed rule this policy replaced: summarize after every 5 chats.
+LEGACY_SUMMARY_EVERY = 5
+
+summarization_policy = SummarizationPolicy(
+    max_tokens=config.SHORT_TERM_TOKEN_BUDGET,
+    max_chats=config.SHORT_TERM_MAX_CHATS,
+    max_age=config.SHORT_TERM_MAX_AGE,
+)
+_trigger_stats = {"chats": 0, "legacy_summaries": 0, "summaries": 0, "tokens": 0, "count": 0, "age": 0}
+_trigger_stats_lock = Lock()
+
+def _load_window(document=None) -> ChatWindow:
+    if document is None:
+        return ChatWindow(max_chats=config.SHORT_TERM_MAX_CHATS)
+    return ChatWindow.from_document(document)
+
+def _append_chat(window: ChatWindow, chat: ChatRecord) -> Optional[MoodShiftRecord]:
+    """Append a chat to the window; returns the mood shift it completes, if any."""
+    shift = None
+    if window.chats:
+        prev_chat = window.chats[-1]
+        if (prev_chat.sentiment_type == 'POS' and chat.sentiment_type == 'NEG') or (prev_chat.sentiment_type == 'NEG' and chat.sentiment_type == 'POS'):
+            shift = MoodShiftRecord(prev_chat, chat)
+
+    if not window.chats:
+        window.window_started_at = time.time()
+    window.chats.append(chat)
+    if len(window.chats) > window.max_chats:
+        window.chats.pop(0)
+    return shift
+
+def _record_mood_shift(user_id: str, shift: MoodShiftRecord):
+    def append(document):
+        document = document or {"shifts": []}
+        document["shifts"].append(shift.to_row())
+        del document["shifts"][:-config.MOOD_SHIFTS_MAX]
+        return document, None
+
+    state.update(user_id, MOOD_SHIFTS, append)
+    _schedule_save()
+
+def add_chat_to_memory(user: str, sentiment_score: float, sentiment_type: str, user_id=None):
     """Helper function to add chat to memory."""
-    chat = ChatMemory(user=user, sentiment_score=sentiment_score, sentiment_type=sentiment_type)
-
-    if short_term_memory.chats:
-        prev_chat = short_term_memory.chats[-1]
-        if (prev_chat.sentiment_type == 'POS' and sentiment_type == 'NEG') or (prev_chat.sentiment_type == 'NEG' and sentiment_type == 'POS'):
-            mood_shift_data = local(
-                chat=[prev_chat, chat]
-            )
-            mood_shift_record = moodshift(moodshift=mood_shift_data)
-
-            mood_shifts.append(mood_shift_record)
-            save_mood_shifts()
-    
-    short_term_memory.chats.append(chat)
-    if len(short_term_memory.chats) > short_term_memory.max_chats:
-        short_term_memory.chats.pop(0)
+    user_id = current_user_id(user_id)
+    chat = ChatRecord(user, None, float(sentiment_score), sentiment_type)
+    shift = state.update_record(user_id, SHORT_TERM, _load_window, lambda window: _append_chat(window, chat))
+    if shift is not None:
+        _record_mood_shift(user_id, shift)
+
 
+def get_chat_records(user_id=None) -> list:
+    """Helper function to get the short-term chats as ChatRecords, for use inside the app."""
+    return state.load_record(current_user_id(user_id), SHORT_TERM, _load_window).chats
 
-def get_chats_from_memory():
+def get_chats_from_memory(user_id=None):
     """Helper function to get chats from memory."""
-    return short_term_memory.chats
+    return [chat.to_model() for chat in get_chat_records(user_id)]
+
+def get_memory_version(user_id=None) -> int:
+    """Helper function to get the short-term memory version (bumped on every write)."""
+    return state.backend.version(current_user_id(user_id), SHORT_TERM)
+
+def _clear_window(window: ChatWindow):
+    window.chats.clear()
+    window.window_started_at = None
 
-def clear_memory():
+def clear_memory(user_id=None):
     """Helper function to clear memory."""
-    short_term_memory.chats.clear()
+    state.update_record(current_user_id(user_id), SHORT_TERM, _load_window, _clear_window)
+
+def chat_tokens(chat: ChatRecord) -> int:
+    """Helper function to count a chat's tokens as it is rendered in the prompt."""
+    return count_tokens(json.dumps(chat.as_dict()))
+
+def get_memory_tokens(user_id=None) -> int:
+    """Helper function to count the tokens of the whole short-term window."""
+    return sum(chat_tokens(chat) for chat in get_chat_records(user_id))
+
+def _window_reason(window: ChatWindow) -> Optional[str]:
+    age = time.time() - window.window_started_at if window.window_started_at else None
+    tokens = sum(chat_tokens(chat) for chat in window.chats)
+    return summarization_policy.reason(tokens, len(window.chats), age)
+
+def summarization_reason(user_id=None) -> Optional[str]:
+    """Helper function to check whether the short-term window should be summarized now ("tokens", "count", "age" or None)."""
+    return _window_reason(state.load_record(current_user_id(user_id), SHORT_TERM, _load_window))
+
+def _record_trigger(reason: Optional[str]):
+    with _trigger_stats_lock:
+        _trigger_stats["chats"] += 1
+        if _trigger_stats["chats"] % LEGACY_SUMMARY_EVERY == 0:
+            _trigger_stats["legacy_summaries"] += 1
+        if reason is not None:
+            _trigger_stats["summaries"] += 1
+            _trigger_stats[reason] += 1
+    if reason is not None:
+        metrics.inc("summarization_triggers_total", reason=reason)
+
+def get_summarization_stats() -> dict:
+    """Helper function to compare summarization calls with the fixed every-5-chats rule."""
+    with _trigger_stats_lock:
+        stats = dict(_trigger_stats)
+    stats["avoided"] = stats["legacy_summaries"] - stats["summaries"]
+    stats["window_tokens"] = get_memory_tokens()
+    stats["token_budget"] = summarization_policy.max_tokens
+    return stats
+
+def add_turn_to_memory(user: str, assistant: Optional[str], sentiment_score: float, sentiment_type: str,
+                       user_id=None) -> str:
+    """Helper function to add one chat (and the reply, if any) to memory, summarizing the window once it is full."""
+    user_id = current_user_id(user_id)
+    chat = ChatRecord(user, assistant, float(sentiment_score), sentiment_type)
+
+    def add(window: ChatWindow):
+        # Taking the window for summarization in the same write means only one worker summarizes it.
+        shift = _append_chat(window, chat)
+        reason = _window_reason(window)
+        flushed = window.copy() if reason is not None else None
+        if flushed is not None:
+            _clear_window(window)
+        return shift, reason, flushed, len(window.chats)
+
+    shift, reason, flushed, count = state.update_record(user_id, SHORT_TERM, _load_window, add)
+    if shift is not None:
+        _record_mood_shift(user_id, shift)
+    _record_trigger(reason)
+    if flushed is not None:
+        from chatapp.memory.summarymemory import summarize_memory
+        extracted_memory = summarize_memory(flushed, user_id)
+        return f"Memory full! Summarized and stored: {extracted_memory}. Short-term memory cleared."
+    
+    return f"Added chat to memory. Current chats: {count}"
 
 @tool
 def add_to_short_term_memory(user: str, assistant: str, sentiment_score: float, sentiment_type: str) -> str:
@@ -63,15 +256,9 @@ def add_to_short_term_memory(user: str, assistant: str, sentiment_score: float,
     Returns:
         Confirmation message.
     """
-    add_chat_to_memory(user, sentiment_score, sentiment_type)
-
-    if len(short_term_memory.chats) >= 5:
-        from chatapp.memory.summarymemory import summarize_memory
-        extracted_memory = summarize_memory(short_term_memory)
-        clear_memory()
-        return f"Memory full! Summarized and stored: {extracted_memory}. Short-term memory cleared."
-    
-    return f"Added chat to memory. Current chats: {len(short_term_memory.chats)}"
+    if get_current_turn() is not None:
+        return TURN_WRITE_NOTE
+    return add_turn_to_memory(user, None, sentiment_score, sentiment_type)
 
 @tool
 def get_short_term_memory() -> str:
@@ -80,25 +267,31 @@ def get_short_term_memory() -> str:
     Returns:
         JSON string of the chats.
     """
-    chats = get_chats_from_memory()
-    return json.dumps([chat.model_dump() for chat in chats])
+    chats = get_chat_records()
+    return json.dumps([chat.as_dict() for chat in chats])
 
-def clear_mood_shifts():
+def clear_mood_shifts(user_id=None):
     """Helper function to clear mood shifts."""
-    global mood_shifts
-    mood_shifts.clear()
-    if os.path.exists(MOOD_SHIFTS_FILE):
-        os.remove(MOOD_SHIFTS_FILE)
+    state.backend.delete(current_user_id(user_id), MOOD_SHIFTS)
+    save_mood_shifts()
 
-def get_mood_shifts():
-    return mood_shifts
+def get_mood_shifts(user_id=None):
+    document, _ = state.backend.load(current_user_id(user_id), MOOD_SHIFTS)
+    return [shift.to_model() for shift in _parse_shifts(document["shifts"])] if document else []
 
-def add_assistant_to_memory(user: str, assistant: str):
+def add_assistant_to_memory(user: str, assistant: str, user_id=None):
     """Helper function to add assistant reply to the last chat in memory."""
-    if short_term_memory.chats and short_term_memory.chats[-1].user == user and short_term_memory.chats[-1].assistant is None:
-        short_term_memory.chats[-1].assistant = assistant
-    else:
-        add_chat_to_memory(user, assistant, 0.5, "NEUTRAL")
+    user_id = current_user_id(user_id)
+
+    def add(window: ChatWindow):
+        if window.chats and window.chats[-1].user == user and window.chats[-1].assistant is None:
+            window.chats[-1] = window.chats[-1].with_assistant(assistant)
+            return None
+        return _append_chat(window, ChatRecord(user, assistant, 0.5, "NEUTRAL"))
+
+    shift = state.update_record(user_id, SHORT_TERM, _load_window, add)
+    if shift is not None:
+        _record_mood_shift(user_id, shift)
 
 @tool
 def add_assistant_reply_to_short_term_memory(user: str, assistant: str) -> str:
@@ -110,5 +303,19 @@ def add_assistant_reply_to_short_term_memory(user: str, assistant: str) -> str:
     Returns:
         Confirmation message.
     """
+    if get_current_turn() is not None:
+        return TURN_WRITE_NOTE
     add_assistant_to_memory(user, assistant)
-    return "Added assistant reply to memory."
\ No newline at end of file
+    return "Added assistant reply to memory."
+
+def _seed_mood_shifts():
+    # A fresh in-process backend starts from the mood shifts saved by the last run.
+    if state.backend.shared:
+        return
+    for user_id, shifts in load_mood_shifts().items():
+        if state.backend.version(user_id, MOOD_SHIFTS) == 0:
+            state.backend.store(user_id, MOOD_SHIFTS, {"shifts": [shift.to_row() for shift in shifts]}, 0)
+
+_seed_mood_shifts()
+
+metrics.register_collector("summarization", get_summarization_stats)
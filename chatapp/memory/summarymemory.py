@@ -1,44 +1,94 @@
-from chatapp.models import ShortTermMemory, SummaryMemory, SummaryEntry
+from chatapp import state
+from chatapp.records import ChatRecord, ChatWindow, SummaryLog, SummaryRecord, as_chat_record
 from chatapp.gemini import client
+from chatapp.metrics import timed
+from chatapp.memory.sessiondigest import add_window_summary, clear_session_digest
+from chatapp.turn import current_user_id
+from settings import config
 import json
 from datetime import datetime
 
-summary_memory = SummaryMemory(summaries=[])
-history = []
+# State documents (chatapp/state.py) this module keeps per user.
+SUMMARIES = "summaries"
+HISTORY = "history"
 
-def add_summary_entry(summary: str, mood: str):
+def _load_summaries(document=None) -> SummaryLog:
+    return SummaryLog() if document is None else SummaryLog.from_document(document)
+
+def _store_entry(entry: SummaryRecord, user_id) -> int:
+    def append(memory: SummaryLog):
+        memory.summaries.append(entry)
+        if len(memory.summaries) > memory.max_summaries:
+            memory.summaries.pop(0)
+        return len(memory.summaries)
+
+    count = state.update_record(user_id, SUMMARIES, _load_summaries, append)
+    add_window_summary(entry.to_model(), user_id)
+    return count
+
+def add_summary_entry(summary: str, mood: str, user_id=None):
     """Helper function to add summary entry."""
-    entry = SummaryEntry(
-        summary=summary,
-        general_mood=mood,
-        timestamp=datetime.now().isoformat()
-    )
-    summary_memory.summaries.append(entry)
-    if len(summary_memory.summaries) > summary_memory.max_summaries:
-        summary_memory.summaries.pop(0)
-
-def get_summaries():
+    entry = SummaryRecord(summary, mood, datetime.now().isoformat())
+    _store_entry(entry, current_user_id(user_id))
+
+def get_summary_records(user_id=None) -> list:
+    """Helper function to get every stored summary as SummaryRecords, oldest first, for use inside the app."""
+    return state.load_record(current_user_id(user_id), SUMMARIES, _load_summaries).summaries
+
+def get_summary_entries(user_id=None):
+    """Helper function to get every stored summary, oldest first."""
+    return [entry.to_model() for entry in get_summary_records(user_id)]
+
+def get_summaries(user_id=None):
     """Helper function to get all summaries."""
-    return summary_memory.summaries[:5]
+    return [entry.to_model() for entry in get_summary_records(user_id)[:5]]
+
+def get_summary_version(user_id=None) -> int:
+    """Helper function to get the summary memory version (bumped on every write)."""
+    return state.backend.version(current_user_id(user_id), SUMMARIES)
+
+def _append_history(chats, user_id):
+    def append(document):
+        document = document or {"windows": []}
+        document["windows"].append([chat.to_row() for chat in chats])
+        del document["windows"][:-config.HISTORY_MAX_WINDOWS]
+        return document, None
 
-def summarize_memory(short_term_memory: ShortTermMemory) -> str:
+    state.update(user_id, HISTORY, append)
+
+def format_chats(chats) -> str:
+    """Helper function to render chats as the conversation history of the summarization prompt."""
+    chats_text = ""
+    for chat in chats:
+        chats_text += f"User: {chat.user}\nAssistant: {chat.assistant}\nSentiment: {chat.sentiment_type} ({chat.sentiment_score})\n\n"
+    return chats_text
+
+def parse_summary_response(response_text: str) -> dict:
+    """Helper function to parse the model's summary JSON, with or without a ```json fence."""
+    response_text = response_text.strip()
+    if response_text.startswith('```json'):
+        response_text = response_text[7:]
+    if response_text.startswith('```'):
+        response_text = response_text[3:]
+    if response_text.endswith('```'):
+        response_text = response_text[:-3]
+    return json.loads(response_text.strip())
+
+@timed("summarize_seconds")
+def summarize_memory(short_term_memory: ChatWindow, user_id=None) -> str:
     """
     Summarize short-term memory and store in summary memory array.
     Args:
-        short_term_memory: The short-term memory to summarize.
+        short_term_memory: The short-term window to summarize (a ChatWindow, or a ShortTermMemory model).
+        user_id: The user the memory belongs to (defaults to the current turn's user).
     Returns:
         Confirmation message with summary details.
     """
 
-    chats_text = ""
-    chats_list = short_term_memory.chats
-    history.append(chats_list)
-    
-    if not summary_memory.summaries and history:
-        chats_list = history[-1]
-    
-    for chat in chats_list:
-        chats_text += f"User: {chat.user}\nAssistant: {chat.assistant}\nSentiment: {chat.sentiment_type} ({chat.sentiment_score})\n\n"
+    user_id = current_user_id(user_id)
+    chats_list = [as_chat_record(chat) for chat in short_term_memory.chats]
+    _append_history(chats_list, user_id)
+    chats_text = format_chats(chats_list)
 
     extraction_prompt = f"""
 Analyze the following conversation history and extract key information:
@@ -61,31 +111,17 @@ Return only valid JSON, no additional text.
         )
         print(response)
         
-        response_text = response.candidates[0].content.parts[0].text.strip()
-
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]  
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]  
-        
-        response_text = response_text.strip()
-        
-        extracted = json.loads(response_text)
+        extracted = parse_summary_response(response.candidates[0].content.parts[0].text)
 
-        summary_entry = SummaryEntry(
+        summary_entry = SummaryRecord(
             summary=extracted.get("summary", "No summary available"),
             general_mood=extracted.get("general_mood", "NEUTRAL"),
             timestamp=datetime.now().isoformat()
         )
 
-        summary_memory.summaries.append(summary_entry)
-
-        if len(summary_memory.summaries) > summary_memory.max_summaries:
-            summary_memory.summaries.pop(0) 
+        total = _store_entry(summary_entry, user_id)
         
-        return f"Summary created and stored. Total summaries: {len(summary_memory.summaries)}"
+        return f"Summary created and stored. Total summaries: {total}"
         
     except Exception as e:
         print(f"Error in summarize_memory: {e}")
@@ -95,32 +131,41 @@ Return only valid JSON, no additional text.
         sentiments = [chat.sentiment_type for chat in chats_list]
         dominant_sentiment = max(set(sentiments), key=sentiments.count) if sentiments else "NEUTRAL"
         
-        summary_entry = SummaryEntry(
+        summary_entry = SummaryRecord(
             summary="Basic summary - extraction failed",
             general_mood=dominant_sentiment,
             timestamp=datetime.now().isoformat()
         )
         
-        summary_memory.summaries.append(summary_entry)
+        total = _store_entry(summary_entry, user_id)
         
-        return f"Basic summary created (extraction failed). Total summaries: {len(summary_memory.summaries)}"
+        return f"Basic summary created (extraction failed). Total summaries: {total}"
 
-def get_all_summaries() -> str:
+def get_all_summaries(user_id=None) -> str:
     """
     Get all stored summaries for generating comprehensive output.
+    Args:
+        user_id: Whose summaries (defaults to the current turn's user).
     Returns:
         JSON string of all summary entries.
     """
-    return json.dumps([entry.model_dump() for entry in summary_memory.summaries])
+    return json.dumps([entry.as_dict() for entry in get_summary_records(user_id)])
 
-def clear_summaries() -> str:
+def clear_summaries(user_id=None) -> str:
     """
     Clear all stored summaries.
+    Args:
+        user_id: Whose summaries (defaults to the current turn's user).
     Returns:
         Confirmation message.
     """
-    summary_memory.summaries.clear()
+    user_id = current_user_id(user_id)
+    state.update_record(user_id, SUMMARIES, _load_summaries, lambda memory: memory.summaries.clear())
+    clear_session_digest(user_id)
     return "All summaries cleared."
 
-def gethistory():
-    return history
\ No newline at end of file
+def gethistory(user_id=None):
+    document, _ = state.backend.load(current_user_id(user_id), HISTORY)
+    if not document:
+        return []
+    return [[chat.to_model() for chat in ChatRecord.from_rows(window)] for window in document["windows"]]
\ No newline at end of file
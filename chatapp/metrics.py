@@ -0,0 +1,347 @@
+"""
+In-process latency histograms and counters.
+
+Timers wrap the turn stages, model and tool calls (MetricsMiddleware),
+summarization, store I/O and prompt rendering. Everything is kept in memory and
+exported as Prometheus text (`render_prometheus()`, or the /metrics endpoint
+from `start_metrics_server()`) and as periodic JSON snapshots
+(`start_snapshot_writer()`). Recording is a perf_counter pair, a bisect and one
+lock acquisition, cheap enough to leave on in production.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "chatapp_"
+# Upper bounds in seconds, from prompt rendering (sub-ms) up to slow model calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) with bucket-interpolated quantiles."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class MetricsRegistry:
+    """Named histograms and counters keyed by label set, plus gauge collectors."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Time the block and record it in histogram `name`, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator form of timer()."""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def register_collector(self, name: str, fn: Callable[[], dict]):
+        """Export the numeric values of fn() as gauges named `<name>_<key>` at scrape time."""
+        self._collectors[name] = fn
+
+    def _collected(self) -> dict:
+        gauges = {}
+        for name, fn in list(self._collectors.items()):
+            try:
+                values = fn()
+            except Exception as e:
+                logger.warning(f"Metrics collector {name} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{name}_{key}"] = value
+                elif isinstance(value, bool):
+                    gauges[f"{name}_{key}"] = int(value)
+        return gauges
+
+    def snapshot(self) -> dict:
+        """All metrics as plain data, with p50/p95/p99 per histogram."""
+        with self._lock:
+            histograms = {key: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                          for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        return {
+            "timestamp": time.time(),
+            "histograms": [
+                {"name": name, "labels": dict(labels), "count": count, "sum": total,
+                 "p50": p50, "p95": p95, "p99": p99}
+                for (name, labels), (count, total, p50, p95, p99) in sorted(histograms.items())
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "gauges": self._collected(),
+        }
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines, typed = [], set()
+
+        def header(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {PREFIX}{name} {self._help[name]}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+        for name, value in sorted(self._collected().items()):
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry(enabled=config.METRICS_ENABLED)
+timer = metrics.timer
+timed = metrics.timed
+
+metrics.describe("turn_stage_seconds", "Wall time of each chat-turn stage")
+metrics.describe("model_call_seconds", "Model call latency per agent")
+metrics.describe("tool_call_seconds", "Tool call latency per agent and tool")
+metrics.describe("summarize_seconds", "summarize_memory latency, including the model call")
+metrics.describe("store_op_seconds", "Long-term store batch latency per operation type")
+metrics.describe("prompt_render_seconds", "Memory-context render time on cache misses")
+metrics.describe("model_tokens_total", "Model tokens reported in usage metadata")
+
+
+class MetricsMiddleware(AgentMiddleware):
+    """
+    Time every model call and tool call of an agent. Place it last in the
+    middleware list so it measures the call itself, not the other middleware.
+    """
+
+    def __init__(self, agent_name: str):
+        super().__init__()
+        self.agent_name = agent_name
+
+    @property
+    def name(self) -> str:
+        return f"MetricsMiddleware[{self.agent_name}]"
+
+    def _record_usage(self, response):
+        messages = response.result if isinstance(response, ModelResponse) else [response]
+        for message in messages:
+            usage = getattr(message, "usage_metadata", None) or {}
+            for kind in ("input_tokens", "output_tokens"):
+                if usage.get(kind):
+                    metrics.inc("model_tokens_total", usage[kind], agent=self.agent_name, kind=kind)
+
+    def wrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        with timer("model_call_seconds", agent=self.agent_name):
+            response = handler(request)
+        self._record_usage(response)
+        return response
+
+    async def awrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        with timer("model_call_seconds", agent=self.agent_name):
+            response = await handler(request)
+        self._record_usage(response)
+        return response
+
+    def _tool_done(self, tool: str, result):
+        if getattr(result, "status", None) == "error":
+            metrics.inc("tool_errors_total", agent=self.agent_name, tool=tool)
+
+    def wrap_tool_call(self, request, handler):
+        tool = request.tool_call["name"]
+        with timer("tool_call_seconds", agent=self.agent_name, tool=tool):
+            result = handler(request)
+        self._tool_done(tool, result)
+        return result
+
+    async def awrap_tool_call(self, request, handler):
+        tool = request.tool_call["name"]
+        with timer("tool_call_seconds", agent=self.agent_name, tool=tool):
+            result = await handler(request)
+        self._tool_done(tool, result)
+        return result
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(metrics.snapshot()).encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, content_type = metrics.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_snapshot_thread = None
+_exporter_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json on a daemon thread. Idempotent."""
+    global _server
+    with _exporter_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # Another process (e.g. a second Streamlit session's server) already owns the port.
+            logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server
+
+
+def write_snapshot(path: str):
+    """Write metrics.snapshot() to path atomically."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metrics.snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def start_snapshot_writer(path: str, interval: float):
+    """Write a JSON snapshot every interval seconds on a daemon thread. Idempotent."""
+    global _snapshot_thread
+    with _exporter_lock:
+        if _snapshot_thread is not None:
+            return _snapshot_thread
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_snapshot(path)
+                except Exception as e:
+                    logger.warning(f"Failed to write metrics snapshot: {e}")
+
+        _snapshot_thread = threading.Thread(target=loop, name="metrics-snapshot", daemon=True)
+        _snapshot_thread.start()
+        return _snapshot_thread
+
+
+def start_exporters():
+    """Helper function to start the exporters configured in settings."""
+    if not config.METRICS_ENABLED:
+        return
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT, config.METRICS_HOST)
+    if config.METRICS_SNAPSHOT_PATH:
+        start_snapshot_writer(config.METRICS_SNAPSHOT_PATH, config.METRICS_SNAPSHOT_INTERVAL)
@@ -12,6 +12,7 @@ class ChatMemory(BaseModel):
 class ShortTermMemory(BaseModel):
     chats: List[ChatMemory]
     max_chats: int = 5
+    window_started_at: Optional[float] = None
 
 class ExtractedMemory(TypedDict):
     name: Optional[str] = None
@@ -24,6 +25,15 @@ class SummaryEntry(BaseModel):
     general_mood: str
     timestamp: str
 
+class SessionDigest(BaseModel):
+    summary: str = ""
+    general_mood: str = "NEUTRAL"
+    windows: int = 0
+    # Window summaries not folded into the digest yet, oldest first.
+    pending: List[SummaryEntry] = []
+    # Bumped when the digest is cleared, so a fold that started earlier is dropped.
+    epoch: int = 0
+
 class SummaryMemory(BaseModel):
     summaries: List[SummaryEntry]
     max_summaries: int = 10
@@ -0,0 +1,525 @@
+import ast
+import json
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+from chatapp.diagnostics import diagnostics
+from chatapp.memory.extraction import update_long_term_memory
+from chatapp.memory.shorttermmemory import add_turn_to_memory
+from chatapp.metrics import metrics
+from chatapp.models import Context
+from chatapp.promptmiddleware import turn_snapshot
+from chatapp.replay import begin_trace, finish_trace, serial_stages
+from chatapp.resilience import run_cancellable, run_with_deadline
+from chatapp.tools.sentimentanalysis import LABEL_NAMES, classify_text, normalize_label
+from chatapp.turn import (
+    TurnState, reset_current_stage, reset_current_turn, set_current_stage, set_current_turn,
+)
+
+# Per-stage timeouts in seconds.
+CLASSIFIER_TIMEOUT = 10.0
+SENTIMENT_TIMEOUT = 45.0
+REPLY_TIMEOUT = 60.0
+MEMORY_EXTRACTION_TIMEOUT = 20.0
+# How long the replier's first model call may wait for the classifier result.
+CLASSIFIER_GRACE = 0.5
+
+FALLBACK_REPLY = "I apologize, but I couldn't generate a response."
+
+# Short-term memory keeps the model labels (POS/NEG/NEU); mood shifts are detected on them.
+MEMORY_LABELS = {name: label for label, name in LABEL_NAMES.items()}
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="turn")
+
+# Recent time-to-first-token samples (seconds) for streamed replies.
+_ttft_samples = deque(maxlen=500)
+
+
+@dataclass
+class TurnResult:
+    """Outcome of one chat turn."""
+    response_text: str
+    sentiment_type: str = "NEUTRAL"
+    sentiment_score: float = 0.5
+    stage_seconds: dict = field(default_factory=dict)
+    errors: dict = field(default_factory=dict)
+    total_seconds: float = 0.0
+    sentiment_fed_to_replier: bool = False
+    sentiment_result: Optional[dict] = None
+    response_result: Optional[dict] = None
+    ttft_seconds: Optional[float] = None
+    extracted_memory: Optional[dict] = None
+    cancelled: bool = False
+
+
+@dataclass
+class TurnEvent:
+    """
+    One event of a streamed turn.
+    kind is "sentiment" (data: {"label", "score"}), "status" (data: str),
+    "token" (data: str), "error" (data: {"stage", "error"}) or "done" (data: TurnResult).
+    """
+    kind: str
+    data: object = None
+
+
+def _message_text(msg) -> str:
+    if isinstance(msg.content, list):
+        text_parts = []
+        for content_block in msg.content:
+            if isinstance(content_block, dict) and 'text' in content_block:
+                text_parts.append(content_block['text'])
+            elif isinstance(content_block, str):
+                text_parts.append(content_block)
+        return ''.join(text_parts)
+    return str(msg.content)
+
+
+def extract_text(result, default: str = FALLBACK_REPLY) -> str:
+    """
+    Get the final assistant text from an agent result.
+    Args:
+        result: The value returned by agent.invoke().
+        default: Text to return when no assistant message is found.
+    Returns:
+        The assistant text.
+    """
+    if isinstance(result, dict):
+        if 'messages' in result:
+            for msg in reversed(result['messages']):
+                if (hasattr(msg, 'type') and msg.type == 'ai') or (hasattr(msg, 'role') and msg.role == 'assistant'):
+                    if hasattr(msg, 'content'):
+                        return _message_text(msg)
+                    break
+        elif 'output' in result:
+            return result['output']
+        return default
+    return str(result) if result is not None else default
+
+
+def _parse_tool_payload(content):
+    if isinstance(content, dict):
+        return content
+    for loader in (json.loads, ast.literal_eval):
+        try:
+            value = loader(content)
+            if isinstance(value, dict):
+                return value
+        except Exception:
+            continue
+    return None
+
+
+def parse_sentiment(result) -> tuple:
+    """
+    Get (sentiment_type, sentiment_score) from a sentiment agent result.
+    Args:
+        result: The value returned by sentiment_agent.invoke().
+    Returns:
+        A (label, score) tuple; ("NEUTRAL", 0.5) when nothing could be parsed.
+    """
+    sentiment_type = "NEUTRAL"
+    sentiment_score = 0.5
+
+    if isinstance(result, dict) and 'messages' in result:
+        for msg in reversed(result['messages']):
+            if getattr(msg, 'type', None) == 'tool' and getattr(msg, 'name', None) == 'analyze_sentiment':
+                payload = _parse_tool_payload(msg.content)
+                if payload and 'label' in payload:
+                    return normalize_label(payload['label']), abs(float(payload.get('score', 0.5)))
+
+    if isinstance(result, dict) and 'output' in result:
+        output = result['output']
+        try:
+            if isinstance(output, str) and 'POSITIVE' in output:
+                sentiment_type = "POSITIVE"
+                score_match = re.search(r"'score':\s*(-?\d+\.?\d*)", output)
+                sentiment_score = abs(float(score_match.group(1))) if score_match else 0.8
+            elif isinstance(output, str) and 'NEGATIVE' in output:
+                sentiment_type = "NEGATIVE"
+                score_match = re.search(r"'score':\s*(-?\d+\.?\d*)", output)
+                sentiment_score = abs(float(score_match.group(1))) if score_match else 0.8
+            elif isinstance(output, dict):
+                sentiment_type = normalize_label(output.get('label', 'NEUTRAL'))
+                sentiment_score = abs(output.get('score', 0.5))
+        except Exception:
+            if 'POSITIVE' in str(output):
+                sentiment_type = "POSITIVE"
+                sentiment_score = 0.8
+            elif 'NEGATIVE' in str(output):
+                sentiment_type = "NEGATIVE"
+                sentiment_score = 0.8
+
+    return sentiment_type, sentiment_score
+
+
+def _timed(stage_seconds: dict, name: str, fn, *args, **kwargs):
+    start = time.perf_counter()
+    stage_token = set_current_stage(name)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        reset_current_stage(stage_token)
+        stage_seconds[name] = time.perf_counter() - start
+        metrics.observe("turn_stage_seconds", stage_seconds[name], stage=name)
+
+
+def _submit(stage_seconds: dict, name: str, fn, *args, deadline: Optional[float] = None, **kwargs):
+    """Run a stage on the pool; model and search calls inside it must finish by deadline (time.monotonic)."""
+    ctx = copy_context()
+    if serial_stages():
+        # Deterministic replay: run the stage here, in submission order.
+        future = Future()
+        try:
+            future.set_result(ctx.run(run_with_deadline, deadline, _timed, stage_seconds, name, fn, *args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return _executor.submit(ctx.run, run_with_deadline, deadline, _timed, stage_seconds, name, fn, *args, **kwargs)
+
+
+def _classify_stage(turn: TurnState):
+    result = classify_text(turn.user_input)
+    turn.publish_sentiment(normalize_label(result['label']), abs(float(result['score'])))
+    return result
+
+
+def _collect(future, deadline: float, name: str, errors: dict):
+    timeout = max(0.0, deadline - time.perf_counter())
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        errors[name] = "timed out"
+    except Exception as e:
+        errors[name] = str(e)
+    return None
+
+
+def _record_turn(total_seconds: float, errors: dict):
+    metrics.observe("turn_stage_seconds", total_seconds, stage="turn_total")
+    for stage in errors:
+        metrics.inc("turn_stage_errors_total", stage=stage)
+    diagnostics.after_turn()
+
+
+def _default_agents(sentiment_agent, replier_agent):
+    if sentiment_agent is None or replier_agent is None:
+        from chatapp.agents import sentiment_agent as default_sentiment, replier_agent as default_replier
+        sentiment_agent = sentiment_agent or default_sentiment
+        replier_agent = replier_agent or default_replier
+    return sentiment_agent, replier_agent
+
+
+def _final_sentiment(classifier_result, sentiment_result) -> tuple:
+    if classifier_result is not None:
+        return normalize_label(classifier_result['label']), abs(float(classifier_result['score']))
+    return parse_sentiment(sentiment_result)
+
+
+def _remember_turn(stage_seconds: dict, errors: dict, turn: TurnState, reply: Optional[str],
+                   sentiment_type: str, sentiment_score: float):
+    """
+    Add the turn's chat to short-term memory in one write, once the sentiment
+    agent and the replier are both done (their memory tools only acknowledge
+    inside a turn, so their order cannot duplicate or split the chat).
+    """
+    try:
+        _timed(stage_seconds, "short_term_memory", add_turn_to_memory, turn.user_input, reply, sentiment_score,
+               MEMORY_LABELS.get(sentiment_type, sentiment_type), turn.user_id)
+    except Exception as e:
+        errors["short_term_memory"] = str(e)
+
+
+def run_turn(user_input: str, user_id: str = "default_user", sentiment_agent=None, replier_agent=None,
+             sentiment_prompt: Optional[str] = None, reply_prompt: Optional[str] = None,
+             classifier_timeout: float = CLASSIFIER_TIMEOUT, sentiment_timeout: float = SENTIMENT_TIMEOUT,
+             reply_timeout: float = REPLY_TIMEOUT) -> TurnResult:
+    """
+    Run one chat turn with the classifier, memory extraction, sentiment agent and
+    replier started concurrently.
+
+    The local classifier result is published to the turn as soon as it is ready;
+    the replier's dynamic prompt includes it if it arrives before (or within
+    CLASSIFIER_GRACE of) the replier's first model call. Each stage has its own
+    timeout; a stage that times out is reported in TurnResult.errors and the
+    turn completes with what is available.
+    """
+    sentiment_agent, replier_agent = _default_agents(sentiment_agent, replier_agent)
+    sentiment_prompt = sentiment_prompt or f"Analyze the sentiment of this message and store it: {user_input}"
+    reply_prompt = reply_prompt or user_input
+    context = Context(user_id=str(user_id))
+    stage_seconds, errors = {}, {}
+    turn = TurnState(user_input=user_input, user_id=str(user_id), classifier_grace=CLASSIFIER_GRACE)
+    begin_trace(turn)
+
+    start = time.perf_counter()
+    deadline_base = time.monotonic()
+    token = set_current_turn(turn)
+    try:
+        with turn_snapshot():
+            classifier_future = _submit(stage_seconds, "classifier", _classify_stage, turn)
+            memory_future = _submit(
+                stage_seconds, "memory_extraction", update_long_term_memory, user_input, str(user_id),
+                deadline=deadline_base + MEMORY_EXTRACTION_TIMEOUT,
+            )
+            sentiment_future = _submit(
+                stage_seconds, "sentiment_agent", sentiment_agent.invoke,
+                {"messages": [{"role": "user", "content": sentiment_prompt}]}, context=context,
+                deadline=deadline_base + sentiment_timeout,
+            )
+            reply_future = _submit(
+                stage_seconds, "replier_agent", replier_agent.invoke,
+                {"messages": [{"role": "user", "content": reply_prompt}]}, context=context,
+                deadline=deadline_base + reply_timeout,
+            )
+
+            classifier_result = _collect(classifier_future, start + classifier_timeout, "classifier", errors)
+            response_result = _collect(reply_future, start + reply_timeout, "replier_agent", errors)
+            sentiment_result = _collect(sentiment_future, start + sentiment_timeout, "sentiment_agent", errors)
+            extracted_memory = _collect(memory_future, start + MEMORY_EXTRACTION_TIMEOUT, "memory_extraction", errors)
+        sentiment_type, sentiment_score = _final_sentiment(classifier_result, sentiment_result)
+        response_text = extract_text(response_result) if response_result is not None else None
+        _remember_turn(stage_seconds, errors, turn, response_text, sentiment_type, sentiment_score)
+    finally:
+        reset_current_turn(token)
+
+    _record_turn(time.perf_counter() - start, errors)
+    result = TurnResult(
+        response_text=response_text if response_text is not None else FALLBACK_REPLY,
+        sentiment_type=sentiment_type,
+        sentiment_score=sentiment_score,
+        stage_seconds=dict(stage_seconds),
+        errors=errors,
+        total_seconds=time.perf_counter() - start,
+        sentiment_fed_to_replier=turn.sentiment_in_prompt,
+        sentiment_result=sentiment_result,
+        response_result=response_result,
+        extracted_memory=extracted_memory,
+    )
+    finish_trace(turn, result, sentiment_prompt, reply_prompt)
+    return result
+
+
+def _stream_reply(replier_agent, reply_prompt: str, context, emit) -> Optional[dict]:
+    """Stream the replier agent, emitting token and tool-status events; returns the final state."""
+    final_state = None
+    for mode, payload in replier_agent.stream(
+        {"messages": [{"role": "user", "content": reply_prompt}]},
+        context=context,
+        stream_mode=["messages", "values"],
+    ):
+        if mode == "values":
+            final_state = payload
+            continue
+        chunk, _metadata = payload
+        if getattr(chunk, 'type', None) == 'tool':
+            emit(TurnEvent("status", f"{getattr(chunk, 'name', 'tool')} finished"))
+            continue
+        for tool_chunk in getattr(chunk, 'tool_call_chunks', None) or []:
+            if tool_chunk.get('name'):
+                emit(TurnEvent("status", f"Calling {tool_chunk['name']}..."))
+        text = _message_text(chunk)
+        if text:
+            emit(TurnEvent("token", text))
+    return final_state
+
+
+def _stream_worker(turn: TurnState, sentiment_agent, replier_agent, sentiment_prompt: str, reply_prompt: str,
+                   events: queue.Queue, classifier_timeout: float, sentiment_timeout: float, reply_timeout: float,
+                   cancel: threading.Event):
+    stage_seconds, errors = {}, {}
+    context = Context(user_id=turn.user_id)
+    start = turn.started_at
+    deadline_base = time.monotonic() - (time.perf_counter() - start)
+    ttft = []
+
+    def emit(event: TurnEvent):
+        if event.kind == "token" and not ttft:
+            ttft.append(time.perf_counter() - start)
+            _ttft_samples.append(ttft[0])
+        events.put(event)
+
+    def on_classified(future):
+        if not future.cancelled() and future.exception() is None and turn.sentiment is not None:
+            events.put(TurnEvent("sentiment", dict(turn.sentiment)))
+
+    token = set_current_turn(turn)
+    response_result = classifier_result = sentiment_result = extracted_memory = None
+    try:
+        with turn_snapshot():
+            classifier_future = _submit(stage_seconds, "classifier", _classify_stage, turn)
+            classifier_future.add_done_callback(on_classified)
+            memory_future = _submit(
+                stage_seconds, "memory_extraction", update_long_term_memory, turn.user_input, turn.user_id,
+                deadline=deadline_base + MEMORY_EXTRACTION_TIMEOUT,
+            )
+            sentiment_future = _submit(
+                stage_seconds, "sentiment_agent", sentiment_agent.invoke,
+                {"messages": [{"role": "user", "content": sentiment_prompt}]}, context=context,
+                deadline=deadline_base + sentiment_timeout,
+            )
+            try:
+                response_result = run_with_deadline(
+                    deadline_base + reply_timeout, _timed, stage_seconds, "replier_agent", _stream_reply,
+                    replier_agent, reply_prompt, context, emit,
+                )
+            except Exception as e:
+                errors["replier_agent"] = str(e)
+                events.put(TurnEvent("error", {"stage": "replier_agent", "error": str(e)}))
+
+            classifier_result = _collect(classifier_future, start + classifier_timeout, "classifier", errors)
+            sentiment_result = _collect(sentiment_future, start + sentiment_timeout, "sentiment_agent", errors)
+            extracted_memory = _collect(memory_future, start + MEMORY_EXTRACTION_TIMEOUT, "memory_extraction", errors)
+        sentiment_type, sentiment_score = _final_sentiment(classifier_result, sentiment_result)
+        response_text = extract_text(response_result) if response_result is not None else None
+        if not cancel.is_set():
+            _remember_turn(stage_seconds, errors, turn, response_text, sentiment_type, sentiment_score)
+    finally:
+        reset_current_turn(token)
+
+    _record_turn(time.perf_counter() - start, errors)
+    if cancel.is_set():
+        metrics.inc("turns_cancelled_total")
+    result = TurnResult(
+        response_text=response_text if response_text is not None else FALLBACK_REPLY,
+        sentiment_type=sentiment_type,
+        sentiment_score=sentiment_score,
+        stage_seconds=dict(stage_seconds),
+        errors=errors,
+        total_seconds=time.perf_counter() - start,
+        sentiment_fed_to_replier=turn.sentiment_in_prompt,
+        sentiment_result=sentiment_result,
+        response_result=response_result,
+        ttft_seconds=ttft[0] if ttft else None,
+        extracted_memory=extracted_memory,
+        cancelled=cancel.is_set(),
+    )
+    finish_trace(turn, result, sentiment_prompt, reply_prompt, streamed=True)
+    events.put(TurnEvent("done", result))
+
+
+def _run_stream_worker(on_exit, cancel: threading.Event, *args):
+    try:
+        run_cancellable(cancel, *args)
+    finally:
+        if on_exit is not None:
+            on_exit()
+
+
+def stream_turn(user_input: str, user_id: str = "default_user", sentiment_agent=None, replier_agent=None,
+                sentiment_prompt: Optional[str] = None, reply_prompt: Optional[str] = None,
+                classifier_timeout: float = CLASSIFIER_TIMEOUT, sentiment_timeout: float = SENTIMENT_TIMEOUT,
+                reply_timeout: float = REPLY_TIMEOUT, cancel: Optional[threading.Event] = None,
+                on_exit: Optional[Callable[[], None]] = None) -> Iterator[TurnEvent]:
+    """
+    Streaming variant of run_turn(). Yields TurnEvent objects as they happen:
+    the classifier result, tool-call status updates, reply tokens and finally a
+    "done" event carrying the TurnResult. The replier is streamed on a worker
+    thread so the caller only blocks while waiting for the next event.
+
+    The classifier result comes first: token and status events that arrive
+    before it are held back for at most CLASSIFIER_GRACE. Setting `cancel`
+    (or closing the generator early) aborts the turn's in-flight model and
+    search calls; the "done" event then has cancelled=True. on_exit is called
+    from the worker thread once the turn has really stopped, which can be
+    after the generator was closed (e.g. to release an admission slot), or
+    here if the turn fails before the worker starts.
+    """
+    try:
+        sentiment_agent, replier_agent = _default_agents(sentiment_agent, replier_agent)
+        sentiment_prompt = sentiment_prompt or f"Analyze the sentiment of this message and store it: {user_input}"
+        reply_prompt = reply_prompt or user_input
+        turn = TurnState(user_input=user_input, user_id=str(user_id), classifier_grace=CLASSIFIER_GRACE)
+        begin_trace(turn)
+        events = queue.Queue()
+        cancel = cancel or threading.Event()
+
+        ctx = copy_context()
+        worker = threading.Thread(
+            target=ctx.run,
+            args=(_run_stream_worker, on_exit, cancel, _stream_worker, turn, sentiment_agent, replier_agent,
+                  sentiment_prompt, reply_prompt, events, classifier_timeout, sentiment_timeout, reply_timeout, cancel),
+            name="turn-stream",
+            daemon=True,
+        )
+        worker.start()
+    except BaseException:
+        # No worker to call on_exit, so call it here.
+        if on_exit is not None:
+            on_exit()
+        raise
+
+    deadline = turn.started_at + max(reply_timeout, sentiment_timeout)
+    release_at = turn.started_at + CLASSIFIER_GRACE
+    partial, held = [], []
+    finished = False
+    try:
+        while True:
+            now = time.perf_counter()
+            if held is not None and now >= release_at:
+                yield from held
+                held = None
+            timeout = deadline - now
+            if held is not None:
+                timeout = min(timeout, release_at - now)
+            try:
+                event = events.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                if held is not None and time.perf_counter() < deadline:
+                    continue
+                yield TurnEvent("error", {"stage": "replier_agent", "error": "timed out"})
+                sentiment = turn.sentiment or {"label": "NEUTRAL", "score": 0.5}
+                finished = True
+                yield TurnEvent("done", TurnResult(
+                    response_text=''.join(partial) or FALLBACK_REPLY,
+                    sentiment_type=sentiment["label"],
+                    sentiment_score=sentiment["score"],
+                    errors={"replier_agent": "timed out"},
+                    total_seconds=time.perf_counter() - turn.started_at,
+                    sentiment_fed_to_replier=turn.sentiment_in_prompt,
+                ))
+                return
+            if event.kind == "token":
+                partial.append(event.data)
+            if held is not None and event.kind in ("token", "status"):
+                held.append(event)
+                continue
+            if event.kind == "sentiment" and held is not None:
+                yield event
+                yield from held
+                held = None
+                continue
+            if held:
+                yield from held
+            held = None
+            if event.kind == "done":
+                finished = True
+            yield event
+            if finished:
+                return
+    finally:
+        if not finished:
+            # The consumer stopped listening before the turn finished.
+            cancel.set()
+
+
+def get_streaming_stats() -> dict:
+    """Helper function to get time-to-first-token statistics for streamed replies."""
+    samples = sorted(_ttft_samples)
+    if not samples:
+        return {"count": 0, "ttft_p50_ms": 0.0, "ttft_p95_ms": 0.0}
+    return {
+        "count": len(samples),
+        "ttft_p50_ms": samples[len(samples) // 2] * 1000,
+        "ttft_p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    }
+
+
+metrics.register_collector("streaming", get_streaming_stats)
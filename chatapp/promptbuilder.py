@@ -0,0 +1,158 @@
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional
+from chatapp.tokens import count_tokens, truncate_to_tokens
+
+# Recent per-call reports, newest last.
+_reports = deque(maxlen=200)
+_reports_lock = Lock()
+
+
+@dataclass
+class PromptSection:
+    """A block of the prompt. Items are ordered oldest first; trimming drops the oldest."""
+    name: str
+    items: List[str]
+    title: Optional[str] = None
+    priority: int = 0
+    budget: Optional[int] = None
+    static: bool = False
+    empty_text: str = ""
+
+
+@dataclass
+class PromptReport:
+    """Token accounting for one assembled prompt."""
+    prompt_name: str
+    section_tokens: Dict[str, int] = field(default_factory=dict)
+    dropped_items: Dict[str, int] = field(default_factory=dict)
+    static_tokens: int = 0
+    total_tokens: int = 0
+    budget: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "prompt_name": self.prompt_name,
+            "section_tokens": dict(self.section_tokens),
+            "dropped_items": dict(self.dropped_items),
+            "static_tokens": self.static_tokens,
+            "total_tokens": self.total_tokens,
+            "budget": self.budget,
+        }
+
+
+class PromptBuilder:
+    """
+    Assemble a prompt from sections with per-section token budgets.
+
+    Static sections are emitted first and never trimmed, so the prompt prefix
+    stays byte-identical across turns and provider-side prompt caching can
+    reuse it. Dynamic sections follow in the order they were added (least
+    volatile first). Each dynamic section is cut to its own budget by dropping
+    its oldest items; if the dynamic total still exceeds max_tokens, the
+    lowest-priority sections are cut further.
+    """
+
+    def __init__(self, name: str, max_tokens: Optional[int] = None):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.sections: List[PromptSection] = []
+
+    def add_static(self, name: str, text: str) -> "PromptBuilder":
+        self.sections.append(PromptSection(name=name, items=[text], static=True))
+        return self
+
+    def add_section(self, name: str, items: List[str], title: Optional[str] = None,
+                    priority: int = 0, budget: Optional[int] = None,
+                    empty_text: str = "") -> "PromptBuilder":
+        self.sections.append(PromptSection(
+            name=name, items=list(items), title=title, priority=priority,
+            budget=budget, empty_text=empty_text,
+        ))
+        return self
+
+    @staticmethod
+    def _render(section: PromptSection, items: List[str]) -> str:
+        body = "\n".join(items) if items else section.empty_text
+        if section.title:
+            return f"{section.title}:\n{body}\n"
+        return body
+
+    def _fit(self, section: PromptSection, items: List[str], budget: int):
+        """Drop oldest items until the section fits; truncate the last survivor if needed."""
+        # Every item costs at least a token, so no more than `budget` of the newest can fit;
+        # past that, binary-search how many of the oldest to drop instead of re-counting once per item.
+        if not items or (len(items) <= budget and count_tokens(self._render(section, items)) <= budget):
+            return items, 0
+        high = len(items) - 1
+        low = min(max(1, len(items) - max(budget, 1)), high)
+        while low < high:
+            middle = (low + high) // 2
+            if count_tokens(self._render(section, items[middle:])) <= budget:
+                high = middle
+            else:
+                low = middle + 1
+        dropped = low
+        items = items[low:]
+        if len(items) == 1 and count_tokens(self._render(section, items)) > budget:
+            overhead = count_tokens(self._render(section, [""]))
+            items = [truncate_to_tokens(items[0], budget - overhead, keep="tail")]
+            if not items[0]:
+                items, dropped = [], dropped + 1
+        return items, dropped
+
+    def build(self) -> tuple:
+        """
+        Build the prompt text.
+        Returns:
+            (prompt, PromptReport)
+        """
+        report = PromptReport(prompt_name=self.name, budget=self.max_tokens)
+        kept = {}
+        for section in self.sections:
+            items = section.items
+            dropped = 0
+            if not section.static and section.budget is not None:
+                items, dropped = self._fit(section, items, section.budget)
+            kept[section.name] = items
+            report.dropped_items[section.name] = dropped
+
+        if self.max_tokens is not None:
+            dynamic = [s for s in self.sections if not s.static]
+            total = sum(count_tokens(self._render(s, kept[s.name])) for s in dynamic)
+            for section in sorted(dynamic, key=lambda s: s.priority):
+                if total <= self.max_tokens:
+                    break
+                current = count_tokens(self._render(section, kept[section.name]))
+                floor = count_tokens(self._render(section, []))
+                allowed = max(floor, current - (total - self.max_tokens))
+                items, dropped = self._fit(section, kept[section.name], allowed)
+                kept[section.name] = items
+                report.dropped_items[section.name] += dropped
+                total += count_tokens(self._render(section, items)) - current
+
+        parts = []
+        for section in self.sections:
+            text = self._render(section, kept[section.name])
+            tokens = count_tokens(text)
+            report.section_tokens[section.name] = tokens
+            if section.static:
+                report.static_tokens += tokens
+            parts.append(text)
+        prompt = "\n".join(parts)
+        report.total_tokens = count_tokens(prompt)
+        return prompt, report
+
+
+def record_report(report: PromptReport):
+    """Helper function to keep a per-call prompt report."""
+    with _reports_lock:
+        _reports.append(report)
+
+
+def get_prompt_reports(limit: int = 20) -> List[dict]:
+    """Helper function to get the most recent per-call prompt reports."""
+    with _reports_lock:
+        recent = list(_reports)[-limit:]
+    return [r.to_dict() for r in recent]
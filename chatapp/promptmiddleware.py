@@ -1,96 +1,314 @@
-from chatapp.memory.shorttermmemory import get_chats_from_memory
-from chatapp.memory.longtermmemory import store
-from chatapp.memory.summarymemory import get_summaries
+from chatapp.memory.shorttermmemory import get_chat_records, get_memory_version
+from chatapp.memory.longtermmemory import store, get_profile_version
+from chatapp.memory.summarymemory import get_summary_records, get_summary_version
+from chatapp.memory.sessiondigest import get_digest_tail, get_digest_version
+import hashlib
 import json
-from chatapp.memory.longtermmemory import Context
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
 from langchain.agents.middleware import dynamic_prompt,ModelRequest
+from chatapp.promptbuilder import PromptBuilder, PromptReport, record_report
+from chatapp.records import SummaryRecord
+from chatapp.metrics import metrics
+from chatapp.tokens import count_tokens
+from chatapp.turn import current_user_id, get_current_turn
+from settings import config
 
+# Rendered memory blocks, keyed by (variant, user_id) -> (version tuple, (text, report)).
+# Only the latest version per user is kept, and the least recently used users
+# are evicted past PROMPT_CONTEXT_CACHE_SIZE entries.
+_context_cache = OrderedDict()
+_context_cache_lock = Lock()
+_render_stats = {"hits": 0, "misses": 0, "pinned_hits": 0, "render_seconds": 0.0}
 
-@dynamic_prompt
-def inject_memory_replier(Request:ModelRequest) -> str:
-    """
-    Dynamically inject short-term and long-term memory into the prompt.
-    """
-    prompt = '''
-    You are a helpful conversational assistant. Your role is to:
-        1. Provide helpful, contextual responses to user queries
-        2. Use web search when you need current information
-        3. Reference conversation history and user preferences from memory
-        4. Be friendly, helpful, and engaging
-        5. maintain your assistant memory for every chat
-        Always consider the user's emotional state and conversation history when responding.
-        Use web search for factual queries or current events.
+# Per-turn snapshot shared by every agent that runs inside `turn_snapshot()`.
+_turn_snapshot: ContextVar = ContextVar("turn_snapshot", default=None)
+
+
+def resolve_user_id(request: ModelRequest = None):
+    """Helper function to get the user id from the agent runtime context."""
+    runtime = getattr(request, "runtime", None) if request is not None else None
+    context = getattr(runtime, "context", None)
+    if isinstance(context, dict) and context.get("user_id"):
+        return context["user_id"]
+    if getattr(context, "user_id", None):
+        return context.user_id
+    return current_user_id()
+
+
+def memory_versions(user_id) -> tuple:
+    """Helper function to get the (short-term, summary, long-term, digest) version tuple."""
+    return (get_memory_version(user_id), get_summary_version(user_id), get_profile_version(user_id),
+            get_digest_version(user_id))
 
-'''
-    chats = get_chats_from_memory()
-    short_term = json.dumps([chat.model_dump() for chat in chats]) if chats else "No recent conversations"
 
-    summaries_list = get_summaries()
-    summaries = json.dumps([s.model_dump() for s in summaries_list]) if summaries_list else "No summaries available"
+# Token budgets for the volatile memory sections. Sections are listed from
+# least to most volatile so the rendered prompt changes as late as possible.
+# The short-term section uses the same budget that triggers summarization, so a
+# full window always fits.
+AGENT_SECTION_BUDGETS = {"long_term": 300, "summaries": 600, "short_term": config.SHORT_TERM_TOKEN_BUDGET}
+AGENT_MEMORY_BUDGET = sum(AGENT_SECTION_BUDGETS.values())
+GLOBAL_SECTION_BUDGETS = {"digest": 800, "summaries": 1200, "short_term": config.SHORT_TERM_TOKEN_BUDGET}
+GLOBAL_MEMORY_BUDGET = sum(GLOBAL_SECTION_BUDGETS.values())
+# Higher priority sections survive longer when the total budget is exceeded.
+SECTION_PRIORITIES = {"short_term": 3, "long_term": 2, "digest": 2, "summaries": 1}
 
-    user_id = getattr(Context, 'user_id', 'default_user')
+
+def _chat_items(chats) -> list:
+    return [json.dumps(chat.as_dict()) for chat in chats]
+
+
+def _summary_items(summaries) -> list:
+    return [json.dumps(s.as_dict()) for s in summaries]
+
+
+def _render_agent_memory(user_id):
     long_term_item = store.get(("users",), user_id)
-    long_term = json.dumps(long_term_item.value) if long_term_item and long_term_item.value else "No long-term memory"
+    long_term = [json.dumps(long_term_item.value)] if long_term_item and long_term_item.value else []
 
-    enhanced_prompt = f"""{prompt}
+    builder = PromptBuilder("agent_memory", max_tokens=AGENT_MEMORY_BUDGET)
+    builder.add_section(
+        "long_term", long_term, title="Long-term Memory (user profile & preferences)",
+        priority=SECTION_PRIORITIES["long_term"], budget=AGENT_SECTION_BUDGETS["long_term"],
+        empty_text="No long-term memory",
+    )
+    builder.add_section(
+        "summaries", _summary_items(get_summary_records(user_id)[:5]), title="Summary Memory (conversation summaries)",
+        priority=SECTION_PRIORITIES["summaries"], budget=AGENT_SECTION_BUDGETS["summaries"],
+        empty_text="No summaries available",
+    )
+    builder.add_section(
+        "short_term", _chat_items(get_chat_records(user_id)), title="Short-term Memory (recent conversations)",
+        priority=SECTION_PRIORITIES["short_term"], budget=AGENT_SECTION_BUDGETS["short_term"],
+        empty_text="No recent conversations",
+    )
+    return builder.build()
 
-CONTEXT MEMORY:
 
-Short-term Memory (recent 5 conversations):
-{short_term}
+def _render_global_memory(user_id):
+    builder = PromptBuilder("global_memory", max_tokens=GLOBAL_MEMORY_BUDGET)
+    if config.SESSION_DIGEST_ENABLED:
+        # The digest covers every folded window; only the tail is listed separately.
+        digest, tail = get_digest_tail(user_id)
+        tail = [SummaryRecord.from_model(entry) for entry in tail]
+        digest_items = [json.dumps({"summary": digest.summary, "general_mood": digest.general_mood,
+                                    "windows": digest.windows})] if digest.windows else []
+        builder.add_section(
+            "digest", digest_items, title="Session Digest (all earlier conversation windows)",
+            priority=SECTION_PRIORITIES["digest"], budget=GLOBAL_SECTION_BUDGETS["digest"],
+            empty_text="No session digest yet",
+        )
+    else:
+        tail = get_summary_records(user_id)
+    builder.add_section(
+        "summaries", _summary_items(tail), title="Summary Memory (conversation summaries)",
+        priority=SECTION_PRIORITIES["summaries"], budget=GLOBAL_SECTION_BUDGETS["summaries"],
+        empty_text="No summaries available",
+    )
+    builder.add_section(
+        "short_term", _chat_items(get_chat_records(user_id)), title="Short-term Memory (recent conversations)",
+        priority=SECTION_PRIORITIES["short_term"], budget=GLOBAL_SECTION_BUDGETS["short_term"],
+        empty_text="No recent conversations",
+    )
+    return builder.build()
 
-Summary Memory (conversation summaries):
-{summaries}
 
-Long-term Memory (user profile & preferences):
-{long_term}
+_RENDERERS = {
+    "agent": _render_agent_memory,
+    "global": _render_global_memory,
+}
 
-Please respond considering both the recent conversation context and the user's long-term preferences.
-"""
-    
-    return enhanced_prompt
 
-@dynamic_prompt
-def inject_memory_sentiment(Request:ModelRequest) -> str:
+def _memory_block(variant: str, user_id) -> tuple:
+    snapshot = _turn_snapshot.get()
+    if snapshot is not None and (variant, user_id) in snapshot:
+        with _context_cache_lock:
+            _render_stats["pinned_hits"] += 1
+        return snapshot[(variant, user_id)]
+
+    versions = memory_versions(user_id)
+    with _context_cache_lock:
+        cached = _context_cache.get((variant, user_id))
+        if cached is not None and cached[0] == versions:
+            _render_stats["hits"] += 1
+            _context_cache.move_to_end((variant, user_id))
+            block = cached[1]
+        else:
+            block = None
+
+    if block is None:
+        start = time.perf_counter()
+        block = _RENDERERS[variant](user_id)
+        elapsed = time.perf_counter() - start
+        metrics.observe("prompt_render_seconds", elapsed, variant=variant)
+        with _context_cache_lock:
+            _context_cache[(variant, user_id)] = (versions, block)
+            _context_cache.move_to_end((variant, user_id))
+            while len(_context_cache) > config.PROMPT_CONTEXT_CACHE_SIZE:
+                _context_cache.popitem(last=False)
+            _render_stats["misses"] += 1
+            _render_stats["render_seconds"] += elapsed
+
+    if snapshot is not None:
+        snapshot[(variant, user_id)] = block
+    return block
+
+
+def render_memory_context(variant: str, user_id) -> str:
     """
-    Dynamically inject short-term and long-term memory into the prompt.
+    Render a memory context block, reusing the cached copy until a memory version changes.
+    Args:
+        variant: "agent" for the sentiment/replier block, "global" for the analyzer block.
+        user_id: The user whose long-term profile is included.
+    Returns:
+        The rendered memory block.
     """
-    prompt = '''
-     You are a sentiment analysis specialist. Your role is to:
-        1. Analyze the sentiment of user messages using the analyze_sentiment tool
-        2. Store conversations in short-term memory with sentiment scores
-        3. When appropriate, save important user information to long-term memory
-        4. Provide sentiment insights and emotional context
-        Always use the sentiment analysis tool first, then store the conversation with sentiment data.
-        Be empathetic and understanding in your responses.
-    '''
-    chats = get_chats_from_memory()
-    short_term = json.dumps([chat.model_dump() for chat in chats]) if chats else "No recent conversations"
-
-    summaries_list = get_summaries()
-    summaries = json.dumps([s.model_dump() for s in summaries_list]) if summaries_list else "No summaries available"
-
-    user_id = getattr(Context, 'user_id', 'default_user')
-    long_term_item = store.get(("users",), user_id)
-    long_term = json.dumps(long_term_item.value) if long_term_item and long_term_item.value else "No long-term memory"
+    return _memory_block(variant, user_id)[0]
 
-    enhanced_prompt = f"""{prompt}
 
-CONTEXT MEMORY:
+def memory_fingerprint(variant: str, user_id) -> str:
+    """
+    Content hash of the rendered memory block. Unlike the version tuple it is
+    stable across processes, so it can key persistent caches.
+    """
+    memory, _ = _memory_block(variant, user_id)
+    return hashlib.sha256(memory.encode("utf-8")).hexdigest()[:16]
+
+
+def build_prompt(prompt_name: str, instructions: str, variant: str, user_id) -> str:
+    """
+    Assemble a system prompt: static instructions first, volatile memory last.
+    Args:
+        prompt_name: Name used in the per-call report.
+        instructions: The static part of the prompt (identical on every call).
+        variant: Which memory block to append.
+        user_id: The user whose memory is included.
+    Returns:
+        The full system prompt.
+    """
+    memory, memory_report = _memory_block(variant, user_id)
+    static_tokens = count_tokens(instructions)
+    report = PromptReport(
+        prompt_name=prompt_name,
+        section_tokens={"instructions": static_tokens, **memory_report.section_tokens},
+        dropped_items=dict(memory_report.dropped_items),
+        static_tokens=static_tokens,
+        total_tokens=static_tokens + memory_report.total_tokens,
+        budget=memory_report.budget,
+    )
+    record_report(report)
+    return f"{instructions}\n{memory}"
+
+
+@contextmanager
+def turn_snapshot():
+    """
+    Pin the rendered memory context for the duration of one turn so that every
+    agent invoked inside the block sees (and reuses) the same snapshot.
+    """
+    token = _turn_snapshot.set({})
+    try:
+        yield
+    finally:
+        _turn_snapshot.reset(token)
+
+
+def get_render_stats() -> dict:
+    """Helper function to get memory-context cache hit/miss counts and render time."""
+    with _context_cache_lock:
+        stats = dict(_render_stats)
+        stats["cached_blocks"] = len(_context_cache)
+    lookups = stats["hits"] + stats["misses"] + stats["pinned_hits"]
+    stats["hit_rate"] = (stats["hits"] + stats["pinned_hits"]) / lookups if lookups else 0.0
+    stats["avg_render_ms"] = stats["render_seconds"] * 1000 / stats["misses"] if stats["misses"] else 0.0
+    return stats
+
+
+def clear_render_cache():
+    """Helper function to drop all cached memory-context blocks."""
+    with _context_cache_lock:
+        _context_cache.clear()
+
+
+metrics.register_collector("memory_context", get_render_stats)
+
 
-Short-term Memory (recent 5 conversations):
-{short_term}
+REPLIER_INSTRUCTIONS = """
+You are a helpful conversational assistant. Your role is to:
+    1. Provide helpful, contextual responses to user queries
+    2. Use web search when you need current information
+    3. Reference conversation history and user preferences from memory
+    4. Be friendly, helpful, and engaging
+    5. maintain your assistant memory for every chat
+    Always consider the user's emotional state and conversation history when responding.
+    Use web search for factual queries or current events.
 
-Summary Memory (conversation summaries):
-{summaries}
+Please respond considering both the recent conversation context and the user's long-term preferences.
 
-Long-term Memory (user profile & preferences):
-{long_term}
+CONTEXT MEMORY:
+"""
+
+SENTIMENT_INSTRUCTIONS = """
+You are a sentiment analysis specialist. Your role is to:
+    1. Analyze the sentiment of user messages using the analyze_sentiment tool
+    2. Store conversations in short-term memory with sentiment scores
+    3. Provide sentiment insights and emotional context
+    Always use the sentiment analysis tool first, then store the conversation with sentiment data.
+    Be empathetic and understanding in your responses.
 
 Please respond considering both the recent conversation context and the user's long-term preferences.
+
+CONTEXT MEMORY:
+"""
+
+GLOBAL_INSTRUCTIONS = """
+You are a global conversation analyzer. Your role is to:
+    1. Analyze overall conversation patterns and sentiment trends
+    2. Provide comprehensive summaries of user interactions
+    3. Generate final sentiment analysis based on entire conversation history
+    4. Identify key insights about user preferences, mood patterns, and topics of interest
+    When a conversation session ends, provide a thoughtful summary including:
+    - Overall sentiment trend
+    - Key topics discussed
+    - User's emotional journey
+    - Important preferences or information learned
 """
-    
-    return enhanced_prompt
+
+
+def _current_sentiment_hint() -> str:
+    """
+    Classifier result for the message being answered, if the turn pipeline has it.
+    Only the first model call of the replier waits (briefly) for it.
+    """
+    turn = get_current_turn()
+    if turn is None:
+        return ""
+    grace = turn.classifier_grace if turn.replier_model_calls == 0 else 0.0
+    turn.replier_model_calls += 1
+    sentiment = turn.wait_for_sentiment(grace)
+    if sentiment is None:
+        return ""
+    turn.sentiment_in_prompt = True
+    return f"\nCurrent message sentiment (classifier): {sentiment['label']} ({sentiment['score']:.2f})\n"
+
+
+@dynamic_prompt
+def inject_memory_replier(Request:ModelRequest) -> str:
+    """
+    Dynamically inject short-term and long-term memory into the prompt.
+    """
+    prompt = build_prompt("replier", REPLIER_INSTRUCTIONS, "agent", resolve_user_id(Request))
+    return prompt + _current_sentiment_hint()
+
+@dynamic_prompt
+def inject_memory_sentiment(Request:ModelRequest) -> str:
+    """
+    Dynamically inject short-term and long-term memory into the prompt.
+    """
+    return build_prompt("sentiment", SENTIMENT_INSTRUCTIONS, "agent", resolve_user_id(Request))
 
 
 @dynamic_prompt
@@ -98,30 +316,4 @@ def inject_global_prompt(Request:ModelRequest) -> str:
     """
     Inject global summaries into the prompt for overall context.
     """
-    prompt = '''
-    You are a global conversation analyzer. Your role is to:
-        1. Analyze overall conversation patterns and sentiment trends
-        2. Provide comprehensive summaries of user interactions
-        3. Generate final sentiment analysis based on entire conversation history
-        4. Identify key insights about user preferences, mood patterns, and topics of interest
-        When a conversation session ends, provide a thoughtful summary including:
-        - Overall sentiment trend
-        - Key topics discussed
-        - User's emotional journey
-        - Important preferences or information learned
-    '''
-    from chatapp.memory.summarymemory import get_all_summaries
-
-    summaries_str = get_all_summaries()
-    short_term = get_chats_from_memory()
-    short_term_str = json.dumps([chat.model_dump() for chat in short_term]) if short_term else "No recent conversations"
-    enhanced_prompt = f"""{prompt}
-    
-Summary Memory (conversation summaries):
-{summaries_str}
-
-Short-term Memory (recent 5 conversations):
-{short_term_str}
-"""
-    
-    return enhanced_prompt
\ No newline at end of file
+    return build_prompt("global", GLOBAL_INSTRUCTIONS, "global", resolve_user_id(Request))
@@ -0,0 +1,172 @@
+"""
+Compact in-memory and stored form of chats, summaries and mood shifts.
+
+The pydantic models in chatapp/models.py validate every field and keep a
+per-instance __dict__, which is what API responses and pages want but costs
+memory and (de)serialization time for memory that is rewritten on every turn
+and can reach millions of chats. Inside the app these are kept instead as
+records: named tuples (immutable, no __dict__, built in C from a decoded row)
+whose labels (sentiment types, moods) are interned when they are decoded, and
+stored as JSON arrays in field order rather than objects, encoded with orjson
+when it is installed (the json module otherwise).
+
+Records convert to the pydantic models with to_model() only where memory
+leaves the app: the public getters in chatapp/memory, the API and the pages.
+Documents written before records existed (one object per entry) still load.
+"""
+import json
+from dataclasses import dataclass, field
+from sys import intern
+from typing import List, NamedTuple, Optional
+
+from chatapp.models import ChatMemory, SummaryEntry, local, moodshift
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value) -> str:
+    """Helper function to encode a document with the fastest codec available."""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, separators=(",", ":"))
+
+
+def loads(data):
+    """Helper function to decode a document written by dumps (or by json.dumps)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+_tuple = tuple.__new__
+
+
+class ChatRecord(NamedTuple):
+    user: str
+    assistant: Optional[str]
+    sentiment_score: float
+    sentiment_type: str
+
+    @classmethod
+    def from_row(cls, row) -> "ChatRecord":
+        if isinstance(row, dict):
+            row = (row["user"], row.get("assistant"), float(row["sentiment_score"]), row["sentiment_type"])
+        return _tuple(cls, (row[0], row[1], row[2], intern(row[3])))
+
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        # The hot path when loading a document: skip the per-row method call for current-format rows.
+        return [_tuple(cls, (row[0], row[1], row[2], intern(row[3]))) if type(row) is list else cls.from_row(row)
+                for row in rows]
+
+    def to_row(self) -> tuple:
+        return tuple(self)
+
+    @classmethod
+    def from_model(cls, chat: ChatMemory) -> "ChatRecord":
+        return cls(chat.user, chat.assistant, chat.sentiment_score, chat.sentiment_type)
+
+    def to_model(self) -> ChatMemory:
+        return ChatMemory.model_construct(**self._asdict())
+
+    def as_dict(self) -> dict:
+        # Same keys in the same order as ChatMemory.model_dump(), so prompt text does not change.
+        return self._asdict()
+
+    def with_assistant(self, assistant: str) -> "ChatRecord":
+        return self._replace(assistant=assistant)
+
+
+class SummaryRecord(NamedTuple):
+    summary: str
+    general_mood: str
+    timestamp: str
+
+    @classmethod
+    def from_row(cls, row) -> "SummaryRecord":
+        if isinstance(row, dict):
+            row = (row["summary"], row["general_mood"], row["timestamp"])
+        return _tuple(cls, (row[0], intern(row[1]), row[2]))
+
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        return [_tuple(cls, (row[0], intern(row[1]), row[2])) if type(row) is list else cls.from_row(row)
+                for row in rows]
+
+    def to_row(self) -> tuple:
+        return tuple(self)
+
+    @classmethod
+    def from_model(cls, entry: SummaryEntry) -> "SummaryRecord":
+        return cls(entry.summary, entry.general_mood, entry.timestamp)
+
+    def to_model(self) -> SummaryEntry:
+        return SummaryEntry.model_construct(**self._asdict())
+
+    def as_dict(self) -> dict:
+        return self._asdict()
+
+
+class MoodShiftRecord(NamedTuple):
+    before: ChatRecord
+    after: ChatRecord
+
+    @classmethod
+    def from_row(cls, row) -> "MoodShiftRecord":
+        if isinstance(row, dict):
+            row = row["moodshift"]["chat"]
+        return _tuple(cls, (ChatRecord.from_row(row[0]), ChatRecord.from_row(row[1])))
+
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        return [cls.from_row(row) for row in rows]
+
+    def to_row(self) -> tuple:
+        return (self.before.to_row(), self.after.to_row())
+
+    def to_model(self) -> moodshift:
+        return moodshift.model_construct(moodshift=local.model_construct(
+            chat=[self.before.to_model(), self.after.to_model()]))
+
+
+def as_chat_record(chat) -> ChatRecord:
+    """Helper function to accept either a ChatRecord or a ChatMemory."""
+    return chat if isinstance(chat, ChatRecord) else ChatRecord.from_model(chat)
+
+
+@dataclass(slots=True)
+class ChatWindow:
+    """The short-term window document: chats oldest first."""
+    chats: List[ChatRecord] = field(default_factory=list)
+    max_chats: int = 5
+    window_started_at: Optional[float] = None
+
+    @classmethod
+    def from_document(cls, document: dict) -> "ChatWindow":
+        return cls(ChatRecord.from_rows(document["chats"]),
+                   document.get("max_chats", 5), document.get("window_started_at"))
+
+    def to_document(self) -> dict:
+        return {"chats": [chat.to_row() for chat in self.chats], "max_chats": self.max_chats,
+                "window_started_at": self.window_started_at}
+
+    def copy(self) -> "ChatWindow":
+        # Records are immutable, so a new list is a full copy.
+        return ChatWindow(list(self.chats), self.max_chats, self.window_started_at)
+
+
+@dataclass(slots=True)
+class SummaryLog:
+    """The summaries document: window summaries oldest first, at most max_summaries."""
+    summaries: List[SummaryRecord] = field(default_factory=list)
+    max_summaries: int = 10
+
+    @classmethod
+    def from_document(cls, document: dict) -> "SummaryLog":
+        return cls(SummaryRecord.from_rows(document["summaries"]), document.get("max_summaries", 10))
+
+    def to_document(self) -> dict:
+        return {"summaries": [entry.to_row() for entry in self.summaries], "max_summaries": self.max_summaries}
@@ -0,0 +1,572 @@
+"""
+Session record/replay for reproducing slow sessions.
+
+With TRACE_RECORD_DIR set, every chat turn of a sampled user (TRACE_RECORD_RATE,
+decided per user so whole sessions are kept) is appended to
+<dir>/<user_id>.jsonl.gz: the turn's input and prompts, every model, search
+and classifier call it made (request fingerprint, stage, start offset,
+duration and response), its stage timings and how the user's stored state
+grew. Calls are captured by thin wrappers around the Gemini chat model, the
+genai client, the Tavily client and the classifier, which only do anything
+while the current turn has a trace; files are written by a background thread.
+
+replay_session() feeds a trace back through the sentiment and replier agents
+with every call answered from the trace instead of the service: by request
+fingerprint first and, when the prompts changed since the recording, by the
+next unused call of the same stage. Turns run one at a time against a fresh
+in-process state backend, with the stages of each turn run one after another
+in a fixed order and background digest folds finished before the next turn,
+so a replay depends only on the trace and the code, and two replays of the
+same trace (e.g. from two commits) can be compared stage by stage. See
+benchmarks/replay.py.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from contextvars import ContextVar
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from chatapp.metrics import metrics
+from chatapp.turn import get_current_stage, get_current_turn
+from settings import config
+
+TRACE_VERSION = 1
+# Replay timing: "none" answers calls at once, "recorded" waits as long as the recorded call took.
+TIMINGS = ("none", "recorded")
+
+# Replays bind their trace here; turns started in this context pick it up.
+_replay: ContextVar = ContextVar("replay", default=None)
+
+
+class ReplayedError(Exception):
+    """A call that failed during recording, raised again on replay (code keeps the HTTP status for retries)."""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+
+def fingerprint(request) -> str:
+    """Helper function to get a short, stable hash of a call's request."""
+    data = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+class TurnRecording:
+    """The calls one turn made while it was recorded."""
+
+    def __init__(self, user_id: str):
+        self.calls = []
+        self.state_before = user_state_bytes(user_id)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, service: str, key: str, seconds: float, response=None, error: Exception = None,
+            partial: bool = False):
+        call = {
+            "service": service,
+            "stage": get_current_stage(),
+            "key": key,
+            "at": round(time.perf_counter() - self._started - seconds, 6),
+            "seconds": round(seconds, 6),
+        }
+        if error is not None:
+            call["error"] = f"{type(error).__name__}: {error}"
+            code = getattr(error, "code", None) or getattr(error, "status_code", None)
+            if isinstance(code, int):
+                call["code"] = code
+        else:
+            call["response"] = response
+        if partial:
+            call["partial"] = True
+        with self._lock:
+            self.calls.append(call)
+
+
+class TurnReplay:
+    """The recorded calls of one turn, served back in place of the services."""
+
+    def __init__(self, calls: List[dict], timing: str = "none", serial: bool = True):
+        if timing not in TIMINGS:
+            raise ValueError(f"Unknown replay timing: {timing}")
+        self.timing = timing
+        # Run the turn's stages one after another, so shared state is written in the same order every time.
+        self.serial = serial
+        self._calls = calls
+        self._used = set()
+        self._by_key, self._by_stage = {}, {}
+        for index, call in enumerate(calls):
+            self._by_key.setdefault((call["service"], call["key"]), deque()).append(index)
+            self._by_stage.setdefault((call["service"], call["stage"]), deque()).append(index)
+        self._lock = threading.Lock()
+        self.stats = {"exact": 0, "by_stage": 0, "missing": 0}
+
+    def _next(self, indexes: Optional[deque]) -> Optional[dict]:
+        while indexes:
+            index = indexes.popleft()
+            if index not in self._used:
+                self._used.add(index)
+                return self._calls[index]
+        return None
+
+    def take(self, service: str, key: str, wait: bool = True) -> Optional[dict]:
+        """The recorded call answering this request, or None if the recording has none left for it."""
+        with self._lock:
+            call, match = self._next(self._by_key.get((service, key))), "exact"
+            if call is None:
+                call, match = self._next(self._by_stage.get((service, get_current_stage()))), "by_stage"
+            if call is None:
+                match = "missing"
+            self.stats[match] += 1
+        if call is not None and wait and self.timing == "recorded":
+            time.sleep(call["seconds"])
+        return call
+
+    @property
+    def unused(self) -> int:
+        return len(self._calls) - len(self._used)
+
+
+def _active_trace():
+    turn = get_current_turn()
+    return turn.trace if turn is not None else None
+
+
+def serial_stages() -> bool:
+    """Helper function to tell the pipeline to run the current turn's stages inline (deterministic replays)."""
+    trace = _active_trace()
+    return isinstance(trace, TurnReplay) and trace.serial
+
+
+def _replayed(recorded: dict, decode: Optional[Callable]):
+    if "error" in recorded:
+        raise ReplayedError(recorded["error"], recorded.get("code"))
+    return decode(recorded["response"]) if decode else recorded["response"]
+
+
+def traced_call(service: str, request, call: Callable, encode: Callable = None, decode: Callable = None):
+    """
+    Helper function to make one external call under the current turn's trace.
+    Args:
+        service: "gemini", "genai", "tavily" or "classifier".
+        request: What identifies the call (hashed into its fingerprint).
+        call: Makes the real call.
+        encode: Turns the result into JSON-serializable data for the trace.
+        decode: Turns the recorded data back into a result.
+    Returns:
+        The call's result: recorded if the turn is recorded, served from the
+        trace if it is replayed (the real call if the trace has none left).
+    """
+    trace = _active_trace()
+    if trace is None:
+        return call()
+    key = fingerprint(request)
+    if isinstance(trace, TurnReplay):
+        recorded = trace.take(service, key)
+        return call() if recorded is None else _replayed(recorded, decode)
+    start = time.perf_counter()
+    try:
+        result = call()
+    except Exception as e:
+        trace.add(service, key, time.perf_counter() - start, error=e)
+        raise
+    trace.add(service, key, time.perf_counter() - start, encode(result) if encode else result)
+    return result
+
+
+def traced_stream(service: str, request, stream: Callable[[], Iterator], encode: Callable,
+                  decode: Callable) -> Iterator:
+    """Streaming variant of traced_call(): each chunk is recorded with its offset and replayed in order."""
+    trace = _active_trace()
+    if trace is None:
+        yield from stream()
+        return
+    key = fingerprint(request)
+    if isinstance(trace, TurnReplay):
+        recorded = trace.take(service, key, wait=False)
+        if recorded is None:
+            yield from stream()
+            return
+        chunks, started = _replayed(recorded, None), time.perf_counter()
+        for offset, chunk in chunks:
+            if trace.timing == "recorded":
+                time.sleep(max(0.0, offset - (time.perf_counter() - started)))
+            yield decode(chunk)
+        return
+    start, chunks = time.perf_counter(), []
+    try:
+        with closing(stream()) as inner:
+            for chunk in inner:
+                chunks.append([round(time.perf_counter() - start, 6), encode(chunk)])
+                yield chunk
+    except GeneratorExit:
+        trace.add(service, key, time.perf_counter() - start, chunks, partial=True)
+        raise
+    except Exception as e:
+        trace.add(service, key, time.perf_counter() - start, error=e)
+        raise
+    trace.add(service, key, time.perf_counter() - start, chunks)
+
+
+def _message_request(message) -> dict:
+    # Tool call ids are random, so only names and arguments identify a request.
+    request = {"type": message.type, "content": message.content}
+    if getattr(message, "tool_calls", None):
+        request["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in message.tool_calls]
+    if message.type == "tool":
+        request["name"] = getattr(message, "name", None)
+    return request
+
+
+def _message_from_dict(data: dict):
+    return messages_from_dict([data])[0]
+
+
+class TracedChatModel(BaseChatModel):
+    """Chat model wrapper whose calls are recorded or replayed with the current turn."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return f"traced-{self.inner._llm_type}"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+    @staticmethod
+    def _request(messages, kwargs: dict) -> dict:
+        return {"messages": [_message_request(m) for m in messages], "kwargs": kwargs}
+
+    @staticmethod
+    def _encode_result(result: ChatResult) -> dict:
+        generation = result.generations[0]
+        return {"message": message_to_dict(generation.message), "generation_info": generation.generation_info}
+
+    @staticmethod
+    def _decode_result(data: dict) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(
+            message=_message_from_dict(data["message"]), generation_info=data.get("generation_info"),
+        )])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return traced_call(
+            "gemini", self._request(messages, kwargs),
+            lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            encode=self._encode_result, decode=self._decode_result,
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        yield from traced_stream(
+            "gemini", self._request(messages, kwargs),
+            lambda: self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            encode=lambda chunk: message_to_dict(chunk.message),
+            decode=lambda data: ChatGenerationChunk(message=_message_from_dict(data)),
+        )
+
+
+def genai_response(data: dict):
+    """Helper function to rebuild a recorded generate_content response (the fields the app reads)."""
+    text = data["text"]
+    return SimpleNamespace(
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))],
+        text=text,
+        usage_metadata=SimpleNamespace(total_token_count=data.get("total_tokens")),
+    )
+
+
+def _genai_data(response) -> dict:
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": response.candidates[0].content.parts[0].text,
+        "total_tokens": getattr(usage, "total_token_count", None),
+    }
+
+
+class _TracedModels:
+    def __init__(self, models):
+        self._models = models
+
+    def generate_content(self, *args, contents=None, **kwargs):
+        return traced_call(
+            "genai", {"args": args, "contents": contents, "kwargs": kwargs},
+            lambda: self._models.generate_content(*args, contents=contents, **kwargs),
+            encode=_genai_data, decode=genai_response,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class TracedGenaiClient:
+    """Proxy for genai.Client whose models.generate_content is recorded or replayed with the current turn."""
+
+    def __init__(self, client):
+        self._client = client
+        self.models = _TracedModels(client.models)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class TracedSearchClient:
+    """Proxy for TavilyClient whose searches are recorded or replayed with the current turn."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def search(self, query: str, **kwargs) -> dict:
+        return traced_call("tavily", {"query": query, "kwargs": kwargs}, lambda: self._client.search(query, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def user_state_bytes(user_id) -> dict:
+    """Helper function to measure a user's stored state: encoded bytes per document name."""
+    from chatapp import state
+    from chatapp.records import dumps
+    from chatapp.memory.longtermmemory import PROFILE_NAMESPACE, SharedStore
+    from chatapp.memory.sessiondigest import DIGEST
+    from chatapp.memory.shorttermmemory import MOOD_SHIFTS, SHORT_TERM
+    from chatapp.memory.summarymemory import HISTORY, SUMMARIES
+
+    sizes = {}
+    for name in (SHORT_TERM, MOOD_SHIFTS, SUMMARIES, HISTORY, DIGEST, SharedStore.document_name(PROFILE_NAMESPACE)):
+        document, version = state.backend.load(user_id, name)
+        sizes[name] = len(dumps(document)) if version else 0
+    return sizes
+
+
+@lru_cache(maxsize=1)
+def code_version() -> str:
+    """Helper function to identify the code a trace was recorded or replayed with (git commit, if available)."""
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=2,
+        )
+        return result.stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def trace_path(directory: str, user_id) -> str:
+    """Helper function to get the trace file of a user."""
+    return os.path.join(directory, re.sub(r"[^\w.-]", "_", str(user_id)) + ".jsonl.gz")
+
+
+class SessionRecorder:
+    """Appends recorded turns to one gzip'd JSON-lines trace per user, on a background thread."""
+
+    def __init__(self, directory: str = "", rate: float = 1.0):
+        self.directory = directory
+        self.rate = rate
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-writer")
+        self._sessions = set()
+        self._stats = {"turns": 0, "calls": 0, "bytes": 0, "write_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.rate > 0
+
+    def sampled(self, user_id) -> bool:
+        return zlib.crc32(str(user_id).encode()) % 10000 < self.rate * 10000
+
+    def begin(self, user_id) -> Optional[TurnRecording]:
+        """A recording for a new turn of user_id, or None if the user is not recorded."""
+        if not self.enabled or not self.sampled(user_id):
+            return None
+        return TurnRecording(user_id)
+
+    def finish(self, turn, result, sentiment_prompt: str, reply_prompt: str, streamed: bool):
+        recording = turn.trace
+        record = {
+            "type": "turn",
+            "recorded_at": time.time(),
+            "input": turn.user_input,
+            "sentiment_prompt": sentiment_prompt,
+            "reply_prompt": reply_prompt,
+            "streamed": streamed,
+            "stage_seconds": result.stage_seconds,
+            "total_seconds": result.total_seconds,
+            "ttft_seconds": result.ttft_seconds,
+            "errors": result.errors,
+            "response_text": result.response_text,
+            "sentiment_type": result.sentiment_type,
+            "sentiment_score": result.sentiment_score,
+            "state_bytes": [recording.state_before, user_state_bytes(turn.user_id)],
+            "calls": recording.calls,
+        }
+        self._writer.submit(self._write, turn.user_id, record)
+
+    def _write(self, user_id: str, record: dict):
+        lines = []
+        if user_id not in self._sessions:
+            self._sessions.add(user_id)
+            lines.append({"type": "session", "version": TRACE_VERSION, "user_id": user_id,
+                          "code_version": code_version(), "stub_mode": config.STUB_MODE, "started_at": time.time()})
+        lines.append(record)
+        data = "".join(json.dumps(line, default=str) + "\n" for line in lines)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with gzip.open(trace_path(self.directory, user_id), "at", encoding="utf-8") as f:
+                f.write(data)
+        except OSError:
+            self._stats["write_errors"] += 1
+            return
+        self._stats["turns"] += 1
+        self._stats["calls"] += len(record["calls"])
+        self._stats["bytes"] += len(data)
+        metrics.inc("trace_turns_recorded_total")
+
+    def flush(self, timeout: float = 10.0):
+        """Wait until every finished turn has been written."""
+        self._writer.submit(lambda: None).result(timeout=timeout)
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+
+recorder = SessionRecorder(config.TRACE_RECORD_DIR, config.TRACE_RECORD_RATE)
+metrics.register_collector("trace_recorder", recorder.stats)
+
+
+def begin_trace(turn):
+    """Helper function to attach a trace to a new turn: the caller's replay, else a recording if enabled."""
+    turn.trace = _replay.get() or recorder.begin(turn.user_id)
+
+
+def finish_trace(turn, result, sentiment_prompt: str, reply_prompt: str, streamed: bool = False):
+    """Helper function to hand a finished turn to the recorder if it was recorded."""
+    if isinstance(turn.trace, TurnRecording):
+        recorder.finish(turn, result, sentiment_prompt, reply_prompt, streamed)
+
+
+def read_trace(path: str) -> Tuple[List[dict], List[dict]]:
+    """
+    Helper function to read a trace file.
+    Returns:
+        (session headers, turns) in file order; one file can hold several sessions of the same user.
+    """
+    sessions, turns = [], []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                (sessions if record["type"] == "session" else turns).append(record)
+    return sessions, turns
+
+
+def _replay_turn(recorded: dict, user_id: str, sentiment_agent, replier_agent):
+    from chatapp.pipeline import run_turn, stream_turn
+
+    kwargs = dict(sentiment_agent=sentiment_agent, replier_agent=replier_agent,
+                  sentiment_prompt=recorded.get("sentiment_prompt"), reply_prompt=recorded.get("reply_prompt"))
+    if not recorded.get("streamed"):
+        return run_turn(recorded["input"], user_id, **kwargs)
+    result = None
+    for event in stream_turn(recorded["input"], user_id, **kwargs):
+        if event.kind == "done":
+            result = event.data
+    return result
+
+
+def _stage_diff(recorded: dict, replayed: dict) -> dict:
+    return {
+        stage: {
+            "recorded": recorded.get(stage),
+            "replayed": replayed.get(stage),
+            "diff": replayed[stage] - recorded[stage] if stage in recorded and stage in replayed else None,
+        }
+        for stage in sorted(set(recorded) | set(replayed))
+    }
+
+
+def replay_session(path: str, timing: str = "none", sentiment_agent=None, replier_agent=None,
+                   track_allocations: bool = False, serial: bool = True) -> dict:
+    """
+    Replay a recorded session through the agents with every call answered from the trace.
+    Args:
+        path: The trace file.
+        timing: "none" to answer calls at once, "recorded" to take as long as the recorded calls.
+        sentiment_agent, replier_agent: The agents to replay through (the app's by default).
+        track_allocations: Also measure Python memory allocated by each turn (tracemalloc; slower).
+        serial: Run each turn's stages one after another (deterministic); False runs them
+            concurrently as in production.
+    Returns:
+        A report with, per turn, recorded and replayed stage times, state growth, call matches and
+        whether the reply and sentiment came out the same.
+    """
+    from chatapp import state
+    from chatapp.memory.sessiondigest import wait_for_folds
+
+    sessions, turns = read_trace(path)
+    user_id = sessions[0]["user_id"] if sessions else "replay_user"
+    previous_backend = state.backend
+    state.backend = state.InProcessBackend()
+    if track_allocations:
+        tracemalloc.start()
+    report_turns = []
+    try:
+        for index, recorded in enumerate(turns):
+            replay = TurnReplay(recorded["calls"], timing, serial)
+            before = user_state_bytes(user_id)
+            allocated = tracemalloc.get_traced_memory()[0] if track_allocations else None
+            token = _replay.set(replay)
+            try:
+                result = _replay_turn(recorded, user_id, sentiment_agent, replier_agent)
+            finally:
+                _replay.reset(token)
+            wait_for_folds()
+            after = user_state_bytes(user_id)
+            recorded_before, recorded_after = recorded["state_bytes"]
+            report_turns.append({
+                "index": index,
+                "input": recorded["input"],
+                "stages": _stage_diff(recorded["stage_seconds"], result.stage_seconds),
+                "total": {"recorded": recorded["total_seconds"], "replayed": result.total_seconds,
+                          "diff": result.total_seconds - recorded["total_seconds"]},
+                "state_delta": {
+                    name: {"recorded": recorded_after.get(name, 0) - recorded_before.get(name, 0),
+                           "replayed": after[name] - before[name]}
+                    for name in after
+                },
+                "allocated_bytes": tracemalloc.get_traced_memory()[0] - allocated if track_allocations else None,
+                "calls": dict(replay.stats, unused=replay.unused),
+                "same_response": result.response_text == recorded["response_text"],
+                "same_sentiment": result.sentiment_type == recorded["sentiment_type"],
+                "errors": result.errors,
+            })
+    finally:
+        state.backend = previous_backend
+        if track_allocations:
+            tracemalloc.stop()
+    return {
+        "trace": os.path.abspath(path),
+        "user_id": user_id,
+        "recorded_code_version": sessions[0].get("code_version") if sessions else None,
+        "code_version": code_version(),
+        "timing": timing,
+        "serial": serial,
+        "turns": report_turns,
+    }
@@ -0,0 +1,410 @@
+"""
+Deadlines, retries, hedging and circuit breaking for calls to Gemini and Tavily.
+
+A turn sets a deadline (`deadline_scope()` / `run_with_deadline()`); it lives in
+a ContextVar, so it follows the turn into worker threads and every call made
+on its behalf. `call_with_resilience(dependency, fn)` then:
+
+- fails fast with CircuitOpenError while the dependency's breaker is open,
+- gives up with DeadlineExceeded once the turn's budget is spent, and with
+  AttemptTimeout (retryable) when one attempt used its whole attempt_timeout,
+- retries retryable errors with full-jitter backoff, but only when the
+  remaining budget still covers the backoff plus a typical (p50) call,
+- optionally sends one hedged duplicate when the first attempt is slower than
+  the dependency's recent p95, and returns whichever finishes first,
+- raises CallCancelled soon after the caller's cancel event (`run_cancellable()`)
+  is set, abandoning the in-flight attempt instead of waiting for it.
+
+An abandoned attempt (and a hedge that lost the race) keeps running on the
+executor until the dependency answers. `track_abandoned()` collects those
+futures, so a caller holding a rate-limit slot can keep it until they finish.
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from chatapp.metrics import metrics
+from settings import config
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_deadline: ContextVar = ContextVar("call_deadline", default=None)
+_cancel: ContextVar = ContextVar("call_cancel", default=None)
+_abandoned: ContextVar = ContextVar("abandoned_calls", default=None)
+# How often a cancellable wait checks the cancel event (seconds).
+CANCEL_POLL = 0.1
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="resilience")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the caller's deadline passes before the call could complete."""
+
+
+class AttemptTimeout(TimeoutError):
+    """Raised when one attempt got its full attempt_timeout and the dependency still did not answer."""
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the dependency while its circuit breaker is open."""
+
+
+class CallCancelled(Exception):
+    """Raised when the work a call was made for has been cancelled (e.g. the client went away)."""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Limit calls in this block to `seconds` from now (never extends an outer deadline)."""
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def run_with_deadline(deadline: Optional[float], fn: Callable, *args, **kwargs):
+    """Run fn with an absolute (time.monotonic) deadline set for every call it makes."""
+    token = _deadline.set(deadline)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _deadline.reset(token)
+
+
+def run_cancellable(cancel: Optional[threading.Event], fn: Callable, *args, **kwargs):
+    """Run fn so that every call it makes stops with CallCancelled once `cancel` is set."""
+    token = _cancel.set(cancel)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _cancel.reset(token)
+
+
+@contextmanager
+def track_abandoned(futures: list):
+    """Append to `futures` the attempts that calls in this block stop waiting for while they still run."""
+    token = _abandoned.set(futures)
+    try:
+        yield futures
+    finally:
+        _abandoned.reset(token)
+
+
+def cancel_event() -> Optional[threading.Event]:
+    """The cancel event bound to the current context, if any."""
+    return _cancel.get()
+
+
+def check_cancelled():
+    """Raise CallCancelled if the current context has been cancelled."""
+    cancel = _cancel.get()
+    if cancel is not None and cancel.is_set():
+        raise CallCancelled("Call cancelled by the caller")
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, or None when no deadline is set."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Helper function to decide whether an error is worth retrying (timeouts, connection errors, 429/5xx)."""
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError, CallCancelled)):
+        return False
+    status = _status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "ReadTimeout", "ConnectTimeout", "ConnectError", "RemoteProtocolError", "ServerError",
+    )
+
+
+class LatencyTracker:
+    """Recent successful call latencies for one dependency."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures, then lets a single
+    trial call through every reset_timeout seconds (half-open) until one succeeds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # This caller becomes the trial call; others keep failing fast until it reports back.
+                self.state = "half_open"
+                return
+            metrics.inc("circuit_rejections_total", dependency=self.name)
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def release_trial(self):
+        """Give back a half-open trial that ended without reaching the dependency (cancelled, local error)."""
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    metrics.inc("circuit_opened_total", dependency=self.name)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+@dataclass
+class ResiliencePolicy:
+    """Retry/hedge settings for one dependency."""
+    max_attempts: int = 3
+    base_delay: float = 0.25
+    max_delay: float = 4.0
+    hedge: bool = False
+    # Never hedge sooner than this, even when p95 is lower.
+    min_hedge_delay: float = 0.05
+    # Longest one attempt may take. Only a timeout after the full attempt_timeout counts against the
+    # breaker; running out of the caller's (shorter) deadline says nothing about the dependency.
+    attempt_timeout: Optional[float] = None
+
+
+class Dependency:
+    """Breaker, latency history and policy for one external service."""
+
+    def __init__(self, name: str, policy: ResiliencePolicy, breaker: CircuitBreaker):
+        self.name = name
+        self.policy = policy
+        self.breaker = breaker
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.policy.hedge:
+            return None
+        p95 = self.latency.percentile(95)
+        return None if p95 is None else max(p95, self.policy.min_hedge_delay)
+
+    def stats(self) -> dict:
+        return {
+            "circuit_open": self.breaker.state == "open",
+            "p50_ms": (self.latency.percentile(50) or 0.0) * 1000,
+            "p95_ms": (self.latency.percentile(95) or 0.0) * 1000,
+        }
+
+
+_dependencies = {}
+
+
+def register_dependency(name: str, policy: ResiliencePolicy, failure_threshold: int = 5,
+                        reset_timeout: float = 30.0) -> Dependency:
+    dependency = Dependency(name, policy, CircuitBreaker(name, failure_threshold, reset_timeout))
+    _dependencies[name] = dependency
+    metrics.register_collector(f"dependency_{name}", dependency.stats)
+    return dependency
+
+
+def get_dependency(name: str) -> Dependency:
+    return _dependencies[name]
+
+
+def _timed_call(dependency: Dependency, fn: Callable, args, kwargs):
+    start = time.monotonic()
+    result = fn(*args, **kwargs)
+    dependency.latency.record(time.monotonic() - start)
+    return result
+
+
+def _abandon(dependency: Dependency, futures):
+    running = [future for future in futures if not future.done()]
+    if not running:
+        return
+    metrics.inc("calls_abandoned_total", len(running), dependency=dependency.name)
+    tracked = _abandoned.get()
+    if tracked is not None:
+        tracked.extend(running)
+
+
+def _left(ends_at: Optional[float]) -> Optional[float]:
+    return None if ends_at is None else ends_at - time.monotonic()
+
+
+def _attempt(dependency: Dependency, fn: Callable, args, kwargs, hedge: bool):
+    """One attempt (plus an optional hedge), bounded by the attempt timeout, the current deadline and cancel event."""
+    limit = dependency.policy.attempt_timeout
+    remaining = remaining_time()
+    full_attempt = limit is not None and (remaining is None or remaining >= limit)
+    if full_attempt:
+        remaining = limit
+    ends_at = None if remaining is None else time.monotonic() + remaining
+    hedge_delay = dependency.hedge_delay() if hedge else None
+    cancel = _cancel.get()
+    if remaining is None and hedge_delay is None and cancel is None:
+        # Nothing to bound, race or abandon, so skip the thread hop.
+        return _timed_call(dependency, fn, args, kwargs)
+    primary = _executor.submit(copy_context().run, _timed_call, dependency, fn, args, kwargs)
+    futures = {primary}
+    if hedge_delay is not None and (remaining is None or remaining > hedge_delay):
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done:
+            metrics.inc("hedged_requests_total", dependency=dependency.name)
+            futures.add(_executor.submit(copy_context().run, _timed_call, dependency, fn, args, kwargs))
+            remaining = _left(ends_at)
+
+    first_error = None
+    try:
+        while futures:
+            timeout = None if remaining is None else max(0.0, remaining)
+            if cancel is not None:
+                timeout = CANCEL_POLL if timeout is None else min(timeout, CANCEL_POLL)
+            done, futures = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                check_cancelled()
+                remaining = _left(ends_at)
+                if remaining is None or remaining > 0:
+                    continue
+                if full_attempt:
+                    raise AttemptTimeout(f"{dependency.name} did not answer within {limit:.1f}s")
+                raise DeadlineExceeded(f"{dependency.name} call exceeded the deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        metrics.inc("hedge_wins_total", dependency=dependency.name)
+                    return future.result()
+                first_error = first_error or future.exception()
+            remaining = _left(ends_at)
+    finally:
+        # Deadline, cancel or a hedge win: whatever is still running is left behind.
+        _abandon(dependency, futures)
+    raise first_error
+
+
+def call_with_resilience(name: str, fn: Callable, *args, hedge: Optional[bool] = None, **kwargs):
+    """
+    Call fn(*args, **kwargs) against dependency `name` with the breaker, the
+    current deadline, budget-aware retries and (optionally) hedging.
+    Args:
+        name: Registered dependency name ("gemini", "tavily").
+        fn: The call to make; it must be safe to repeat.
+        hedge: Override the dependency's hedging setting for this call.
+    """
+    dependency = _dependencies[name]
+    policy = dependency.policy
+    hedge = policy.hedge if hedge is None else hedge
+    attempt = 0
+    while True:
+        attempt += 1
+        check_cancelled()
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            metrics.inc("deadline_exceeded_total", dependency=name)
+            raise DeadlineExceeded(f"No time left for {name} call")
+        dependency.breaker.before_call()
+        try:
+            result = _attempt(dependency, fn, args, kwargs, hedge)
+        except DeadlineExceeded:
+            # The caller's budget ran out before the dependency had its full attempt_timeout (a slow
+            # dependency surfaces as AttemptTimeout below). Neutral, like a cancel: give back a trial.
+            dependency.breaker.release_trial()
+            metrics.inc("deadline_exceeded_total", dependency=name)
+            raise
+        except CallCancelled:
+            # Abandoned by the caller; says nothing about the dependency's health, but a
+            # half-open trial has to be given back or the breaker never leaves half_open.
+            dependency.breaker.release_trial()
+            metrics.inc("calls_cancelled_total", dependency=name)
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                if _status(e) is not None:
+                    # The service answered (e.g. a 400), so it is up.
+                    dependency.breaker.record_success()
+                else:
+                    # A local error (bad arguments, a scheduler timeout): the service was never judged.
+                    dependency.breaker.release_trial()
+                raise
+            dependency.breaker.record_failure()
+            if attempt >= policy.max_attempts:
+                raise
+            backoff = random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** (attempt - 1)))
+            remaining = remaining_time()
+            typical = dependency.latency.percentile(50) or 0.0
+            if remaining is not None and remaining < backoff + typical:
+                metrics.inc("retries_skipped_total", dependency=name)
+                raise
+            metrics.inc("retries_total", dependency=name)
+            cancel = _cancel.get()
+            if cancel is not None:
+                cancel.wait(backoff)
+            else:
+                time.sleep(backoff)
+            continue
+        dependency.breaker.record_success()
+        return result
+
+
+gemini = register_dependency(
+    "gemini",
+    ResiliencePolicy(max_attempts=config.GEMINI_MAX_ATTEMPTS, hedge=config.GEMINI_HEDGE,
+                     attempt_timeout=config.GEMINI_ATTEMPT_TIMEOUT),
+    failure_threshold=config.BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=config.BREAKER_RESET_TIMEOUT,
+)
+tavily = register_dependency(
+    "tavily",
+    ResiliencePolicy(max_attempts=config.TAVILY_MAX_ATTEMPTS, hedge=config.TAVILY_HEDGE,
+                     attempt_timeout=config.TAVILY_ATTEMPT_TIMEOUT),
+    failure_threshold=config.BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=config.BREAKER_RESET_TIMEOUT,
+)
@@ -0,0 +1,333 @@
+"""
+Central scheduler for Gemini calls.
+
+Every model call (the LangChain `llm` through ScheduledChatModel, the raw genai
+client used by summarize_memory through ScheduledGenaiClient) acquires a slot
+from one ModelCallScheduler before it is sent. The scheduler enforces shared
+requests-per-minute and tokens-per-minute token buckets and grants slots in
+priority order (interactive > sentiment > summary > analytics), with a
+concurrency cap per class. Background classes also leave headroom in the
+buckets so a burst of summaries cannot use up the quota interactive turns need.
+
+The slot is taken before call_with_resilience and held across its retries, so
+queue time stays out of the latency percentiles that drive hedging and retry
+budgets, and a queue timeout is never reported to the circuit breaker. It is
+only given back once every request sent under it has finished: an attempt the
+caller gave up on (deadline, cancel, a losing hedge) still runs against the
+quota, so it keeps counting against the class's concurrency cap.
+"""
+import itertools
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from chatapp.metrics import metrics
+from chatapp.resilience import (
+    CANCEL_POLL, DeadlineExceeded, call_with_resilience, cancel_event, check_cancelled, remaining_time,
+    track_abandoned,
+)
+from chatapp.tokens import count_tokens
+from settings import config
+
+PRIORITIES = {"interactive": 0, "sentiment": 1, "summary": 2, "analytics": 3}
+# Fraction of each bucket a class must leave untouched for higher-priority work.
+HEADROOM = {"interactive": 0.0, "sentiment": 0.0, "summary": 0.2, "analytics": 0.3}
+# Output tokens assumed when reserving TPM before the real usage is known.
+DEFAULT_OUTPUT_ESTIMATE = 256
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call waited longer than its queue timeout for a slot."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_minute, holding at most capacity tokens."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, headroom: float = 0.0) -> float:
+        """Seconds until `amount` can be taken while leaving headroom * capacity behind."""
+        self._refill()
+        needed = min(self.capacity, min(amount, self.capacity) + headroom * self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def give(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelCallScheduler:
+    """
+    Priority scheduler over shared RPM/TPM buckets.
+    Args:
+        rpm: Requests per minute across all classes.
+        tpm: Tokens per minute across all classes (input + output).
+        concurrency: Maximum in-flight calls per priority class.
+        queue_timeout: Default seconds a call may wait for a slot.
+    """
+
+    def __init__(self, rpm: float, tpm: float, concurrency: dict, queue_timeout: float = 30.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = {name: concurrency.get(name, 4) for name in PRIORITIES}
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._in_flight = {name: 0 for name in PRIORITIES}
+        self._seq = itertools.count()
+
+    def _next_eligible(self):
+        for waiter in sorted(self._waiting):
+            if self._in_flight[waiter[2]] < self.concurrency[waiter[2]]:
+                return waiter
+        return None
+
+    def acquire(self, priority: str, tokens: int, timeout: Optional[float] = None) -> float:
+        """
+        Block until the call may be sent. Returns the seconds spent queued.
+        Raises:
+            SchedulerTimeout: If no slot was granted within timeout.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        timeout = self.queue_timeout if timeout is None else timeout
+        budget = remaining_time()
+        if budget is not None and budget < timeout:
+            # Waiting past the caller's deadline is pointless.
+            if budget <= 0:
+                raise DeadlineExceeded(f"No time left to schedule a {priority} call")
+            timeout = budget
+        start = time.monotonic()
+        deadline = start + timeout
+        waiter = (PRIORITIES[priority], next(self._seq), priority)
+        with self._cond:
+            self._waiting.append(waiter)
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    wait = remaining
+                    if self._next_eligible() == waiter:
+                        headroom = HEADROOM[priority]
+                        wait = max(self.requests.wait_time(1, headroom), self.tokens.wait_time(tokens, headroom))
+                        if wait == 0.0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self._in_flight[priority] += 1
+                            break
+                    if remaining <= 0:
+                        metrics.inc("scheduler_timeouts_total", priority=priority)
+                        raise SchedulerTimeout(f"{priority} call waited {timeout:.1f}s for a model slot")
+                    check_cancelled()
+                    if cancel_event() is not None:
+                        wait = min(wait, CANCEL_POLL)
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._waiting.remove(waiter)
+                self._cond.notify_all()
+        queued = time.monotonic() - start
+        metrics.observe("scheduler_queue_seconds", queued, priority=priority)
+        return queued
+
+    def release(self, priority: str, reserved_tokens: int, used_tokens: Optional[int] = None):
+        """Free the slot and settle the TPM reservation against the real usage, if known."""
+        with self._cond:
+            self._in_flight[priority] -= 1
+            if used_tokens is not None and used_tokens != reserved_tokens:
+                if used_tokens < reserved_tokens:
+                    self.tokens.give(reserved_tokens - used_tokens)
+                else:
+                    self.tokens.take(used_tokens - reserved_tokens)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str, tokens: int, timeout: Optional[float] = None):
+        """
+        Hold a slot for the duration of the block. The block may set
+        `usage["tokens"]` to the real token count to settle the TPM bucket, and
+        collects the calls it abandoned in `usage["abandoned"]` (see
+        resilience.track_abandoned); the slot is released once those finish too.
+        """
+        self.acquire(priority, tokens, timeout)
+        usage = {"tokens": None, "abandoned": []}
+        try:
+            yield usage
+        finally:
+            self._release_when_done(priority, tokens, usage)
+
+    def _release_when_done(self, priority: str, reserved_tokens: int, usage: dict):
+        running = [future for future in usage["abandoned"] if not future.done()]
+        if not running:
+            self.release(priority, reserved_tokens, usage["tokens"])
+            return
+        left = [len(running)]
+        lock = threading.Lock()
+
+        def finished(_future):
+            with lock:
+                left[0] -= 1
+                if left[0]:
+                    return
+            self.release(priority, reserved_tokens, usage["tokens"])
+
+        for future in running:
+            future.add_done_callback(finished)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = {f"queued_{name}": sum(1 for w in self._waiting if w[2] == name) for name in PRIORITIES}
+            stats.update({f"in_flight_{name}": count for name, count in self._in_flight.items()})
+            self.requests._refill()
+            self.tokens._refill()
+            stats["rpm_available"] = self.requests.level
+            stats["tpm_available"] = self.tokens.level
+        return stats
+
+
+def _parse_concurrency(spec: str) -> dict:
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+
+scheduler = ModelCallScheduler(
+    rpm=config.GEMINI_RPM,
+    tpm=config.GEMINI_TPM,
+    concurrency=_parse_concurrency(config.GEMINI_CLASS_CONCURRENCY),
+    queue_timeout=config.GEMINI_QUEUE_TIMEOUT,
+)
+metrics.describe("scheduler_queue_seconds", "Time model calls waited for a scheduler slot, per priority class")
+metrics.register_collector("scheduler", scheduler.stats)
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Helper function to estimate the tokens a call will use (prompt plus a fixed output allowance)."""
+    prompt = sum(count_tokens(m.content if isinstance(m.content, str) else str(m.content)) for m in messages)
+    return prompt + DEFAULT_OUTPUT_ESTIMATE
+
+
+def _usage_tokens(message) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    Chat model that sends every call through the scheduler under its priority class.
+    Use with_priority() to get a copy for another class; tool bindings are
+    delegated to the wrapped model.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: Any
+    priority: str = "interactive"
+    scheduler: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"scheduled-{self.inner._llm_type}"
+
+    @property
+    def _scheduler(self) -> ModelCallScheduler:
+        return self.scheduler or scheduler
+
+    def with_priority(self, priority: str) -> "ScheduledChatModel":
+        return self.model_copy(update={"priority": priority})
+
+    def bind_tools(self, tools, **kwargs):
+        binding = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**binding.kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reserved = estimate_tokens(messages)
+        # The slot is held outside call_with_resilience, so time spent queued is not
+        # recorded as Gemini latency and a queue timeout never counts against the breaker.
+        with self._scheduler.slot(self.priority, reserved) as usage:
+            with track_abandoned(usage["abandoned"]):
+                result = call_with_resilience(
+                    "gemini", self.inner._generate, messages, stop=stop, run_manager=run_manager, **kwargs,
+                )
+            if result.generations:
+                usage["tokens"] = _usage_tokens(result.generations[0].message)
+        return result
+
+    def _open_stream(self, messages, stop, run_manager, **kwargs):
+        stream = self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        return next(stream, None), stream
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        reserved = estimate_tokens(messages)
+        with self._scheduler.slot(self.priority, reserved) as usage:
+            # Retries only cover opening the stream (up to the first chunk); tokens
+            # already shown to the user cannot be taken back, so streams are never hedged.
+            with track_abandoned(usage["abandoned"]):
+                first, stream = call_with_resilience(
+                    "gemini", self._open_stream, messages, stop, run_manager, hedge=False, **kwargs,
+                )
+            total = None
+            # Closing the inner stream on cancel drops the connection to the model.
+            with closing(stream):
+                for chunk in itertools.chain([first] if first is not None else [], stream):
+                    check_cancelled()
+                    tokens = _usage_tokens(chunk.message)
+                    if tokens:
+                        total = (total or 0) + tokens
+                    yield chunk
+            usage["tokens"] = total
+
+
+class _ScheduledModels:
+    def __init__(self, models, priority: str, scheduler_: Optional[ModelCallScheduler]):
+        self._models = models
+        self._priority = priority
+        self._scheduler = scheduler_
+
+    def generate_content(self, *args, contents=None, **kwargs):
+        reserved = count_tokens(str(contents)) + DEFAULT_OUTPUT_ESTIMATE
+        # As in ScheduledChatModel: queue first, then only the network call is timed and retried.
+        with (self._scheduler or scheduler).slot(self._priority, reserved) as usage:
+            with track_abandoned(usage["abandoned"]):
+                response = call_with_resilience(
+                    "gemini", self._models.generate_content, *args, contents=contents, **kwargs,
+                )
+            usage_metadata = getattr(response, "usage_metadata", None)
+            usage["tokens"] = getattr(usage_metadata, "total_token_count", None)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class ScheduledGenaiClient:
+    """Proxy for genai.Client whose models.generate_content goes through the scheduler."""
+
+    def __init__(self, client, priority: str = "summary", scheduler_: Optional[ModelCallScheduler] = None):
+        self._client = client
+        self.models = _ScheduledModels(client.models, priority, scheduler_)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
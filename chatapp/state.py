@@ -0,0 +1,305 @@
+"""
+Shared per-user session state.
+
+Short-term memory, summaries, the summarized-chat history, mood shifts, the
+session digest and the long-term profile store are JSON documents in a
+StateBackend, one per (user_id, name). Every process pointed at the same
+backend sees the same state, so the app can run as several Streamlit or
+uvicorn processes without splitting a user's memory between them.
+
+- InProcessBackend (STATE_BACKEND=memory, the default): dictionaries in this
+  process, split into STATE_SHARDS shards by user_id, each with its own lock.
+- RedisBackend (STATE_BACKEND=redis): any Redis-protocol server. Keys are
+  "<prefix>:{<user_id>}:<name>"; the braces make Redis Cluster keep a user's
+  keys on one shard, and a comma-separated STATE_REDIS_URL shards users across
+  standalone servers. STATE_REDIS_URL=fake:// uses the in-process stand-in
+  from chatapp/stubs.py.
+
+Writes are optimistic: update() reads a document and its version, applies the
+change, and writes it back only if the version has not moved, re-reading and
+re-applying on conflict. Documents are encoded with the codec in
+chatapp/records.py (orjson when installed).
+"""
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from chatapp.metrics import metrics
+from chatapp.records import dumps, loads
+from settings import config
+
+
+class VersionConflict(Exception):
+    """Raised when an update kept losing the race for a document."""
+
+
+def shard_index(user_id, shards: int) -> int:
+    """Helper function to map a user id to one of `shards` shards (stable across processes)."""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+class StateBackend:
+    """Versioned JSON documents keyed by (user_id, name)."""
+
+    # True when other processes can see the same documents.
+    shared = False
+
+    def load(self, user_id, name: str) -> Tuple[Optional[dict], int]:
+        """Return (document, version); (None, 0) when it does not exist."""
+        raise NotImplementedError
+
+    def version(self, user_id, name: str) -> int:
+        return self.load(user_id, name)[1]
+
+    def store(self, user_id, name: str, value: dict, expected_version: int) -> bool:
+        """Write the document if its version is still expected_version (0: must not exist)."""
+        raise NotImplementedError
+
+    def delete(self, user_id, name: str):
+        raise NotImplementedError
+
+    def scan(self, name: str) -> Iterator[Tuple[str, dict]]:
+        """Yield (user_id, document) for every user that has a document called name."""
+        raise NotImplementedError
+
+    def sizes(self) -> dict:
+        """Document count and total JSON bytes per document name, where the backend tracks them."""
+        return {}
+
+
+class InProcessBackend(StateBackend):
+    """Documents in this process, sharded by user id so users do not contend for one lock."""
+
+    def __init__(self, shards: int = 16):
+        self._shards = [(threading.Lock(), {}) for _ in range(max(1, shards))]
+        # name -> [documents, bytes], kept up to date on every write so reading it is free.
+        self._sizes = {}
+        self._sizes_lock = threading.Lock()
+
+    def _resize(self, name: str, documents: int, size: int):
+        with self._sizes_lock:
+            totals = self._sizes.setdefault(name, [0, 0])
+            totals[0] += documents
+            totals[1] += size
+
+    def _shard(self, user_id) -> tuple:
+        return self._shards[shard_index(user_id, len(self._shards))]
+
+    def load(self, user_id, name: str) -> Tuple[Optional[dict], int]:
+        lock, documents = self._shard(user_id)
+        with lock:
+            entry = documents.get((str(user_id), name))
+        if entry is None:
+            return None, 0
+        return loads(entry[1]), entry[0]
+
+    def version(self, user_id, name: str) -> int:
+        lock, documents = self._shard(user_id)
+        with lock:
+            entry = documents.get((str(user_id), name))
+        return entry[0] if entry else 0
+
+    def store(self, user_id, name: str, value: dict, expected_version: int) -> bool:
+        data = dumps(value)
+        lock, documents = self._shard(user_id)
+        with lock:
+            entry = documents.get((str(user_id), name))
+            if (entry[0] if entry else 0) != expected_version:
+                return False
+            documents[(str(user_id), name)] = (expected_version + 1, data)
+        self._resize(name, 0 if entry else 1, len(data) - (len(entry[1]) if entry else 0))
+        return True
+
+    def delete(self, user_id, name: str):
+        lock, documents = self._shard(user_id)
+        with lock:
+            entry = documents.pop((str(user_id), name), None)
+        if entry:
+            self._resize(name, -1, -len(entry[1]))
+
+    def scan(self, name: str) -> Iterator[Tuple[str, dict]]:
+        for lock, documents in self._shards:
+            with lock:
+                entries = [(key[0], entry[1]) for key, entry in documents.items() if key[1] == name]
+            for user_id, data in entries:
+                yield user_id, loads(data)
+
+    def sizes(self) -> dict:
+        with self._sizes_lock:
+            return {name: {"documents": totals[0], "bytes": totals[1]} for name, totals in self._sizes.items()}
+
+
+class RedisBackend(StateBackend):
+    """
+    Documents in Redis-protocol servers, as hashes with "version" and "data"
+    fields. Writes use WATCH/MULTI/EXEC, so a write only lands if nobody
+    changed the key since it was read.
+    """
+
+    shared = True
+
+    def __init__(self, clients: list, prefix: str = "chatapp"):
+        self.clients = clients
+        self.prefix = prefix
+
+    def _key(self, user_id, name: str) -> str:
+        return f"{self.prefix}:{{{user_id}}}:{name}"
+
+    def _client(self, user_id):
+        return self.clients[shard_index(user_id, len(self.clients))]
+
+    def load(self, user_id, name: str) -> Tuple[Optional[dict], int]:
+        version, data = self._client(user_id).hmget(self._key(user_id, name), ["version", "data"])
+        if version is None:
+            return None, 0
+        return loads(data), int(version)
+
+    def version(self, user_id, name: str) -> int:
+        version = self._client(user_id).hget(self._key(user_id, name), "version")
+        return int(version) if version is not None else 0
+
+    def store(self, user_id, name: str, value: dict, expected_version: int) -> bool:
+        key = self._key(user_id, name)
+        with self._client(user_id).pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.hget(key, "version")
+                if int(current or 0) != expected_version:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={"version": expected_version + 1, "data": dumps(value)})
+                pipe.execute()
+                return True
+            except Exception as e:
+                if type(e).__name__ == "WatchError":
+                    return False
+                raise
+
+    def delete(self, user_id, name: str):
+        self._client(user_id).delete(self._key(user_id, name))
+
+    def scan(self, name: str) -> Iterator[Tuple[str, dict]]:
+        for client in self.clients:
+            for key in client.scan_iter(match=f"{self.prefix}:*:{name}"):
+                user_id = key[key.index("{") + 1:key.rindex("}")]
+                document, version = self.load(user_id, name)
+                if version:
+                    yield user_id, document
+
+
+def _redis_clients(urls: List[str]) -> list:
+    if urls == ["fake://"]:
+        from chatapp.stubs import FakeRedis
+        return [FakeRedis()]
+    import redis
+    return [redis.Redis.from_url(url, decode_responses=True) for url in urls]
+
+
+def create_backend(kind: str = None) -> StateBackend:
+    """Helper function to build the backend selected by STATE_BACKEND."""
+    kind = (kind or config.STATE_BACKEND).lower()
+    if kind == "memory":
+        return InProcessBackend(shards=config.STATE_SHARDS)
+    if kind == "redis":
+        urls = [url.strip() for url in config.STATE_REDIS_URL.split(",") if url.strip()]
+        return RedisBackend(_redis_clients(urls), prefix=config.STATE_REDIS_PREFIX)
+    raise ValueError(f"Unknown STATE_BACKEND: {kind}")
+
+
+backend = create_backend()
+_stats = {"updates": 0, "conflicts": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def update(user_id, name: str, fn: Callable, retries: int = None):
+    """
+    Read-modify-write one document with optimistic concurrency.
+    Args:
+        user_id: The user the document belongs to.
+        name: The document name.
+        fn: Called with the current document (None if missing); returns
+            (new document, result). A new document of None skips the write.
+        retries: Attempts before giving up (defaults to STATE_MAX_RETRIES).
+    Returns:
+        The result returned by fn on the attempt that was written.
+    Raises:
+        VersionConflict: If every attempt lost to a concurrent writer.
+    """
+    retries = retries or config.STATE_MAX_RETRIES
+    for attempt in range(retries):
+        current, version = backend.load(user_id, name)
+        new_value, result = fn(current)
+        if new_value is None or backend.store(user_id, name, new_value, version):
+            with _stats_lock:
+                _stats["updates"] += 1
+            return result
+        with _stats_lock:
+            _stats["conflicts"] += 1
+        metrics.inc("state_conflicts_total", document=name)
+        time.sleep(random.uniform(0, 0.002 * 2 ** attempt))
+    with _stats_lock:
+        _stats["failed"] += 1
+    raise VersionConflict(f"Gave up updating {name} for user {user_id} after {retries} attempts")
+
+
+def load_model(user_id, name: str, factory: Callable):
+    """Helper function to load a document as a pydantic model (factory() when it does not exist)."""
+    current, _ = backend.load(user_id, name)
+    default = factory()
+    return default if current is None else type(default).model_validate(current)
+
+
+def update_model(user_id, name: str, factory: Callable, fn: Callable):
+    """
+    Helper function to update a document held as a pydantic model.
+    fn mutates the model in place and returns the result passed back to the caller.
+    """
+    def apply(current):
+        default = factory()
+        model = default if current is None else type(default).model_validate(current)
+        result = fn(model)
+        return model.model_dump(), result
+
+    return update(user_id, name, apply)
+
+
+def load_record(user_id, name: str, decode: Callable):
+    """Helper function to load a document as a record container (chatapp/records.py); decode(None) when it does not exist."""
+    current, _ = backend.load(user_id, name)
+    return decode(current)
+
+
+def update_record(user_id, name: str, decode: Callable, fn: Callable):
+    """
+    Helper function to update a document held as a record container.
+    decode(document) builds the container (document is None when missing); fn mutates it
+    in place and returns the result passed back to the caller.
+    """
+    def apply(current):
+        record = decode(current)
+        result = fn(record)
+        return record.to_document(), result
+
+    return update(user_id, name, apply)
+
+
+def get_state_stats() -> dict:
+    """
+    Helper function to get state update counters (writes, version conflicts, gave-up updates)
+    and, for backends that track them, the document count and bytes per document name.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["backend"] = type(backend).__name__
+    for name, size in backend.sizes().items():
+        label = re.sub(r"\W", "_", name)
+        stats[f"documents_{label}"] = size["documents"]
+        stats[f"bytes_{label}"] = size["bytes"]
+    return stats
+
+
+metrics.register_collector("state", get_state_stats)
@@ -0,0 +1,382 @@
+"""
+Local stand-ins for the external services, used when STUB_MODE is set.
+
+FakeChatModel replaces ChatGoogleGenerativeAI, FakeGenaiClient replaces the
+genai.Client used by summarize_memory, FakeTavilyClient replaces TavilyClient
+FakeClassifier replaces the transformers sentiment pipeline and FakeRedis
+replaces a Redis server for the shared state backend. Each fake
+sleeps for a duration drawn from a configurable LatencyDistribution and can
+fail a fraction of calls with StubServiceError (HTTP 503), so the turn pipeline
+and the resilience layer can be exercised offline.
+"""
+import fnmatch
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict, Field
+
+from chatapp.tokens import count_tokens
+
+
+class LatencyDistribution:
+    """
+    Latency in seconds drawn from a named distribution.
+    Specs: "none", "fixed:S", "uniform:LO,HI", "lognormal:MEDIAN,SIGMA".
+    """
+
+    def __init__(self, kind: str = "none", a: float = 0.0, b: float = 0.0, seed: Optional[int] = None):
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def parse(cls, spec: Optional[str], seed: Optional[int] = None) -> "LatencyDistribution":
+        if not spec or spec == "none":
+            return cls("none", seed=seed)
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v.strip()]
+        if kind == "fixed":
+            return cls("fixed", values[0], seed=seed)
+        if kind in ("uniform", "lognormal"):
+            return cls(kind, values[0], values[1], seed=seed)
+        raise ValueError(f"Unknown latency spec: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return self._rng.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return self._rng.lognormvariate(math.log(self.a), self.b)
+        return 0.0
+
+    def sleep(self) -> float:
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def __repr__(self):
+        return f"LatencyDistribution({self.kind}, {self.a}, {self.b})"
+
+
+class StubServiceError(Exception):
+    """Injected transient failure; `code` mimics the HTTP status of a real client error."""
+
+    def __init__(self, service: str, code: int = 503):
+        super().__init__(f"{service} stub injected a {code} error")
+        self.code = code
+
+
+def _maybe_fail(service: str, error_rate: float):
+    if error_rate and random.random() < error_rate:
+        raise StubServiceError(service)
+
+
+_SEARCH_TRIGGER = re.compile(r"\b(latest|news|today|current|weather|price|who|when|where|search)\b", re.I)
+_PROMPT_PREFIX = re.compile(r"^.*?(store it(?: in memory)?|and store it in memory):\s*", re.I)
+_POSITIVE_WORDS = {"good", "great", "happy", "love", "awesome", "thanks", "excited", "nice", "glad", "amazing"}
+_NEGATIVE_WORDS = {"bad", "sad", "hate", "angry", "terrible", "awful", "tired", "upset", "worried", "stressed"}
+
+
+def _user_text(message: BaseMessage) -> str:
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    return _PROMPT_PREFIX.sub("", content).strip()
+
+
+def _tool_call(name: str, args: dict) -> dict:
+    return {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"}
+
+
+def scripted_turn(messages: List[BaseMessage], tool_names: List[str]) -> AIMessage:
+    """
+    Default script: call the sentiment tools (analyze, then store) or the replier
+    tools (web_search for factual-looking questions, then store the reply) in
+    order, then answer with plain text.
+    """
+    last_human = max((i for i, m in enumerate(messages) if m.type == "human"), default=None)
+    if last_human is None:
+        return AIMessage(content="Hello! How can I help you today?")
+    user_text = _user_text(messages[last_human])
+    tool_results = {m.name: m.content for m in messages[last_human + 1:] if m.type == "tool"}
+
+    if "analyze_sentiment" in tool_names and "analyze_sentiment" not in tool_results:
+        return AIMessage(content="", tool_calls=[_tool_call("analyze_sentiment", {"text": user_text})])
+    if "add_to_short_term_memory" in tool_names and "add_to_short_term_memory" not in tool_results:
+        try:
+            sentiment = json.loads(tool_results.get("analyze_sentiment", "{}"))
+        except (TypeError, ValueError):
+            sentiment = {}
+        return AIMessage(content="", tool_calls=[_tool_call("add_to_short_term_memory", {
+            "user": user_text,
+            "assistant": "",
+            "sentiment_score": float(sentiment.get("score", 0.5)),
+            "sentiment_type": sentiment.get("label", "NEU"),
+        })])
+    if "analyze_sentiment" in tool_names:
+        return AIMessage(content=f"Sentiment recorded for: {user_text[:60]}")
+
+    reply = f"Thanks for sharing. Here is a thoughtful answer about: {user_text[:120]}"
+    if "web_search" in tool_names and "web_search" not in tool_results and _SEARCH_TRIGGER.search(user_text):
+        # Several questions in one message become independent searches in the same step.
+        queries = [q.strip() + "?" for q in user_text.split("?") if _SEARCH_TRIGGER.search(q)][:3] or [user_text]
+        return AIMessage(content="", tool_calls=[_tool_call("web_search", {"query": q}) for q in queries])
+    if "web_search" in tool_results:
+        reply += " (based on what I found online)"
+    if ("add_assistant_reply_to_short_term_memory" in tool_names
+            and "add_assistant_reply_to_short_term_memory" not in tool_results):
+        return AIMessage(content="", tool_calls=[_tool_call(
+            "add_assistant_reply_to_short_term_memory", {"user": user_text, "assistant": reply},
+        )])
+    if not tool_names:
+        return AIMessage(content=(
+            "Session summary: the user discussed several topics; the overall sentiment "
+            "trend was mixed and no critical issues were raised."
+        ))
+    return AIMessage(content=reply)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model stand-in with scripted tool calls and injected latency.
+    `script` receives (messages, bound tool names) and returns the AIMessage.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    latency: Any = Field(default_factory=LatencyDistribution)
+    error_rate: float = 0.0
+    token_delay: float = 0.0
+    script: Any = None
+    model: str = "fake-gemini"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], tool_choice=tool_choice, **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        tool_names = [t["function"]["name"] for t in kwargs.get("tools") or []]
+        if kwargs.get("tool_choice") == "none":
+            tool_names = []
+        message = (self.script or scripted_turn)(messages, tool_names)
+        input_tokens = sum(count_tokens(str(m.content)) for m in messages)
+        output_tokens = count_tokens(str(message.content)) + 8 * len(message.tool_calls)
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.latency.sleep()
+        _maybe_fail("gemini", self.error_rate)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, **kwargs))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        self.latency.sleep()
+        _maybe_fail("gemini", self.error_rate)
+        message = self._respond(messages, **kwargs)
+        if message.tool_calls:
+            chunk = AIMessageChunk(content="", tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ], usage_metadata=message.usage_metadata)
+            yield ChatGenerationChunk(message=chunk)
+            return
+        words = re.findall(r"\S+\s*", str(message.content)) or [""]
+        for i, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            chunk = AIMessageChunk(content=word, usage_metadata=message.usage_metadata if i == 0 else None)
+            if run_manager:
+                run_manager.on_llm_new_token(word, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+def _fake_response(text: str):
+    part = SimpleNamespace(text=f"```json\n{text}\n```")
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))], text=text)
+
+
+class _FakeModels:
+    def __init__(self, latency: LatencyDistribution, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def generate_content(self, model: str, contents: str, **kwargs):
+        self.latency.sleep()
+        _maybe_fail("gemini", self.error_rate)
+        if contents.lstrip().startswith("Extract profile information"):
+            # Memory extraction prompt: answer with the local extractor's fields.
+            from chatapp.memory.extraction import FIELDS, extract_candidates
+
+            found = extract_candidates(contents.split("\n\n")[1])
+            return _fake_response(json.dumps({name: found.get(name) for name in FIELDS}))
+        sentiments = re.findall(r"Sentiment: (\w+)", contents)
+        mood = max(set(sentiments), key=sentiments.count) if sentiments else "NEUTRAL"
+        turns = contents.count("User:")
+        return _fake_response(json.dumps({
+            "summary": f"Summary of {turns} exchanges covering the user's recent topics.",
+            "general_mood": mood,
+        }))
+
+
+class FakeGenaiClient:
+    """Stand-in for google.genai.Client (only models.generate_content is used)."""
+
+    def __init__(self, latency: Optional[LatencyDistribution] = None, error_rate: float = 0.0):
+        self.models = _FakeModels(latency or LatencyDistribution(), error_rate)
+
+
+class FakeTavilyClient:
+    """Stand-in for tavily.TavilyClient returning deterministic results."""
+
+    def __init__(self, api_key: Optional[str] = None, latency: Optional[LatencyDistribution] = None,
+                 error_rate: float = 0.0):
+        self.latency = latency or LatencyDistribution()
+        self.error_rate = error_rate
+
+    def search(self, query: str, **kwargs) -> dict:
+        self.latency.sleep()
+        _maybe_fail("tavily", self.error_rate)
+        slug = re.sub(r"\W+", "-", query.lower()).strip("-")[:40]
+        return {"query": query, "results": [
+            {"title": f"Result {i + 1} for {query[:40]}", "url": f"https://example.com/{slug}/{i + 1}",
+             "content": f"Snippet {i + 1} about {query[:80]}."}
+            for i in range(5)
+        ]}
+
+
+class FakeClassifier:
+    """Stand-in for the transformers sentiment pipeline (lexicon based, bertweet labels)."""
+
+    def __init__(self, latency: Optional[LatencyDistribution] = None):
+        self.latency = latency or LatencyDistribution()
+
+    def _score(self, text: str) -> dict:
+        words = set(re.findall(r"[a-z']+", text.lower()))
+        pos, neg = len(words & _POSITIVE_WORDS), len(words & _NEGATIVE_WORDS)
+        if pos > neg:
+            return {"label": "POS", "score": min(0.99, 0.7 + 0.1 * pos)}
+        if neg > pos:
+            return {"label": "NEG", "score": min(0.99, 0.7 + 0.1 * neg)}
+        return {"label": "NEU", "score": 0.8}
+
+    def __call__(self, inputs, **kwargs):
+        self.latency.sleep()
+        if isinstance(inputs, str):
+            return [self._score(inputs)]
+        return [self._score(text) for text in inputs]
+
+
+class WatchError(Exception):
+    """Raised by FakeRedis transactions when a watched key changed (redis.exceptions.WatchError)."""
+
+
+class _FakePipeline:
+    def __init__(self, server: "FakeRedis"):
+        self._server = server
+        self._watched = {}
+        self._queued = []
+        self._multi = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self._watched, self._queued, self._multi = {}, [], False
+
+    def watch(self, *keys):
+        with self._server._lock:
+            self._watched.update({key: self._server._revisions.get(key, 0) for key in keys})
+
+    def unwatch(self):
+        self._watched = {}
+
+    def hget(self, key, field):
+        return self._server.hget(key, field)
+
+    def multi(self):
+        self._multi = True
+
+    def hset(self, key, mapping):
+        self._queued.append((key, mapping))
+
+    def execute(self):
+        with self._server._lock:
+            for key, revision in self._watched.items():
+                if self._server._revisions.get(key, 0) != revision:
+                    self.reset()
+                    raise WatchError(f"Watched key {key} changed")
+            for key, mapping in self._queued:
+                self._server._hset(key, mapping)
+        results = [len(mapping) for _, mapping in self._queued]
+        self.reset()
+        return results
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the subset of redis.Redis the state backend uses:
+    hashes, SCAN and WATCH/MULTI/EXEC transactions (values as str, as with
+    decode_responses=True).
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._revisions = {}
+        self._lock = threading.Lock()
+
+    def _hset(self, key, mapping):
+        self._hashes.setdefault(key, {}).update({field: str(value) for field, value in mapping.items()})
+        self._revisions[key] = self._revisions.get(key, 0) + 1
+
+    def hset(self, key, mapping):
+        with self._lock:
+            self._hset(key, mapping)
+        return len(mapping)
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._hashes.get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        with self._lock:
+            values = self._hashes.get(key, {})
+            return [values.get(field) for field in fields]
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._hashes.pop(key, None) is not None:
+                    removed += 1
+                    self._revisions[key] = self._revisions.get(key, 0) + 1
+            return removed
+
+    def scan_iter(self, match: str = "*"):
+        with self._lock:
+            keys = list(self._hashes)
+        return (key for key in keys if fnmatch.fnmatchcase(key, match))
+
+    def pipeline(self):
+        return _FakePipeline(self)
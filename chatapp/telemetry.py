@@ -0,0 +1,287 @@
+"""
+Telemetry export off the request path.
+
+Callers hand runs and dataset examples to `telemetry` (a TelemetryExporter),
+which only does a non-blocking put on a bounded queue. A background thread
+drains the queue in batches and writes them to a sink: LangSmith when it is
+configured, or, when asked for, a JSONL file (rotated at TELEMETRY_FILE_MAX_BYTES)
+or a local HTTP endpoint. Runs carry full prompts and replies, so nothing is
+written locally unless TELEMETRY_SINK says so. When the queue
+fills up, sampled events are thinned out first and anything that still does
+not fit is dropped and counted, so a slow endpoint never adds to user latency.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from chatapp.metrics import metrics
+from settings import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TelemetryEvent:
+    """One run or dataset example waiting to be exported."""
+    kind: str
+    payload: dict
+    created_at: float = field(default_factory=time.time)
+    event_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+class FileSink:
+    """Append events as JSON lines to a local file, moving it to `<path>.1` once it reaches max_bytes."""
+
+    name = "file"
+
+    def __init__(self, path: str, max_bytes: int = 10 * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+
+    def write_batch(self, events: List[TelemetryEvent]):
+        if self.max_bytes:
+            self._rotate()
+        with open(self.path, "a") as f:
+            for event in events:
+                f.write(json.dumps(asdict(event), default=str) + "\n")
+
+
+class HttpSink:
+    """POST each batch as a JSON array to an HTTP endpoint (e.g. a local collector stub)."""
+
+    name = "http"
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def write_batch(self, events: List[TelemetryEvent]):
+        body = json.dumps([asdict(event) for event in events], default=str).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class LangSmithSink:
+    """Write runs with create_run and examples with one create_examples call per dataset."""
+
+    name = "langsmith"
+
+    def __init__(self, client=None):
+        if client is None:
+            from langsmith import Client
+            client = Client()
+        self.client = client
+
+    def write_batch(self, events: List[TelemetryEvent]):
+        examples = {}
+        for event in events:
+            payload = dict(event.payload)
+            if event.kind == "example":
+                examples.setdefault(payload.pop("dataset_name"), []).append(payload)
+            elif event.kind == "run":
+                self.client.create_run(
+                    name=payload["name"],
+                    inputs=payload.get("inputs", {}),
+                    run_type=payload.get("run_type", "chain"),
+                    outputs=payload.get("outputs"),
+                    error=payload.get("error"),
+                    start_time=datetime.fromtimestamp(payload.get("start_time", event.created_at), tz=timezone.utc),
+                    end_time=datetime.fromtimestamp(payload.get("end_time", event.created_at), tz=timezone.utc),
+                    extra={"metadata": payload.get("metadata", {})},
+                )
+        for dataset_name, rows in examples.items():
+            self.client.create_examples(dataset_name=dataset_name, examples=rows)
+
+
+class TelemetryExporter:
+    """
+    Bounded queue plus background flusher.
+    Args:
+        sink: Object with write_batch(events); None disables export.
+        max_queue: Queue capacity; events beyond it are dropped.
+        batch_size: Maximum events per write_batch call.
+        flush_interval: Longest time an event waits before its batch is written.
+        sample_rate: Fraction of sampled events kept once the queue is over
+            high_watermark (a fraction of max_queue).
+    """
+
+    def __init__(self, sink, max_queue: int = 1000, batch_size: int = 50, flush_interval: float = 2.0,
+                 sample_rate: float = 0.1, high_watermark: float = 0.8):
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.high_watermark = high_watermark
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "exported": 0, "dropped_full": 0, "dropped_sampled": 0,
+                       "export_errors": 0, "batches": 0}
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._stats[name] += value
+
+    def submit(self, kind: str, payload: dict, sampled: bool = True) -> bool:
+        """
+        Queue an event without blocking.
+        Args:
+            kind: "run" or "example".
+            payload: Sink-specific fields (see LangSmithSink).
+            sampled: Whether the event may be thinned out under backpressure.
+        Returns:
+            True if the event was queued.
+        """
+        if not self.enabled:
+            return False
+        self._ensure_started()
+        if sampled and self._queue.qsize() >= self.max_queue * self.high_watermark \
+                and random.random() >= self.sample_rate:
+            self._count("dropped_sampled")
+            return False
+        try:
+            self._queue.put_nowait(TelemetryEvent(kind=kind, payload=payload))
+        except queue.Full:
+            self._count("dropped_full")
+            return False
+        self._count("queued")
+        return True
+
+    def record_run(self, name: str, inputs: dict, outputs: Optional[dict] = None, metadata: Optional[dict] = None,
+                   start_time: Optional[float] = None, end_time: Optional[float] = None,
+                   error: Optional[str] = None, run_type: str = "chain") -> bool:
+        """Queue a finished run (wall-clock start/end times)."""
+        now = time.time()
+        return self.submit("run", {
+            "name": name, "run_type": run_type, "inputs": inputs, "outputs": outputs or {},
+            "metadata": metadata or {}, "start_time": start_time or now, "end_time": end_time or now,
+            "error": error,
+        })
+
+    def record_example(self, dataset_name: str, inputs: dict, outputs: dict) -> bool:
+        """Queue a dataset example. Examples are never sampled away, only dropped when the queue is full."""
+        return self.submit("example", {
+            "dataset_name": dataset_name, "inputs": inputs, "outputs": outputs,
+            "created_at": _iso(time.time()),
+        }, sampled=False)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="telemetry-flush", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> List[TelemetryEvent]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.sink.write_batch(batch)
+                self._count("exported", len(batch))
+            except Exception as e:
+                self._count("export_errors", len(batch))
+                logger.warning(f"Telemetry export to {getattr(self.sink, 'name', 'sink')} failed: {e}")
+            self._count("batches")
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far has been written (or timeout). Returns True if drained."""
+        if not self.enabled or self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["enabled"] = self.enabled
+        return stats
+
+
+def build_sink():
+    """Helper function to build the sink configured in settings (None when disabled)."""
+    sink_name = config.TELEMETRY_SINK.lower()
+    if sink_name == "auto":
+        sink_name = "langsmith" if os.getenv("LANGSMITH_API_KEY") and not config.STUB_MODE else "off"
+    if sink_name == "off":
+        return None
+    if sink_name == "http":
+        return HttpSink(config.TELEMETRY_HTTP_URL)
+    if sink_name == "file":
+        return FileSink(config.TELEMETRY_FILE, max_bytes=config.TELEMETRY_FILE_MAX_BYTES)
+    if sink_name != "langsmith":
+        logger.warning(f"Unknown TELEMETRY_SINK {config.TELEMETRY_SINK!r}; telemetry is off")
+        return None
+    try:
+        return LangSmithSink()
+    except Exception as e:
+        logger.warning(f"LangSmith not configured ({e}); telemetry is off")
+        return None
+
+
+telemetry = TelemetryExporter(
+    build_sink(),
+    max_queue=config.TELEMETRY_QUEUE_SIZE,
+    batch_size=config.TELEMETRY_BATCH_SIZE,
+    flush_interval=config.TELEMETRY_FLUSH_INTERVAL,
+    sample_rate=config.TELEMETRY_SAMPLE_RATE,
+)
+atexit.register(telemetry.flush, 2.0)
+metrics.register_collector("telemetry", telemetry.stats)
+
+
+def get_telemetry_stats() -> dict:
+    """Helper function to get exporter counters (queued, exported, dropped, queue depth)."""
+    return {"sink": getattr(telemetry.sink, "name", "off"), **telemetry.stats()}
@@ -0,0 +1,67 @@
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+# Roughly mirrors BPE behaviour: words, numbers and single punctuation marks,
+# with long words costing one token per 4 characters.
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def tokenizer_name() -> str:
+    """Helper function to get the name of the local tokenizer in use."""
+    return "tiktoken/cl100k_base" if _encoding is not None else "regex-approx"
+
+
+def _count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    total = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        total += max(1, (len(piece) + 3) // 4)
+    return total
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Count tokens in text with the local tokenizer.
+    Args:
+        text: The text to measure.
+    Returns:
+        Number of tokens.
+    """
+    return _count_tokens(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """
+    Trim text so it fits in max_tokens.
+    Args:
+        text: The text to trim.
+        max_tokens: Token budget.
+        keep: "head" keeps the beginning, "tail" keeps the end.
+    Returns:
+        The trimmed text (unchanged if it already fits).
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        candidate = text[:mid] if keep == "head" else text[-mid:]
+        if _count_tokens(candidate) + 1 <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    trimmed = text[:lo] if keep == "head" else (text[-lo:] if lo else "")
+    return trimmed + "…" if keep == "head" else "…" + trimmed
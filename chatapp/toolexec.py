@@ -0,0 +1,248 @@
+"""
+Concurrent execution of the tool calls in one agent step.
+
+When a model message carries several tool calls, create_agent already sends
+each one to the tool node as its own task, and LangGraph runs the tasks of a
+step side by side, writing their ToolMessages back in the order of the calls.
+ToolExecutionMiddleware puts limits on that:
+
+- at most `max_workers` tool calls of an agent run at once,
+- tools that write memory (MEMORY_TOOLS) hold a per-user lock, so two of
+  them never touch the same user's memory at the same time (a user's lock
+  only exists while someone holds or waits for it),
+- each step's wall time is measured next to its sequential baseline (the sum
+  of its tool call durations), so the saving from running tools side by side
+  shows up in metrics.
+
+With TOOL_PARALLEL=false the calls of a step run one at a time, which gives a
+measured sequential baseline to compare against.
+"""
+import asyncio
+import functools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from langchain.agents.middleware import AgentMiddleware
+
+from chatapp.metrics import metrics
+from settings import config
+
+# Tools that mutate per-user memory and must not run concurrently for one user.
+# Their writes are optimistic (chatapp/state.py), so the lock only saves retries
+# within this process; save_memory merges the profile in one optimistic write.
+MEMORY_TOOLS = {"add_to_short_term_memory", "add_assistant_reply_to_short_term_memory"}
+
+# A step whose calls have not all finished after this long is dropped (its other calls never came).
+STEP_MAX_AGE = 600.0
+
+# user id -> [lock, holders and waiters]; an entry is removed when its count drops to zero.
+_user_locks = {}
+_user_locks_guard = threading.Lock()
+_step_totals = {"steps": 0, "multi_call_steps": 0, "wall_seconds": 0.0, "sequential_seconds": 0.0}
+_step_totals_lock = threading.Lock()
+
+
+class _UserLock:
+    """A user's memory write lock, with the same acquire/release interface as threading.Lock."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def acquire(self):
+        with _user_locks_guard:
+            entry = _user_locks.get(self.user_id)
+            if entry is None:
+                entry = _user_locks[self.user_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        entry[0].acquire()
+        return True
+
+    def release(self):
+        with _user_locks_guard:
+            entry = _user_locks[self.user_id]
+            entry[0].release()
+            entry[1] -= 1
+            if not entry[1]:
+                del _user_locks[self.user_id]
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+def user_lock(user_id) -> _UserLock:
+    """Helper function to get the lock that serializes memory writes for a user."""
+    return _UserLock(user_id)
+
+
+def _release_if_acquired(lock, waiter: asyncio.Future):
+    if not waiter.cancelled() and waiter.exception() is None:
+        lock.release()
+
+
+class _Step:
+    """Tool calls issued by one model message, with their timings."""
+
+    def __init__(self, expected: int, parallel: bool, max_workers: int):
+        self.expected = expected
+        self.finished = 0
+        self.started_at = None
+        self.durations = []
+        # Bounds this step only: the agents are shared by every turn, so a per-agent bound would be process-wide.
+        self.slots = threading.BoundedSemaphore(max(1, max_workers))
+        # Only used when parallel execution is off.
+        self.lock = threading.Lock() if not parallel else None
+
+
+def _step_key(request) -> tuple:
+    state = request.state if isinstance(request.state, dict) else {}
+    call_id = request.tool_call.get("id")
+    for message in reversed(state.get("messages", [])):
+        calls = getattr(message, "tool_calls", None) or []
+        if any(call.get("id") == call_id for call in calls):
+            return (message.id or id(message), len(calls))
+    return (call_id, 1)
+
+
+class ToolExecutionMiddleware(AgentMiddleware):
+    """
+    Bound and time the tool calls of an agent; serialize memory tools per user.
+    Args:
+        agent_name: Label used in metrics.
+        max_workers: Maximum tool calls of one step (model message) running at once.
+        parallel: Run the calls of a step side by side (False runs them one at a time).
+    """
+
+    def __init__(self, agent_name: str, max_workers: int = 4, parallel: bool = True):
+        super().__init__()
+        self.agent_name = agent_name
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self._steps = {}
+        self._steps_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"ToolExecutionMiddleware[{self.agent_name}]"
+
+    def _locks(self, request, step: _Step) -> list:
+        # The user lock comes first, so a call waiting for it holds nothing another call needs.
+        locks = []
+        if request.tool_call["name"] in MEMORY_TOOLS:
+            from chatapp.promptmiddleware import resolve_user_id
+            locks.append(user_lock(resolve_user_id(request)))
+        if step.lock is not None:
+            locks.append(step.lock)
+        locks.append(step.slots)
+        return locks
+
+    def _begin(self, request) -> tuple:
+        key, expected = _step_key(request)
+        now = time.monotonic()
+        with self._steps_lock:
+            step = self._steps.get(key)
+            if step is None:
+                for stale in [k for k, s in self._steps.items() if now - s.started_at > STEP_MAX_AGE]:
+                    del self._steps[stale]
+                step = self._steps[key] = _Step(expected, self.parallel, self.max_workers)
+                step.started_at = now
+        return key, step
+
+    def _end(self, key, step: _Step, duration: float):
+        with self._steps_lock:
+            step.durations.append(duration)
+            step.finished += 1
+            if step.finished < step.expected:
+                return
+            self._steps.pop(key, None)
+        wall = time.monotonic() - step.started_at
+        sequential = sum(step.durations)
+        metrics.observe("tool_step_seconds", wall, agent=self.agent_name)
+        metrics.observe("tool_step_sequential_seconds", sequential, agent=self.agent_name)
+        with _step_totals_lock:
+            _step_totals["steps"] += 1
+            if step.expected > 1:
+                _step_totals["multi_call_steps"] += 1
+                _step_totals["wall_seconds"] += wall
+                _step_totals["sequential_seconds"] += sequential
+
+    @contextmanager
+    def _held(self, locks: list):
+        acquired = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    @asynccontextmanager
+    async def _aheld(self, locks: list):
+        acquired = []
+        try:
+            for lock in locks:
+                waiter = asyncio.ensure_future(asyncio.to_thread(lock.acquire))
+                try:
+                    await asyncio.shield(waiter)
+                except asyncio.CancelledError:
+                    # The thread still gets the lock; give it back once it does.
+                    waiter.add_done_callback(functools.partial(_release_if_acquired, lock))
+                    raise
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def wrap_tool_call(self, request, handler):
+        key, step = self._begin(request)
+        duration = 0.0
+        try:
+            with self._held(self._locks(request, step)):
+                start = time.monotonic()
+                try:
+                    return handler(request)
+                finally:
+                    duration = time.monotonic() - start
+        finally:
+            self._end(key, step, duration)
+
+    async def awrap_tool_call(self, request, handler):
+        key, step = self._begin(request)
+        duration = 0.0
+        try:
+            async with self._aheld(self._locks(request, step)):
+                start = time.monotonic()
+                try:
+                    return await handler(request)
+                finally:
+                    duration = time.monotonic() - start
+        finally:
+            # Also when the call never got its locks (e.g. cancelled while waiting), so the step is not left behind.
+            self._end(key, step, duration)
+
+
+def tool_execution_for(agent_name: str) -> ToolExecutionMiddleware:
+    """Helper function to build the tool execution middleware configured in settings."""
+    return ToolExecutionMiddleware(agent_name, max_workers=config.TOOL_MAX_WORKERS, parallel=config.TOOL_PARALLEL)
+
+
+def get_tool_step_stats() -> dict:
+    """Helper function to compare wall time with the sequential baseline over multi-call steps."""
+    with _step_totals_lock:
+        stats = dict(_step_totals)
+    wall = stats["wall_seconds"]
+    stats["speedup"] = stats["sequential_seconds"] / wall if wall else 1.0
+    return stats
+
+
+metrics.describe("tool_step_seconds", "Wall time of each agent step's tool calls")
+metrics.describe("tool_step_sequential_seconds", "Sum of each step's tool call durations (sequential baseline)")
+metrics.register_collector("tool_steps", get_tool_step_stats)
@@ -1,6 +1,163 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
 from langchain.tools import tool
-from transformers import pipeline
-from typing import List, Dict
+from typing import Dict, List
+from functools import lru_cache
+from chatapp.metrics import metrics
+from chatapp.replay import traced_call
+from settings import config
+
+SENTIMENT_MODEL = "finiteautomata/bertweet-base-sentiment-analysis"
+
+LABEL_NAMES = {
+    "POS": "POSITIVE",
+    "NEG": "NEGATIVE",
+    "NEU": "NEUTRAL",
+}
+
+
+@lru_cache(maxsize=1)
+def get_classifier():
+    """Helper function to load the sentiment pipeline once per process."""
+    if config.STUB_MODE:
+        from chatapp.stubs import FakeClassifier, LatencyDistribution
+        return FakeClassifier(LatencyDistribution.parse(config.STUB_CLASSIFIER_LATENCY))
+    from transformers import pipeline
+    return pipeline(model=SENTIMENT_MODEL)
+
+
+def normalize_label(label: str) -> str:
+    """Helper function to map model labels (POS/NEG/NEU) to display labels."""
+    label = (label or "NEUTRAL").upper()
+    return LABEL_NAMES.get(label, label)
+
+
+def signed_score(label: str, score: float) -> float:
+    """Helper function to apply the sign convention: negative sentiment gets a negative score."""
+    return -abs(score) if normalize_label(label) == "NEGATIVE" else score
+
+
+class ClassifierBatcher:
+    """
+    Shares one classifier between all callers by scoring texts in batches.
+
+    Callers submit single texts from any thread and get a Future back. A worker
+    thread takes the first queued text, waits up to max_wait for more (up to
+    max_batch), and scores them with one pipeline call, so concurrent chat
+    turns and bulk requests fill the same batches.
+
+    Every future taken off the queue is resolved, with the error if the batch
+    failed, and a worker that died anyway is started again on the next submit.
+    """
+
+    def __init__(self, max_batch: int = 32, max_wait: float = 0.005):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = {"batches": 0, "texts": 0, "errors": 0, "largest_batch": 0, "restarts": 0}
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                if self._worker is not None:
+                    self._stats["restarts"] += 1
+                self._worker = threading.Thread(target=self._run, name="classifier-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue one text; the Future resolves to (label, score) as returned by the model."""
+        if self._worker is None or not self._worker.is_alive():
+            self._start()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _fail(batch: list, error: BaseException):
+        for _, future in batch:
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                # Already resolved, or cancelled by its caller.
+                pass
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._score(batch)
+            except Exception as e:
+                self._stats["errors"] += 1
+                self._fail(batch, e)
+            finally:
+                # Texts the model returned no result for, or the worker is going down.
+                self._fail(batch, RuntimeError("classifier batch was not scored"))
+
+    def _score(self, batch: list):
+        # Drop texts whose caller already gave up; the rest can no longer be cancelled.
+        batch[:] = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        start = time.perf_counter()
+        results = get_classifier()(texts, batch_size=len(texts), truncation=True)
+        metrics.observe("classifier_batch_seconds", time.perf_counter() - start)
+        metrics.observe("classifier_batch_size", len(batch))
+        self._stats["batches"] += 1
+        self._stats["texts"] += len(batch)
+        self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, list):
+                result = result[0]
+            future.set_result((result['label'], result['score']))
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["mean_batch"] = stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+batcher = ClassifierBatcher(max_batch=config.CLASSIFIER_MAX_BATCH, max_wait=config.CLASSIFIER_BATCH_WAIT)
+metrics.register_collector("classifier_batches", batcher.stats)
+
+
+@lru_cache(maxsize=256)
+def _classify(text: str) -> tuple:
+    return batcher.submit(text).result(timeout=config.CLASSIFIER_RESULT_TIMEOUT)
+
+
+def classify_text(text: str) -> Dict:
+    """
+    Classify a single text, reusing the result if the same text was scored recently.
+    Args:
+        text: The input text to analyze.
+    Returns:
+        A dictionary like {"label": "POS", "score": 0.998}
+    """
+    label, score = traced_call("classifier", text, lambda: _classify(text), encode=list, decode=tuple)
+    return {"label": label, "score": signed_score(label, score)}
+
+
+def sentiment_result(label: str, score: float) -> Dict:
+    """Helper function to build the public form of a model result: display label and signed score."""
+    return {"label": normalize_label(label), "score": signed_score(label, score)}
+
 
 @tool
 def analyze_sentiment(text: str) -> List[Dict]:
@@ -9,16 +166,8 @@ def analyze_sentiment(text: str) -> List[Dict]:
     Args:
         text: The input text to analyze.
     Returns:
-    
+
         A dictionary containing the sentiment analysis results.
         example: {"label": "POSITIVE", "score": 0.998}
     """
-    specific_model = pipeline(model="finiteautomata/bertweet-base-sentiment-analysis")
-    result = specific_model(text)
-    if result:
-        result = result[0]
-    if result['label'] == 'NEGATIVE':
-        result['score'] = -result['score']
-
-    print(result)
-    return result
\ No newline at end of file
+    return classify_text(text)
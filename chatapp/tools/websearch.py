@@ -1,6 +1,19 @@
 from langchain.tools import tool
-from tavily import TavilyClient
 from settings import config
+from chatapp.replay import TracedSearchClient
+from chatapp.resilience import call_with_resilience
+
+
+def get_search_client():
+    """Helper function to build the Tavily client (or its local stand-in in stub mode)."""
+    if config.STUB_MODE:
+        from chatapp.stubs import FakeTavilyClient, LatencyDistribution
+        return TracedSearchClient(FakeTavilyClient(
+            latency=LatencyDistribution.parse(config.STUB_TAVILY_LATENCY), error_rate=config.STUB_TAVILY_ERROR_RATE,
+        ))
+    from tavily import TavilyClient
+    return TracedSearchClient(TavilyClient(api_key=config.TAVILY_API_KEY))
+
 @tool
 def web_search(query: str) -> str:
     """
@@ -10,10 +23,8 @@ def web_search(query: str) -> str:
     Returns:
         A string containing the search results.
     """
-    api_key = config.TAVILY_API_KEY
-
-    client = TavilyClient(api_key=api_key)
-    response = client.search(query)
+    client = get_search_client()
+    response = call_with_resilience("tavily", client.search, query)
     results = response.get('results', [])
     if not results:
         return "No results found."
@@ -0,0 +1,73 @@
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+DEFAULT_USER = "default_user"
+
+
+@dataclass
+class TurnState:
+    """State shared by the stages of one chat turn (classifier, sentiment agent, replier)."""
+    user_input: str
+    user_id: str
+    started_at: float = field(default_factory=time.perf_counter)
+    sentiment: Optional[dict] = None
+    replier_model_calls: int = 0
+    sentiment_in_prompt: bool = False
+    classifier_grace: float = 0.0
+    # Set by chatapp/replay.py: the turn's calls are being recorded or served from a trace.
+    trace: Optional[object] = field(default=None, repr=False)
+    _sentiment_ready: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def publish_sentiment(self, label: str, score: float):
+        """Make the classifier result visible to the other stages of the turn."""
+        self.sentiment = {"label": label, "score": score}
+        self._sentiment_ready.set()
+
+    def wait_for_sentiment(self, timeout: float = 0.0) -> Optional[dict]:
+        """Return the classifier result, waiting at most timeout seconds for it."""
+        if timeout > 0:
+            self._sentiment_ready.wait(timeout)
+        return self.sentiment
+
+
+_current_turn: ContextVar = ContextVar("current_turn", default=None)
+_current_stage: ContextVar = ContextVar("current_stage", default=None)
+
+
+def get_current_turn() -> Optional[TurnState]:
+    """Helper function to get the turn being processed in this context, if any."""
+    return _current_turn.get()
+
+
+def current_user_id(user_id=None) -> str:
+    """Helper function to resolve whose memory to use: user_id if given, else the current turn's user."""
+    if user_id is not None:
+        return str(user_id)
+    turn = _current_turn.get()
+    return turn.user_id if turn is not None else DEFAULT_USER
+
+
+def set_current_turn(turn: Optional[TurnState]):
+    """Helper function to bind a turn to the current context. Returns a reset token."""
+    return _current_turn.set(turn)
+
+
+def reset_current_turn(token):
+    _current_turn.reset(token)
+
+
+def get_current_stage() -> Optional[str]:
+    """Helper function to get the turn stage (classifier, replier_agent, ...) running in this context, if any."""
+    return _current_stage.get()
+
+
+def set_current_stage(stage: Optional[str]):
+    """Helper function to name the turn stage running in the current context. Returns a reset token."""
+    return _current_stage.set(stage)
+
+
+def reset_current_stage(token):
+    _current_stage.reset(token)
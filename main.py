@@ -2,11 +2,23 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
 from rich.prompt import Prompt
+from rich.live import Live
+from rich.text import Text
 from chatapp.agents import sentiment_agent, replier_agent, global_analyzer_agent
 from chatapp.models import Context
-from chatapp.memory.shorttermmemory import get_chats_from_memory, clear_memory, get_mood_shifts
+from chatapp.memory.shorttermmemory import get_chats_from_memory, clear_memory, get_mood_shifts, get_memory_tokens, get_summarization_stats
 from chatapp.memory.summarymemory import get_summaries
+from chatapp.memory.sessiondigest import prepare_session_digest
+from chatapp.promptmiddleware import get_render_stats
+from chatapp.pipeline import stream_turn, get_streaming_stats
+from chatapp.cache import get_cache_stats
+from chatapp.promptbuilder import get_prompt_reports
+from chatapp.metrics import metrics, start_exporters
+from chatapp.budget import get_end_reason_counts
+from chatapp.toolexec import get_tool_step_stats
+from chatapp.diagnostics import get_memory_report
 from datetime import datetime
+from settings import config
 
 console = Console()
 
@@ -71,10 +83,10 @@ class SentimentCLI:
     
     def show_memory(self):
         """Display current short-term memory."""
-        chats = get_chats_from_memory()
+        chats = get_chats_from_memory(self.context.user_id)
         
         if chats:
-            console.print(f"\n[cyan]Short-Term Memory ({len(chats)}/5 slots):[/cyan]")
+            console.print(f"\n[cyan]Short-Term Memory ({len(chats)} chats, {get_memory_tokens(self.context.user_id)}/{config.SHORT_TERM_TOKEN_BUDGET} tokens):[/cyan]")
             for i, chat in enumerate(chats):
                 sentiment_color = {
                     'POSITIVE': 'green',
@@ -91,7 +103,7 @@ class SentimentCLI:
     
     def show_summaries(self):
         """Display all conversation summaries."""
-        summaries = get_summaries()
+        summaries = get_summaries(self.context.user_id)
         
         if summaries:
             console.print(f"\n[cyan]Conversation Summaries ({len(summaries)}):[/cyan]")
@@ -109,7 +121,7 @@ class SentimentCLI:
     
     def show_mood_shifts(self):
         """Display mood shifts."""
-        mood_shifts = get_mood_shifts()
+        mood_shifts = get_mood_shifts(self.context.user_id)
         
         if mood_shifts:
             console.print(f"\n[cyan]Mood Shifts ({len(mood_shifts)}):[/cyan]")
@@ -129,8 +141,8 @@ class SentimentCLI:
     def show_stats(self):
         """Display session statistics."""
         duration = datetime.now() - self.session_start
-        chats = get_chats_from_memory()
-        mood_shifts = get_mood_shifts()
+        chats = get_chats_from_memory(self.context.user_id)
+        mood_shifts = get_mood_shifts(self.context.user_id)
         
         stats_table = Table(title="Session Statistics", show_header=False)
         stats_table.add_column("Metric", style="cyan")
@@ -138,10 +150,73 @@ class SentimentCLI:
         
         stats_table.add_row("Session Duration", str(duration).split('.')[0])
         stats_table.add_row("Messages Exchanged", str(self.message_count))
-        stats_table.add_row("Current Memory", f"{len(chats)}/5")
+        stats_table.add_row("Current Memory", f"{len(chats)} chats, {get_memory_tokens(self.context.user_id)}/{config.SHORT_TERM_TOKEN_BUDGET} tokens")
+        summarization = get_summarization_stats()
+        stats_table.add_row("Summarization Calls", f"{summarization['summaries']} ({summarization['avoided']} avoided vs every 5 chats)")
         stats_table.add_row("Mood Shifts", str(len(mood_shifts)))
+        render_stats = get_render_stats()
+        stats_table.add_row("Memory Context Cache", f"{render_stats['hit_rate']:.0%} hits ({render_stats['avg_render_ms']:.2f} ms/render)")
+        streaming_stats = get_streaming_stats()
+        if streaming_stats["count"]:
+            stats_table.add_row("Time to First Token", f"p50 {streaming_stats['ttft_p50_ms']:.0f} ms / p95 {streaming_stats['ttft_p95_ms']:.0f} ms")
+        cache_stats = get_cache_stats()
+        if cache_stats["enabled"]:
+            stats_table.add_row("Response Cache", f"{cache_stats['hit_rate']:.0%} hits ({cache_stats['entries']} entries)")
+        for report in get_prompt_reports(limit=3):
+            stats_table.add_row(f"Prompt Tokens ({report['prompt_name']})", str(report['total_tokens']))
+        for histogram in metrics.snapshot()["histograms"]:
+            if histogram["name"] in ("turn_stage_seconds", "model_call_seconds"):
+                label = "/".join(histogram["labels"].values())
+                stats_table.add_row(f"Latency ({label})", f"p50 {histogram['p50'] * 1000:.0f} ms / p95 {histogram['p95'] * 1000:.0f} ms")
+        tool_steps = get_tool_step_stats()
+        if tool_steps["multi_call_steps"]:
+            stats_table.add_row("Parallel Tool Steps", f"{tool_steps['multi_call_steps']} steps, {tool_steps['speedup']:.1f}x vs sequential")
+        for key, count in get_end_reason_counts().items():
+            stats_table.add_row(f"Agent Runs ({key})", str(count))
+        memory = get_memory_report(refresh=True)
+        stats_table.add_row("Memory (RSS)", f"{memory['rss']['current'] / 2**20:.1f} MB ({memory['rss']['per_turn'] / 1024:+.1f} KB/turn)")
+        if memory["tracing"]:
+            stats_table.add_row("Traced Memory", f"{memory['traced']['current'] / 2**20:.1f} MB ({memory['traced']['per_turn'] / 1024:+.1f} KB/turn)")
+        stats_table.add_row("Live Objects", ", ".join(f"{name} {count}" for name, count in memory["objects"].items()))
         
         console.print(stats_table)
+        self.show_memory_diagnostics(memory)
+    
+    def show_memory_diagnostics(self, memory: dict):
+        """Display per-component memory, budget warnings and the fastest-growing allocation sites."""
+        if not memory["tracing"]:
+            console.print("[dim]Set DIAGNOSTICS_ENABLED=true for per-component memory and allocation sites.[/dim]")
+        components = Table(title="Memory by Component")
+        components.add_column("Component", style="cyan")
+        components.add_column("Size", justify="right")
+        components.add_column("Budget", justify="right")
+        for name, component in list(memory["components"].items())[:12]:
+            budget = component["budget"]
+            style = "red" if component["over"] else "white"
+            size = component["bytes"]
+            size = f"{size / 2**20:.1f} MB" if size >= 2**20 else f"{size / 1024:.1f} KB"
+            components.add_row(name, f"[{style}]{size}[/{style}]",
+                               f"{budget / 2**20:.0f} MB" if budget else "-")
+        console.print(components)
+        if memory["top_growth"]:
+            sites = Table(title=f"Allocation Growth Since Last Snapshot (turn {memory['snapshot_turn']})")
+            sites.add_column("Site", style="cyan")
+            sites.add_column("Growth", justify="right")
+            sites.add_column("Total", justify="right")
+            for site in memory["top_growth"][:5]:
+                sites.add_row(site["site"], f"{site['bytes_diff'] / 1024:+.1f} KB", f"{site['bytes'] / 1024:.1f} KB")
+            console.print(sites)
+        for warning in memory["warnings"][-3:]:
+            console.print(f"[yellow]⚠ {warning['component']} over its memory budget at turn {warning['turn']}: "
+                          f"{warning['bytes'] / 2**20:.1f} MB > {warning['budget'] / 2**20:.1f} MB[/yellow]")
+    
+    @staticmethod
+    def _render_reply(reply: Text, status_line=None) -> Text:
+        """Render the streamed reply with an optional status line (e.g. tool calls)."""
+        rendered = Text.assemble(("Assistant: ", "green"), reply)
+        if status_line:
+            rendered.append(f"\n⏳ {status_line}", style="dim cyan")
+        return rendered
     
     def process_message(self, user_input: str):
         """Process user message and generate response."""
@@ -150,77 +225,35 @@ class SentimentCLI:
         console.print(f"\n[blue]You:[/blue] {user_input}")
         
         try:
-            with console.status("[cyan]Analyzing sentiment...[/cyan]"):
-                sentiment_result = self.sentiment_agent.invoke({
-                    "messages": [{"role": "user", "content": f"Analyze the sentiment of this message and store it: {user_input}"}]
-                })
-            
-            with console.status("[cyan]Generating response...[/cyan]"):
-                response_result = self.replier_agent.invoke({
-                    "messages": [{"role": "user", "content": user_input}]
-                })
-            
-            response_text = "I apologize, but I couldn't generate a response."
-            if isinstance(response_result, dict):
-                if 'messages' in response_result:
-                    for msg in reversed(response_result['messages']):
-                        if hasattr(msg, 'type') and msg.type == 'ai':
-                            if hasattr(msg, 'content'):
-                                if isinstance(msg.content, list):
-                                    text_parts = []
-                                    for content_block in msg.content:
-                                        if isinstance(content_block, dict) and 'text' in content_block:
-                                            text_parts.append(content_block['text'])
-                                    response_text = ''.join(text_parts)
-                                else:
-                                    response_text = str(msg.content)
-                            break
-                        elif hasattr(msg, 'role') and msg.role == 'assistant':
-                            if hasattr(msg, 'content'):
-                                if isinstance(msg.content, list):
-                                    text_parts = []
-                                    for content_block in msg.content:
-                                        if isinstance(content_block, dict) and 'text' in content_block:
-                                            text_parts.append(content_block['text'])
-                                    response_text = ''.join(text_parts)
-                                else:
-                                    response_text = str(msg.content)
-                            break
-                elif 'output' in response_result:
-                    response_text = response_result['output']
-            
-            sentiment_type = "NEUTRAL"
-            sentiment_score = 0.5
+            result = None
+            reply = Text()
+            status_line = "Analyzing sentiment and generating response..."
+            console.print()
+            with Live(self._render_reply(reply, status_line), console=console, refresh_per_second=12) as live:
+                for event in stream_turn(
+                    user_input,
+                    self.context.user_id,
+                    sentiment_agent=self.sentiment_agent,
+                    replier_agent=self.replier_agent,
+                ):
+                    if event.kind == "token":
+                        reply.append(event.data)
+                        status_line = None
+                    elif event.kind == "status":
+                        status_line = event.data
+                    elif event.kind == "sentiment":
+                        status_line = status_line and f"Sentiment: {event.data['label']} · generating response..."
+                    elif event.kind == "done":
+                        result = event.data
+                        if not reply.plain:
+                            reply.append(result.response_text)
+                        status_line = None
+                    live.update(self._render_reply(reply, status_line))
             
-            if isinstance(sentiment_result, dict) and 'output' in sentiment_result:
-                output = sentiment_result['output']
-                try:
-                    if isinstance(output, str) and 'POSITIVE' in output:
-                        sentiment_type = "POSITIVE"
-                        import re
-                        score_match = re.search(r"'score':\s*(-?\d+\.?\d*)", output)
-                        if score_match:
-                            sentiment_score = abs(float(score_match.group(1)))
-                        else:
-                            sentiment_score = 0.8
-                    elif isinstance(output, str) and 'NEGATIVE' in output:
-                        sentiment_type = "NEGATIVE"
-                        import re
-                        score_match = re.search(r"'score':\s*(-?\d+\.?\d*)", output)
-                        if score_match:
-                            sentiment_score = abs(float(score_match.group(1)))
-                        else:
-                            sentiment_score = 0.8
-                    elif isinstance(output, dict):
-                        sentiment_type = output.get('label', 'NEUTRAL').upper()
-                        sentiment_score = abs(output.get('score', 0.5))
-                except Exception:
-                    if 'POSITIVE' in str(output):
-                        sentiment_type = "POSITIVE"
-                        sentiment_score = 0.8
-                    elif 'NEGATIVE' in str(output):
-                        sentiment_type = "NEGATIVE"
-                        sentiment_score = 0.8
+            sentiment_type = result.sentiment_type
+            sentiment_score = result.sentiment_score
+            for stage, error in result.errors.items():
+                console.print(f"[yellow]⚠ {stage}: {error}[/yellow]")
             
             sentiment_color = {
                 'POSITIVE': 'green',
@@ -234,7 +267,6 @@ class SentimentCLI:
                 'NEUTRAL': '😐'
             }.get(sentiment_type, '😐')
             
-            console.print(f"\n[green]Assistant:[/green] {response_text}")
             console.print(f"[dim]Sentiment: [{sentiment_color}]{sentiment_emoji} {sentiment_type}[/{sentiment_color}] ({sentiment_score:.2f})[/dim]\n")
             
         except Exception as e:
@@ -246,9 +278,10 @@ class SentimentCLI:
         
         try:
             with console.status("[cyan]Generating session summary...[/cyan]"):
+                prepare_session_digest(self.context.user_id)
                 summary_result = self.global_analyzer.invoke({
                     "messages": [{"role": "user", "content": "Provide a comprehensive summary of this conversation session."}]
-                })
+                }, context=self.context)
             
             if isinstance(summary_result, dict):
                 if 'messages' in summary_result:
@@ -319,7 +352,7 @@ class SentimentCLI:
                 elif user_input.lower() == '/stats':
                     self.show_stats()
                 elif user_input.lower() == '/clear':
-                    clear_memory()
+                    clear_memory(self.context.user_id)
                     console.print("[green]✓ Short-term memory cleared![/green]")
                 else:
                     self.process_message(user_input)
@@ -332,6 +365,7 @@ class SentimentCLI:
 
 def main():
     try:
+        start_exporters()
         cli = SentimentCLI()
         cli.run()
     except Exception as e:
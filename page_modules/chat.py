@@ -1,23 +1,29 @@
 # Standard library imports
 import random
-from datetime import datetime
+import time
 
 # Third-party imports
 import streamlit as st
-from langsmith import traceable, Client
-from langsmith.run_helpers import get_current_run_tree
 
 # Local imports
+from chatapp.admission import AdmissionRejected, admission, turn_key
 from chatapp.agents import sentiment_agent, replier_agent, global_analyzer_agent
+from chatapp.diagnostics import diagnostics, json_size
 from chatapp.models import Context
 from chatapp.memory.shorttermmemory import clear_mood_shifts
+from chatapp.memory.sessiondigest import prepare_session_digest
+from chatapp.pipeline import stream_turn
+from chatapp.telemetry import telemetry, get_telemetry_stats
+from chatapp.turn import DEFAULT_USER
 
-try:
-    ls_client = Client()
-    LANGSMITH_ENABLED = True
-except Exception as e:
-    st.warning(f"LangSmith not configured: {e}")
-    LANGSMITH_ENABLED = False
+# Runs and examples are queued for the background exporter; nothing here waits on LangSmith.
+TELEMETRY_ENABLED = telemetry.enabled
+LANGSMITH_ENABLED = get_telemetry_stats()["sink"] == "langsmith"
+
+def session_user_id() -> str:
+    """Get the user id of this browser session (memory is stored per user)."""
+    context = st.session_state.get("context")
+    return context.user_id if context else DEFAULT_USER
 
 def get_sentiment_emoji(sentiment_type: str) -> str:
     """Get emoji based on sentiment type."""
@@ -37,119 +43,47 @@ def get_sentiment_color(sentiment_type: str) -> str:
     }
     return color_map.get(sentiment_type, "#6c757d")
 
-@traceable(name="sentiment_analysis", run_type="chain")
-def analyze_sentiment_with_tracking(prompt: str, user_id: str):
-    """Analyze sentiment with LangSmith tracking."""
-    try:
-        sentiment_result = st.session_state.sentiment_agent.invoke({
-            "messages": [{"role": "user", "content": f"Analyze the sentiment of this message and store it in memory: {prompt}"}]
-        },
-        {'context': {"user_id": user_id}}
-        )
-        
-        sentiment_type = "NEUTRAL"
-        sentiment_score = 0.5
-        
-        if isinstance(sentiment_result, dict) and 'output' in sentiment_result:
-            output = sentiment_result['output']
-            try:
-                if isinstance(output, str) and 'POSITIVE' in output:
-                    sentiment_type = "POSITIVE"
-                    import re
-                    score_match = re.search(r"'score':\s*(-?\d+\.?\d*)", output)
-                    if score_match:
-                        sentiment_score = abs(float(score_match.group(1)))
-                    else:
-                        sentiment_score = 0.8
-                elif isinstance(output, str) and 'NEGATIVE' in output:
-                    sentiment_type = "NEGATIVE"
-                    import re
-                    score_match = re.search(r"'score':\s*(-?\d+\.?\d*)", output)
-                    if score_match:
-                        sentiment_score = abs(float(score_match.group(1)))
-                    else:
-                        sentiment_score = 0.8
-                elif isinstance(output, dict):
-                    sentiment_type = output.get('label', 'NEUTRAL').upper()
-                    sentiment_score = abs(output.get('score', 0.5))
-            except Exception:
-                if 'POSITIVE' in str(output):
-                    sentiment_type = "POSITIVE"
-                    sentiment_score = 0.8
-                elif 'NEGATIVE' in str(output):
-                    sentiment_type = "NEGATIVE"
-                    sentiment_score = 0.8
-
-        if LANGSMITH_ENABLED:
-            run_tree = get_current_run_tree()
-            if run_tree:
-                run_tree.add_metadata({
-                    "sentiment_type": sentiment_type,
-                    "sentiment_score": sentiment_score,
-                    "user_id": user_id
-                })
-        
-        return sentiment_type, sentiment_score
-    
-    except Exception as e:
-        st.error(f"Sentiment analysis failed: {e}")
-        return "NEUTRAL", 0.5
-
-@traceable(name="response_generation", run_type="chain")
-def generate_response_with_tracking(prompt: str, sentiment_type: str, sentiment_score: float):
-    """Generate response with LangSmith tracking."""
-    try:
-        response_result = st.session_state.replier_agent.invoke({
-            "messages": [{"role": "user", "content": f"Generate a response to this message and store it in memory: {prompt}"}]
-        })
-        
-        response_text = "I apologize, but I couldn't generate a response."
-        if isinstance(response_result, dict):
-            if 'messages' in response_result:
-                for msg in reversed(response_result['messages']):
-                    if hasattr(msg, 'type') and msg.type == 'ai':
-                        if hasattr(msg, 'content'):
-                            if isinstance(msg.content, list):
-                                text_parts = []
-                                for content_block in msg.content:
-                                    if isinstance(content_block, dict) and 'text' in content_block:
-                                        text_parts.append(content_block['text'])
-                                response_text = ''.join(text_parts)
-                            else:
-                                response_text = str(msg.content)
-                        break
-                    elif hasattr(msg, 'role') and msg.role == 'assistant':
-                        if hasattr(msg, 'content'):
-                            if isinstance(msg.content, list):
-                                text_parts = []
-                                for content_block in msg.content:
-                                    if isinstance(content_block, dict) and 'text' in content_block:
-                                        text_parts.append(content_block['text'])
-                                response_text = ''.join(text_parts)
-                            else:
-                                response_text = str(msg.content)
-                        break
-            elif 'output' in response_result:
-                response_text = response_result['output']
+def admission_message(error: AdmissionRejected) -> str:
+    """Get the message shown when a turn is not admitted."""
+    if error.reason == "duplicate":
+        return "That message is already being answered."
+    return f"The assistant is busy right now, please try again in {error.retry_after:.0f}s."
 
-        if LANGSMITH_ENABLED:
-            run_tree = get_current_run_tree()
-            if run_tree:
-                run_tree.add_metadata({
-                    "input_sentiment": sentiment_type,
-                    "input_sentiment_score": sentiment_score,
-                    "response_length": len(response_text)
-                })
-        
-        return response_text
-    
-    except Exception as e:
-        st.error(f"Failed to generate response: {e}")
-        return "I apologize, but I couldn't generate a response."
+def stream_turn_with_tracking(prompt: str, user_id: str, on_exit=None):
+    """Stream one turn (sentiment and reply run concurrently) and queue its run for export."""
+    start_time = time.time()
+    for event in stream_turn(
+        prompt,
+        user_id,
+        sentiment_agent=st.session_state.sentiment_agent,
+        replier_agent=st.session_state.replier_agent,
+        sentiment_prompt=f"Analyze the sentiment of this message and store it in memory: {prompt}",
+        reply_prompt=f"Generate a response to this message and store it in memory: {prompt}",
+        on_exit=on_exit,
+    ):
+        if event.kind == "done" and TELEMETRY_ENABLED:
+            result = event.data
+            telemetry.record_run(
+                "chat_turn",
+                inputs={"prompt": prompt, "user_id": user_id},
+                outputs={"response": result.response_text},
+                metadata={
+                    "sentiment_type": result.sentiment_type,
+                    "sentiment_score": result.sentiment_score,
+                    "user_id": user_id,
+                    "response_length": len(result.response_text),
+                    "stage_seconds": result.stage_seconds,
+                    "ttft_seconds": result.ttft_seconds,
+                    "sentiment_fed_to_replier": result.sentiment_fed_to_replier,
+                },
+                start_time=start_time,
+                error="; ".join(f"{stage}: {error}" for stage, error in result.errors.items()) or None,
+            )
+        yield event
 
-@traceable(name="conversation_analysis", run_type="chain")
 def analyze_conversation_with_tracking(analysis_type: str):
-    """Analyze conversation with LangSmith tracking."""
+    """Analyze conversation and queue the analysis run for export."""
+    start_time = time.time()
     try:
         prompt = ""
         if analysis_type == "finish":
@@ -157,9 +91,11 @@ def analyze_conversation_with_tracking(analysis_type: str):
         else:
             prompt = "Please provide a comprehensive summary of this conversation session including overall sentiment trends, key topics, and user's emotional journey."
         
+        # Only the summaries not yet folded into the rolling digest are sent in full
+        prepare_session_digest(session_user_id())
         analysis_result = st.session_state.global_analyzer.invoke({
             "messages": [{"role": "user", "content": prompt}]
-        })
+        }, context=st.session_state.context)
         
         analysis_text = "Unable to generate analysis."
         if isinstance(analysis_result, dict):
@@ -190,15 +126,19 @@ def analyze_conversation_with_tracking(analysis_type: str):
             elif 'output' in analysis_result:
                 analysis_text = analysis_result['output']
         
-        # Log to LangSmith
-        if LANGSMITH_ENABLED:
-            run_tree = get_current_run_tree()
-            if run_tree:
-                run_tree.add_metadata({
+        # Log to LangSmith (via the background exporter)
+        if TELEMETRY_ENABLED:
+            telemetry.record_run(
+                "conversation_analysis",
+                inputs={"analysis_type": analysis_type},
+                outputs={"analysis": analysis_text},
+                metadata={
                     "analysis_type": analysis_type,
                     "total_messages": len(st.session_state.chat_history),
                     "session_id": st.session_state.context.user_id
-                })
+                },
+                start_time=start_time,
+            )
         
         return analysis_text
     
@@ -206,8 +146,8 @@ def analyze_conversation_with_tracking(analysis_type: str):
         raise e
 
 def log_session_metrics():
-    """Log session-level metrics to LangSmith."""
-    if not LANGSMITH_ENABLED:
+    """Log session-level metrics to the telemetry sink (LangSmith when configured)."""
+    if not TELEMETRY_ENABLED:
         return
     
     try:
@@ -220,7 +160,8 @@ def log_session_metrics():
         neutral_count = sentiments.count('NEUTRAL')
         
         # Create a dataset example for this session
-        ls_client.create_example(
+        telemetry.record_example(
+            dataset_name="chat_sessions",
             inputs={
                 "session_id": st.session_state.context.user_id,
                 "total_messages": len(st.session_state.chat_history),
@@ -233,8 +174,6 @@ def log_session_metrics():
                     "neutral": neutral_count
                 }
             },
-            dataset_name="chat_sessions",
-            created_at=datetime.now()
         )
     except Exception as e:
         st.warning(f"Failed to log session metrics: {e}")
@@ -244,8 +183,17 @@ def show_chat_page():
     st.title("💬 Chat with Sentiment Analysis")
     
     # LangSmith status indicator
-    if LANGSMITH_ENABLED:
-        st.sidebar.success("🔬 LangSmith Tracking: Active")
+    if TELEMETRY_ENABLED:
+        telemetry_stats = get_telemetry_stats()
+        if LANGSMITH_ENABLED:
+            st.sidebar.success("🔬 LangSmith Tracking: Active")
+        else:
+            st.sidebar.info(f"🔬 LangSmith Tracking: Disabled (telemetry to {telemetry_stats['sink']} sink)")
+        if telemetry_stats["dropped_full"] or telemetry_stats["dropped_sampled"]:
+            st.sidebar.caption(
+                f"Telemetry dropped: {telemetry_stats['dropped_full'] + telemetry_stats['dropped_sampled']} "
+                f"(queue {telemetry_stats['queue_depth']})"
+            )
     else:
         st.sidebar.warning("🔬 LangSmith Tracking: Disabled")
     
@@ -255,19 +203,15 @@ def show_chat_page():
     if 'context' not in st.session_state:
         user = random.randint(1000,9999)
         st.session_state.context = Context(user_id=str(user))
-        clear_mood_shifts()
+        clear_mood_shifts(str(user))
         
         # Log session start to LangSmith
-        if LANGSMITH_ENABLED:
-            try:
-                ls_client.create_run(
-                    name="chat_session_start",
-                    run_type="chain",
-                    inputs={"user_id": str(user)},
-                    extra={"session_start": datetime.now().isoformat()}
-                )
-            except Exception:
-                pass
+        if TELEMETRY_ENABLED:
+            telemetry.record_run(
+                "chat_session_start",
+                inputs={"user_id": str(user)},
+                metadata={"session_start": time.time()},
+            )
     
     if 'agents_initialized' not in st.session_state:
         with st.spinner("Initializing agents..."):
@@ -276,6 +220,11 @@ def show_chat_page():
             st.session_state.global_analyzer = global_analyzer_agent
             st.session_state.agents_initialized = True
     
+    if diagnostics.enabled:
+        # Per-session state grows with every rerun's history; the diagnostics page adds it up across sessions.
+        diagnostics.track_size("session:streamlit", st.session_state.context.user_id,
+                               json_size(st.session_state.chat_history))
+    
     with st.sidebar:
         st.markdown("### 📊 Current Session")
         st.metric("Session ID", st.session_state.context.user_id)
@@ -315,6 +264,8 @@ def show_chat_page():
                     
                     if LANGSMITH_ENABLED:
                         st.info("📊 Session data logged to LangSmith for analysis")
+                    elif TELEMETRY_ENABLED:
+                        st.info(f"📊 Session data exported to the {get_telemetry_stats()['sink']} telemetry sink")
                     
                 except Exception as e:
                     st.error(f"Failed to generate summary: {e}")
@@ -341,6 +292,15 @@ def show_chat_page():
     
     # Handle new messages
     if prompt := st.chat_input("Type your message here..."):
+        # A rerun interrupts the script, not the turn it started: the same message again is refused
+        # while that turn is still running, and a new one waits for it (one running turn per user).
+        user_id = st.session_state.context.user_id
+        try:
+            ticket = admission.request(user_id, key=turn_key(user_id, prompt))
+        except AdmissionRejected as e:
+            st.info(admission_message(e))
+            return
+        
         st.session_state.chat_history.append({
             'role': 'user',
             'content': prompt
@@ -349,38 +309,56 @@ def show_chat_page():
         with st.chat_message("user"):
             st.write(prompt)
         
-        # Analyze sentiment with tracking
-        with st.spinner("Analyzing sentiment..."):
-            sentiment_type, sentiment_score = analyze_sentiment_with_tracking(
-                prompt, 
-                st.session_state.context.user_id
-            )
-        
-        # Generate response with tracking
-        with st.spinner("Generating response..."):
-            response_text = generate_response_with_tracking(
-                prompt, 
-                sentiment_type, 
-                sentiment_score
-            )
-            
-            st.session_state.chat_history.append({
-                'role': 'assistant',
-                'content': response_text,
-                'sentiment_type': sentiment_type,
-                'sentiment_score': sentiment_score
-            })
+        # Sentiment analysis and response generation run concurrently; the reply is streamed
+        turn = {}
+        with st.chat_message("assistant"):
+            status = st.status("Analyzing sentiment and generating response...", expanded=False)
             
-            with st.chat_message("assistant"):
-                col1, col2 = st.columns([0.9, 0.1])
-                with col1:
-                    st.write(response_text)
-                with col2:
-                    emoji = get_sentiment_emoji(sentiment_type)
-                    st.markdown(
-                        f"<div style='text-align: center; font-size: 24px;'>{emoji}</div>",
-                        unsafe_allow_html=True
-                    )
-                st.caption(f"Sentiment: {sentiment_type} ({sentiment_score:.2f})")
+            with ticket:
+                if not ticket.admitted:
+                    status.update(label=f"Waiting for a free slot (position {ticket.position()})...", state="running")
+                    try:
+                        ticket.wait()
+                    except AdmissionRejected as e:
+                        status.update(label=admission_message(e), state="error")
+                        st.session_state.chat_history.pop()
+                        return
+                    status.update(label="Analyzing sentiment and generating response...", state="running")
+                
+                def reply_tokens():
+                    streamed = False
+                    # The turn's worker thread gives the slot back once it has stopped.
+                    for event in stream_turn_with_tracking(prompt, user_id, on_exit=ticket.hold()):
+                        if event.kind == "token":
+                            streamed = True
+                            yield event.data
+                        elif event.kind == "status":
+                            status.update(label=event.data, state="running")
+                        elif event.kind == "sentiment":
+                            status.update(label=f"Sentiment: {event.data['label']} ({event.data['score']:.2f})", state="running")
+                        elif event.kind == "done":
+                            turn['result'] = event.data
+                            if not streamed:
+                                # e.g. served from the response cache, so no tokens were produced
+                                yield event.data.response_text
+                
+                st.write_stream(reply_tokens())
+                result = turn['result']
+                emoji = get_sentiment_emoji(result.sentiment_type)
+                status.update(
+                    label=f"{emoji} Sentiment: {result.sentiment_type} ({result.sentiment_score:.2f})",
+                    state="error" if result.errors else "complete",
+                )
+        
+        for stage, error in result.errors.items():
+            st.error(f"{stage} failed: {error}")
+        
+        # Store the final text once the stream has completed
+        st.session_state.chat_history.append({
+            'role': 'assistant',
+            'content': result.response_text,
+            'sentiment_type': result.sentiment_type,
+            'sentiment_score': result.sentiment_score
+        })
         
         st.rerun()
\ No newline at end of file
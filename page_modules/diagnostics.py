@@ -0,0 +1,99 @@
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+from chatapp.diagnostics import diagnostics, get_memory_report
+
+MB = 1024 * 1024
+
+
+def show_diagnostics_page():
+    """Render the memory diagnostics page: RSS trend, memory per component, allocation sites, object counts."""
+    st.title("🩺 Memory Diagnostics")
+    st.markdown("Where this server's memory goes, per chat turn and per component")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if diagnostics.tracing:
+            if st.button("⏹️ Stop tracing", use_container_width=True):
+                diagnostics.stop()
+                st.rerun()
+        elif st.button("▶️ Start tracing", use_container_width=True,
+                       help="Traces allocations made from now on (slows the app down)"):
+            diagnostics.start()
+            st.rerun()
+    with col2:
+        refresh = st.button("📸 Take snapshot now", use_container_width=True)
+
+    report = get_memory_report(refresh=refresh)
+    if not report["tracing"]:
+        st.info("Allocation tracing is off: showing RSS, state sizes and object counts only. "
+                "Start tracing here or set DIAGNOSTICS_ENABLED=true.")
+
+    for warning in reversed(report["warnings"][-5:]):
+        st.warning(f"**{warning['component']}** went over its budget at turn {warning['turn']}: "
+                   f"{warning['bytes'] / MB:.1f} MB > {warning['budget'] / MB:.1f} MB")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("RSS", f"{report['rss']['current'] / MB:.1f} MB",
+                  f"{(report['rss']['current'] - report['rss']['start']) / MB:+.1f} MB since start", delta_color="inverse")
+    with col2:
+        st.metric("RSS per Turn", f"{report['rss']['per_turn'] / 1024:+.1f} KB")
+    with col3:
+        st.metric("Traced Memory", f"{report['traced']['current'] / MB:.1f} MB",
+                  f"{report['traced']['per_turn'] / 1024:+.1f} KB/turn", delta_color="inverse")
+    with col4:
+        st.metric("Turns", report["turns"])
+
+    st.markdown("---")
+
+    samples = report["samples"]
+    if samples:
+        st.subheader("Memory Trend")
+        trend = pd.DataFrame({
+            "Turn": [s["turn"] for s in samples],
+            "RSS (MB)": [s["rss"] / MB for s in samples],
+            "Traced (MB)": [s["traced"] / MB for s in samples],
+        })
+        fig = px.line(trend, x="Turn", y=["RSS (MB)", "Traced (MB)"], markers=True)
+        st.plotly_chart(fig, use_container_width=True)
+
+        objects = pd.DataFrame([{"Turn": s["turn"], **s["objects"]} for s in samples])
+        fig_objects = px.line(objects, x="Turn", y=[c for c in objects.columns if c != "Turn"], markers=True,
+                              title="Live Objects")
+        st.plotly_chart(fig_objects, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Memory by Component")
+        if report["components"]:
+            st.dataframe(pd.DataFrame([
+                {
+                    "Component": name,
+                    "Size (KB)": round(component["bytes"] / 1024, 1),
+                    "Budget (MB)": component["budget"] / MB if component["budget"] else None,
+                    "Over Budget": "⚠️" if component["over"] else "",
+                }
+                for name, component in report["components"].items()
+            ]), use_container_width=True, hide_index=True)
+        else:
+            st.write("No snapshot yet. Chat a little or take one now.")
+    with col2:
+        st.subheader("Live Objects")
+        for name, count in report["objects"].items():
+            st.metric(name, count)
+
+    if report["top_growth"]:
+        st.subheader(f"Fastest-Growing Allocation Sites (turn {report['snapshot_turn']})")
+        st.dataframe(pd.DataFrame([
+            {"Site": site["site"], "Growth (KB)": round(site["bytes_diff"] / 1024, 1),
+             "Blocks Added": site["blocks_diff"], "Total (KB)": round(site["bytes"] / 1024, 1)}
+            for site in report["top_growth"]
+        ]), use_container_width=True, hide_index=True)
+    if report["top_sites"]:
+        st.subheader("Largest Allocation Sites")
+        st.dataframe(pd.DataFrame([
+            {"Site": site["site"], "Size (KB)": round(site["bytes"] / 1024, 1), "Blocks": site["blocks"]}
+            for site in report["top_sites"]
+        ]), use_container_width=True, hide_index=True)
+    st.caption(f"Last snapshot took {report['snapshot_seconds'] * 1000:.0f} ms")
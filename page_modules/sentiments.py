@@ -1,8 +1,10 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from chatapp.analytics import all_chats as merge_chats, mood_overview, sentiment_overview
 from chatapp.memory.shorttermmemory import get_chats_from_memory
 from chatapp.memory.summarymemory import gethistory, get_summaries
+from page_modules.chat import session_user_id
 
 def show_sentiments_page():
     """Render the mood tracking and sentiment analytics page."""
@@ -14,21 +16,15 @@ def show_sentiments_page():
     with tab1:
         st.header("All Conversations Analysis")
         
-        history = gethistory()
-        all_chats = []
-        for session in history:
-            all_chats.extend(session)
-        
-        current_chats = get_chats_from_memory()
-        all_chats.extend(current_chats)
+        all_chats = merge_chats(gethistory(session_user_id()), get_chats_from_memory(session_user_id()))
+        overview = sentiment_overview(all_chats)
         
         if all_chats:
             col1, col2, col3 = st.columns(3)
             
-            total_messages = len(all_chats)
-            avg_sentiment = sum(chat.sentiment_score for chat in all_chats) / total_messages
-            sentiment_types = [chat.sentiment_type for chat in all_chats]
-            dominant_sentiment = max(set(sentiment_types), key=sentiment_types.count)
+            total_messages = overview["total"]
+            avg_sentiment = overview["average_score"]
+            dominant_sentiment = overview["dominant"]
             
             with col1:
                 st.metric("Total Messages", total_messages)
@@ -40,10 +36,10 @@ def show_sentiments_page():
             st.markdown("---")
             
             st.subheader("Sentiment Trend Over Time (All Conversations)")
-            sentiment_data = pd.DataFrame([
-                {"Message": i+1, "Sentiment Value": 1 if chat.sentiment_type in ['POSITIVE', 'POS'] else (-1 if chat.sentiment_type in ['NEGATIVE', 'NEG'] else 0)}
-                for i, chat in enumerate(all_chats)
-            ])
+            sentiment_data = pd.DataFrame({
+                "Message": range(1, total_messages + 1),
+                "Sentiment Value": overview["trend"],
+            })
             fig_line = px.line(sentiment_data, x="Message", y="Sentiment Value", 
                               markers=True, title="Sentiment Trend")
             fig_line.update_yaxes(range=[-1, 1])
@@ -53,7 +49,7 @@ def show_sentiments_page():
             
             with col1:
                 st.subheader("Sentiment Distribution")
-                sentiment_counts = pd.Series(sentiment_types).value_counts()
+                sentiment_counts = pd.Series(overview["counts"])
                 fig_bar = px.bar(x=sentiment_counts.index, y=sentiment_counts.values,
                                 labels={'x': 'Sentiment Type', 'y': 'Count'},
                                 color=sentiment_counts.index,
@@ -103,15 +99,8 @@ def show_sentiments_page():
     with tab2:
         st.header("Mood Shift Analysis (All History)")
         
-        all_historical_chats = []
-        history = gethistory()
-        for session in history:
-            all_historical_chats.extend(session)
-        current_chats = get_chats_from_memory()
-        all_historical_chats.extend(current_chats)
-        
         from chatapp.memory.shorttermmemory import get_mood_shifts
-        mood_shifts = get_mood_shifts()
+        mood_shifts = get_mood_shifts(session_user_id())
         
         if mood_shifts:
             col1, col2, col3 = st.columns(3)
@@ -154,8 +143,8 @@ def show_sentiments_page():
     with tab3:
         st.header("Historical Trends")
         
-        summaries = get_summaries()
-        history = gethistory()
+        summaries = get_summaries(session_user_id())
+        history = gethistory(session_user_id())
         
         if history:
             st.subheader("📜 All Historical Chats")
@@ -185,19 +174,18 @@ def show_sentiments_page():
             st.markdown("---")
         
         if summaries:
+            moods = mood_overview(summaries)
             col1, col2 = st.columns(2)
             
             with col1:
-                st.metric("Total Sessions", len(summaries))
+                st.metric("Total Sessions", moods["sessions"])
             with col2:
-                moods = [s.general_mood for s in summaries]
-                dominant_mood = max(set(moods), key=moods.count)
-                st.metric("Most Common Mood", dominant_mood)
+                st.metric("Most Common Mood", moods["dominant"])
             
             st.markdown("---")
             
             st.subheader("Mood Distribution Across Sessions")
-            mood_counts = pd.Series(moods).value_counts()
+            mood_counts = pd.Series(moods["counts"])
             fig_bar = px.bar(x=mood_counts.index, y=mood_counts.values,
                             labels={'x': 'Mood', 'y': 'Count'},
                             color=mood_counts.index,
@@ -3,6 +3,7 @@ import json
 from chatapp.memory.shorttermmemory import get_chats_from_memory, clear_memory, get_mood_shifts
 from chatapp.memory.longtermmemory import store
 from chatapp.memory.summarymemory import get_summaries, clear_summaries
+from page_modules.chat import session_user_id
 
 def show_home_page():
     """Render the home dashboard page."""
@@ -17,9 +18,9 @@ def show_home_page():
     
     col1, col2, col3, col4 = st.columns(4)
     
-    chats = get_chats_from_memory()
-    summaries = get_summaries()
-    mood_shifts = get_mood_shifts()
+    chats = get_chats_from_memory(session_user_id())
+    summaries = get_summaries(session_user_id())
+    mood_shifts = get_mood_shifts(session_user_id())
     
     with col1:
         st.metric("Current Session Messages", len(chats))
@@ -93,8 +94,8 @@ def show_home_page():
     
     with st.container():
         if st.button("🗑️ Clear History", use_container_width=True, type="secondary"):
-            clear_memory()
-            clear_summaries()
+            clear_memory(session_user_id())
+            clear_summaries(session_user_id())
             st.success("History cleared!")
             st.rerun()
 
@@ -110,7 +111,7 @@ def show_memory_page():
         st.header("Short-Term Memory")
         st.caption("Stores the last 5 conversations")
         
-        chats = get_chats_from_memory()
+        chats = get_chats_from_memory(session_user_id())
         
         if chats:
             capacity = len(chats)
@@ -143,7 +144,7 @@ def show_memory_page():
                     st.markdown("---")
             
             if st.button("🗑️ Clear Short-Term Memory", type="secondary"):
-                clear_memory()
+                clear_memory(session_user_id())
                 st.success("Short-term memory cleared!")
                 st.rerun()
         else:
@@ -154,7 +155,7 @@ def show_memory_page():
         st.caption("Persistent user profile and preferences")
         
         try:
-            user_data = store.get(("users",), "default_user")
+            user_data = store.get(("users",), session_user_id())
             
             if user_data and user_data.value:
                 st.success("✅ User profile found")
@@ -187,7 +188,7 @@ def show_memory_page():
         st.header("Conversation Summaries")
         st.caption("Historical conversation summaries and insights")
         
-        summaries = get_summaries()
+        summaries = get_summaries(session_user_id())
         
         if summaries:
             col1, col2 = st.columns(2)
@@ -244,7 +245,7 @@ def show_memory_page():
             
             with col2:
                 if st.button("🗑️ Clear All Summaries", type="secondary"):
-                    clear_summaries()
+                    clear_summaries(session_user_id())
                     st.success("All summaries cleared!")
                     st.rerun()
         else:
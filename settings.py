@@ -2,13 +2,169 @@ from dotenv import load_dotenv
 import os
 load_dotenv()
 
+def _mapping(value: str) -> dict:
+    """Parse "name=number,name=number" settings into a dict of floats."""
+    parsed = {}
+    for part in value.split(","):
+        if "=" in part:
+            name, number = part.split("=", 1)
+            parsed[name.strip()] = float(number)
+    return parsed
+
 class settings:
+    # Stub mode replaces Gemini, Tavily and the classifier with local fakes (chatapp/stubs.py)
+    STUB_MODE = os.getenv("STUB_MODE", "").lower() in ("1", "true", "yes")
+    # Latency specs for the fakes: "none", "fixed:S", "uniform:LO,HI" or "lognormal:MEDIAN,SIGMA" (seconds)
+    STUB_GEMINI_LATENCY = os.getenv("STUB_GEMINI_LATENCY", "lognormal:0.6,0.4")
+    STUB_TAVILY_LATENCY = os.getenv("STUB_TAVILY_LATENCY", "lognormal:0.4,0.5")
+    STUB_CLASSIFIER_LATENCY = os.getenv("STUB_CLASSIFIER_LATENCY", "fixed:0.02")
+    # Fraction of stub calls that fail with a 503 (exercises retries and the circuit breaker)
+    STUB_GEMINI_ERROR_RATE = float(os.getenv("STUB_GEMINI_ERROR_RATE", "0"))
+    STUB_TAVILY_ERROR_RATE = float(os.getenv("STUB_TAVILY_ERROR_RATE", "0"))
+
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if GEMINI_API_KEY is None:
+    if GEMINI_API_KEY is None and not STUB_MODE:
         raise ValueError("GEMINI_API_KEY is not set in environment variables.")
     TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
-    if TAVILY_API_KEY is None:
+    if TAVILY_API_KEY is None and not STUB_MODE:
         raise ValueError("TAVILY_API_KEY is not set in environment variables.")
 
+    # LLM response cache: "memory", "off" or "disk" (opt-in: persists responses and transcripts to LLM_CACHE_PATH)
+    LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_responses.sqlite3")
+    LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+    # Responses that used web_search get this TTL instead; 0 disables caching them
+    LLM_CACHE_SEARCH_TTL = float(os.getenv("LLM_CACHE_SEARCH_TTL", "0"))
+    # Optional similarity tier (token Jaccard threshold, e.g. 0.9); empty disables it
+    LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY")) if os.getenv("LLM_CACHE_SIMILARITY") else None
+
+    # In-process latency metrics (chatapp/metrics.py)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    # Port for the /metrics (Prometheus) and /metrics.json endpoint; 0 disables it
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    # Periodic JSON snapshot file; empty disables it
+    METRICS_SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH", "")
+    METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "60"))
+
+    # Gemini call scheduler (chatapp/scheduler.py): shared quota and per-class concurrency
+    GEMINI_RPM = float(os.getenv("GEMINI_RPM", "1000"))
+    GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+    GEMINI_CLASS_CONCURRENCY = os.getenv("GEMINI_CLASS_CONCURRENCY", "interactive=16,sentiment=16,summary=2,analytics=2")
+    # Seconds a call may wait for a slot before failing
+    GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "30"))
+
+    # Resilience (chatapp/resilience.py): attempts per call, hedging after the recent p95, circuit breaker
+    GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+    GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() in ("1", "true", "yes")
+    TAVILY_MAX_ATTEMPTS = int(os.getenv("TAVILY_MAX_ATTEMPTS", "3"))
+    TAVILY_HEDGE = os.getenv("TAVILY_HEDGE", "true").lower() in ("1", "true", "yes")
+    # Seconds one attempt may take; only such full-length timeouts count against the breaker
+    GEMINI_ATTEMPT_TIMEOUT = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "30"))
+    TAVILY_ATTEMPT_TIMEOUT = float(os.getenv("TAVILY_ATTEMPT_TIMEOUT", "10"))
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+    # Per-run agent budgets (chatapp/budget.py): wall seconds, tokens and model calls per agent run
+    AGENT_TIME_BUDGETS = _mapping(os.getenv("AGENT_TIME_BUDGETS", "sentiment=30,replier=45,global_analyzer=60"))
+    AGENT_TOKEN_BUDGETS = _mapping(os.getenv("AGENT_TOKEN_BUDGETS", "sentiment=12000,replier=20000,global_analyzer=40000"))
+    AGENT_CALL_BUDGETS = _mapping(os.getenv("AGENT_CALL_BUDGETS", "sentiment=5,replier=5,global_analyzer=2"))
+
+    # Long-term memory extraction (chatapp/memory/extraction.py): confirm local candidates with Gemini,
+    # and the optional spaCy model used for names and places ("" to use patterns only)
+    MEMORY_EXTRACTION_LLM = os.getenv("MEMORY_EXTRACTION_LLM", "true").lower() in ("1", "true", "yes")
+    MEMORY_NER_MODEL = os.getenv("MEMORY_NER_MODEL", "en_core_web_sm")
+
+    # Short-term window: summarize once it reaches SHORT_TERM_TOKEN_BUDGET tokens (also the short-term
+    # prompt section budget), SHORT_TERM_MAX_CHATS chats or SHORT_TERM_MAX_AGE seconds
+    SHORT_TERM_TOKEN_BUDGET = int(os.getenv("SHORT_TERM_TOKEN_BUDGET", "900"))
+    SHORT_TERM_MAX_CHATS = int(os.getenv("SHORT_TERM_MAX_CHATS", "12"))
+    SHORT_TERM_MAX_AGE = float(os.getenv("SHORT_TERM_MAX_AGE", "1800"))
+    # Per-user caps on the append-only memory documents: mood shifts kept, summarized windows kept in history
+    MOOD_SHIFTS_MAX = int(os.getenv("MOOD_SHIFTS_MAX", "500"))
+    HISTORY_MAX_WINDOWS = int(os.getenv("HISTORY_MAX_WINDOWS", "200"))
+    # Rendered memory blocks kept for reuse across turns (one per prompt variant and user, least recent evicted)
+    PROMPT_CONTEXT_CACHE_SIZE = int(os.getenv("PROMPT_CONTEXT_CACHE_SIZE", "1024"))
+
+    # Rolling session digest (chatapp/memory/sessiondigest.py): fold each window summary in the background,
+    # and map-reduce the unfolded tail in chunks once it reaches SESSION_DIGEST_MAP_REDUCE_MIN summaries
+    SESSION_DIGEST_ENABLED = os.getenv("SESSION_DIGEST_ENABLED", "true").lower() in ("1", "true", "yes")
+    SESSION_DIGEST_MAX_WORDS = int(os.getenv("SESSION_DIGEST_MAX_WORDS", "250"))
+    SESSION_DIGEST_CHUNK_SIZE = int(os.getenv("SESSION_DIGEST_CHUNK_SIZE", "4"))
+    SESSION_DIGEST_MAP_REDUCE_MIN = int(os.getenv("SESSION_DIGEST_MAP_REDUCE_MIN", "6"))
+    # Background folds: users folded side by side, and users that may wait for a fold before new ones are skipped
+    SESSION_DIGEST_FOLD_WORKERS = int(os.getenv("SESSION_DIGEST_FOLD_WORKERS", "4"))
+    SESSION_DIGEST_MAX_QUEUED = int(os.getenv("SESSION_DIGEST_MAX_QUEUED", "1000"))
+
+    # Tool calls from one model message run side by side (chatapp/toolexec.py)
+    TOOL_PARALLEL = os.getenv("TOOL_PARALLEL", "true").lower() in ("1", "true", "yes")
+    # At most this many tool calls of one model message at once
+    TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "4"))
+
+    # Shared per-user session state (chatapp/state.py): "memory" (this process) or "redis"
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+    STATE_SHARDS = int(os.getenv("STATE_SHARDS", "16"))
+    # Comma-separated URLs shard users across servers; "fake://" uses the in-process stand-in
+    STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+    STATE_REDIS_PREFIX = os.getenv("STATE_REDIS_PREFIX", "chatapp")
+    STATE_MAX_RETRIES = int(os.getenv("STATE_MAX_RETRIES", "8"))
+
+    # Classifier calls from all callers are scored in batches (chatapp/tools/sentimentanalysis.py)
+    CLASSIFIER_MAX_BATCH = int(os.getenv("CLASSIFIER_MAX_BATCH", "32"))
+    CLASSIFIER_BATCH_WAIT = float(os.getenv("CLASSIFIER_BATCH_WAIT", "0.005"))
+    # Seconds a caller waits for its text to be scored before giving up
+    CLASSIFIER_RESULT_TIMEOUT = float(os.getenv("CLASSIFIER_RESULT_TIMEOUT", "30"))
+
+    # HTTP API (api.py): bind address, uvicorn worker processes and engine threads per process
+    API_HOST = os.getenv("API_HOST", "127.0.0.1")
+    API_PORT = int(os.getenv("API_PORT", "8000"))
+    API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+    API_ENGINE_THREADS = int(os.getenv("API_ENGINE_THREADS", "32"))
+    # Streamed turns are cancelled when the client falls this many events behind
+    STREAM_MAX_PENDING_EVENTS = int(os.getenv("STREAM_MAX_PENDING_EVENTS", "512"))
+    # Bulk sentiment (POST /sentiment/batch): texts per request, characters per text, texts in flight
+    BULK_MAX_TEXTS = int(os.getenv("BULK_MAX_TEXTS", "10000"))
+    BULK_MAX_TEXT_CHARS = int(os.getenv("BULK_MAX_TEXT_CHARS", "2000"))
+    BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "256"))
+    # NDJSON bulk uploads: bytes per line (a text at the worst JSON escaping, plus its id) and bytes per body
+    BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(BULK_MAX_TEXT_CHARS * 12 + 1024)))
+    BULK_MAX_BODY_BYTES = int(os.getenv("BULK_MAX_BODY_BYTES", str(64 * 2 ** 20)))
+    # Admission control (chatapp/admission.py): turns running at once (overall and per user),
+    # turns waiting (overall and per user), seconds a turn may wait, Retry-After sent on rejection
+    ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+    ADMISSION_PER_USER = int(os.getenv("ADMISSION_PER_USER", "1"))
+    ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "32"))
+    ADMISSION_USER_QUEUED = int(os.getenv("ADMISSION_USER_QUEUED", "1"))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+    ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+    # Session record/replay (chatapp/replay.py): directory for per-user trace files (empty: off),
+    # fraction of users recorded
+    TRACE_RECORD_DIR = os.getenv("TRACE_RECORD_DIR", "")
+    TRACE_RECORD_RATE = float(os.getenv("TRACE_RECORD_RATE", "1.0"))
+
+    # Memory diagnostics (chatapp/diagnostics.py): tracemalloc snapshots every DIAGNOSTICS_EVERY turns,
+    # traceback depth, allocation sites reported, per-component budgets in MB ("rss", "state:<document>",
+    # "code:<module>", "session:streamlit")
+    DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "false").lower() in ("1", "true", "yes")
+    DIAGNOSTICS_EVERY = int(os.getenv("DIAGNOSTICS_EVERY", "1"))
+    DIAGNOSTICS_FRAMES = int(os.getenv("DIAGNOSTICS_FRAMES", "10"))
+    DIAGNOSTICS_TOP_SITES = int(os.getenv("DIAGNOSTICS_TOP_SITES", "10"))
+    DIAGNOSTICS_BUDGETS = _mapping(os.getenv(
+        "DIAGNOSTICS_BUDGETS", "rss=2048,state:history=256,state:mood_shifts=64,session:streamlit=64"))
+
+    # Telemetry export (chatapp/telemetry.py): "auto" (LangSmith if configured, else off), "langsmith", "file", "http" or "off"
+    TELEMETRY_SINK = os.getenv("TELEMETRY_SINK", "auto")
+    TELEMETRY_FILE = os.getenv("TELEMETRY_FILE", ".cache/telemetry.jsonl")
+    # The file sink moves the file to TELEMETRY_FILE.1 at this size (0 never rotates)
+    TELEMETRY_FILE_MAX_BYTES = int(os.getenv("TELEMETRY_FILE_MAX_BYTES", str(10 * 2 ** 20)))
+    TELEMETRY_HTTP_URL = os.getenv("TELEMETRY_HTTP_URL", "http://127.0.0.1:8765/telemetry")
+    TELEMETRY_QUEUE_SIZE = int(os.getenv("TELEMETRY_QUEUE_SIZE", "1000"))
+    TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "50"))
+    TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "2"))
+    # Fraction of sampled events kept once the queue is 80% full
+    TELEMETRY_SAMPLE_RATE = float(os.getenv("TELEMETRY_SAMPLE_RATE", "0.1"))
+
 
 config = settings()
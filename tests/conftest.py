@@ -0,0 +1,43 @@
+"""
+Shared setup for the tests: everything runs offline against the stand-ins in
+chatapp/stubs.py, with no artificial latency, no response cache, telemetry off
+and memory extraction limited to the local patterns. Settings are read when
+settings.py is imported, so the environment is fixed here, before any import.
+"""
+import os
+
+os.environ.update({
+    "STUB_MODE": "1",
+    "STUB_GEMINI_LATENCY": "none",
+    "STUB_TAVILY_LATENCY": "none",
+    "STUB_CLASSIFIER_LATENCY": "none",
+    "STUB_GEMINI_ERROR_RATE": "0",
+    "STUB_TAVILY_ERROR_RATE": "0",
+    "LLM_CACHE_BACKEND": "off",
+    "TELEMETRY_SINK": "off",
+    "TRACE_RECORD_DIR": "",
+    "METRICS_PORT": "0",
+    "METRICS_SNAPSHOT_PATH": "",
+    "MEMORY_EXTRACTION_LLM": "false",
+    "MEMORY_NER_MODEL": "",
+    "STATE_BACKEND": "memory",
+})
+
+import pytest  # noqa: E402
+
+from chatapp import state  # noqa: E402
+from chatapp.memory import shorttermmemory  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _mood_shifts_file(tmp_path_factory):
+    # save_mood_shifts (also run at exit) writes relative to the working directory; keep it out of the repo.
+    shorttermmemory.MOOD_SHIFTS_FILE = str(tmp_path_factory.mktemp("state") / "mood_shifts.json")
+
+
+@pytest.fixture
+def fresh_state(monkeypatch):
+    """An empty in-process state backend for the test."""
+    backend = state.InProcessBackend(shards=4)
+    monkeypatch.setattr(state, "backend", backend)
+    return backend
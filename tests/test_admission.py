@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+import pytest
+
+from chatapp.admission import AdmissionController, AdmissionRejected
+
+
+@pytest.fixture
+def controller():
+    return AdmissionController(max_concurrent=2, per_user=1, max_queued=2, user_queued=1, queue_timeout=0.2,
+                               retry_after=3.0)
+
+
+def test_admits_up_to_the_limits_and_queues_the_rest(controller):
+    first = controller.request("a")
+    second = controller.request("b")
+    assert first.admitted and second.admitted
+    third = controller.request("c")
+    assert not third.admitted
+    assert third.position() == 1
+    first.release()
+    assert third.admitted
+    assert controller.stats()["running"] == 2
+
+
+def test_per_user_limit(controller):
+    running = controller.request("a")
+    queued = controller.request("a")
+    assert not queued.admitted
+    other = controller.request("b")
+    # Another user is not held up behind the queued turn.
+    assert other.admitted
+    running.release()
+    assert queued.admitted
+
+
+def test_rejects_when_the_queue_is_full(controller):
+    controller.request("a")
+    controller.request("b")
+    controller.request("c")
+    controller.request("d")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.request("e")
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after == 3.0
+
+
+def test_rejects_a_second_queued_turn_of_the_same_user(controller):
+    controller.request("a")
+    controller.request("a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.request("a")
+    assert rejected.value.reason == "user_queue_full"
+
+
+def test_rejects_duplicates_until_released(controller):
+    ticket = controller.request("a", key=("a", "hello"))
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.request("a", key=("a", "hello"))
+    assert rejected.value.reason == "duplicate"
+    ticket.release()
+    controller.request("a", key=("a", "hello")).release()
+
+
+def test_wait_times_out_and_leaves_the_queue(controller):
+    controller.request("a")
+    controller.request("b")
+    waiting = controller.request("c")
+    with pytest.raises(AdmissionRejected) as rejected:
+        waiting.wait(0.05)
+    assert rejected.value.reason == "timeout"
+    stats = controller.stats()
+    assert stats["queue_depth"] == 0 and stats["timeouts"] == 1
+
+
+def test_wait_returns_once_a_slot_frees_up(controller):
+    running = [controller.request("a"), controller.request("b")]
+    waiting = controller.request("c")
+    threading.Timer(0.05, running[0].release).start()
+    assert waiting.wait(1.0).admitted
+
+
+def test_release_is_idempotent_and_hands_the_slot_on(controller):
+    running = [controller.request("a"), controller.request("b")]
+    waiting = [controller.request("c"), controller.request("d")]
+    running[0].release()
+    running[0].release()
+    assert waiting[0].admitted and not waiting[1].admitted
+    assert controller.stats()["running"] == 2
+
+
+def test_releasing_a_queued_ticket_withdraws_it(controller):
+    controller.request("a")
+    controller.request("b")
+    waiting = controller.request("c")
+    waiting.release()
+    assert controller.stats()["queue_depth"] == 0
+
+
+def test_held_ticket_survives_the_with_block(controller):
+    ticket = controller.request("a")
+    with ticket:
+        release = ticket.hold()
+    assert controller.stats()["running"] == 1
+    release()
+    assert controller.stats()["running"] == 0
+
+
+def test_queued_reports_positions_on_the_event_loop(controller):
+    running = [controller.request("a"), controller.request("b")]
+    waiting = controller.request("c")
+
+    async def wait_for_slot():
+        asyncio.get_running_loop().call_later(0.05, running[0].release)
+        return [position async for position in waiting.queued(timeout=1.0, poll=0.01)]
+
+    assert asyncio.run(wait_for_slot()) == [1]
+    assert waiting.admitted
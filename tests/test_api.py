@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import json
+import threading
+import types
+import uuid
+from concurrent.futures import Future
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from chatapp import pipeline
+from chatapp.admission import AdmissionController
+from chatapp.pipeline import TurnEvent
+from settings import config
+
+NDJSON = {"content-type": "application/x-ndjson"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(api.app) as client:
+        yield client
+
+
+def rows(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_bulk_ndjson_scores_every_line_in_order(client):
+    body = b'"great news"\n\n{"id": "b", "text": "awful day"}\n12\n"last line without a newline"'
+    response = client.post("/sentiment/batch", content=body, headers=NDJSON)
+    assert response.status_code == 200
+    results = rows(response)
+    assert [row["index"] for row in results] == [0, 1, 2, 3]
+    assert results[0]["label"] == "POSITIVE"
+    assert results[1]["id"] == "b" and results[1]["label"] == "NEGATIVE"
+    assert "error" in results[2]
+    assert "label" in results[3]
+
+
+def test_bulk_ndjson_rejects_an_oversized_line_with_413(client, monkeypatch):
+    monkeypatch.setattr(config, "BULK_MAX_LINE_BYTES", 100)
+    response = client.post("/sentiment/batch", content=b'"' + b"a" * 200 + b'"\n', headers=NDJSON)
+    assert response.status_code == 413
+
+
+def test_bulk_ndjson_rejects_a_line_that_never_ends(client, monkeypatch):
+    monkeypatch.setattr(config, "BULK_MAX_LINE_BYTES", 100)
+    response = client.post("/sentiment/batch", content=(b"a" * 50 for _ in range(10)), headers=NDJSON)
+    assert response.status_code == 413
+
+
+def test_bulk_ndjson_rejects_an_oversized_body_with_413(client, monkeypatch):
+    monkeypatch.setattr(config, "BULK_MAX_BODY_BYTES", 1000)
+    response = client.post("/sentiment/batch", content=b'"fine"\n' * 500, headers=NDJSON)
+    assert response.status_code == 413
+
+
+def test_bulk_ndjson_ends_with_an_error_line_once_results_were_sent(client, monkeypatch):
+    monkeypatch.setattr(config, "BULK_MAX_LINE_BYTES", 100)
+    monkeypatch.setattr(config, "BULK_MAX_IN_FLIGHT", 1)
+    body = f'"fine {uuid.uuid4().hex}"\n'.encode() + b'"' + b"a" * 200 + b'"\n'
+    response = client.post("/sentiment/batch", content=body, headers=NDJSON)
+    assert response.status_code == 200
+    results = rows(response)
+    assert "label" in results[0]
+    assert results[-1] == {"index": 1, "error": "NDJSON line longer than 100 bytes"}
+
+
+def test_bulk_ndjson_stops_after_max_texts(client, monkeypatch):
+    monkeypatch.setattr(config, "BULK_MAX_TEXTS", 2)
+    response = client.post("/sentiment/batch", content=b'"a"\n"b"\n"c"\n"d"\n', headers=NDJSON)
+    results = rows(response)
+    assert len(results) == 3
+    assert results[-1]["error"] == "more than 2 texts"
+
+
+def test_bulk_json_rejects_too_many_texts(client, monkeypatch):
+    monkeypatch.setattr(config, "BULK_MAX_TEXTS", 2)
+    response = client.post("/sentiment/batch", json={"texts": ["a", "b", "c"]})
+    assert response.status_code == 413
+
+
+def test_bulk_cancels_queued_texts_when_the_client_goes_away(monkeypatch):
+    from chatapp.tools.sentimentanalysis import batcher
+
+    submitted = []
+
+    def submit(text):
+        # Never scored: the request is abandoned while these are still queued.
+        submitted.append(Future())
+        return submitted[-1]
+
+    monkeypatch.setattr(batcher, "submit", submit)
+    monkeypatch.setattr(config, "BULK_MAX_IN_FLIGHT", 10)
+
+    async def items():
+        for index in range(5):
+            yield index, None, f"text {index}", None
+
+    async def disconnect():
+        lines = api.score_bulk(items())
+        reading = asyncio.ensure_future(anext(lines))
+        await asyncio.sleep(0.05)
+        reading.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await reading
+        await lines.aclose()
+
+    asyncio.run(disconnect())
+    assert len(submitted) == 5
+    assert all(future.cancelled() for future in submitted)
+
+
+def make_stream(controller, stream_turn, monkeypatch) -> api.TurnStream:
+    monkeypatch.setattr(pipeline, "stream_turn", stream_turn)
+    ticket = controller.request("u1")
+    agents = types.SimpleNamespace(sentiment_agent=None, replier_agent=None)
+    return api.TurnStream("hello", "u1", agents, "sse", ticket)
+
+
+def test_turn_stream_cancels_a_reader_that_stopped_reading(monkeypatch):
+    monkeypatch.setattr(config, "STREAM_MAX_PENDING_EVENTS", 20)
+    controller = AdmissionController()
+    exited = threading.Event()
+
+    def chatty_turn(message, user_id, cancel=None, on_exit=None, **kwargs):
+        try:
+            for _ in range(1000):
+                if cancel.is_set():
+                    break
+                yield TurnEvent("token", "x")
+            yield TurnEvent("done", None)
+        finally:
+            on_exit()
+            exited.set()
+
+    async def read_once_then_stall():
+        stream = make_stream(controller, chatty_turn, monkeypatch)
+        events = stream.events()
+        await events.__anext__()
+        # The reader never comes back; the producer has to notice on its own.
+        assert await asyncio.to_thread(exited.wait, 2.0)
+        assert stream.cancel.is_set()
+        await events.aclose()
+
+    asyncio.run(read_once_then_stall())
+    assert controller.stats()["running"] == 0
+
+
+def test_turn_stream_releases_the_slot_when_the_turn_fails_to_start(monkeypatch):
+    controller = AdmissionController()
+
+    def broken_turn(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    async def read_all():
+        stream = make_stream(controller, broken_turn, monkeypatch)
+        return [event async for event in stream.events()]
+
+    events = asyncio.run(read_all())
+    assert events == [("error", {"stage": "turn", "error": "boom"})]
+    assert controller.stats()["running"] == 0
@@ -0,0 +1,27 @@
+import time
+
+from chatapp.cache import DiskCacheBackend
+
+
+def test_disk_backend_prunes_once_past_the_slack(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / "responses.sqlite3"), max_entries=10, prune_slack=5)
+    expires_at = time.time() + 60
+    for i in range(15):
+        backend.set(f"k{i}", f"v{i}", expires_at, "scope", None)
+    # Up to max_entries + prune_slack rows are kept without pruning.
+    assert len(backend) == 15
+    backend.set("k15", "v15", expires_at, "scope", None)
+    assert len(backend) == 10
+    # The least recently used rows went first.
+    assert backend.get("k5") is None
+    assert backend.get("k15") == "v15"
+
+
+def test_disk_backend_prunes_expired_rows_first(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / "responses.sqlite3"), max_entries=4, prune_slack=1)
+    for i in range(3):
+        backend.set(f"old{i}", "v", time.time() - 1, "scope", None)
+    for i in range(3):
+        backend.set(f"new{i}", "v", time.time() + 60, "scope", None)
+    assert len(backend) == 3
+    assert all(backend.get(f"new{i}") == "v" for i in range(3))
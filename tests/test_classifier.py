@@ -0,0 +1,54 @@
+import pytest
+
+from chatapp.tools import sentimentanalysis
+from chatapp.tools.sentimentanalysis import ClassifierBatcher
+
+
+@pytest.fixture
+def batcher():
+    return ClassifierBatcher(max_batch=4, max_wait=0.001)
+
+
+def test_scores_texts(batcher):
+    assert batcher.submit("what a great day").result(timeout=2)[0] == "POS"
+
+
+def test_model_error_fails_the_batch_and_keeps_the_worker(batcher, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("model failed")
+
+    classifier = sentimentanalysis.get_classifier()
+    monkeypatch.setattr(sentimentanalysis, "get_classifier", lambda: broken)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.submit("hello").result(timeout=2)
+    monkeypatch.setattr(sentimentanalysis, "get_classifier", lambda: classifier)
+    assert batcher.submit("what a great day").result(timeout=2)[0] == "POS"
+
+
+def test_missing_results_fail_instead_of_hanging(batcher, monkeypatch):
+    monkeypatch.setattr(sentimentanalysis, "get_classifier", lambda: lambda texts, **kwargs: [])
+    with pytest.raises(RuntimeError, match="not scored"):
+        batcher.submit("hello").result(timeout=2)
+
+
+def test_cancelled_texts_do_not_kill_the_worker(batcher):
+    abandoned = batcher.submit("nobody waits for this")
+    abandoned.cancel()
+    assert batcher.submit("what a great day").result(timeout=2)[0] == "POS"
+    assert batcher._worker.is_alive()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_worker_is_restarted(batcher, monkeypatch):
+    classifier = sentimentanalysis.get_classifier()
+
+    def dying():
+        monkeypatch.setattr(sentimentanalysis, "get_classifier", lambda: classifier)
+        raise SystemExit
+
+    monkeypatch.setattr(sentimentanalysis, "get_classifier", dying)
+    with pytest.raises(RuntimeError, match="not scored"):
+        batcher.submit("hello").result(timeout=2)
+    batcher._worker.join(2)
+    assert batcher.submit("what a great day").result(timeout=2)[0] == "POS"
+    assert batcher.stats()["restarts"] == 1
@@ -0,0 +1,181 @@
+import threading
+import time
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from chatapp import pipeline
+from chatapp.memory.shorttermmemory import (
+    add_assistant_reply_to_short_term_memory, add_to_short_term_memory, get_chat_records,
+)
+from chatapp.pipeline import FALLBACK_REPLY, run_turn, stream_turn
+from chatapp.resilience import check_cancelled
+
+
+class FakeAgent:
+    """Agent stand-in: invoke() returns `reply` after `delay`; stream() yields it word by word."""
+
+    def __init__(self, reply: str = "hello there friend", delay: float = 0.0, token_delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.token_delay = token_delay
+
+    def invoke(self, inputs, context=None):
+        time.sleep(self.delay)
+        return {"messages": [AIMessage(content=self.reply)]}
+
+    def stream(self, inputs, context=None, stream_mode=None):
+        time.sleep(self.delay)
+        for word in self.reply.split(" "):
+            # The model calls of a real agent go through call_with_resilience, which stops here on cancel.
+            check_cancelled()
+            yield "messages", (AIMessageChunk(content=word + " "), {})
+            time.sleep(self.token_delay)
+        yield "values", {"messages": [AIMessage(content=self.reply)]}
+
+
+class MemoryToolAgent(FakeAgent):
+    """FakeAgent that calls one of the memory tools, as the real agents do, before it answers."""
+
+    def __init__(self, memory_tool, tool_args, **kwargs):
+        super().__init__(**kwargs)
+        self.memory_tool = memory_tool
+        self.tool_args = tool_args
+
+    def invoke(self, inputs, context=None):
+        time.sleep(self.delay)
+        self.memory_tool.invoke(self.tool_args)
+        return {"messages": [AIMessage(content=self.reply)]}
+
+    def stream(self, inputs, context=None, stream_mode=None):
+        self.memory_tool.invoke(self.tool_args)
+        yield from super().stream(inputs, context, stream_mode)
+
+
+def memory_agents(message: str, reply: str, sentiment_delay: float) -> tuple:
+    sentiment_agent = MemoryToolAgent(add_to_short_term_memory, {
+        "user": message, "assistant": "", "sentiment_score": 0.9, "sentiment_type": "POS",
+    }, delay=sentiment_delay)
+    replier_agent = MemoryToolAgent(add_assistant_reply_to_short_term_memory, {
+        "user": message, "assistant": reply,
+    }, reply=reply)
+    return sentiment_agent, replier_agent
+
+
+@pytest.fixture
+def message():
+    # classify_text caches by text, so every test scores its own.
+    return f"I am so happy today {uuid.uuid4().hex}"
+
+
+@pytest.fixture(autouse=True)
+def _state(fresh_state):
+    return fresh_state
+
+
+def test_run_turn_combines_the_stages(message):
+    result = run_turn(message, "u1", sentiment_agent=FakeAgent("stored"), replier_agent=FakeAgent("hi!"))
+    assert result.response_text == "hi!"
+    assert result.sentiment_type == "POSITIVE"
+    assert not result.errors
+    assert {"classifier", "sentiment_agent", "replier_agent", "memory_extraction"} <= set(result.stage_seconds)
+
+
+def test_run_turn_times_out_a_slow_replier(message):
+    start = time.perf_counter()
+    result = run_turn(message, "u1", sentiment_agent=FakeAgent(), replier_agent=FakeAgent(delay=2.0),
+                      reply_timeout=0.2)
+    assert time.perf_counter() - start < 1.5
+    assert result.errors == {"replier_agent": "timed out"}
+    assert result.response_text == FALLBACK_REPLY
+    # The classifier still answered.
+    assert result.sentiment_type == "POSITIVE"
+
+
+@pytest.mark.parametrize("sentiment_delay", [0.0, 0.2])
+def test_run_turn_writes_the_chat_once_whichever_agent_finishes_first(message, sentiment_delay):
+    sentiment_agent, replier_agent = memory_agents(message, "hi!", sentiment_delay)
+    result = run_turn(message, "u1", sentiment_agent=sentiment_agent, replier_agent=replier_agent)
+    assert not result.errors
+    chats = get_chat_records("u1")
+    assert [(chat.user, chat.assistant, chat.sentiment_type) for chat in chats] == [(message, "hi!", "POS")]
+
+
+def test_stream_turn_writes_the_chat_once_after_the_reply(message):
+    # The replier finishes (and calls its memory tool) well before the sentiment agent.
+    sentiment_agent, replier_agent = memory_agents(message, "one two", 0.2)
+    events = list(stream_turn(message, "u1", sentiment_agent=sentiment_agent, replier_agent=replier_agent))
+    assert events[-1].kind == "done"
+    chats = get_chat_records("u1")
+    assert [(chat.user, chat.assistant, chat.sentiment_type) for chat in chats] == [(message, "one two", "POS")]
+
+
+def test_stream_turn_sends_the_sentiment_before_held_back_tokens(message, monkeypatch):
+    classify_text = pipeline.classify_text
+
+    def slow_classifier(text):
+        time.sleep(0.2)
+        return classify_text(text)
+
+    monkeypatch.setattr(pipeline, "classify_text", slow_classifier)
+    events = list(stream_turn(message, "u1", sentiment_agent=FakeAgent(), replier_agent=FakeAgent("one two three")))
+    kinds = [event.kind for event in events]
+    assert kinds[0] == "sentiment"
+    assert kinds[-1] == "done"
+    assert "".join(event.data for event in events if event.kind == "token") == "one two three "
+    assert events[-1].data.response_text == "one two three"
+    assert events[-1].data.ttft_seconds is not None
+
+
+def test_stream_turn_releases_tokens_after_the_grace_period(message, monkeypatch):
+    monkeypatch.setattr(pipeline, "CLASSIFIER_GRACE", 0.05)
+
+    def stuck_classifier(text):
+        time.sleep(1.0)
+        return {"label": "POS", "score": 0.9}
+
+    monkeypatch.setattr(pipeline, "classify_text", stuck_classifier)
+    started = time.perf_counter()
+    stream = stream_turn(message, "u1", sentiment_agent=FakeAgent(), replier_agent=FakeAgent("one two"))
+    first = next(stream)
+    assert first.kind == "token"
+    assert time.perf_counter() - started < 0.8
+    stream.close()
+
+
+def test_stream_turn_times_out(message):
+    start = time.perf_counter()
+    events = list(stream_turn(message, "u1", sentiment_agent=FakeAgent(), replier_agent=FakeAgent(delay=2.0),
+                              reply_timeout=0.2, sentiment_timeout=0.2))
+    assert time.perf_counter() - start < 1.5
+    assert events[-2].kind == "error" and events[-2].data == {"stage": "replier_agent", "error": "timed out"}
+    assert events[-1].kind == "done"
+    assert events[-1].data.response_text == FALLBACK_REPLY
+
+
+def test_stream_turn_cancel_stops_the_reply_and_calls_on_exit(message):
+    cancel = threading.Event()
+    exited = threading.Event()
+    replier = FakeAgent(" ".join(f"word{i}" for i in range(100)), token_delay=0.01)
+    events = []
+    for event in stream_turn(message, "u1", sentiment_agent=FakeAgent(), replier_agent=replier, cancel=cancel,
+                             on_exit=exited.set):
+        events.append(event)
+        if event.kind == "token" and not cancel.is_set():
+            cancel.set()
+    done = events[-1]
+    assert done.kind == "done" and done.data.cancelled
+    assert sum(event.kind == "token" for event in events) < 100
+    assert exited.wait(2.0)
+
+
+def test_stream_turn_calls_on_exit_when_it_fails_to_start(message, monkeypatch):
+    def broken(turn):
+        raise RuntimeError("trace store unavailable")
+
+    monkeypatch.setattr(pipeline, "begin_trace", broken)
+    exited = threading.Event()
+    with pytest.raises(RuntimeError):
+        list(stream_turn(message, "u1", sentiment_agent=FakeAgent(), replier_agent=FakeAgent(), on_exit=exited.set))
+    assert exited.is_set()
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+from chatapp import resilience
+from chatapp.resilience import (
+    AttemptTimeout, CallCancelled, CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResiliencePolicy, call_with_resilience,
+    deadline_scope, register_dependency, run_cancellable,
+)
+
+
+class Unavailable(Exception):
+    status_code = 503
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+@pytest.fixture
+def dependency():
+    dependency = register_dependency("test_dependency", ResiliencePolicy(max_attempts=1), failure_threshold=2,
+                                     reset_timeout=0.05)
+    yield dependency
+    resilience._dependencies.pop("test_dependency", None)
+
+
+def fail(error):
+    def call():
+        raise error
+    return call
+
+
+def open_breaker(dependency):
+    for _ in range(dependency.breaker.failure_threshold):
+        with pytest.raises(Unavailable):
+            call_with_resilience("test_dependency", fail(Unavailable()))
+    assert dependency.breaker.state == "open"
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast(dependency):
+    open_breaker(dependency)
+    called = []
+    with pytest.raises(CircuitOpenError):
+        call_with_resilience("test_dependency", lambda: called.append(1))
+    assert not called
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = CircuitBreaker("trial", failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_trial_closes_the_breaker(dependency):
+    open_breaker(dependency)
+    time.sleep(0.06)
+    assert call_with_resilience("test_dependency", lambda: "ok") == "ok"
+    assert dependency.breaker.state == "closed"
+
+
+def test_failed_trial_reopens_the_breaker(dependency):
+    open_breaker(dependency)
+    time.sleep(0.06)
+    with pytest.raises(Unavailable):
+        call_with_resilience("test_dependency", fail(Unavailable()))
+    assert dependency.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        call_with_resilience("test_dependency", lambda: "ok")
+
+
+def test_cancelled_trial_does_not_wedge_the_breaker(dependency):
+    open_breaker(dependency)
+    time.sleep(0.06)
+    cancel = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(1.0)
+
+    def cancel_soon():
+        started.wait(1.0)
+        cancel.set()
+
+    threading.Thread(target=cancel_soon).start()
+    with pytest.raises(CallCancelled):
+        run_cancellable(cancel, call_with_resilience, "test_dependency", slow)
+    # The trial was given back: open again, and the next trial after reset_timeout gets through.
+    assert dependency.breaker.state == "open"
+    time.sleep(0.06)
+    assert call_with_resilience("test_dependency", lambda: "ok") == "ok"
+    assert dependency.breaker.state == "closed"
+
+
+def test_local_error_in_a_trial_does_not_wedge_or_close_the_breaker(dependency):
+    open_breaker(dependency)
+    time.sleep(0.06)
+    with pytest.raises(ValueError):
+        call_with_resilience("test_dependency", fail(ValueError("bad arguments")))
+    assert dependency.breaker.state == "open"
+    time.sleep(0.06)
+    assert call_with_resilience("test_dependency", lambda: "ok") == "ok"
+
+
+def test_non_retryable_answer_from_the_service_closes_the_breaker(dependency):
+    open_breaker(dependency)
+    time.sleep(0.06)
+    with pytest.raises(BadRequest):
+        call_with_resilience("test_dependency", fail(BadRequest()))
+    assert dependency.breaker.state == "closed"
+
+
+def test_deadline_bounds_a_slow_call(dependency):
+    start = time.monotonic()
+    with deadline_scope(0.1), pytest.raises(DeadlineExceeded):
+        call_with_resilience("test_dependency", time.sleep, 1.0)
+    assert time.monotonic() - start < 0.5
+
+
+def test_callers_deadline_does_not_count_against_the_breaker(dependency):
+    dependency.policy.attempt_timeout = 1.0
+    for _ in range(dependency.breaker.failure_threshold + 1):
+        with deadline_scope(0.02), pytest.raises(DeadlineExceeded):
+            call_with_resilience("test_dependency", time.sleep, 0.2)
+    assert dependency.breaker.state == "closed"
+
+
+def test_callers_deadline_gives_back_the_half_open_trial(dependency):
+    open_breaker(dependency)
+    time.sleep(0.06)
+    with deadline_scope(0.02), pytest.raises(DeadlineExceeded):
+        call_with_resilience("test_dependency", time.sleep, 0.2)
+    assert dependency.breaker.state == "open"
+    time.sleep(0.06)
+    assert call_with_resilience("test_dependency", lambda: "ok") == "ok"
+
+
+def test_full_attempt_timeouts_open_the_breaker(dependency):
+    dependency.policy.attempt_timeout = 0.02
+    for _ in range(dependency.breaker.failure_threshold):
+        with deadline_scope(1.0), pytest.raises(AttemptTimeout):
+            call_with_resilience("test_dependency", time.sleep, 0.2)
+    assert dependency.breaker.state == "open"
+
+
+def test_retries_retryable_errors():
+    dependency = register_dependency("test_retries", ResiliencePolicy(max_attempts=3, base_delay=0.001))
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Unavailable()
+        return "ok"
+
+    try:
+        assert call_with_resilience("test_retries", flaky) == "ok"
+        assert len(attempts) == 3
+        assert dependency.breaker.state == "closed"
+    finally:
+        resilience._dependencies.pop("test_retries", None)
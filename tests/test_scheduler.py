@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from chatapp import resilience
+from chatapp.resilience import (
+    DeadlineExceeded, ResiliencePolicy, call_with_resilience, deadline_scope, register_dependency, track_abandoned,
+)
+from chatapp.scheduler import ModelCallScheduler, SchedulerTimeout, TokenBucket
+
+
+def drained_scheduler(rpm: float, **kwargs) -> ModelCallScheduler:
+    scheduler = ModelCallScheduler(rpm=rpm, tpm=1_000_000, concurrency={}, **kwargs)
+    # A small bucket keeps the background classes' headroom small too.
+    scheduler.requests = TokenBucket(rpm, capacity=2)
+    scheduler.requests.take(2)
+    return scheduler
+
+
+def test_higher_priority_is_granted_first():
+    # One request every 50ms: whoever is first in priority order gets the next one.
+    scheduler = drained_scheduler(rpm=1200)
+    order = []
+
+    def call(priority):
+        scheduler.acquire(priority, 10, timeout=2.0)
+        order.append(priority)
+
+    threads = [threading.Thread(target=call, args=(priority,)) for priority in ("analytics", "sentiment", "interactive")]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "sentiment", "analytics"]
+
+
+def test_concurrency_cap_per_class():
+    scheduler = ModelCallScheduler(rpm=1000, tpm=1_000_000, concurrency={"summary": 1})
+    scheduler.acquire("summary", 10)
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire("summary", 10, timeout=0.05)
+    # Other classes are not held up by it.
+    scheduler.acquire("interactive", 10, timeout=0.05)
+    scheduler.release("summary", 10)
+    scheduler.acquire("summary", 10, timeout=0.05)
+
+
+def test_queue_timeout():
+    scheduler = drained_scheduler(rpm=1)
+    start = time.monotonic()
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire("interactive", 10, timeout=0.1)
+    assert time.monotonic() - start < 0.5
+    assert scheduler.stats()["queued_interactive"] == 0
+
+
+def test_waits_no_longer_than_the_callers_deadline():
+    scheduler = drained_scheduler(rpm=1, queue_timeout=5.0)
+    start = time.monotonic()
+    with deadline_scope(0.1), pytest.raises(SchedulerTimeout):
+        scheduler.acquire("interactive", 10)
+    assert time.monotonic() - start < 0.5
+
+
+def test_slot_settles_tokens_with_the_real_usage():
+    scheduler = ModelCallScheduler(rpm=1000, tpm=1000, concurrency={})
+    with scheduler.slot("interactive", 400) as usage:
+        usage["tokens"] = 100
+    assert scheduler.stats()["in_flight_interactive"] == 0
+    assert scheduler.tokens.level == pytest.approx(900, abs=5)
+
+
+def test_slot_is_held_until_an_abandoned_call_finishes():
+    register_dependency("test_slow", ResiliencePolicy(max_attempts=1))
+    scheduler = ModelCallScheduler(rpm=1000, tpm=1_000_000, concurrency={"interactive": 1})
+    finished = threading.Event()
+
+    def slow():
+        time.sleep(0.3)
+        finished.set()
+
+    try:
+        with pytest.raises(DeadlineExceeded), deadline_scope(0.05):
+            with scheduler.slot("interactive", 10) as usage, track_abandoned(usage["abandoned"]):
+                call_with_resilience("test_slow", slow)
+        # The request is still running against the quota, so the slot is not free yet.
+        assert scheduler.stats()["in_flight_interactive"] == 1
+        with pytest.raises(SchedulerTimeout):
+            scheduler.acquire("interactive", 10, timeout=0.05)
+        assert finished.wait(1.0)
+        scheduler.acquire("interactive", 10, timeout=0.5)
+    finally:
+        resilience._dependencies.pop("test_slow", None)
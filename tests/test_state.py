@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from chatapp import state
+from chatapp.records import ChatRecord, ChatWindow
+from chatapp.stubs import FakeRedis
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, monkeypatch):
+    backend = state.InProcessBackend(shards=4) if request.param == "memory" else state.RedisBackend([FakeRedis()])
+    monkeypatch.setattr(state, "backend", backend)
+    return backend
+
+
+def test_store_only_succeeds_at_the_expected_version(backend):
+    assert backend.load("u1", "doc") == (None, 0)
+    assert backend.store("u1", "doc", {"n": 1}, 0)
+    assert not backend.store("u1", "doc", {"n": 2}, 0)
+    assert backend.load("u1", "doc") == ({"n": 1}, 1)
+    assert backend.store("u1", "doc", {"n": 2}, 1)
+    assert backend.version("u1", "doc") == 2
+
+
+def test_concurrent_updates_are_not_lost(backend):
+    def increment(current):
+        count = (current or {"n": 0})["n"] + 1
+        return {"n": count}, count
+
+    def worker():
+        for _ in range(50):
+            state.update("u1", "counter", increment, retries=1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.load("u1", "counter")[0] == {"n": 400}
+
+
+def test_update_retries_after_a_conflict(backend):
+    calls = []
+
+    def racing(current):
+        calls.append(current)
+        if len(calls) == 1:
+            # Another writer gets in between this read and the write.
+            backend.store("u1", "doc", {"n": 10}, backend.version("u1", "doc"))
+        return {"n": (current or {"n": 0})["n"] + 1}, len(calls)
+
+    assert state.update("u1", "doc", racing) == 2
+    assert calls == [None, {"n": 10}]
+    assert backend.load("u1", "doc")[0] == {"n": 11}
+
+
+def test_update_gives_up_with_version_conflict(backend):
+    def always_loses(current):
+        backend.store("u1", "doc", {"n": 0}, backend.version("u1", "doc"))
+        return {"n": -1}, None
+
+    with pytest.raises(state.VersionConflict):
+        state.update("u1", "doc", always_loses, retries=3)
+    assert backend.load("u1", "doc")[0] == {"n": 0}
+
+
+def test_update_without_a_new_document_writes_nothing(backend):
+    assert state.update("u1", "doc", lambda current: (None, "unchanged")) == "unchanged"
+    assert backend.version("u1", "doc") == 0
+
+
+def test_update_record_round_trips_records(backend):
+    decode = lambda document: ChatWindow() if document is None else ChatWindow.from_document(document)  # noqa: E731
+    chat = ChatRecord("hi", None, 0.9, "POS")
+    state.update_record("u1", "window", decode, lambda window: window.chats.append(chat))
+    state.update_record("u1", "window", decode, lambda window: window.chats.append(chat.with_assistant("hello")))
+    window = state.load_record("u1", "window", decode)
+    assert window.chats == [chat, chat.with_assistant("hello")]
+    assert backend.version("u1", "window") == 2
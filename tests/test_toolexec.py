@@ -0,0 +1,65 @@
+import threading
+import types
+import uuid
+
+from langchain_core.messages import AIMessage
+
+from chatapp.toolexec import ToolExecutionMiddleware, user_lock
+
+
+def make_request(name: str, user_id: str = "u1"):
+    """A tool call request of its own model message (one step per request)."""
+    call = {"name": name, "args": {}, "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"}
+    message = AIMessage(content="", tool_calls=[call])
+    return types.SimpleNamespace(
+        tool_call=call,
+        state={"messages": [message]},
+        runtime=types.SimpleNamespace(context={"user_id": user_id}),
+    )
+
+
+def test_max_workers_bounds_a_step_not_the_whole_agent():
+    middleware = ToolExecutionMiddleware("test", max_workers=1)
+    running = threading.Barrier(2, timeout=2.0)
+
+    def handler(request):
+        # Both calls only return once both are running.
+        running.wait()
+        return request.tool_call["name"]
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(middleware.wrap_tool_call(make_request("web_search"), handler)))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(3.0)
+    assert results == ["web_search", "web_search"]
+
+
+def test_a_call_waiting_for_the_user_lock_holds_no_slot():
+    middleware = ToolExecutionMiddleware("test", max_workers=1)
+    lock = user_lock("u1")
+    lock.acquire()
+    waiting = threading.Thread(
+        target=middleware.wrap_tool_call,
+        args=(make_request("add_to_short_term_memory"), lambda request: "stored"),
+    )
+    other = []
+    try:
+        waiting.start()
+        waiting.join(0.1)
+        assert waiting.is_alive()
+        # Another call of the same agent is not held up by the one waiting for the user.
+        searching = threading.Thread(
+            target=lambda: other.append(middleware.wrap_tool_call(make_request("web_search"), lambda request: "found")),
+        )
+        searching.start()
+        searching.join(2.0)
+        assert other == ["found"]
+    finally:
+        lock.release()
+    waiting.join(2.0)
+    assert not waiting.is_alive()